@@ -2,6 +2,7 @@ require([
   'Canvas-Flowmap-Layer/CanvasFlowmapLayer',
   'esri/graphic',
   'esri/map',
+  'esri/request',
   'local-resources/config',
   'dojo/on',
   'dojo/domReady!'
@@ -9,6 +10,7 @@ require([
   CanvasFlowmapLayer,
   Graphic,
   Map,
+  esriRequest,
   config,
   on
 ) {
@@ -62,35 +64,32 @@ require([
 
     map.addLayers([oneToManyLayer, manyToOneLayer, oneToOneLayer]);
 
-    createGraphicsFromCsv('../csv-data/Flowmap_Cities_one_to_many.csv', oneToManyLayer);
-    createGraphicsFromCsv('../csv-data/Flowmap_Cities_many_to_one.csv', manyToOneLayer);
-    createGraphicsFromCsv('../csv-data/Flowmap_Cities_one_to_one.csv', oneToOneLayer);
-
-    // here we use Papa Parse to load and read the CSV data
-    // we could have also used another library like D3js to do the same
-    function createGraphicsFromCsv(csvFilePath, canvasLayer) {
-      Papa.parse(csvFilePath, {
-        download: true,
-        header: true,
-        dynamicTyping: true,
-        skipEmptyLines: true,
-        complete: function(results) {
-          var csvGraphics = results.data.map(function(datum) {
-            return new Graphic({
-              geometry: {
-                x: datum.s_lon,
-                y: datum.s_lat,
-                spatialReference: {
-                  wkid: 4326
-                }
-              },
-              attributes: datum
-            });
+    createGraphicsFromFlows('../flowmap-data/one_to_many.geojson', oneToManyLayer);
+    createGraphicsFromFlows('../flowmap-data/many_to_one.geojson', manyToOneLayer);
+    createGraphicsFromFlows('../flowmap-data/one_to_one.geojson', oneToOneLayer);
+
+    // the flows are aggregated by city pair in python/build_flowmaps.py,
+    // so the canvas flowmap layer gets one graphic per pair instead of one per trade record
+    function createGraphicsFromFlows(flowsFilePath, canvasLayer) {
+      esriRequest({
+        url: flowsFilePath,
+        handleAs: 'json'
+      }).then(function(flows) {
+        var flowGraphics = flows.features.map(function(feature) {
+          return new Graphic({
+            geometry: {
+              x: feature.properties.s_lon,
+              y: feature.properties.s_lat,
+              spatialReference: {
+                wkid: 4326
+              }
+            },
+            attributes: feature.properties
           });
+        });
 
-          // add all graphics to the canvas flowmap layer
-          canvasLayer.addGraphics(csvGraphics);
-        }
+        // add all graphics to the canvas flowmap layer
+        canvasLayer.addGraphics(flowGraphics);
       });
     }
 
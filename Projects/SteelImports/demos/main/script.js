@@ -1,15 +1,25 @@
 require([
-  'Canvas-Flowmap-Layer/CanvasFlowmapLayer',
+  'esri/Color',
   'esri/graphic',
   'esri/map',
-  'esri/layers/FeatureLayer',
+  'esri/request',
+  'esri/layers/GraphicsLayer',
+  'esri/geometry/Point',
+  'esri/geometry/Polyline',
+  'esri/symbols/SimpleLineSymbol',
+  'esri/symbols/SimpleMarkerSymbol',
   'local-resources/config',
   'dojo/domReady!'
 ], function(
-  CanvasFlowmapLayer,
+  Color,
   Graphic,
   Map,
-  FeatureLayer,
+  esriRequest,
+  GraphicsLayer,
+  Point,
+  Polyline,
+  SimpleLineSymbol,
+  SimpleMarkerSymbol,
   config
 ) {
   var map = new Map('map', {
@@ -18,69 +28,79 @@ require([
     zoom: 2
   });
 
+  // 'selection': only the arcs of the clicked origin or destination are shown; 'all': every arc is shown
+  var pathDisplayMode = 'selection';
+
+  var pathSymbol = new SimpleLineSymbol(SimpleLineSymbol.STYLE_SOLID, new Color([207, 241, 17, 0.8]), 1);
+  var originSymbol = new SimpleMarkerSymbol(SimpleMarkerSymbol.STYLE_CIRCLE, 10, new SimpleLineSymbol(
+    SimpleLineSymbol.STYLE_SOLID, new Color([255, 0, 51]), 0.5), new Color([255, 0, 51, 0.4]));
+  var destinationSymbol = new SimpleMarkerSymbol(SimpleMarkerSymbol.STYLE_CIRCLE, 8, new SimpleLineSymbol(
+    SimpleLineSymbol.STYLE_SOLID, new Color([61, 225, 255]), 0.5), new Color([87, 216, 255, 0.65]));
+
   map.on('load', function() {
-    var cityToCityLayer = new CanvasFlowmapLayer({
-      // JSAPI GraphicsLayer constructor properties
-      id: 'cityToCityLayer',
-      visible: true,
-      // CanvasFlowmapLayer custom constructor properties
-      //  - required
-      originAndDestinationFieldIds: config.originAndDestinationFieldIds,
-      //  - optional
-      pathDisplayMode: 'selection', // 'selection' or 'all'
-      wrapAroundCanvas: true,
-      animationStarted: true
+    // the great-circle arcs of the city pairs are precomputed by python/build_flowmaps.py,
+    // so the page only draws them
+    var pathLayer = new GraphicsLayer({
+      id: 'cityToCityPathLayer'
     });
+    var cityLayer = new GraphicsLayer({
+      id: 'cityToCityLayer'
+    });
+
+    map.addLayers([pathLayer, cityLayer]);
 
-    map.addLayer(cityToCityLayer);
-    
-    // var originLayer = new FeatureLayer("https://services.arcgis.com/hRUr1F8lE8Jq2uJo/arcgis/rest/services/BIS_steel_import_origins_FS/FeatureServer/0");
-    // var destLayer = new FeatureLayer("https://services.arcgis.com/hRUr1F8lE8Jq2uJo/ArcGIS/rest/services/BIS_steel_imports_destinations/FeatureServer/0");
+    esriRequest({
+      url: '../flowmap-data/one_to_many.geojson',
+      handleAs: 'json'
+    }).then(function(flows) {
+      var fieldIds = config.originAndDestinationFieldIds;
+      var shownCities = {};
 
-    // map.addLayer(originsLayer);
-    // map.addLayer(destLayer);
+      flows.features.forEach(function(feature) {
+        var attributes = feature.properties;
+        var pathGraphic = new Graphic(new Polyline({
+          paths: [feature.geometry.coordinates],
+          spatialReference: {
+            wkid: 4326
+          }
+        }), pathSymbol, attributes);
+        pathLayer.add(pathGraphic);
+        if (pathDisplayMode !== 'all') {
+          pathGraphic.hide();
+        }
 
-    // here we use Papa Parse to load and read the CSV data
-    // we could have also used another library like D3js to do the same
-    Papa.parse('../csv-data/Flowmap_Cities_one_to_many.csv', {
-      download: true,
-      header: true,
-      dynamicTyping: true,
-      skipEmptyLines: true,
-      complete: function(results) {
-        var csvGraphics = results.data.map(function(datum) {
-          return new Graphic({
-            geometry: {
-              x: datum.s_lon,
-              y: datum.s_lat,
-              spatialReference: {
-                wkid: 4326
-              }
-            },
-            attributes: datum
-          });
-        });
+        // one point per unique origin and destination
+        addCity(attributes, fieldIds.originUniqueIdField, fieldIds.originGeometry, originSymbol, true);
+        addCity(attributes, fieldIds.destinationUniqueIdField, fieldIds.destinationGeometry, destinationSymbol, false);
+      });
 
-        // add all graphics to the canvas flowmap layer
-        cityToCityLayer.addGraphics(csvGraphics);
+      function addCity(attributes, idField, geometryFields, symbol, isOrigin) {
+        var key = (isOrigin ? 'origin-' : 'destination-') + attributes[idField];
+        if (shownCities[key]) {
+          return;
+        }
+        shownCities[key] = true;
+        var cityGraphic = new Graphic(new Point(attributes[geometryFields.x], attributes[geometryFields.y],
+          geometryFields.spatialReference), symbol, attributes);
+        cityGraphic.isOrigin = isOrigin;
+        cityLayer.add(cityGraphic);
       }
+    }, function(error) {
+      console.error('The flow map data could not be loaded; run python/build_flowmaps.py', error);
     });
 
-    cityToCityLayer.on('click', function(evt) {
-      // evt.sharedOriginGraphics: array of all ORIGIN graphics with the same ORIGIN ID field
-      // evt.sharedDestinationGraphics: array of all ORIGIN graphics with the same DESTINATION ID field
-      //  - you can mark shared origin or destination graphics as selected for path display using these modes:
-      //    - 'SELECTION_NEW', 'SELECTION_ADD', or 'SELECTION_SUBTRACT'
-      //  - these selected graphics inform the canvas flowmap layer which paths to display
-
-      // NOTE: if the layer's pathDisplayMode was originally set to "all",
-      // this manual selection will override the displayed paths
-      if (evt.sharedOriginGraphics.length) {
-        cityToCityLayer.selectGraphicsForPathDisplay(evt.sharedOriginGraphics, 'SELECTION_NEW');
-      }
-      if (evt.sharedDestinationGraphics.length) {
-        cityToCityLayer.selectGraphicsForPathDisplay(evt.sharedDestinationGraphics, 'SELECTION_NEW');
-      }
+    cityLayer.on('click', function(evt) {
+      // show the arcs sharing the ORIGIN or DESTINATION ID field of the clicked city
+      var fieldIds = config.originAndDestinationFieldIds;
+      var idField = evt.graphic.isOrigin ? fieldIds.originUniqueIdField : fieldIds.destinationUniqueIdField;
+      var cityId = evt.graphic.attributes[idField];
+      pathLayer.graphics.forEach(function(pathGraphic) {
+        if (pathGraphic.attributes[idField] === cityId) {
+          pathGraphic.show();
+        } else {
+          pathGraphic.hide();
+        }
+      });
     });
   });
 });
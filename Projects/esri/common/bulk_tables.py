@@ -0,0 +1,312 @@
+# #############
+"""
+Source Name: bulk_tables.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Bulk table writers shared by the EFL tools (event tables and event feature classes, see efl/bulk_output.py) and
+the SAS bridge (result tables, see sas-arcgis-bridge/bulk_output.py). Tables are written from columns, without
+an insert cursor:
+- GeoPackage (.gpkg) and SQLite (.sqlite, .db) databases are written with executemany in batched transactions,
+  with the journal kept in memory and without syncing to disk after every batch
+- Parquet files are written with pyarrow, which is only needed for this format; line geometry is a WKB column
+  described by GeoParquet metadata
+
+A table goes to one of these formats when its path is in a .gpkg or .sqlite database
+(C:/data/efl.gpkg/LEC_LinearEvents) or ends with .parquet. Table and field names are quoted, so any name the
+caller passes is written as it is.
+"""
+
+import json
+import os
+import sqlite3
+
+import numpy as np
+
+# Rows per transaction of the SQLite writer and per row group of the Parquet writer
+BATCH_SIZE = 100000
+
+_GEOPACKAGE_HEADER = np.dtype([("magic", "S2"), ("version", "u1"), ("flags", "u1"), ("srs_id", "<i4"),
+                               ("envelope", "<f8", (4,)), ("byte_order", "u1"), ("type", "<u4"),
+                               ("count", "<u4")])
+_WKB_HEADER = np.dtype([("byte_order", "u1"), ("type", "<u4"), ("count", "<u4")])
+
+# ISO WKB type code of a LineString with M values
+_LINESTRING_M = 2002
+
+_WGS84 = 'GEOGCS["WGS 84",DATUM["WGS_1984",SPHEROID["WGS 84",6378137,298.257223563]],PRIMEM["Greenwich",0],' \
+         'UNIT["degree",0.0174532925199433]]'
+
+_PROJJSON_SCHEMA = "https://proj.org/schemas/v0.7/projjson.schema.json"
+
+
+def output_format(path):
+    """GEOPACKAGE, SQLITE or PARQUET for the paths written by this module; None for the other workspaces."""
+    lower_path = path.lower()
+    if lower_path.endswith(".parquet"):
+        return "PARQUET"
+    workspace = os.path.dirname(lower_path)
+    if workspace.endswith(".gpkg"):
+        return "GEOPACKAGE"
+    if workspace.endswith((".sqlite", ".db")):
+        return "SQLITE"
+    return None
+
+
+def split_table_path(path):
+    """(database, table) of a table in a GeoPackage or SQLite database; a "main." prefix is dropped."""
+    database, table = os.path.split(path)
+    if table.lower().startswith("main."):
+        table = table[5:]
+    return database, table
+
+
+def quote_identifier(name):
+    """A table or column name as an SQL identifier."""
+    return '"{0}"'.format(str(name).replace('"', '""'))
+
+
+##### Geometry encoding #####
+
+def linestring_wkb(offsets, x, y, m, srs_id=None):
+    """
+    Encode polylines with M values into one buffer, as ISO WKB or, when srs_id is given, as GeoPackage
+    geometry blobs (WKB behind a header with the SRS id and the envelope).
+    :param offsets: the vertices of line i are offsets[i]:offsets[i + 1]
+    :return: (buffer, byte offsets); the encoding of line i is buffer[byte_offsets[i]:byte_offsets[i + 1]]
+    """
+    count = np.diff(offsets)
+    lines = len(count)
+    header = np.zeros(lines, dtype=_WKB_HEADER if srs_id is None else _GEOPACKAGE_HEADER)
+    header["byte_order"] = 1
+    header["type"] = _LINESTRING_M
+    header["count"] = count
+    if srs_id is not None:
+        header["magic"] = b"GP"
+        # Little endian, envelope [minx, maxx, miny, maxy]
+        header["flags"] = 0b011
+        header["srs_id"] = srs_id
+        if lines and len(x):
+            starts = offsets[:-1][count > 0]
+            header["envelope"][count > 0] = np.column_stack((np.minimum.reduceat(x, starts),
+                                                             np.maximum.reduceat(x, starts),
+                                                             np.minimum.reduceat(y, starts),
+                                                             np.maximum.reduceat(y, starts)))
+    size = header.dtype.itemsize + 24 * count
+    byte_offsets = np.append(0, np.cumsum(size))
+
+    ##### Header bytes and coordinate bytes interleave line by line; a mask tells which is which #####
+    change = np.zeros(byte_offsets[-1] + 1, dtype=np.int8)
+    change[byte_offsets[:-1]] += 1
+    change[byte_offsets[:-1] + header.dtype.itemsize] -= 1
+    is_header = np.cumsum(change[:-1], dtype=np.int8).astype(bool)
+    buffer = np.empty(byte_offsets[-1], dtype=np.uint8)
+    buffer[is_header] = header.view(np.uint8)
+    buffer[~is_header] = np.column_stack((x, y, m)).astype("<f8").view(np.uint8).ravel()
+    return buffer, byte_offsets
+
+
+##### Coordinate systems #####
+
+def spatial_reference_info(spatial_reference):
+    """(srs id, name, WKT) of an arcpy spatial reference; the undefined cartesian SRS when None."""
+    if spatial_reference is None:
+        return -1, "Undefined cartesian SRS", "undefined"
+    code = spatial_reference.factoryCode or 0
+    return (code if code > 0 else 100000), spatial_reference.name, spatial_reference.exportToString()
+
+
+def projjson(spatial_reference):
+    """
+    PROJJSON of an arcpy spatial reference, as GeoParquet wants the CRS; None when it is unknown.
+
+    The full definition comes from pyproj when it is installed. Without pyproj a spatial reference with an
+    EPSG code is written as its name and identifier, which readers resolve from their EPSG database.
+    """
+    if spatial_reference is None:
+        return None
+    code = spatial_reference.factoryCode or 0
+    try:
+        import pyproj
+    except ImportError:
+        pyproj = None
+    if pyproj is not None:
+        try:
+            crs = pyproj.CRS.from_epsg(code) if code > 0 else pyproj.CRS.from_wkt(spatial_reference.exportToString())
+            return crs.to_json_dict()
+        except pyproj.exceptions.CRSError:
+            pass
+    if code <= 0:
+        return None
+    crs_type = "GeographicCRS" if getattr(spatial_reference, "type", "") == "Geographic" else "ProjectedCRS"
+    return {"$schema": _PROJJSON_SCHEMA, "type": crs_type, "name": spatial_reference.name,
+            "id": {"authority": "EPSG", "code": code}}
+
+
+##### SQLite and GeoPackage #####
+
+def _column_type(column):
+    if column.dtype.kind in "iub":
+        return "INTEGER"
+    if column.dtype.kind == "f":
+        return "DOUBLE"
+    return "TEXT"
+
+
+def _python_values(column):
+    """Column values as Python objects, NaN as NULL."""
+    if column.dtype.kind == "f":
+        column = column.astype(object)
+        column[column != column] = None
+        return column.tolist()
+    if column.dtype.kind == "O":
+        return [None if value is None else str(value) for value in column]
+    return column.tolist()
+
+
+def _init_geopackage(connection, srs):
+    """Create the GeoPackage metadata tables when missing and register the SRS of the output."""
+    connection.execute("PRAGMA application_id = 1196444487")
+    connection.execute("PRAGMA user_version = 10200")
+    connection.execute("CREATE TABLE IF NOT EXISTS gpkg_spatial_ref_sys (srs_name TEXT NOT NULL, "
+                       "srs_id INTEGER PRIMARY KEY, organization TEXT NOT NULL, "
+                       "organization_coordsys_id INTEGER NOT NULL, definition TEXT NOT NULL, description TEXT)")
+    connection.execute("CREATE TABLE IF NOT EXISTS gpkg_contents (table_name TEXT NOT NULL PRIMARY KEY, "
+                       "data_type TEXT NOT NULL, identifier TEXT UNIQUE, description TEXT DEFAULT '', "
+                       "last_change DATETIME NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ','now')), "
+                       "min_x DOUBLE, min_y DOUBLE, max_x DOUBLE, max_y DOUBLE, "
+                       "srs_id INTEGER REFERENCES gpkg_spatial_ref_sys(srs_id))")
+    connection.execute("CREATE TABLE IF NOT EXISTS gpkg_geometry_columns (table_name TEXT NOT NULL, "
+                       "column_name TEXT NOT NULL, geometry_type_name TEXT NOT NULL, srs_id INTEGER NOT NULL, "
+                       "z TINYINT NOT NULL, m TINYINT NOT NULL, PRIMARY KEY (table_name, column_name))")
+    connection.executemany("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, NULL)",
+                           [("Undefined cartesian SRS", -1, "NONE", -1, "undefined"),
+                            ("Undefined geographic SRS", 0, "NONE", 0, "undefined"),
+                            ("WGS 84 geodetic", 4326, "EPSG", 4326, _WGS84)])
+    srs_id, name, definition = srs
+    organization = "EPSG" if 0 < srs_id < 100000 else "NONE"
+    connection.execute("INSERT OR IGNORE INTO gpkg_spatial_ref_sys VALUES (?, ?, ?, ?, ?, NULL)",
+                       (name, srs_id, organization, srs_id, definition))
+
+
+def write_sqlite(columns, database, table, geometry=None, spatial_reference=None, batch_size=BATCH_SIZE):
+    """
+    Write columns to a table of a GeoPackage (.gpkg) or plain SQLite database, replacing the table. Without
+    geometry the table is a GeoPackage attribute table.
+    :param columns: dict of equal-length arrays
+    :param geometry: optional (offsets, x, y, m) line vertices per row, as returned by RouteNetwork.slices
+    :param spatial_reference: arcpy spatial reference of the geometry
+    :return: database/table
+    """
+    geopackage = database.lower().endswith(".gpkg")
+    srs = spatial_reference_info(spatial_reference)
+    columns = {name: np.asarray(column) for name, column in columns.items()}
+    rows = len(next(iter(columns.values()))) if columns else (len(geometry[0]) - 1 if geometry else 0)
+
+    blobs = None
+    if geometry is not None:
+        offsets, x, y, m = geometry
+        buffer, byte_offsets = linestring_wkb(offsets, x, y, m, srs[0] if geopackage else None)
+        view = memoryview(buffer)
+        count = np.diff(offsets)
+        blobs = [view[start:stop] if size else None
+                 for start, stop, size in zip(byte_offsets[:-1].tolist(), byte_offsets[1:].tolist(), count.tolist())]
+
+    quoted_table = quote_identifier(table)
+    connection = sqlite3.connect(database)
+    try:
+        # A bulk load: the journal stays in memory and nothing is synced to disk before the end
+        connection.execute("PRAGMA journal_mode = MEMORY")
+        connection.execute("PRAGMA synchronous = OFF")
+        with connection:
+            if geopackage:
+                _init_geopackage(connection, srs)
+                connection.execute("DELETE FROM gpkg_contents WHERE table_name = ?", (table,))
+                connection.execute("DELETE FROM gpkg_geometry_columns WHERE table_name = ?", (table,))
+            connection.execute("DROP TABLE IF EXISTS {0}".format(quoted_table))
+            definitions = ['"fid" INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL']
+            if blobs is not None:
+                definitions.append('"geom" {0}'.format("LINESTRING" if geopackage else "BLOB"))
+            definitions += ["{0} {1}".format(quote_identifier(name), _column_type(column))
+                            for name, column in columns.items()]
+            connection.execute("CREATE TABLE {0} ({1})".format(quoted_table, ", ".join(definitions)))
+
+        names = (["geom"] if blobs is not None else []) + list(columns)
+        insert = "INSERT INTO {0} ({1}) VALUES ({2})".format(quoted_table, ", ".join(map(quote_identifier, names)),
+                                                             ", ".join("?" * len(names)))
+        for start in range(0, rows, batch_size):
+            stop = min(start + batch_size, rows)
+            values = [_python_values(column[start:stop]) for column in columns.values()]
+            if blobs is not None:
+                values.insert(0, blobs[start:stop])
+            with connection:
+                connection.executemany(insert, zip(*values))
+
+        if geopackage:
+            with connection:
+                extent = (None,) * 4
+                if blobs is not None and len(geometry[1]):
+                    extent = (float(np.min(geometry[1])), float(np.min(geometry[2])),
+                              float(np.max(geometry[1])), float(np.max(geometry[2])))
+                connection.execute("INSERT INTO gpkg_contents (table_name, data_type, identifier, min_x, min_y, "
+                                   "max_x, max_y, srs_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                   (table, "features" if blobs is not None else "attributes", table) + extent +
+                                   (srs[0] if blobs is not None else None,))
+                if blobs is not None:
+                    connection.execute("INSERT INTO gpkg_geometry_columns VALUES (?, 'geom', 'LINESTRING', ?, 0, 1)",
+                                       (table, srs[0]))
+    finally:
+        connection.close()
+    return os.path.join(database, table)
+
+
+##### Parquet #####
+
+def geoparquet_metadata(spatial_reference, geometry_types=("LineString M",)):
+    """
+    GeoParquet "geo" metadata of a WKB "geometry" column. The CRS is PROJJSON; an unknown CRS is written as
+    null, since a missing "crs" means longitude/latitude (OGC:CRS84).
+    """
+    return {"version": "1.0.0", "primary_column": "geometry", "columns": {
+        "geometry": {"encoding": "WKB", "geometry_types": list(geometry_types), "crs": projjson(spatial_reference)}}}
+
+
+def write_parquet(columns, path, geometry=None, spatial_reference=None, row_group_size=BATCH_SIZE):
+    """
+    Write columns to a Parquet file, replacing it; the geometry goes to a WKB "geometry" column.
+    :param columns: dict of equal-length arrays
+    :param geometry: optional (offsets, x, y, m) line vertices per row, as returned by RouteNetwork.slices
+    :param spatial_reference: arcpy spatial reference of the geometry, stored as PROJJSON in the GeoParquet
+                              metadata and as Esri WKT next to it
+    :return: path
+    """
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError("Writing Parquet output requires the pyarrow package.")
+
+    arrays, names = [], []
+    for name, column in columns.items():
+        column = np.asarray(column)
+        arrays.append(pa.array(column.astype(object) if column.dtype.kind in "OU" else column,
+                               from_pandas=True))
+        names.append(str(name))
+    metadata = {}
+    if geometry is not None:
+        offsets, x, y, m = geometry
+        buffer, byte_offsets = linestring_wkb(offsets, x, y, m)
+        arrays.append(pa.Array.from_buffers(pa.large_binary(), len(byte_offsets) - 1,
+                                            [None, pa.py_buffer(byte_offsets.astype(np.int64)),
+                                             pa.py_buffer(buffer)]))
+        names.append("geometry")
+        metadata[b"geo"] = json.dumps(geoparquet_metadata(spatial_reference)).encode("utf-8")
+        if spatial_reference is not None:
+            metadata[b"esri_spatial_reference"] = spatial_reference_info(spatial_reference)[2].encode("utf-8")
+
+    table = pa.Table.from_arrays(arrays, names=names).replace_schema_metadata(metadata)
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = path + ".tmp"
+    pq.write_table(table, temp_path, row_group_size=row_group_size)
+    os.replace(temp_path, path)
+    return path
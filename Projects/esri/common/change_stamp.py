@@ -0,0 +1,50 @@
+# #############
+"""
+Source Name: change_stamp.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Change stamps of the datasets behind the caches of the ESRI tools: the calibrated route cache and the event
+index of the EFL tools, and the field cache of the SAS bridge. A cache records the stamp of the dataset it was
+built from and is rebuilt when the stamp changes.
+
+A stamp is the latest modification time and the total size of the files holding a dataset:
+- a file geodatabase table: the files of the geodatabase, without the lock files
+- a shapefile or dBASE table: its .shp and .dbf files
+- a GeoPackage or SQLite table: the database file
+Datasets in other workspaces, and datasets without any of these files (a new or empty workspace), have no
+stamp (None); callers treat them as changed on every call.
+"""
+
+import os
+
+
+def file_stamp(paths):
+    """Latest modification time and total size of the files; None when none of them exists."""
+    stats = [os.stat(path) for path in paths if os.path.isfile(path)]
+    if not stats:
+        return None
+    return "{0:.6f}:{1}".format(max(stat.st_mtime for stat in stats), sum(stat.st_size for stat in stats))
+
+
+def dataset_files(path):
+    """The files holding a dataset, see the module description; an empty list for other workspaces."""
+    lower_path = path.lower()
+    if ".gdb" in lower_path:
+        gdb = path[:lower_path.index(".gdb") + 4]
+        if not os.path.isdir(gdb):
+            return []
+        # Lock files come and go with readers, so they are not part of the stamp
+        return [os.path.join(gdb, name) for name in os.listdir(gdb) if not name.endswith(".lock")]
+    if os.path.splitext(lower_path)[1] in (".shp", ".dbf"):
+        base = os.path.splitext(path)[0]
+        return [base + ".shp", base + ".dbf"]
+    workspace = os.path.dirname(path)
+    if workspace.lower().endswith((".gpkg", ".sqlite", ".db")):
+        return [workspace]
+    return []
+
+
+def dataset_stamp(path):
+    """Change stamp of a dataset, or None when it has none."""
+    return file_stamp(dataset_files(path))
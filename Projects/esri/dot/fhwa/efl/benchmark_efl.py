@@ -0,0 +1,304 @@
+# #############
+"""
+Source Name: benchmark_efl.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Measure how the condition event and LEC event pipelines scale with the size of the route network.
+
+Synthetic route networks are generated with a configurable number of routes and vertices per route, a
+share of routes digitized in the opposite direction, and node sets with a number of nodes per route, GPS
+noise and a share of LEC fault IDs reused on other routes. Every pipeline backend runs on each size:
+
+- condition_inmemory: lr_engine.condition_events (grid index)
+- condition_incremental: event_state.incremental_events after editing a share of the nodes
+- lec_inmemory: snapping.snap_sequences and lr_engine.line_events (k-d tree index)
+- condition_arcpy, lec_arcpy: the geoprocessing tool chains, only when arcpy is available
+
+The in-memory backends run offline: lr_engine stands in for the arcpy geometry operations and no data is
+written. Throughput, latency percentiles over the repeats and peak Python memory are printed as a table
+and can be saved as JSON; --compare prints the speed ratio against an earlier JSON file so regressions
+between versions show up.
+
+Example:
+    python benchmark_efl.py --routes 100 1000 --nodes-per-route 10 100 --repeat 5 --out efl_benchmark.json
+"""
+
+import argparse
+import datetime
+import importlib.util
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+
+import numpy as np
+
+import event_state
+import lr_engine
+import snapping
+import tracing
+
+
+CONDITIONS = np.array(["Excellent", "Good", "Fair", "Poor", "Failed"])
+
+
+class Case(object):
+    """A synthetic route network with condition and LEC nodes."""
+
+    def __init__(self, routes, vertices_per_route, nodes_per_route, reverse_fraction=0.5, gps_noise=2.0,
+                 fault_overlap=0.05, search_meters=10.0, seed=0):
+        self.parameters = {"routes": routes, "vertices_per_route": vertices_per_route,
+                           "nodes_per_route": nodes_per_route, "reverse_fraction": reverse_fraction,
+                           "gps_noise": gps_noise, "fault_overlap": fault_overlap, "search_meters": search_meters}
+        self.search_distance = search_meters
+        rng = np.random.default_rng(seed)
+        self.network = synthetic_network(rng, routes, vertices_per_route, reverse_fraction)
+        self.x, self.y, self.oid, self.condition, self.fault_id = synthetic_nodes(
+            rng, self.network, nodes_per_route, gps_noise, fault_overlap)
+
+    def __len__(self):
+        return len(self.x)
+
+
+def synthetic_network(rng, routes, vertices_per_route, reverse_fraction, step=20.0):
+    """
+    Random-walk routes started on a grid, 20 m between vertices. A share of the routes is digitized in the
+    opposite direction, so their measures run against the direction the other routes were walked in.
+    """
+    side = int(np.ceil(np.sqrt(routes)))
+    spacing = step * vertices_per_route / 4.0
+    origin_x = (np.arange(routes) % side) * spacing
+    origin_y = (np.arange(routes) // side) * spacing
+    turns = np.cumsum(rng.normal(0, 0.1, (routes, vertices_per_route)), axis=1)
+    heading = rng.uniform(0, 2 * np.pi, routes)[:, None] + turns
+    x = origin_x[:, None] + np.cumsum(step * np.cos(heading), axis=1)
+    y = origin_y[:, None] + np.cumsum(step * np.sin(heading), axis=1)
+    reverse = rng.random(routes) < reverse_fraction
+    x[reverse] = x[reverse, ::-1]
+    y[reverse] = y[reverse, ::-1]
+    route_ids = np.array(["R{0:06d}".format(route) for route in range(routes)])
+    return lr_engine.RouteNetwork.from_vertices(np.repeat(route_ids, vertices_per_route), x.ravel(), y.ravel())
+
+
+def synthetic_nodes(rng, network, nodes_per_route, gps_noise, fault_overlap):
+    """
+    Nodes at random measures along every route, with Gaussian GPS noise. Consecutive node pairs of a route
+    share a fault ID; a share of the fault IDs is reused by a fault on another route.
+    :return: (x, y, oid, condition, fault_id)
+    """
+    routes = len(network)
+    route = np.repeat(np.arange(routes), nodes_per_route)
+    low, high = network.measure_range()
+    measure = np.sort(rng.uniform(low[route], high[route]).reshape(routes, nodes_per_route), axis=1).ravel()
+
+    ##### Interpolate the node positions along the vertex measures of their routes #####
+    vertex = np.searchsorted(network.m + np.repeat(np.arange(routes) * (high.max() + 1), np.diff(network.offsets)),
+                             measure + route * (high.max() + 1))
+    vertex = np.clip(vertex, network.offsets[route] + 1, network.offsets[route + 1] - 1)
+    fraction = (measure - network.m[vertex - 1]) / np.maximum(network.m[vertex] - network.m[vertex - 1], 1e-12)
+    x = network.x[vertex - 1] + fraction * (network.x[vertex] - network.x[vertex - 1])
+    y = network.y[vertex - 1] + fraction * (network.y[vertex] - network.y[vertex - 1])
+    x += rng.normal(0, gps_noise, len(x))
+    y += rng.normal(0, gps_noise, len(y))
+
+    fault_id = np.arange(len(x)) // 2
+    faults = fault_id.max() + 1 if len(fault_id) else 0
+    reused = np.flatnonzero(rng.random(faults) < fault_overlap)
+    mapping = np.arange(faults)
+    mapping[reused] = rng.integers(0, faults, len(reused))
+    fault_id = mapping[fault_id] if faults else fault_id
+    return x, y, np.arange(1, len(x) + 1), rng.choice(CONDITIONS, len(x)), fault_id
+
+
+##### Backends: each prepares a case and returns a callable that runs the pipeline once #####
+
+def condition_inmemory(case):
+    def run():
+        events = lr_engine.condition_events(case.network, case.x, case.y, case.condition, case.search_distance,
+                                            sequence=case.oid)
+        return len(events["RID"])
+    return run
+
+
+def condition_incremental(case, edit_fraction=0.01, seed=1):
+    state = event_state.incremental_events(case.network, None, case.oid, case.x, case.y, case.condition,
+                                           case.search_distance)[0]
+    rng = np.random.default_rng(seed)
+    condition = case.condition.copy()
+    edited = rng.random(len(condition)) < edit_fraction
+    condition[edited] = rng.choice(CONDITIONS, edited.sum())
+
+    def run():
+        return len(event_state.incremental_events(case.network, state, case.oid, case.x, case.y, condition,
+                                                  case.search_distance)[2]["RID"])
+    return run
+
+
+def lec_inmemory(case):
+    def run():
+        index = snapping.get_index(case.network)
+        candidates = index.snap(case.x, case.y, k=3, max_distance=case.search_distance)
+        route, measure, distance = snapping.snap_sequences(case.network, candidates, case.x, case.y, case.fault_id,
+                                                           order=case.oid)
+        return len(lr_engine.line_events(case.network, case.fault_id, route, measure, distance)["RID"])
+    return run
+
+
+def _write_case(case, gdb):
+    """Write the synthetic routes and nodes to a file geodatabase for the arcpy backends."""
+    import arcpy
+
+    spatial_reference = arcpy.SpatialReference(3857)
+    routes_fc = arcpy.CreateFeatureclass_management(gdb, "routes", "POLYLINE", has_m="ENABLED",
+                                                    spatial_reference=spatial_reference).getOutput(0)
+    arcpy.AddField_management(routes_fc, "ROUTE_ID", "TEXT", field_length=20)
+    network = case.network
+    with arcpy.da.InsertCursor(routes_fc, ["SHAPE@", "ROUTE_ID"]) as cursor:
+        for route, route_id in enumerate(network.route_ids):
+            start, stop = network.offsets[route], network.offsets[route + 1]
+            points = arcpy.Array([arcpy.Point(px, py, None, pm) for px, py, pm in
+                                  zip(network.x[start:stop], network.y[start:stop], network.m[start:stop])])
+            cursor.insertRow([arcpy.Polyline(points, spatial_reference, False, True), str(route_id)])
+    nodes = np.empty(len(case), dtype=[("X", "f8"), ("Y", "f8"), ("CONDITION", "U20"), ("FAULT_ID", "i4")])
+    nodes["X"], nodes["Y"], nodes["CONDITION"], nodes["FAULT_ID"] = case.x, case.y, case.condition, case.fault_id
+    nodes_fc = os.path.join(gdb, "nodes")
+    arcpy.da.NumPyArrayToFeatureClass(nodes, nodes_fc, ("X", "Y"), spatial_reference)
+    return routes_fc, nodes_fc
+
+
+def _arcpy_backend(case, lec):
+    import arcpy
+    import condition_node_processing
+    import lec_node_processing
+
+    folder = tempfile.mkdtemp(prefix="efl_benchmark_")
+    gdb = arcpy.CreateFileGDB_management(folder, "input").getOutput(0)
+    routes_fc, nodes_fc = _write_case(case, gdb)
+    arcpy.env.overwriteOutput = True
+    tracer = tracing.Tracer(backend=_QuietBackend())
+
+    def run():
+        if lec:
+            output = lec_node_processing.convert_lec_nodes_to_line_events(
+                gdb, nodes_fc, "FAULT_ID", routes_fc, "ROUTE_ID", case.search_distance, True, tracer)
+        else:
+            # Every run gets its own folder: the output geodatabase is named by the minute
+            output = condition_node_processing.create_cond_events(
+                tempfile.mkdtemp(dir=folder), "benchmark", nodes_fc, "CONDITION", routes_fc, "ROUTE_ID",
+                case.search_distance, True, tracer)
+        return int(arcpy.GetCount_management(output).getOutput(0))
+    run.cleanup = lambda: shutil.rmtree(folder, ignore_errors=True)
+    return run
+
+
+class _QuietBackend(tracing.ArcpyBackend):
+    """Counts rows through arcpy but keeps the per-run summaries out of the benchmark output."""
+
+    def message(self, text):
+        pass
+
+
+def condition_arcpy(case):
+    return _arcpy_backend(case, lec=False)
+
+
+def lec_arcpy(case):
+    return _arcpy_backend(case, lec=True)
+
+
+BACKENDS = {"condition_inmemory": condition_inmemory, "condition_incremental": condition_incremental,
+            "lec_inmemory": lec_inmemory, "condition_arcpy": condition_arcpy, "lec_arcpy": lec_arcpy}
+OFFLINE_BACKENDS = ["condition_inmemory", "condition_incremental", "lec_inmemory"]
+
+
+def measure(run, nodes, repeat):
+    """Run a backend repeat times; returns throughput, latency percentiles and peak Python memory."""
+    run()  # Warm-up, e.g. building the snapping index once per network
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        events = run()
+        timings.append(time.perf_counter() - start)
+    # Memory is measured in a separate run, since tracemalloc slows the timed code down
+    tracer = tracing.Tracer(backend=_QuietBackend(), python_memory=True)
+    with tracer.stage("memory"):
+        run()
+    timings = np.array(timings)
+    return {"events": events, "seconds_min": float(timings.min()),
+            "latency_p50": float(np.percentile(timings, 50)), "latency_p90": float(np.percentile(timings, 90)),
+            "latency_p99": float(np.percentile(timings, 99)),
+            "nodes_per_second": nodes / float(timings.min()) if timings.min() > 0 else float("inf"),
+            "peak_python_bytes": tracer.stages[0].peak_python_bytes}
+
+
+def run(routes_list, nodes_list, backends, repeat, vertices_per_route, reverse_fraction, gps_noise, fault_overlap,
+        search_meters):
+    results = []
+    for routes in routes_list:
+        for nodes_per_route in nodes_list:
+            case = Case(routes, vertices_per_route, nodes_per_route, reverse_fraction, gps_noise, fault_overlap,
+                        search_meters)
+            for name in backends:
+                backend = BACKENDS[name](case)
+                try:
+                    result = dict(case.parameters, backend=name, nodes=len(case),
+                                  **measure(backend, len(case), repeat))
+                finally:
+                    getattr(backend, "cleanup", lambda: None)()
+                print("{backend:<24}{routes:>8} routes {nodes:>10} nodes {seconds_min:10.3f} s "
+                      "{nodes_per_second:>12.0f} nodes/s  p90 {latency_p90:8.3f} s "
+                      "{peak_python_bytes:>14} B".format(**result))
+                results.append(result)
+    return results
+
+
+def compare(results, previous_path):
+    """Print the speed ratio of every case against an earlier results file (> 1 means slower now)."""
+    with open(previous_path) as previous_file:
+        previous = json.load(previous_file)
+    key = lambda result: (result["backend"], result["routes"], result["nodes_per_route"])
+    earlier = {key(result): result for result in previous["results"]}
+    for result in results:
+        before = earlier.get(key(result))
+        if before:
+            print("{0:<24}{1:>8} routes {2:>6} nodes/route  {3:6.2f}x".format(
+                result["backend"], result["routes"], result["nodes_per_route"],
+                result["seconds_min"] / before["seconds_min"]))
+
+
+def main():
+    arcpy_available = importlib.util.find_spec("arcpy") is not None
+    parser = argparse.ArgumentParser(description="Benchmark the EFL condition and LEC event pipelines.")
+    parser.add_argument("--routes", type=int, nargs="+", default=[100, 1000])
+    parser.add_argument("--nodes-per-route", type=int, nargs="+", default=[10, 100])
+    parser.add_argument("--vertices-per-route", type=int, default=100)
+    parser.add_argument("--reverse-fraction", type=float, default=0.5)
+    parser.add_argument("--gps-noise", type=float, default=2.0, help="standard deviation in meters")
+    parser.add_argument("--fault-overlap", type=float, default=0.05)
+    parser.add_argument("--search-meters", type=float, default=10.0)
+    parser.add_argument("--backends", nargs="+", choices=sorted(BACKENDS),
+                        default=sorted(BACKENDS) if arcpy_available else OFFLINE_BACKENDS)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--label", default="", help="version label stored with the results")
+    parser.add_argument("--out", help="optional JSON file for the results")
+    parser.add_argument("--compare", help="earlier JSON results to compare against")
+    args = parser.parse_args()
+
+    results = run(args.routes, args.nodes_per_route, args.backends, args.repeat, args.vertices_per_route,
+                  args.reverse_fraction, args.gps_noise, args.fault_overlap, args.search_meters)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump({"label": args.label, "created": datetime.datetime.now().isoformat(),
+                       "python": platform.python_version(), "numpy": np.__version__, "platform": platform.platform(),
+                       "results": results}, out_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
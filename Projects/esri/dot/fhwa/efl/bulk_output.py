@@ -0,0 +1,84 @@
+# #############
+"""
+Source Name: bulk_output.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Bulk writers for the event tables and event feature classes of the EFL tools, from columnar arrays.
+
+Writing events through an insert cursor (or copying a route event layer) costs one Python call and one
+geometry object per event. Here the event geometry is cut out of the route arrays for all events at once
+(RouteNetwork.slices) and encoded as WKB into one byte buffer, so the writers only move columns. The
+GeoPackage, SQLite and GeoParquet writers are shared with the SAS bridge (see common/bulk_tables.py).
+
+An output goes to one of these formats when its path is in a .gpkg or .sqlite database
+(C:/data/efl.gpkg/LEC_LinearEvents) or ends with .parquet; output_path builds such paths.
+"""
+
+import os
+
+import numpy as np
+
+import esri_common  # puts Projects/esri/common on the import path
+from bulk_tables import output_format, split_table_path, write_parquet, write_sqlite
+
+OUTPUT_FORMATS = ("FILE_GDB", "GEOPACKAGE", "SQLITE", "PARQUET")
+
+
+def output_path(workspace_gdb, name, chosen_format="FILE_GDB"):
+    """
+    Path of an output named name for the output format chosen in a tool (one of OUTPUT_FORMATS): in the file
+    geodatabase, in a GeoPackage or SQLite database next to it, or in a <geodatabase name>_parquet folder
+    next to it.
+    """
+    chosen_format = (chosen_format or "FILE_GDB").upper()
+    base = os.path.splitext(workspace_gdb)[0]
+    if chosen_format == "GEOPACKAGE":
+        return os.path.join(base + ".gpkg", name)
+    if chosen_format == "SQLITE":
+        return os.path.join(base + ".sqlite", name)
+    if chosen_format == "PARQUET":
+        return os.path.join(base + "_parquet", name + ".parquet")
+    return os.path.join(workspace_gdb, name)
+
+
+def output_locations(workspace_gdb):
+    """The GeoPackage, the SQLite database and the Parquet folder output_path writes to next to a geodatabase."""
+    base = os.path.splitext(workspace_gdb)[0]
+    return [base + ".gpkg", base + ".sqlite", base + "_parquet"]
+
+
+def write_events(columns, out_path, field_names=None, network=None, spatial_reference=None):
+    """
+    Write event columns to a GeoPackage, SQLite or Parquet output (see output_format).
+    :param field_names: optional mapping of column name -> output field name
+    :param network: RouteNetwork to cut the event geometry from; None for an event table
+    :return: out_path
+    """
+    field_names = field_names or {}
+    renamed = {str(field_names.get(name, name)): column for name, column in columns.items()}
+    geometry = None
+    if network is not None:
+        route = network.route_index(np.asarray(columns["RID"]))
+        geometry = network.slices(route, np.asarray(columns["FMEAS"]), np.asarray(columns["TMEAS"]))
+
+    if output_format(out_path) == "PARQUET":
+        return write_parquet(renamed, out_path, geometry, spatial_reference)
+    database, table = split_table_path(out_path)
+    os.makedirs(os.path.dirname(database) or ".", exist_ok=True)
+    return write_sqlite(renamed, database, table, geometry, spatial_reference)
+
+
+def write_event_layer(routes_fc, routes_id_field, event_table, out_fc, field_names=None):
+    """
+    Bulk counterpart of MakeRouteEventLayer followed by CopyFeatures, for the geoprocessing pipelines writing
+    to a GeoPackage, SQLite or Parquet output: the event table (RID, FMEAS, TMEAS) is read into columns and
+    the event features are written from them.
+    :return: out_fc
+    """
+    import event_overlay
+    import lr_engine
+
+    events = event_overlay.read_event_table(event_table)
+    network, spatial_reference = lr_engine.load_routes(routes_fc, routes_id_field)
+    return write_events(events, out_fc, field_names, network, spatial_reference)
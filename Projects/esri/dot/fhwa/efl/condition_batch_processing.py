@@ -0,0 +1,157 @@
+# #############
+"""
+Tool Name:  Condition Event Node Batch Post-Processing
+Source Name: condition_batch_processing.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Batch version of the Condition Event Node Post-Processing tool for several condition feature classes at once
+(the five condition types described in condition_node_processing.py).
+
+The routes are read and indexed once. Each condition is then located on the shared route index in a worker
+process, and all event outputs are written to a single workspace file geodatabase, followed by a timing
+summary per condition.
+"""
+
+### EXECUTION ###
+
+# Import needed modules
+import arcpy
+import concurrent.futures
+import datetime
+import multiprocessing
+import os
+import sys
+import time
+
+import lr_engine
+import scratch
+
+
+# Route network shared by the worker processes, set once per worker by _init_worker
+_network = None
+
+
+def _init_worker(network):
+    global _network
+    _network = network
+
+
+def _process_condition(condition, condlec_nodes_fc, condition_field, search_distance, spatial_reference_text,
+                       network=None):
+    """Locate one condition's nodes on the shared routes; returns (condition, condition field, events, timings)."""
+    network = network or _network
+    spatial_reference = arcpy.SpatialReference()
+    spatial_reference.loadFromString(spatial_reference_text)
+
+    start = time.perf_counter()
+    node_x, node_y, node_attributes = lr_engine.load_points(condlec_nodes_fc, ["OID@", condition_field],
+                                                            spatial_reference)
+    loaded = time.perf_counter()
+    events = lr_engine.condition_events(network, node_x, node_y, node_attributes[condition_field],
+                                        search_distance, default_value="Excellent", sequence=node_attributes["OID@"])
+    located = time.perf_counter()
+    return condition, condition_field, events, {"nodes": len(node_x), "load_seconds": loaded - start,
+                                                "locate_seconds": located - loaded}
+
+
+def create_cond_events_batch(workspace,
+                             conditions,
+                             routes_fc,
+                             routes_id_field,
+                             point_search_meters,
+                             workers=None):
+
+    """
+    :param workspace: folder in which the output file geodatabase is created
+    :param conditions: list of (condition name, condition node feature class, condition field)
+    :param routes_fc: route feature class
+    :param routes_id_field: route identifier field
+    :param point_search_meters: search distance in meters between nodes and routes
+    :param workers: number of worker processes; defaults to one per condition, up to the CPU count
+    :return: (workspace_gdb, list of per-condition timing summaries)
+    """
+
+    # STEP 0: Set-up
+    timestamp = '{:%Y%m%d_%H%M}'.format(datetime.datetime.now())
+    workspace_gdb_name = "ConditionPostProcessing_{0}".format(timestamp)
+
+    # The workspace geodatabase is removed again if the run fails
+    with scratch.output_geodatabase(workspace, workspace_gdb_name) as workspace_gdb:
+
+        # STEP 1: Load and index the routes once for every condition.
+        arcpy.AddMessage("Loading and indexing routes...")
+        start = time.perf_counter()
+        network, spatial_reference = lr_engine.load_routes(routes_fc, routes_id_field)
+        search_distance = lr_engine.meters_to_units(spatial_reference, point_search_meters)
+        arcpy.AddMessage("Routes indexed in {0:.2f} s.".format(time.perf_counter() - start))
+
+        # STEP 2: Locate each condition's nodes in parallel worker processes.
+        arcpy.AddMessage("Processing {0} conditions...".format(len(conditions)))
+        jobs = [(condition, nodes_fc, field, search_distance, spatial_reference.exportToString())
+                for condition, nodes_fc, field in conditions]
+        workers = workers or min(len(jobs), os.cpu_count() or 1)
+        if workers > 1 and len(jobs) > 1:
+            with concurrent.futures.ProcessPoolExecutor(workers, initializer=_init_worker,
+                                                        initargs=(network,)) as executor:
+                results = list(executor.map(_process_condition, *zip(*jobs)))
+        else:
+            results = [_process_condition(*job, network=network) for job in jobs]
+
+        # STEP 3: Write every condition's events into the shared workspace (one writer per geodatabase).
+        # Conditions sharing a name get numbered outputs.
+        summary = []
+        for condition, condition_field, events, timings in results:
+            field_names = {"VALUE": condition_field}
+            start = time.perf_counter()
+            lr_engine.write_event_table(events,
+                                        arcpy.CreateUniqueName("out_{0}_event_table".format(condition), workspace_gdb),
+                                        field_names)
+            lr_engine.write_event_features(network, events,
+                                           arcpy.CreateUniqueName("out_{0}_events".format(condition), workspace_gdb),
+                                           spatial_reference, field_names)
+            timings["write_seconds"] = time.perf_counter() - start
+            timings["events"] = len(events["RID"])
+            timings["condition"] = condition
+            summary.append(timings)
+
+        # STEP 4: Timing summary.
+        arcpy.AddMessage("{0:<20}{1:>10}{2:>10}{3:>10}{4:>10}{5:>10}".format("Condition", "Nodes", "Events",
+                                                                           "Load s", "Locate s", "Write s"))
+        for timings in summary:
+            arcpy.AddMessage("{condition:<20}{nodes:>10}{events:>10}{load_seconds:>10.2f}{locate_seconds:>10.2f}"
+                             "{write_seconds:>10.2f}".format(**timings))
+
+    return workspace_gdb, summary
+
+
+def main():
+
+    # Prod GP Tool Vars
+    workspace = arcpy.GetParameterAsText(0)
+    # Value table: condition name, condition node feature class, condition field
+    condition_table = arcpy.GetParameter(1)
+    routes_fc = arcpy.GetParameterAsText(2)
+    routes_id_field = arcpy.GetParameterAsText(3)
+    point_search_meters = arcpy.GetParameterAsText(4)
+
+    conditions = [(condition_table.getValue(row, 0), condition_table.getValue(row, 1),
+                   condition_table.getValue(row, 2)) for row in range(condition_table.rowCount)]
+
+    arcpy.AddMessage("Starting Condition Event batch post-processing...")
+
+    # ArcGIS Pro embeds Python, so worker processes must be started with the real interpreter
+    if sys.platform == "win32":
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+
+    create_cond_events_batch(workspace,
+                             conditions,
+                             routes_fc,
+                             routes_id_field,
+                             point_search_meters)
+
+    arcpy.AddMessage("Condition Event batch post-processing completed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -65,6 +65,12 @@ import arcpy
 import os
 import datetime
 
+import bulk_output
+import event_state
+import lr_engine
+import scratch
+import tracing
+
 
 def create_cond_events(workspace,
                        condition,
@@ -73,7 +79,9 @@ def create_cond_events(workspace,
                        routes_fc,
                        routes_id_field,
                        point_search_meters,
-                       clean_up_temp_files):
+                       clean_up_temp_files,
+                       tracer=None,
+                       output_format="FILE_GDB"):
 
     """
     
@@ -85,6 +93,9 @@ def create_cond_events(workspace,
     :param routes_id_field: 
     :param point_search_meters: 
     :param clean_up_temp_files: 
+    :param tracer: optional tracing.Tracer recording the steps; the one-line summary is always reported
+    :param output_format: FILE_GDB, or GEOPACKAGE, SQLITE or PARQUET for bulk output next to the workspace
+                          geodatabase (see bulk_output.py)
     :return: 
     """
 
@@ -93,110 +104,305 @@ def create_cond_events(workspace,
     # Take the user parameter for search radius and append linear unit measurement for string
     search_distance = "{0} Meters".format(str(point_search_meters))
 
-    # Create workspace file geodatabase
+    # Create workspace file geodatabase; it is removed again if the run fails
     timestamp = '{:%Y%m%d_%H%M}'.format(datetime.datetime.now())
     workspace_gdb_name = "ConditionPostProcessing_{0}".format(timestamp)
 
-    arcpy.AddMessage("Creating workspace file geodatabase '{0}'...".format(workspace_gdb_name))
-    workspace_gdb = arcpy.CreateFileGDB_management(workspace, workspace_gdb_name).getOutput(0)
+    # Every geoprocessing tool runs through the tracer's backend (see tracing.py)
+    tracer = tracer or tracing.Tracer()
+    gp = tracer.gp
+
+    with scratch.output_geodatabase(workspace, workspace_gdb_name, gp) as workspace_gdb:
+
+        tracer.workspace = tracer.workspace or workspace_gdb
+
+        os.chdir(workspace)
+        if os.path.isfile(os.path.join(workspace, "work_routes_lyr")):
+            gp.AddMessage("Removing previously-existing layers...")
+            os.remove(os.path.join(workspace, "work_routes_lyr"))
+
+        out_condition_event_fc = bulk_output.output_path(workspace_gdb, "out_{0}_events".format(condition),
+                                                         output_format)
+
+        # Intermediates stay in memory and are deleted when the block ends, even on error. Without clean-up
+        # they are kept in the workspace geodatabase for inspection.
+        with scratch.ScratchWorkspace(None if clean_up_temp_files else workspace_gdb, gp) as work:
+
+            work_event_table = work.path("work_cond_events_table")
+
+            # STEP 1: Create copy of our routes and condition points so we can operate on them for the
+            # splitting by point step.
+            gp.AddMessage("Copying data to workspace...")
+            work_nodes_path = work.path("work_condition_nodes")
+            with tracer.stage("copy nodes", inputs=[condlec_nodes_fc], outputs=[work_nodes_path]):
+                work_nodes_fc = gp.CopyFeatures_management(condlec_nodes_fc, work_nodes_path).getOutput(0)
+
+            work_routes_lyr = gp.MakeFeatureLayer_management(routes_fc,
+                                                             work.layer("work_routes_lyr")).getOutput(0)
+
+            # STEP 2: Perform Select-by-Location using the input points on the routes copy - the idea is to
+            # select only the lines that were evaluated. Export this selection as "Evaluated_Routes".
+            gp.AddMessage("Finding evaluated roads...")
+            work_routes_evaluated_path = work.path("work_evaluated_routes")
+            with tracer.stage("select routes", inputs=[routes_fc], outputs=[work_routes_evaluated_path]):
+                gp.SelectLayerByLocation_management(work_routes_lyr, "INTERSECT", work_nodes_fc,
+                                                    search_distance)
+                work_routes_evaluated = gp.CopyFeatures_management(work_routes_lyr,
+                                                                   work_routes_evaluated_path).getOutput(0)
+
+            # STEP 3: Use Split Line by Point to fracture the Routes into lines that are determined by the
+            # points entered. Make sure to enter a search area.
+            gp.AddMessage("Creating condition segments...")
+            #TODO - Use the near tool to find the nearest point on the line instead of a search radius for "SplitLineAtPoint"
+            work_segments_path = work.path("work_evaluated_route_segments")
+            with tracer.stage("split", inputs=[work_routes_evaluated, work_nodes_fc], outputs=[work_segments_path]):
+                work_route_evaluated_segments = gp.SplitLineAtPoint_management(
+                    in_features=work_routes_evaluated,
+                    point_features=work_nodes_fc,
+                    out_feature_class=work_segments_path,
+                    search_radius=search_distance).getOutput(0)
+
+            # STEP 4: Transfer the condition from the points to the line segments by using spatial join
+            gp.AddMessage("Transferring condition attributes to condition route segments...")
+            work_conditions_path = work.path("work_evaluated_route_segment_conditions")
+            with tracer.stage("spatial join", inputs=[work_route_evaluated_segments],
+                              outputs=[work_conditions_path]):
+                work_evaluated_route_segment_conditions = gp.SpatialJoin_analysis(
+                    target_features=work_route_evaluated_segments,
+                    join_features=work_nodes_fc,
+                    out_feature_class=work_conditions_path,
+                    join_operation="JOIN_ONE_TO_ONE", join_type="KEEP_ALL",
+                    match_option="INTERSECT", search_radius=search_distance,
+                    distance_field_name="closest_node_distance").getOutput(0)
+
+            # STEP 5: Correct for the first line segment by selecting it and changing the condition rating to
+            # "Excellent"
+            gp.AddMessage("Adding default start segment condition...")
+            with tracer.stage("default condition"):
+                with gp.da.UpdateCursor(work_evaluated_route_segment_conditions, condition_field) as cursor:
+                    for row in cursor:
+                        row[0] = "Excellent"
+                        cursor.updateRow(row)
+                        break
+
+            # STEP 6: Create event table using condition segments
+            with tracer.stage("locate", inputs=[work_evaluated_route_segment_conditions],
+                              outputs=[work_event_table]):
+                gp.LocateFeaturesAlongRoutes_lr(in_features=work_evaluated_route_segment_conditions,
+                                                in_routes=work_routes_evaluated,
+                                                route_id_field=routes_id_field,
+                                                out_table=work_event_table, radius_or_tolerance=search_distance,
+                                                out_event_properties="RID LINE FMEAS TMEAS",
+                                                route_locations="FIRST",
+                                                distance_field="DISTANCE",
+                                                zero_length_events="ZERO",
+                                                in_fields="FIELDS", m_direction_offsetting="M_DIRECTON")
+
+            if bulk_output.output_format(out_condition_event_fc):
+                # GeoPackage, SQLite or Parquet output: the located events are written in bulk from columns
+                with tracer.stage("write events", inputs=[work_event_table],
+                                  written=[out_condition_event_fc]) as stage:
+                    bulk_output.write_event_layer(routes_fc, routes_id_field, work_event_table,
+                                                  out_condition_event_fc)
+                    stage.rows_out = stage.rows_in
+            else:
+                with tracer.stage("write events", inputs=[work_event_table], outputs=[out_condition_event_fc]):
+                    # GP Tool: Table conversion of edited events to a feature layer.
+                    work_condition_events_lyr = gp.MakeRouteEventLayer_lr(
+                        in_routes=routes_fc,
+                        route_id_field=routes_id_field,
+                        in_table=work_event_table,
+                        in_event_properties="rid LINE fmeas tmeas",
+                        out_layer=work.layer("work_condition_events_lyr")).getOutput(0)
+
+                    # GP Tool: Copy feature layer to disk as feature class; the only dataset written to the output.
+                    gp.CopyFeatures_management(in_features=work_condition_events_lyr,
+                                               out_feature_class=out_condition_event_fc)
+
+            if clean_up_temp_files:
+                gp.AddMessage("Cleaning up temporary content...")
+
+    tracer.report()
+    return out_condition_event_fc
+
+
+def create_cond_events_inmemory(workspace,
+                                condition,
+                                condlec_nodes_fc,
+                                condition_field,
+                                routes_fc,
+                                routes_id_field,
+                                point_search_meters,
+                                tracer=None,
+                                output_format="FILE_GDB"):
 
-    os.chdir(workspace)
-    if os.path.isfile(os.path.join(workspace, "work_routes_lyr")):
-        arcpy.AddMessage("Removing previously-existing layers...")
-        os.remove(os.path.join(workspace, "work_routes_lyr"))
+    """
+    In-memory alternative to create_cond_events. Routes and condition nodes are read once into arrays, every
+    node is located on its nearest route within the search distance and the condition events are built
+    straight from the node measures. Only the output event table and feature class are written.
+
+    Each node starts a new event that lasts until the next node along the route; the stretch before the
+    first node of a route is "Excellent". The survey direction of each route is taken from the ObjectID order
+    of its nodes: on a route digitized against the survey direction, the events run towards the lower
+    measures and the "Excellent" stretch is at the high-measure end, where Step 5 of create_cond_events
+    would mark the wrong segment (TODO 01).
+
+    :param workspace: folder in which the output file geodatabase is created
+    :param condition: condition name used in the output names
+    :param condlec_nodes_fc: condition node feature class
+    :param condition_field: field of the nodes holding the condition rating
+    :param routes_fc: route feature class
+    :param routes_id_field: route identifier field
+    :param point_search_meters: search distance in meters between nodes and routes
+    :param tracer: optional tracing.Tracer recording the steps; the one-line summary is always reported
+    :param output_format: FILE_GDB, or GEOPACKAGE, SQLITE or PARQUET for bulk output next to the workspace
+                          geodatabase (see bulk_output.py)
+    :return: output event feature class
+    """
 
-    work_event_table = os.path.join(workspace_gdb, "work_cond_events_table")
+    # STEP 0: Set-up
+    timestamp = '{:%Y%m%d_%H%M}'.format(datetime.datetime.now())
+    workspace_gdb_name = "ConditionPostProcessing_{0}".format(timestamp)
 
-    out_condition_event_fc = os.path.join(workspace_gdb, "out_{0}_events".format(condition))
+    tracer = tracer or tracing.Tracer()
+    gp = tracer.gp
+
+    # The workspace geodatabase is removed again if the run fails
+    with scratch.output_geodatabase(workspace, workspace_gdb_name, gp) as workspace_gdb:
+
+        out_condition_event_table = bulk_output.output_path(workspace_gdb, "out_{0}_event_table".format(condition),
+                                                            output_format)
+        out_condition_event_fc = bulk_output.output_path(workspace_gdb, "out_{0}_events".format(condition),
+                                                         output_format)
+        bulk = bulk_output.output_format(out_condition_event_fc) is not None
+
+        tracer.workspace = tracer.workspace or workspace_gdb
+
+        # STEP 1: Load routes and nodes into memory and index the route segments.
+        gp.AddMessage("Loading routes and condition nodes...")
+        with tracer.stage("load", inputs=[routes_fc, condlec_nodes_fc]) as stage:
+            network, spatial_reference = lr_engine.load_routes(routes_fc, routes_id_field)
+            search_distance = lr_engine.meters_to_units(spatial_reference, point_search_meters)
+            node_x, node_y, node_attributes = lr_engine.load_points(condlec_nodes_fc, ["OID@", condition_field],
+                                                                    spatial_reference)
+            stage.rows_out = len(node_x)
+
+        # STEP 2: Locate the nodes on their nearest routes and build the condition events.
+        gp.AddMessage("Locating condition nodes along routes...")
+        with tracer.stage("locate") as stage:
+            stage.rows_in = len(node_x)
+            events = lr_engine.condition_events(network, node_x, node_y, node_attributes[condition_field],
+                                                search_distance, default_value="Excellent",
+                                                sequence=node_attributes["OID@"])
+            stage.rows_out = len(events["RID"])
+        gp.AddMessage("{0} condition events created.".format(len(events["RID"])))
+
+        # STEP 3: Write the event table and the event feature class.
+        field_names = {"VALUE": condition_field}
+        with tracer.stage("write events",
+                          outputs=[] if bulk else [out_condition_event_table, out_condition_event_fc],
+                          written=[out_condition_event_table, out_condition_event_fc] if bulk else []) as stage:
+            stage.rows_in = len(events["RID"])
+            if bulk:
+                stage.rows_out = 2 * len(events["RID"])
+            lr_engine.write_event_table(events, out_condition_event_table, field_names)
+            lr_engine.write_event_features(network, events, out_condition_event_fc, spatial_reference, field_names)
+
+    tracer.report()
+    return out_condition_event_fc
+
+
+def create_cond_events_incremental(workspace,
+                                   condition,
+                                   condlec_nodes_fc,
+                                   condition_field,
+                                   routes_fc,
+                                   routes_id_field,
+                                   point_search_meters,
+                                   tracer=None):
+
+    """
+    Incremental version of create_cond_events_inmemory. The outputs are kept in a persistent
+    "ConditionPostProcessing.gdb" in the workspace together with a state file of the nodes from the last run.
+    On a re-run only the routes touched by new, moved, re-rated or deleted nodes have their events deleted
+    and rebuilt; the other events are left as they are. Every route is rebuilt on the first run, when the
+    routes changed or when an output is missing.
+
+    :param workspace: folder holding the persistent output file geodatabase and the state file
+    :param condition: condition name used in the output names
+    :param condlec_nodes_fc: condition node feature class
+    :param condition_field: field of the nodes holding the condition rating
+    :param routes_fc: route feature class
+    :param routes_id_field: route identifier field
+    :param point_search_meters: search distance in meters between nodes and routes
+    :param tracer: optional tracing.Tracer recording the steps; the one-line summary is always reported
+    :return: output event feature class
+    """
 
-    # STEP 1: Create copy of our routes and condition points so we can operate on them for the splitting by point step.
-    arcpy.AddMessage("Copying data to workspace...")
-    work_nodes_fc = arcpy.FeatureClassToFeatureClass_conversion(condlec_nodes_fc, workspace_gdb,
-                                                                "work_condition_nodes").getOutput(0)
-
-    work_routes_fc = arcpy.FeatureClassToFeatureClass_conversion(routes_fc, workspace_gdb,
-                                                                "work_routes").getOutput(0)
-
-    work_routes_lyr = arcpy.MakeFeatureLayer_management(routes_fc, "work_routes_lyr").getOutput(0)
-
-    # STEP 2: Perform Select-by-Location using the input points on the routes copy - the idea is to select only the
-    # lines that were evaluated. Export this selection to disk as "Evaluated_Routes".
-    arcpy.AddMessage("Finding evaluated roads...")
-    arcpy.SelectLayerByLocation_management(work_routes_lyr, "INTERSECT", work_nodes_fc, search_distance)
-    work_routes_evaluated = arcpy.CopyFeatures_management(work_routes_lyr,
-                                                          os.path.join(workspace_gdb,
-                                                                       "work_evaluated_routes")).getOutput(0)
-
-    # STEP 3: Use Split Line by Point to fracture the Routes into lines that are determined by the points entered.
-    # Make sure to enter a search area.
-    arcpy.AddMessage("Creating condition segments...")
-    #TODO - Use the near tool to find the nearest point on the line instead of a search radius for "SplitLineAtPoint"
-    work_route_evaluated_segments = arcpy.SplitLineAtPoint_management(in_features=work_routes_evaluated,
-                                                                      point_features=work_nodes_fc,
-                                                                      out_feature_class=os.path.join(workspace_gdb,
-                                                                                                     "work_evaluated_route_segments"),
-                                                                      search_radius=search_distance).getOutput(0)
-
-    # STEP 4: Transfer the condition from the points to the line segments by using spatial join
-    arcpy.AddMessage("Transferring condition attributes to condition route segments...")
-    arcpy.SpatialJoin_analysis(
-        target_features=work_route_evaluated_segments,
-        join_features=work_nodes_fc,
-        out_feature_class=os.path.join(workspace_gdb, "work_evaluated_route_segment_conditions"),
-        join_operation="JOIN_ONE_TO_ONE", join_type="KEEP_ALL",
-        match_option="INTERSECT", search_radius=search_distance, distance_field_name="closest_node_distance")
-
-    work_evaluated_route_segment_conditions = os.path.join(workspace_gdb, "work_evaluated_route_segment_conditions")
-
-    # STEP 5: Correct for the first line segment by selecting it and changing the condition rating to "Excellent"
-    arcpy.AddMessage("Adding default start segment condition...")
-    with arcpy.da.UpdateCursor(work_evaluated_route_segment_conditions, condition_field) as cursor:
-        for row in cursor:
-            row[0] = "Excellent"
-            cursor.updateRow(row)
-            break
-
-    # STEP 6: Create event table using condition segments
-    arcpy.LocateFeaturesAlongRoutes_lr(in_features=work_evaluated_route_segment_conditions,
-                                       in_routes=work_routes_evaluated,
-                                       route_id_field=routes_id_field,
-                                       out_table=work_event_table, radius_or_tolerance=search_distance,
-                                       out_event_properties="RID LINE FMEAS TMEAS",
-                                       route_locations="FIRST",
-                                       distance_field="DISTANCE",
-                                       zero_length_events="ZERO",
-                                       in_fields="FIELDS", m_direction_offsetting="M_DIRECTON")
-
-    # GP Tool: Table conversion of edited events to a feature layer.
-    work_condition_events_lyr = arcpy.MakeRouteEventLayer_lr(in_routes=routes_fc,
-                                                             route_id_field=routes_id_field,
-                                                             in_table=work_event_table,
-                                                             in_event_properties="rid LINE fmeas tmeas",
-                                                             out_layer="work_condition_events_lyr").getOutput(0)
-
-    # GP Tool: Copy feature layer to disk as feature class.
-    arcpy.CopyFeatures_management(in_features=work_condition_events_lyr,
-                                  out_feature_class=out_condition_event_fc)
-
-    # Optional clean-up of temp data.
-    if clean_up_temp_files:
-        arcpy.AddMessage("Cleaning up temporary content...")
-        # print("Cleaning up temporary content...")
-
-        content_to_delete = [work_evaluated_route_segment_conditions,
-                             work_nodes_fc,
-                             work_routes_lyr,
-                             work_condition_events_lyr,
-                             work_event_table,
-                             work_route_evaluated_segments,
-                             work_routes_evaluated,
-                             work_routes_fc]
-
-        for item in content_to_delete:
-            arcpy.Delete_management(item)
-
-        arcpy.AddMessage("Temp files cleaned up.")
-        # print("Temp files cleaned up.")
+    # STEP 0: Set-up
+    workspace_gdb_name = "ConditionPostProcessing"
+    workspace_gdb = os.path.join(workspace, "{0}.gdb".format(workspace_gdb_name))
+    tracer = tracer or tracing.Tracer()
+    tracer.workspace = tracer.workspace or workspace_gdb
+    gp = tracer.gp
+    if not gp.Exists(workspace_gdb):
+        gp.AddMessage("Creating workspace file geodatabase '{0}'...".format(workspace_gdb_name))
+        gp.CreateFileGDB_management(workspace, workspace_gdb_name)
+
+    out_condition_event_table = os.path.join(workspace_gdb, "out_{0}_event_table".format(condition))
+    out_condition_event_fc = os.path.join(workspace_gdb, "out_{0}_events".format(condition))
+    state_file = os.path.join(workspace, "{0}_{1}_state.npz".format(workspace_gdb_name, condition))
+
+    # STEP 1: Load routes and nodes into memory, with the node ObjectIDs to compare against the last run.
+    gp.AddMessage("Loading routes and condition nodes...")
+    with tracer.stage("load", inputs=[routes_fc, condlec_nodes_fc]) as stage:
+        network, spatial_reference = lr_engine.load_routes(routes_fc, routes_id_field)
+        search_distance = lr_engine.meters_to_units(spatial_reference, point_search_meters)
+        node_x, node_y, node_attributes = lr_engine.load_points(condlec_nodes_fc, ["OID@", condition_field],
+                                                                spatial_reference)
+        stage.rows_out = len(node_x)
+
+    state = None
+    if gp.Exists(out_condition_event_table) and gp.Exists(out_condition_event_fc):
+        state = event_state.NodeState.load(state_file)
+
+    # STEP 2: Locate the new and edited nodes and rebuild the events of the routes they touch.
+    gp.AddMessage("Locating changed condition nodes along routes...")
+    with tracer.stage("locate") as stage:
+        stage.rows_in = len(node_x)
+        new_state, touched, events = event_state.incremental_events(network, state, node_attributes["OID@"],
+                                                                    node_x, node_y, node_attributes[condition_field],
+                                                                    search_distance, default_value="Excellent",
+                                                                    condition_field=condition_field)
+        stage.rows_out = len(events["RID"])
+
+    # STEP 3: Replace the events of the touched routes, or write the outputs from scratch. The old state is
+    # removed first, so a run that fails while writing is followed by a full rebuild.
+    if os.path.isfile(state_file):
+        os.remove(state_file)
+    field_names = {"VALUE": condition_field}
+    with tracer.stage("write events") as stage:
+        stage.rows_in = len(events["RID"])
+        stage.rows_out = 2 * len(events["RID"])
+        if touched is None:
+            gp.AddMessage("Rebuilding the events of every route...")
+            for output in (out_condition_event_table, out_condition_event_fc):
+                if gp.Exists(output):
+                    gp.Delete_management(output)
+            lr_engine.write_event_table(events, out_condition_event_table, field_names)
+            lr_engine.write_event_features(network, events, out_condition_event_fc, spatial_reference, field_names)
+        else:
+            gp.AddMessage("Rebuilding the events of {0} changed routes...".format(len(touched)))
+            if len(touched):
+                for output, output_network in ((out_condition_event_table, None), (out_condition_event_fc, network)):
+                    lr_engine.delete_route_events(output, "RID", touched)
+                    lr_engine.append_events(output_network, events, output, field_names)
+    gp.AddMessage("{0} condition events written.".format(len(events["RID"])))
+
+    new_state.save(state_file)
+
+    tracer.report()
+    return out_condition_event_fc
 
 
 def main():
@@ -209,20 +415,54 @@ def main():
     routes_id_field = arcpy.GetParameterAsText(4)
     point_search_meters = arcpy.GetParameterAsText(5)
     clean_up_temp_files = arcpy.GetParameter(6)
+    # Optional engine parameter: "ARCPY" (geoprocessing tool chain), "IN_MEMORY" or "INCREMENTAL"
+    engine = (arcpy.GetParameterAsText(7) if arcpy.GetArgumentCount() > 7 else "") or "ARCPY"
+    # Optional trace file: stage timings as JSON, plus a Chrome trace next to it
+    trace_file = arcpy.GetParameterAsText(8) if arcpy.GetArgumentCount() > 8 else ""
+    # Optional output format of the ARCPY and IN_MEMORY engines: "FILE_GDB", or "GEOPACKAGE", "SQLITE" or
+    # "PARQUET" written in bulk; the INCREMENTAL engine updates its file geodatabase in place
+    output_format = (arcpy.GetParameterAsText(9) if arcpy.GetArgumentCount() > 9 else "") or "FILE_GDB"
+    tracer = tracing.Tracer()
 
     arcpy.AddMessage("Starting Condition Event post-processing...")
     # print("Starting LEC post-processing...")
 
     condition = "longcracking"
 
-    create_cond_events(workspace,
-                       condition,
-                       condlec_nodes_fc,
-                       condition_field,
-                       routes_fc,
-                       routes_id_field,
-                       point_search_meters,
-                       clean_up_temp_files)
+    if engine.upper() == "INCREMENTAL":
+        create_cond_events_incremental(workspace,
+                                       condition,
+                                       condlec_nodes_fc,
+                                       condition_field,
+                                       routes_fc,
+                                       routes_id_field,
+                                       point_search_meters,
+                                       tracer)
+    elif engine.upper() == "IN_MEMORY":
+        create_cond_events_inmemory(workspace,
+                                    condition,
+                                    condlec_nodes_fc,
+                                    condition_field,
+                                    routes_fc,
+                                    routes_id_field,
+                                    point_search_meters,
+                                    tracer,
+                                    output_format)
+    else:
+        create_cond_events(workspace,
+                           condition,
+                           condlec_nodes_fc,
+                           condition_field,
+                           routes_fc,
+                           routes_id_field,
+                           point_search_meters,
+                           clean_up_temp_files,
+                           tracer,
+                           output_format)
+
+    if trace_file:
+        arcpy.AddMessage("Writing stage trace to '{0}'...".format(trace_file))
+        tracer.write(trace_file)
 
     arcpy.AddMessage("Condition Event post-processing completed.")
     # print("LEC post-processing completed.")
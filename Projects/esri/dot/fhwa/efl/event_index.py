@@ -0,0 +1,183 @@
+# #############
+"""
+Source Name: event_index.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Persistent route-measure index over the output event tables of the EFL tools, answering "which events cover
+route R at measure m?" and "which events overlap route R between m1 and m2?" without a route event layer.
+
+The events are sorted by route and low measure. Next to the low and high measures, every route keeps the
+running maximum of the high measures, which makes the sorted arrays an implicit interval tree: the events
+covering a measure lie between the first event whose running maximum reaches the measure and the last
+event starting at or before it, and both ends are found with a binary search.
+
+An index is a directory of .npy files (one per column, like the SAS field cache) that are opened as
+read-only memory maps, plus a meta.json with the change stamp of the event table it was built from.
+open_index rebuilds the index when the table changed since, so it follows re-runs of the pipeline.
+"""
+
+import json
+import os
+import shutil
+
+import numpy as np
+
+import esri_common  # puts Projects/esri/common on the import path
+import change_stamp
+import event_overlay
+
+
+class EventIndex(object):
+    """
+    Sorted, memory-mapped event arrays with per-route offsets.
+
+    :param directory: index directory written by build
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json")) as meta_file:
+            self.meta = json.load(meta_file)
+        # Plain ndarray views of the memory maps: slicing a np.memmap object costs more than the search itself
+        load = lambda name: np.load(os.path.join(directory, "{0}.npy".format(name)), mmap_mode="r").view(np.ndarray)
+        self.route_ids = np.array(load("__routes__"))
+        self.offsets = np.array(load("__offsets__")).tolist()
+        self.low = load("__low__")
+        self.high = load("__high__")
+        self.reach = load("__reach__")
+        self.columns = {name: load(name) for name in self.meta["columns"]}
+        self._routes = {route_id: route for route, route_id in enumerate(self.route_ids.tolist())}
+
+    def __len__(self):
+        return len(self.low)
+
+    def _span(self, rid, from_measure, to_measure):
+        """Rows of route rid that may overlap [from_measure, to_measure]."""
+        route = self._routes.get(rid)
+        if route is None:
+            return 0, 0
+        start, stop = self.offsets[route], self.offsets[route + 1]
+        first = start + np.searchsorted(self.reach[start:stop], from_measure, side="left")
+        last = start + np.searchsorted(self.low[start:stop], to_measure, side="right")
+        return first, last
+
+    def range(self, rid, from_measure, to_measure):
+        """Indexes of the events of route rid overlapping [from_measure, to_measure], by low measure."""
+        low, high = min(from_measure, to_measure), max(from_measure, to_measure)
+        first, last = self._span(rid, low, high)
+        if last <= first:
+            return np.empty(0, dtype=np.int64)
+        rows = np.arange(first, last)
+        return rows[self.high[first:last] >= low]
+
+    def point(self, rid, measure):
+        """Indexes of the events of route rid covering measure."""
+        return self.range(rid, measure, measure)
+
+    def rows(self, indexes, fields=None):
+        """Attribute values of the events at indexes, as a dict of arrays (RID, FMEAS, TMEAS and attributes)."""
+        fields = fields or list(self.columns)
+        indexes = np.asarray(indexes, dtype=np.int64)
+        return {name: self.columns[name][indexes] for name in fields}
+
+    def batch_range(self, rids, from_measures, to_measures):
+        """
+        Range queries in one call.
+        :return: (query, event) index pairs, sorted by query
+        """
+        rids = np.asarray(rids)
+        low = np.minimum(from_measures, to_measures).astype(float)
+        high = np.maximum(from_measures, to_measures).astype(float)
+        position = np.clip(np.searchsorted(self.route_ids, rids), 0, max(len(self.route_ids) - 1, 0))
+        known = self.route_ids[position] == rids if len(self.route_ids) else np.zeros(len(rids), dtype=bool)
+        route = np.where(known, position, -1)
+
+        ##### Binary searches per route present in the batch #####
+        first = np.zeros(len(rids), dtype=np.int64)
+        last = np.zeros(len(rids), dtype=np.int64)
+        for value in np.unique(route[route >= 0]):
+            queries = np.flatnonzero(route == value)
+            start, stop = self.offsets[value], self.offsets[value + 1]
+            first[queries] = start + np.searchsorted(self.reach[start:stop], low[queries], side="left")
+            last[queries] = start + np.searchsorted(self.low[start:stop], high[queries], side="right")
+
+        ##### Expand the candidate rows and keep those reaching the query #####
+        count = np.maximum(last - first, 0)
+        query = np.repeat(np.arange(len(rids)), count)
+        event = np.repeat(first, count) + np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        keep = self.high[event] >= low[query]
+        return query[keep], event[keep]
+
+    def batch_point(self, rids, measures):
+        """Point queries in one call; returns (query, event) index pairs, sorted by query."""
+        return self.batch_range(rids, measures, measures)
+
+
+def build(columns, directory, stamp=None):
+    """
+    Write an index for event columns, replacing an existing index in directory.
+    :param columns: dict of columns with RID, FMEAS and TMEAS plus any attribute columns
+    :param stamp: change stamp of the source table, stored to detect when the index is out of date
+    :return: EventIndex
+    """
+    rid = np.asarray(columns["RID"])
+    low = np.minimum(columns["FMEAS"], columns["TMEAS"]).astype(float)
+    high = np.maximum(columns["FMEAS"], columns["TMEAS"]).astype(float)
+    order = np.lexsort((low, rid))
+    rid, low, high = rid[order], low[order], high[order]
+
+    change = np.ones(len(rid), dtype=bool)
+    change[1:] = rid[1:] != rid[:-1]
+    starts = np.flatnonzero(change)
+    offsets = np.append(starts, len(rid))
+
+    ##### Running maximum of the high measures, restarted on every route #####
+    reach = high.copy()
+    for start, stop in zip(offsets[:-1], offsets[1:]):
+        np.maximum.accumulate(reach[start:stop], out=reach[start:stop])
+
+    ##### Write to a new directory and swap it in, so readers never see a half-written index #####
+    temp_directory = directory.rstrip("\\/") + ".tmp"
+    shutil.rmtree(temp_directory, ignore_errors=True)
+    os.makedirs(temp_directory)
+    arrays = {"__routes__": rid[starts], "__offsets__": offsets, "__low__": low, "__high__": high,
+              "__reach__": reach}
+    for name, column in columns.items():
+        column = np.asarray(column)[order]
+        if column.dtype.kind == "O":
+            column = column.astype(str)
+        arrays[name] = column
+    for name, array in arrays.items():
+        np.save(os.path.join(temp_directory, "{0}.npy".format(name)), array)
+    with open(os.path.join(temp_directory, "meta.json"), "w") as meta_file:
+        json.dump({"stamp": stamp, "columns": list(columns), "events": len(rid)}, meta_file)
+    shutil.rmtree(directory, ignore_errors=True)
+    os.replace(temp_directory, directory)
+    return EventIndex(directory)
+
+
+def default_directory(event_table):
+    """<geodatabase folder>/<geodatabase name>_index/<table name>"""
+    workspace, name = os.path.split(event_table)
+    return os.path.join(os.path.dirname(workspace), "{0}_index".format(os.path.splitext(os.path.basename(
+        workspace))[0]), name)
+
+
+def open_index(event_table, directory=None, rid_field="RID", from_field="FMEAS", to_field="TMEAS"):
+    """
+    Open the index of an event table, building it first when it is missing or the table changed.
+    Tables without a change stamp (see change_stamp.py) are re-indexed on every call.
+    :return: EventIndex
+    """
+    directory = directory or default_directory(event_table)
+    stamp = change_stamp.dataset_stamp(event_table)
+    meta_path = os.path.join(directory, "meta.json")
+    if stamp is not None and os.path.isfile(meta_path):
+        with open(meta_path) as meta_file:
+            if json.load(meta_file).get("stamp") == stamp:
+                return EventIndex(directory)
+
+    columns = event_overlay.read_event_table(event_table, rid_field, from_field, to_field)
+    os.makedirs(os.path.dirname(directory), exist_ok=True)
+    return build(columns, directory, stamp)
@@ -0,0 +1,187 @@
+# #############
+"""
+Tool Name:  Route Event Overlay
+Source Name: event_overlay.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Dynamic segmentation overlay of any number of linear event tables on the same routes, e.g. the condition
+event tables (out_<condition>_event_table) and the LEC linear events (LEC_LinearEvents_table).
+
+The from and to measures of every event of every table are sorted once per route; together they cut each
+route into homogeneous segments. A segment carries, for every input table, the attributes of the events of
+that table covering it, so a network-wide multi-table summary is a single sort instead of a chain of
+overlay geoprocessing tools. Segments covered by no event are left out.
+
+When events of one table overlap, a segment is written once per combination of the covering events of the
+tables, as the union overlay of route events does; the <prefix>COUNT column tells how many events of the
+table cover it.
+"""
+
+### EXECUTION ###
+
+# Import needed modules
+import os
+
+import numpy as np
+
+import lr_engine
+
+
+def _missing(column):
+    """Null value for the segments a table does not cover: NaN for numbers, "" for text."""
+    return np.nan if column.dtype.kind in "fiub" else ""
+
+
+def overlay(tables, prefixes=None):
+    """
+    Overlay linear event tables.
+    :param tables: list of dicts of columns with RID, FMEAS and TMEAS plus any attribute columns
+    :param prefixes: output column prefix per table; "T1_", "T2_", ... when None
+    :return: dict of columns RID, FMEAS, TMEAS, then <prefix><attribute> and <prefix>COUNT for every table,
+             sorted by route and measure; a segment has one row per combination of covering events
+    """
+    prefixes = prefixes or ["T{0}_".format(number + 1) for number in range(len(tables))]
+    tables = [{name: np.asarray(column) for name, column in table.items()} for table in tables]
+    sizes = [len(table["RID"]) for table in tables]
+
+    ##### Every event endpoint, low measure first #####
+    low = np.concatenate([np.minimum(table["FMEAS"], table["TMEAS"]) for table in tables]).astype(float)
+    high = np.concatenate([np.maximum(table["FMEAS"], table["TMEAS"]) for table in tables]).astype(float)
+    route_ids, route = np.unique(np.concatenate([table["RID"] for table in tables]), return_inverse=True)
+    route = route.ravel()
+
+    ##### Sorted unique (route, measure) breakpoints; each endpoint gets its breakpoint index #####
+    endpoint_route = np.concatenate((route, route))
+    endpoint_measure = np.concatenate((low, high))
+    order = np.lexsort((endpoint_measure, endpoint_route))
+    new = np.ones(len(order), dtype=bool)
+    new[1:] = (endpoint_route[order][1:] != endpoint_route[order][:-1]) | \
+              (endpoint_measure[order][1:] != endpoint_measure[order][:-1])
+    breakpoint = np.empty(len(order), dtype=np.int64)
+    breakpoint[order] = np.cumsum(new) - 1
+    breakpoint_route = endpoint_route[order][new]
+    breakpoint_measure = endpoint_measure[order][new]
+    low_index, high_index = breakpoint[:len(route)], breakpoint[len(route):]
+
+    ##### Segment j runs from breakpoint j to breakpoint j + 1 on the same route #####
+    segments = max(len(breakpoint_route) - 1, 0)
+    same_route = breakpoint_route[1:] == breakpoint_route[:-1]
+    covered = np.zeros(segments, dtype=bool)
+    per_table = []
+    start = 0
+    for table, size, prefix in zip(tables, sizes, prefixes):
+        first, last = low_index[start:start + size], high_index[start:start + size]
+        start += size
+
+        # An event covers the segments first..last - 1; breakpoint indexes are route-major, so these are all on
+        # the route of the event. Zero-length events cover no segment.
+        length = last - first
+        pair_event = np.repeat(np.arange(size), length)
+        pair_segment = np.repeat(first, length) + np.arange(len(pair_event)) - np.repeat(np.cumsum(length) - length,
+                                                                                        length)
+        count = np.bincount(pair_segment, minlength=segments)[:segments]
+        covered |= count > 0
+
+        # Covering events grouped by segment; a segment the table does not cover holds one null entry (-1)
+        uncovered = np.flatnonzero(count == 0)
+        entry_segment = np.concatenate((pair_segment, uncovered))
+        entry_event = np.concatenate((pair_event, np.full(len(uncovered), -1, dtype=np.int64)))
+        order = np.lexsort((entry_event, entry_segment))
+        per_table.append((table, prefix, entry_event[order], np.searchsorted(entry_segment[order],
+                                                                             np.arange(segments)), count))
+
+    ##### One row per combination of the covering events of the tables #####
+    row_segment = np.flatnonzero(same_route & covered)
+    row_events = []
+    for table, prefix, entry_event, entry_start, count in per_table:
+        repeats = np.maximum(count, 1)[row_segment]
+        within = np.arange(repeats.sum()) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        row_events = [np.repeat(event, repeats) for event in row_events]
+        row_segment = np.repeat(row_segment, repeats)
+        row_events.append(entry_event[entry_start[row_segment] + within])
+
+    columns = {"RID": route_ids[breakpoint_route[row_segment]],
+               "FMEAS": breakpoint_measure[row_segment],
+               "TMEAS": breakpoint_measure[row_segment + 1]}
+    for (table, prefix, _, _, count), event in zip(per_table, row_events):
+        for name, column in table.items():
+            if name in ("RID", "FMEAS", "TMEAS"):
+                continue
+            values = column[np.maximum(event, 0)] if len(column) else np.zeros(len(event), dtype=column.dtype)
+            if values.dtype.kind in "iub":
+                values = values.astype(float)
+            elif values.dtype.kind in "OU":
+                values = values.astype(object)
+            values[event < 0] = _missing(column)
+            columns[prefix + name] = values
+        columns[prefix + "COUNT"] = count[row_segment]
+    return columns
+
+
+def read_event_table(table, rid_field="RID", from_field="FMEAS", to_field="TMEAS", fields=None):
+    """
+    Read an event table into columns RID, FMEAS, TMEAS plus its attribute fields.
+    :param fields: attribute fields to carry; every field except the ObjectID, geometry and event fields when None
+    """
+    import arcpy
+
+    event_fields = {rid_field.upper(), from_field.upper(), to_field.upper()}
+    if fields is None:
+        fields = [field.name for field in arcpy.ListFields(table)
+                  if field.type not in ("OID", "Geometry", "GlobalID", "Blob", "Raster")
+                  and field.name.upper() not in event_fields
+                  and field.name.upper() not in ("SHAPE_LENGTH", "SHAPE_AREA")]
+    array = arcpy.da.TableToNumPyArray(table, [rid_field, from_field, to_field] + list(fields), skip_nulls=False,
+                                       null_value=lr_engine._null_values(table, [from_field, to_field] + list(fields)))
+    columns = {"RID": array[rid_field], "FMEAS": array[from_field], "TMEAS": array[to_field]}
+    for field in fields:
+        columns[field] = array[field]
+    return columns
+
+
+def overlay_event_tables(event_tables, out_table, routes_fc=None, routes_id_field=None, out_fc=None):
+    """
+    :param event_tables: event tables with RID, FMEAS and TMEAS fields
+    :param out_table: output segment table
+    :param routes_fc: optional routes to also write the segments as a polyline feature class
+    :param routes_id_field: route identifier field of routes_fc
+    :param out_fc: optional output segment feature class, written when routes_fc is given
+    :return: out_table
+    """
+    import arcpy
+
+    arcpy.AddMessage("Reading {0} event tables...".format(len(event_tables)))
+    tables = [read_event_table(table) for table in event_tables]
+    prefixes = ["{0}_".format(os.path.basename(table)) for table in event_tables]
+
+    arcpy.AddMessage("Overlaying {0} events...".format(sum(len(table["RID"]) for table in tables)))
+    segments = overlay(tables, prefixes)
+    arcpy.AddMessage("{0} homogeneous segments created.".format(len(segments["RID"])))
+
+    lr_engine.write_event_table(segments, out_table)
+    if routes_fc and out_fc:
+        network, spatial_reference = lr_engine.load_routes(routes_fc, routes_id_field)
+        lr_engine.write_event_features(network, segments, out_fc, spatial_reference)
+    return out_table
+
+
+def main():
+    import arcpy
+
+    # Prod GP Tool Vars
+    event_tables = [table.strip("'") for table in arcpy.GetParameterAsText(0).split(";") if table]
+    out_table = arcpy.GetParameterAsText(1)
+    routes_fc = arcpy.GetParameterAsText(2)
+    routes_id_field = arcpy.GetParameterAsText(3)
+    out_fc = arcpy.GetParameterAsText(4)
+
+    arcpy.AddMessage("Starting route event overlay...")
+
+    overlay_event_tables(event_tables, out_table, routes_fc, routes_id_field, out_fc)
+
+    arcpy.AddMessage("Route event overlay completed.")
+
+
+if __name__ == "__main__":
+    main()
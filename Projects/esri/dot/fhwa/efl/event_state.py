@@ -0,0 +1,151 @@
+# #############
+"""
+Source Name: event_state.py
+Version: ArcGIS Pro
+Author: ESRI
+
+State kept between runs of the incremental condition event processing.
+
+For every condition node the state records its ObjectID, coordinates and condition value from the last run,
+and where it was located (route id, measure, distance). Comparing the current nodes with the state gives
+the new, changed and deleted nodes; the routes they touch, before or after the edit, are the only routes
+whose events have to be rebuilt. Unchanged nodes keep their stored location, so only the edited nodes are
+located again.
+
+The state also stores a fingerprint of the route network and the parameters the nodes were located and rated
+with (search distance, condition field); when the routes or a parameter change, the state is discarded and
+every route is rebuilt.
+"""
+
+import os
+
+import numpy as np
+
+import lr_engine
+
+
+class NodeState(object):
+    """Per-node snapshot of the last run, sorted by ObjectID."""
+
+    def __init__(self, routes_fingerprint, oid, x, y, value, rid, measure, distance, located, search_distance=None,
+                 condition_field=None):
+        order = np.argsort(oid, kind="mergesort")
+        self.routes_fingerprint = routes_fingerprint
+        self.search_distance = None if search_distance is None else float(search_distance)
+        self.condition_field = condition_field
+        self.oid = np.asarray(oid)[order]
+        self.x = np.asarray(x, dtype=float)[order]
+        self.y = np.asarray(y, dtype=float)[order]
+        self.value = np.asarray(value).astype(str)[order]
+        self.rid = np.asarray(rid)[order]
+        self.measure = np.asarray(measure, dtype=float)[order]
+        self.distance = np.asarray(distance, dtype=float)[order]
+        self.located = np.asarray(located, dtype=bool)[order]
+
+    def save(self, path):
+        np.savez(path, routes_fingerprint=np.array(self.routes_fingerprint), oid=self.oid, x=self.x, y=self.y,
+                 value=self.value, rid=self.rid, measure=self.measure, distance=self.distance, located=self.located,
+                 search_distance=np.array(np.nan if self.search_distance is None else self.search_distance),
+                 condition_field=np.array("" if self.condition_field is None else self.condition_field))
+
+    @classmethod
+    def load(cls, path):
+        """Return the saved state, or None when there is none."""
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as saved:
+            # States saved without the parameters match no run, so they lead to a full rebuild
+            search_distance = float(saved["search_distance"]) if "search_distance" in saved.files else np.nan
+            condition_field = str(saved["condition_field"]) if "condition_field" in saved.files else ""
+            return cls(str(saved["routes_fingerprint"]), saved["oid"], saved["x"], saved["y"], saved["value"],
+                       saved["rid"], saved["measure"], saved["distance"], saved["located"],
+                       None if np.isnan(search_distance) else search_distance, condition_field or None)
+
+    def matches(self, routes_fingerprint, search_distance, condition_field):
+        """Whether the state was saved for these routes and parameters."""
+        return self.routes_fingerprint == routes_fingerprint and self.search_distance == float(search_distance) and \
+            self.condition_field == condition_field
+
+
+def _state_position(state, oid):
+    """Index of every ObjectID in the state and whether it was found there."""
+    if not len(state.oid):
+        return np.zeros(len(oid), dtype=np.int64), np.zeros(len(oid), dtype=bool)
+    position = np.clip(np.searchsorted(state.oid, oid), 0, len(state.oid) - 1)
+    return position, state.oid[position] == oid
+
+
+def diff_nodes(state, oid, x, y, value):
+    """
+    Compare the current nodes with the state.
+    :return: (changed, deleted) where changed is a boolean mask over the current nodes (new or edited) and
+             deleted indexes the state nodes whose ObjectID no longer exists
+    """
+    oid = np.asarray(oid)
+    position, known = _state_position(state, oid)
+    same = known.copy()
+    same[known] = (state.x[position[known]] == np.asarray(x, dtype=float)[known]) & \
+                  (state.y[position[known]] == np.asarray(y, dtype=float)[known]) & \
+                  (state.value[position[known]] == np.asarray(value).astype(str)[known])
+    deleted = np.flatnonzero(~np.isin(state.oid, oid))
+    return ~same, deleted
+
+
+def incremental_events(network, state, oid, x, y, value, search_distance, default_value="Excellent",
+                       condition_field=None):
+    """
+    Rebuild the condition events of the routes touched by node edits since the last run. The ObjectIDs give
+    the collection order of the nodes, from which the survey direction of each route is taken (see
+    lr_engine.condition_events).
+    :param network: RouteNetwork
+    :param state: NodeState of the last run, or None to rebuild every route
+    :param condition_field: field the values were read from; like the search distance, a change rebuilds every
+                            route
+    :return: (new_state, touched route ids or None when every route was rebuilt, events of the rebuilt routes)
+    """
+    oid = np.asarray(oid)
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    value = np.asarray(value)
+    fingerprint = network.fingerprint()
+    full = state is None or not state.matches(fingerprint, search_distance, condition_field)
+
+    route = np.full(len(oid), -1, dtype=np.int64)
+    measure = np.full(len(oid), np.nan)
+    distance = np.full(len(oid), np.nan)
+
+    if full:
+        changed = np.ones(len(oid), dtype=bool)
+        deleted = np.empty(0, dtype=np.int64)
+    else:
+        changed, deleted = diff_nodes(state, oid, x, y, value)
+        ##### Unchanged nodes keep the location found by an earlier run #####
+        position = _state_position(state, oid[~changed])[0]
+        route[~changed] = np.where(state.located[position], network.route_index(state.rid[position]), -1)
+        measure[~changed] = state.measure[position]
+        distance[~changed] = state.distance[position]
+
+    ##### Locate only the new and edited nodes #####
+    route[changed], measure[changed], distance[changed] = network.locate(x[changed], y[changed], search_distance)
+
+    located = route >= 0
+    rid = network.route_ids[np.maximum(route, 0)] if len(network) else np.zeros(len(route))
+    new_state = NodeState(fingerprint, oid, x, y, value, rid, measure, distance, located, search_distance,
+                          condition_field)
+
+    if full:
+        return new_state, None, lr_engine.located_condition_events(network, route, measure, distance, value,
+                                                                   default_value, sequence=oid)
+
+    ##### Routes touched before the edit (old location) or after it (new location) #####
+    position, known = _state_position(state, oid[changed])
+    old_index = np.concatenate((position[known], deleted))
+    old_touched = state.rid[old_index[state.located[old_index]]]
+    new_touched = rid[changed & located]
+    touched = np.unique(np.concatenate((old_touched.astype(network.route_ids.dtype), new_touched)))
+
+    ##### Rebuild every touched route from all of its current nodes #####
+    on_touched = located & np.isin(rid, touched)
+    events = lr_engine.located_condition_events(network, np.where(on_touched, route, -1), measure, distance, value,
+                                                default_value, sequence=oid)
+    return new_state, touched, events
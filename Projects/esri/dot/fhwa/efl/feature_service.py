@@ -0,0 +1,441 @@
+# #############
+"""
+Source Name: feature_service.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Paged download of a feature service layer (ArcGIS REST API), e.g. the LEC nodes collected in the field, into a
+feature class or into arrays for the in-memory engines.
+
+- The ObjectIDs of the layer are requested first (returnIdsOnly) and cut into pages of at most the layer's
+  maxRecordCount; each page is then queried by its ObjectIDs, which is stable while the service is edited and
+  does not require pagination support on the service.
+- Pages are fetched by a pool of threads over a pool of keep-alive connections. At most max_in_flight pages are
+  requested ahead of the page being written, so a slow writer holds back the downloads instead of letting the
+  pages pile up in memory.
+- Pages are written in order and a checkpoint file is updated after every page, so an interrupted pull resumes
+  after the last page written.
+- After a first full pull, later pulls are incremental: only the features edited since the previous pull
+  started (the latest edit date on the layer at that time) are downloaded and replace their previous version,
+  and features deleted from the service are deleted.
+  This needs editor tracking on the layer; without it every pull is a full pull.
+
+The client only uses the standard library, so it runs against any server speaking the query protocol,
+including a local mock server.
+"""
+
+import datetime
+import http.client
+import json
+import os
+import queue
+import time
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+SOURCE_OID_FIELD = "SOURCE_OID"
+
+_GEOMETRY_TYPES = {"esriGeometryPoint": "POINT", "esriGeometryMultipoint": "MULTIPOINT",
+                   "esriGeometryPolyline": "POLYLINE", "esriGeometryPolygon": "POLYGON"}
+
+_FIELD_TYPES = {"esriFieldTypeString": "TEXT", "esriFieldTypeInteger": "LONG", "esriFieldTypeSmallInteger": "SHORT",
+                "esriFieldTypeDouble": "DOUBLE", "esriFieldTypeSingle": "FLOAT", "esriFieldTypeDate": "DATE",
+                "esriFieldTypeGUID": "GUID", "esriFieldTypeGlobalID": "GUID", "esriFieldTypeBigInteger": "DOUBLE"}
+
+_ARRAY_TYPES = {"esriFieldTypeInteger": np.int64, "esriFieldTypeSmallInteger": np.int64,
+                "esriFieldTypeOID": np.int64, "esriFieldTypeDouble": float, "esriFieldTypeSingle": float,
+                "esriFieldTypeBigInteger": float}
+
+
+class FeatureServiceError(Exception):
+    """Error returned by the service, or a request that kept failing after its retries."""
+
+
+class ConnectionPool(object):
+    """
+    Keep-alive HTTP(S) connections to one host, shared by the fetching threads.
+
+    :param url: any URL on the host
+    :param size: number of connections kept open
+    :param timeout: socket timeout in seconds
+    :param retries: attempts per request on connection errors and 429/5xx responses, with exponential back-off
+    """
+
+    def __init__(self, url, size=4, timeout=60, retries=3):
+        parts = urllib.parse.urlsplit(url)
+        self.scheme = parts.scheme
+        self.host = parts.netloc
+        self.timeout = timeout
+        self.retries = retries
+        self._idle = queue.LifoQueue(maxsize=size)
+
+    def _connect(self):
+        if self.scheme == "https":
+            return http.client.HTTPSConnection(self.host, timeout=self.timeout)
+        return http.client.HTTPConnection(self.host, timeout=self.timeout)
+
+    def request(self, path, params):
+        """POST form-encoded params to path and return the decoded JSON response."""
+        body = urllib.parse.urlencode(params)
+        headers = {"Content-Type": "application/x-www-form-urlencoded", "Connection": "keep-alive"}
+        for attempt in range(self.retries):
+            try:
+                connection = self._idle.get_nowait()
+            except queue.Empty:
+                connection = self._connect()
+            try:
+                connection.request("POST", path, body, headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (OSError, http.client.HTTPException) as error:
+                connection.close()
+                problem = error
+            else:
+                try:
+                    self._idle.put_nowait(connection)
+                except queue.Full:
+                    connection.close()
+                if response.status == 200:
+                    result = json.loads(data.decode("utf-8"))
+                    if "error" in result:
+                        raise FeatureServiceError("{0}: {1}".format(path, result["error"]))
+                    return result
+                problem = "HTTP {0}".format(response.status)
+                if response.status != 429 and response.status < 500:
+                    break
+            if attempt + 1 < self.retries:
+                time.sleep(0.5 * 2 ** attempt)
+        raise FeatureServiceError("{0}: {1}".format(path, problem))
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+class FeatureServiceLayer(object):
+    """
+    One layer of a feature or map service, e.g. https://host/arcgis/rest/services/LEC/FeatureServer/0
+
+    :param url: layer URL
+    :param token: optional ArcGIS token
+    :param pool_size: number of pooled connections, normally the number of fetching threads
+    """
+
+    def __init__(self, url, token=None, pool_size=4, timeout=60, retries=3):
+        self.url = url.rstrip("/")
+        self.token = token
+        self.pool = ConnectionPool(self.url, pool_size, timeout, retries)
+        self._path = urllib.parse.urlsplit(self.url).path
+        self._info = None
+
+    def _request(self, suffix, params):
+        params = dict(params, f="json")
+        if self.token:
+            params["token"] = self.token
+        return self.pool.request(self._path + suffix, params)
+
+    @property
+    def info(self):
+        """Layer description: fields, geometry type, spatial reference, maxRecordCount, editFieldsInfo."""
+        if self._info is None:
+            self._info = self._request("", {})
+        return self._info
+
+    @property
+    def oid_field(self):
+        return self.info.get("objectIdField") or next(
+            field["name"] for field in self.info["fields"] if field["type"] == "esriFieldTypeOID")
+
+    @property
+    def edit_date_field(self):
+        return (self.info.get("editFieldsInfo") or {}).get("editDateField")
+
+    @property
+    def page_size(self):
+        return int(self.info.get("maxRecordCount") or 1000)
+
+    def object_ids(self, where="1=1"):
+        """Sorted ObjectIDs of the features matching where."""
+        result = self._request("/query", {"where": where, "returnIdsOnly": "true"})
+        return np.sort(np.asarray(result.get("objectIds") or [], dtype=np.int64))
+
+    def max_edit_date(self, where="1=1"):
+        """Latest edit date of the features matching where, in epoch milliseconds; None without edit dates."""
+        edit_date_field = self.edit_date_field
+        if not edit_date_field:
+            return None
+        statistics = [{"statisticType": "max", "onStatisticField": edit_date_field,
+                       "outStatisticFieldName": "LAST_EDIT"}]
+        result = self._request("/query", {"where": where, "outStatistics": json.dumps(statistics),
+                                          "returnGeometry": "false"})
+        features = result.get("features") or [{}]
+        attributes = features[0].get("attributes") or {}
+        # Services differ in the case of the output statistic field name
+        return next((value for name, value in attributes.items() if name.upper() == "LAST_EDIT"), None)
+
+    def query(self, object_ids, out_fields="*", return_geometry=True, out_sr=None):
+        """Features with the given ObjectIDs, as Esri JSON feature dicts."""
+        params = {"objectIds": ",".join(str(oid) for oid in object_ids), "outFields": out_fields,
+                  "returnGeometry": "true" if return_geometry else "false"}
+        if out_sr is not None:
+            params["outSR"] = out_sr
+        return self._request("/query", params).get("features", [])
+
+    def close(self):
+        self.pool.close()
+
+
+def iter_pages(layer, object_ids, page_size=None, workers=4, max_in_flight=None, start_page=0, **query):
+    """
+    Yield (page number, features) for the ObjectIDs cut into pages, in page order.
+
+    Up to workers pages are fetched at once, and at most max_in_flight (2 * workers by default) pages are
+    fetched ahead of the page being consumed.
+    :param query: extra arguments of FeatureServiceLayer.query (out_fields, return_geometry, out_sr)
+    """
+    page_size = page_size or layer.page_size
+    max_in_flight = max(max_in_flight or 2 * workers, 1)
+    pages = [object_ids[start:start + page_size] for start in range(0, len(object_ids), page_size)]
+    futures = {}
+    executor = ThreadPoolExecutor(max_workers=workers)
+    try:
+        next_page = start_page
+        for page in range(start_page, len(pages)):
+            while next_page < len(pages) and next_page - page < max_in_flight:
+                futures[next_page] = executor.submit(layer.query, pages[next_page], **query)
+                next_page += 1
+            yield page, futures.pop(page).result()
+    finally:
+        # The consumer stopped early or failed: do not fetch the pages nobody will read
+        for future in futures.values():
+            future.cancel()
+        executor.shutdown(wait=True)
+
+
+def _timestamp(milliseconds):
+    return datetime.datetime(1970, 1, 1) + datetime.timedelta(milliseconds=milliseconds)
+
+
+def _edited_since(edit_date_field, milliseconds):
+    """Standardized SQL for the features edited after an epoch time in milliseconds (UTC, as stored)."""
+    return "{0} > timestamp '{1:%Y-%m-%d %H:%M:%S}'".format(edit_date_field, _timestamp(milliseconds))
+
+
+def _attribute_fields(info):
+    """Layer fields that are copied: everything but the ObjectID, the geometry and the binary fields."""
+    return [field for field in info["fields"] if field["type"] in _FIELD_TYPES]
+
+
+def _row_values(feature, fields):
+    attributes = feature.get("attributes") or {}
+    values = []
+    for field in fields:
+        value = attributes.get(field["name"])
+        if value is not None and field["type"] == "esriFieldTypeDate":
+            value = _timestamp(value)
+        values.append(value)
+    return values
+
+
+def load_points(url, fields, where="1=1", token=None, workers=4, spatial_reference=None):
+    """
+    Read a point layer into arrays, the service counterpart of lr_engine.load_points. The arrays are allocated
+    once from the ObjectID count and every page is copied in as it arrives.
+    :param fields: attribute fields to read; "OID@" reads the ObjectIDs
+    :param spatial_reference: spatial reference of the coordinates, e.g. the one of the routes; the service
+                              projects the points to its WKID. None keeps the spatial reference of the layer.
+    :return: x, y, dict of attribute arrays
+    """
+    out_sr = None
+    if spatial_reference is not None:
+        # A custom spatial reference has no WKID the service could project to
+        if not spatial_reference.factoryCode:
+            raise ValueError("The points of a feature service can only be projected to a spatial reference with a "
+                             "WKID; {0} has none.".format(spatial_reference.name))
+        out_sr = spatial_reference.factoryCode
+    layer = FeatureServiceLayer(url, token, pool_size=workers)
+    try:
+        object_ids = layer.object_ids(where)
+        types = {field["name"]: field["type"] for field in layer.info["fields"]}
+        names = [layer.oid_field if field == "OID@" else field for field in fields]
+        x = np.full(len(object_ids), np.nan)
+        y = np.full(len(object_ids), np.nan)
+        attributes = {field: np.empty(len(object_ids), dtype=_ARRAY_TYPES.get(types.get(name), object))
+                      for field, name in zip(fields, names)}
+        start = 0
+        for _, features in iter_pages(layer, object_ids, workers=workers, out_fields=",".join(set(names)),
+                                      out_sr=out_sr):
+            stop = start + len(features)
+            geometry = [feature.get("geometry") or {} for feature in features]
+            x[start:stop] = [point.get("x", np.nan) for point in geometry]
+            y[start:stop] = [point.get("y", np.nan) for point in geometry]
+            for field, name in zip(fields, names):
+                values = [(feature.get("attributes") or {}).get(name) for feature in features]
+                if attributes[field].dtype.kind in "if":
+                    values = [np.nan if value is None else value for value in values]
+                    if attributes[field].dtype.kind == "i" and np.isnan(values).any():
+                        attributes[field] = attributes[field].astype(float)
+                attributes[field][start:stop] = values
+            start = stop
+    finally:
+        layer.close()
+    return x[:start], y[:start], {field: values[:start] for field, values in attributes.items()}
+
+
+def state_path(out_fc):
+    """Checkpoint file of a download: <geodatabase folder>/<geodatabase name>_<feature class>.download.json"""
+    workspace, name = os.path.split(out_fc)
+    if workspace.lower().endswith((".gdb", ".sde", ".gpkg")):
+        return os.path.join(os.path.dirname(workspace), "{0}_{1}.download.json".format(
+            os.path.splitext(os.path.basename(workspace))[0], name))
+    return out_fc + ".download.json"
+
+
+def _save_state(path, state, **object_ids):
+    """
+    Write the checkpoint atomically. The ObjectID lists ("downloaded", "pending") go to .npy files next to it,
+    written only when they change, so the checkpoint after every page stays small.
+    """
+    for key, ids in object_ids.items():
+        np.save("{0}.{1}.npy".format(path, key), np.asarray(ids, dtype=np.int64))
+    temp_path = path + ".tmp"
+    with open(temp_path, "w") as state_file:
+        json.dump(state, state_file)
+    os.replace(temp_path, path)
+
+
+def _load_ids(path, key):
+    ids_path = "{0}.{1}.npy".format(path, key)
+    return np.load(ids_path) if os.path.isfile(ids_path) else np.empty(0, dtype=np.int64)
+
+
+def _create_feature_class(layer, out_fc, fields):
+    import arcpy
+
+    info = layer.info
+    workspace, name = os.path.split(out_fc)
+    wkid = (info.get("extent", {}).get("spatialReference") or info.get("spatialReference") or {}).get("wkid")
+    arcpy.CreateFeatureclass_management(workspace, name, _GEOMETRY_TYPES[info["geometryType"]],
+                                        spatial_reference=arcpy.SpatialReference(wkid) if wkid else None)
+    arcpy.AddField_management(out_fc, SOURCE_OID_FIELD, "LONG")
+    for field in fields:
+        arcpy.AddField_management(out_fc, field["name"], _FIELD_TYPES[field["type"]],
+                                  field_length=field.get("length") if field["type"] == "esriFieldTypeString" else None,
+                                  field_alias=field.get("alias"))
+
+
+def _delete_source_rows(out_fc, source_oids):
+    """Delete the rows whose SOURCE_OID is in source_oids."""
+    import arcpy
+
+    source_oids = set(int(oid) for oid in source_oids)
+    if not source_oids:
+        return 0
+    deleted = 0
+    with arcpy.da.UpdateCursor(out_fc, [SOURCE_OID_FIELD]) as cursor:
+        for row in cursor:
+            if row[0] in source_oids:
+                cursor.deleteRow()
+                deleted += 1
+    return deleted
+
+
+def download(url, out_fc, where="1=1", incremental=True, token=None, workers=4, page_size=None):
+    """
+    Download a feature service layer into a feature class, resuming an interrupted pull and only pulling the
+    features edited since the previous pull when possible. The ObjectID of every feature on the service is kept
+    in the SOURCE_OID field.
+
+    :param url: layer URL
+    :param out_fc: output feature class
+    :param where: filter on the service features
+    :param incremental: update an existing out_fc from the edits since the previous pull; False pulls it again
+    :param workers: number of pages fetched at once
+    :param page_size: features per page; the layer's maxRecordCount when None
+    :return: out_fc
+    """
+    import arcpy
+
+    layer = FeatureServiceLayer(url, token, pool_size=workers)
+    path = state_path(out_fc)
+    state = {}
+    if os.path.isfile(path):
+        with open(path) as state_file:
+            state = json.load(state_file)
+    same_source = state.get("url") == layer.url and state.get("where") == where and arcpy.Exists(out_fc)
+
+    try:
+        fields = _attribute_fields(layer.info)
+        edit_date_field = layer.edit_date_field
+
+        if same_source and state.get("pending"):
+            ##### Resume the interrupted pull; the page being written when it stopped is written again #####
+            downloaded = _load_ids(path, "downloaded")
+            object_ids = _load_ids(path, "pending")
+            page_size, pages_done = state["page_size"], state["pages_done"]
+            _delete_source_rows(out_fc, object_ids[pages_done * page_size:(pages_done + 1) * page_size])
+            arcpy.AddMessage("Resuming download at page {0}...".format(pages_done + 1))
+        elif same_source and incremental and edit_date_field and state.get("last_edit") is not None:
+            ##### Incremental pull: edited features replace their previous version #####
+            downloaded = _load_ids(path, "downloaded")
+            deleted = np.setdiff1d(downloaded, layer.object_ids(where))
+            pull_edit = layer.max_edit_date(where)
+            object_ids = layer.object_ids("({0}) AND {1}".format(where, _edited_since(edit_date_field,
+                                                                                      state["last_edit"])))
+            removed = _delete_source_rows(out_fc, np.concatenate((deleted, object_ids)))
+            arcpy.AddMessage("{0} features edited and {1} deleted since the previous download ({2} rows "
+                             "removed).".format(len(object_ids), len(deleted), removed))
+            downloaded = np.setdiff1d(downloaded, np.concatenate((deleted, object_ids)))
+            page_size, pages_done = page_size or layer.page_size, 0
+            state.update(pending=True, page_size=page_size, pages_done=0, pull_edit=pull_edit)
+            _save_state(path, state, downloaded=downloaded, pending=object_ids)
+        else:
+            ##### Full pull into a new feature class #####
+            if arcpy.Exists(out_fc):
+                arcpy.Delete_management(out_fc)
+            _create_feature_class(layer, out_fc, fields)
+            downloaded = np.empty(0, dtype=np.int64)
+            pull_edit = layer.max_edit_date(where)
+            object_ids = layer.object_ids(where)
+            page_size, pages_done = page_size or layer.page_size, 0
+            state = {"url": layer.url, "where": where, "last_edit": None, "pending": True, "page_size": page_size,
+                     "pages_done": 0, "pull_edit": pull_edit}
+            _save_state(path, state, downloaded=downloaded, pending=object_ids)
+
+        pages = -(-len(object_ids) // page_size)
+        arcpy.AddMessage("Downloading {0} features in {1} pages...".format(len(object_ids) - pages_done * page_size,
+                                                                          pages - pages_done))
+
+        ##### Stream the pages into the feature class, checkpointing after every page #####
+        point = layer.info["geometryType"] == "esriGeometryPoint"
+        cursor_fields = ["SHAPE@XY" if point else "SHAPE@", SOURCE_OID_FIELD] + [field["name"] for field in fields]
+        oid_field = layer.oid_field
+        for page, features in iter_pages(layer, object_ids, page_size, workers, start_page=pages_done):
+            with arcpy.da.InsertCursor(out_fc, cursor_fields) as cursor:
+                for feature in features:
+                    geometry = feature.get("geometry")
+                    if not geometry or geometry.get("x") == "NaN":
+                        shape = None
+                    elif point:
+                        shape = (geometry["x"], geometry["y"])
+                    else:
+                        shape = arcpy.AsShape(geometry, True)
+                    cursor.insertRow([shape, feature["attributes"][oid_field]] + _row_values(feature, fields))
+            state["pages_done"] = page + 1
+            _save_state(path, state)
+
+        # The next incremental pull starts from the latest edit seen when this pull started: features edited
+        # while the pages were fetched have later edit dates, so they are pulled again
+        state["last_edit"] = state.pop("pull_edit", None)
+        state["pending"] = False
+        _save_state(path, state, downloaded=np.union1d(downloaded, object_ids), pending=[])
+    finally:
+        layer.close()
+
+    arcpy.AddMessage("Download of '{0}' completed.".format(out_fc))
+    return out_fc
@@ -43,10 +43,30 @@ while still being able to collect other point events along the linear event.
 import arcpy
 import os
 
+import bulk_output
+import feature_service
+import lr_engine
+import route_cache
+import scratch
+import snapping
+import tracing
+
 
 def convert_routes_to_lr(routes_fc,
                          routes_id_field,
-                         out_fc):
+                         out_fc,
+                         engine="ARCPY"):
+    """
+    LENGTH-calibrated routes with UPPER_LEFT priority and ignored gaps.
+
+    The ARCPY engine runs CreateRoutes. The CACHED engine calibrates the routes in memory, the way CreateRoutes
+    does, and caches them next to the routes geodatabase (see route_cache.py): when the routes did not change
+    out_fc is left as it is, otherwise only the routes whose geometry changed are calibrated and replaced in it.
+    :param engine: ARCPY or CACHED
+    :return: out_fc
+    """
+    if engine.upper() == "CACHED":
+        return route_cache.create_routes(routes_fc, routes_id_field, out_fc)
     arcpy.CreateRoutes_lr(in_line_features=routes_fc, route_id_field=routes_id_field,
                           out_feature_class=out_fc,
                           measure_source="LENGTH", from_measure_field="", to_measure_field="",
@@ -55,8 +75,19 @@ def convert_routes_to_lr(routes_fc,
     return out_fc
 
 
-def convert_fs_to_fc(fs_url, out_fc):
-    pass
+def is_feature_service(lec_nodes_fc):
+    return lec_nodes_fc.lower().startswith(("http://", "https://"))
+
+
+def convert_fs_to_fc(fs_url, out_fc, where="1=1", incremental=True, token=None, workers=4):
+    """
+    Download the LEC nodes of a feature service layer into a feature class (see feature_service.py). An
+    interrupted download resumes where it stopped; once out_fc exists, only the nodes edited since the previous
+    download are pulled when the layer has editor tracking.
+    :return: out_fc
+    """
+    arcpy.AddMessage("Downloading '{0}'...".format(fs_url))
+    return feature_service.download(fs_url, out_fc, where, incremental, token, workers)
 
 
 def convert_lec_nodes_to_line_events(workspace_gdb,
@@ -66,64 +97,163 @@ def convert_lec_nodes_to_line_events(workspace_gdb,
                                      routes_id_field,
                                      snapping_tolerance_meters,
                                      clean_up_temp_files=False,
+                                     tracer=None,
+                                     output_format="FILE_GDB",
                                      ):
 
-    # Naming file variables
-    temp_lines_fc = os.path.join(workspace_gdb, "temp_ConvertedLines")
-    temp_events_table = os.path.join(workspace_gdb, "temp_LocatedAlongRoute")
-    temp_events_lyr_name = "LEC_events_lyr"
-    output_fc = os.path.join(workspace_gdb, "LEC_LinearEvents")
+    # Every geoprocessing tool runs through the tracer's backend (see tracing.py)
+    tracer = tracer or tracing.Tracer(workspace=workspace_gdb)
+    gp = tracer.gp
+    output_fc = bulk_output.output_path(workspace_gdb, "LEC_LinearEvents", output_format)
 
     # Snapping tolerance variable since GP tool accepts string with distance format
     snapping_tolerance = "{0} Meters".format(str(snapping_tolerance_meters))
 
-    # GP Tool: LEC points to line, using a fault ID field to allow multiple edits to be processed
-    arcpy.PointsToLine_management(Input_Features=lec_nodes_fc,
-                                  Output_Feature_Class=temp_lines_fc,
-                                  Line_Field=lec_fault_id_field, Sort_Field="OBJECTID", Close_Line="NO_CLOSE")
-
-    # GP Tool: Locate features along route using lines and routes and write to a table.
-    arcpy.LocateFeaturesAlongRoutes_lr(in_features=temp_lines_fc,
-                                       in_routes=routes_fc,
-                                       route_id_field=routes_id_field,
-                                       radius_or_tolerance=snapping_tolerance,
-                                       out_table=temp_events_table,
-                                       out_event_properties="RID LINE FMEAS TMEAS",
-                                       route_locations="FIRST",
-                                       distance_field="DISTANCE",
-                                       zero_length_events="ZERO",
-                                       in_fields="FIELDS", m_direction_offsetting="M_DIRECTON")
-
-    # GP Tool: Table conversion of edited events to a feature layer.
-    event_layer = arcpy.MakeRouteEventLayer_lr(in_routes=routes_fc,
-                                               route_id_field=routes_id_field,
-                                               in_table=temp_events_table,
-                                               in_event_properties="rid LINE fmeas tmeas",
-                                               out_layer=temp_events_lyr_name,
-                                               offset_field="",
-                                               add_error_field="NO_ERROR_FIELD",
-                                               add_angle_field="NO_ANGLE_FIELD",
-                                               angle_type="NORMAL",
-                                               complement_angle="ANGLE",
-                                               offset_direction="LEFT",
-                                               point_event_type="POINT").getOutput(0)
-
-    # GP Tool: Copy feature layer to disk as feature class.
-    arcpy.CopyFeatures_management(in_features=event_layer,
-                                  out_feature_class=output_fc)
-
-    # Optional clean-up of temp data.
-    if clean_up_temp_files:
-        arcpy.AddMessage("Cleaning up temporary content...")
-        # print("Cleaning up temporary content...")
-
-        content_to_delete = [temp_lines_fc, temp_events_table]
-
-        for item in content_to_delete:
-            arcpy.Delete_management(item)
-
-        arcpy.AddMessage("Temp files cleaned up.")
-        # print("Temp files cleaned up.")
+    # Intermediates stay in memory and are deleted when the block ends, even on error. Without clean-up they
+    # are kept in the workspace geodatabase for inspection.
+    with scratch.ScratchWorkspace(None if clean_up_temp_files else workspace_gdb, gp) as work:
+
+        # Naming file variables
+        temp_lines_fc = work.path("temp_ConvertedLines")
+        temp_events_table = work.path("temp_LocatedAlongRoute")
+        temp_events_lyr_name = work.layer("LEC_events_lyr")
+
+        # GP Tool: LEC points to line, using a fault ID field to allow multiple edits to be processed
+        with tracer.stage("points to line", inputs=[lec_nodes_fc], outputs=[temp_lines_fc]):
+            gp.PointsToLine_management(Input_Features=lec_nodes_fc,
+                                       Output_Feature_Class=temp_lines_fc,
+                                       Line_Field=lec_fault_id_field, Sort_Field="OBJECTID",
+                                       Close_Line="NO_CLOSE")
+
+        # GP Tool: Locate features along route using lines and routes and write to a table.
+        with tracer.stage("locate", inputs=[temp_lines_fc], outputs=[temp_events_table]):
+            gp.LocateFeaturesAlongRoutes_lr(in_features=temp_lines_fc,
+                                            in_routes=routes_fc,
+                                            route_id_field=routes_id_field,
+                                            radius_or_tolerance=snapping_tolerance,
+                                            out_table=temp_events_table,
+                                            out_event_properties="RID LINE FMEAS TMEAS",
+                                            route_locations="FIRST",
+                                            distance_field="DISTANCE",
+                                            zero_length_events="ZERO",
+                                            in_fields="FIELDS", m_direction_offsetting="M_DIRECTON")
+
+        if bulk_output.output_format(output_fc):
+            # GeoPackage, SQLite or Parquet output: the located events are written in bulk from columns
+            with tracer.stage("write events", inputs=[temp_events_table], written=[output_fc]) as stage:
+                bulk_output.write_event_layer(routes_fc, routes_id_field, temp_events_table, output_fc)
+                stage.rows_out = stage.rows_in
+        else:
+            with tracer.stage("write events", inputs=[temp_events_table], outputs=[output_fc]):
+                # GP Tool: Table conversion of edited events to a feature layer.
+                event_layer = gp.MakeRouteEventLayer_lr(in_routes=routes_fc,
+                                                        route_id_field=routes_id_field,
+                                                        in_table=temp_events_table,
+                                                        in_event_properties="rid LINE fmeas tmeas",
+                                                        out_layer=temp_events_lyr_name,
+                                                        offset_field="",
+                                                        add_error_field="NO_ERROR_FIELD",
+                                                        add_angle_field="NO_ANGLE_FIELD",
+                                                        angle_type="NORMAL",
+                                                        complement_angle="ANGLE",
+                                                        offset_direction="LEFT",
+                                                        point_event_type="POINT").getOutput(0)
+
+                # GP Tool: Copy feature layer to disk as feature class; the only dataset written to the output.
+                try:
+                    gp.CopyFeatures_management(in_features=event_layer,
+                                               out_feature_class=output_fc)
+                except Exception:
+                    # Do not leave a partial output behind
+                    if gp.Exists(output_fc):
+                        gp.Delete_management(output_fc)
+                    raise
+
+        if clean_up_temp_files:
+            gp.AddMessage("Cleaning up temporary content...")
+
+    tracer.report()
+    return output_fc
+
+
+def convert_lec_nodes_to_line_events_inmemory(workspace_gdb,
+                                              lec_nodes_fc,
+                                              lec_fault_id_field,
+                                              routes_fc,
+                                              routes_id_field,
+                                              snapping_tolerance_meters,
+                                              tracer=None,
+                                              output_format="FILE_GDB"):
+
+    """
+    Array-based alternative to convert_lec_nodes_to_line_events. The nodes are read once, snapped to the
+    indexed routes in one pass (see snapping.py) and grouped by fault ID with a sort; each fault becomes one
+    event from its lowest to its highest node measure on the route most of its nodes are on. The event table
+    and the event feature class are written directly, without the temporary lines and located-events tables.
+
+    :param workspace_gdb: output file geodatabase
+    :param lec_nodes_fc: LEC node feature class, or the URL of a feature service layer
+    :param lec_fault_id_field: field pairing the start and end nodes of a fault
+    :param routes_fc: route feature class
+    :param routes_id_field: route identifier field
+    :param snapping_tolerance_meters: search distance in meters between nodes and routes
+    :param tracer: optional tracing.Tracer recording the steps; the one-line summary is always reported
+    :param output_format: FILE_GDB, or GEOPACKAGE, SQLITE or PARQUET for bulk output next to workspace_gdb
+                          (see bulk_output.py)
+    :return: output event feature class
+    """
+
+    tracer = tracer or tracing.Tracer(workspace=workspace_gdb)
+    gp = tracer.gp
+
+    output_table = bulk_output.output_path(workspace_gdb, "LEC_LinearEvents_table", output_format)
+    output_fc = bulk_output.output_path(workspace_gdb, "LEC_LinearEvents", output_format)
+    bulk = bulk_output.output_format(output_fc) is not None
+
+    # Load routes and nodes into memory and index the route segments.
+    gp.AddMessage("Loading routes and LEC nodes...")
+    with tracer.stage("load", inputs=[routes_fc, lec_nodes_fc]) as stage:
+        network, spatial_reference = lr_engine.load_routes(routes_fc, routes_id_field)
+        search_distance = lr_engine.meters_to_units(spatial_reference, snapping_tolerance_meters)
+        if is_feature_service(lec_nodes_fc):
+            # Nodes straight from the service, page by page into the node arrays
+            node_x, node_y, node_attributes = feature_service.load_points(
+                lec_nodes_fc, ["OID@", lec_fault_id_field], spatial_reference=spatial_reference)
+        else:
+            node_x, node_y, node_attributes = lr_engine.load_points(lec_nodes_fc, ["OID@", lec_fault_id_field],
+                                                                    spatial_reference)
+        stage.rows_out = len(node_x)
+
+    # Snap every node to its nearest routes; where routes are close together, keep the nodes of a fault on
+    # one route in collection (ObjectID) order.
+    gp.AddMessage("Snapping {0} LEC nodes to routes...".format(len(node_x)))
+    with tracer.stage("snap") as stage:
+        stage.rows_in = len(node_x)
+        candidates = snapping.get_index(network).snap(node_x, node_y, k=3, max_distance=search_distance)
+        route, measure, distance = snapping.snap_sequences(network, candidates, node_x, node_y,
+                                                           node_attributes[lec_fault_id_field],
+                                                           order=node_attributes["OID@"])
+        stage.rows_out = int((route >= 0).sum())
+
+    # Collapse the nodes of each fault into one linear event.
+    with tracer.stage("pair nodes") as stage:
+        stage.rows_in = len(node_x)
+        events = lr_engine.line_events(network, node_attributes[lec_fault_id_field], route, measure, distance)
+        stage.rows_out = len(events["RID"])
+    gp.AddMessage("{0} linear events created.".format(len(events["RID"])))
+
+    # Write the event table and the event feature class.
+    field_names = {"GROUP": lec_fault_id_field}
+    with tracer.stage("write events", outputs=[] if bulk else [output_table, output_fc],
+                      written=[output_table, output_fc] if bulk else []) as stage:
+        stage.rows_in = len(events["RID"])
+        if bulk:
+            stage.rows_out = 2 * len(events["RID"])
+        lr_engine.write_event_table(events, output_table, field_names)
+        lr_engine.write_event_features(network, events, output_fc, spatial_reference, field_names)
+
+    tracer.report()
+    return output_fc
 
 
 def main():
@@ -136,17 +266,52 @@ def main():
     routes_id_field = arcpy.GetParameterAsText(4)
     snapping_tolerance_meters = arcpy.GetParameterAsText(5)
     clean_up_temp_files = arcpy.GetParameter(6)
+    # Optional engine parameter: "ARCPY" (geoprocessing tool chain) or "IN_MEMORY"
+    engine = (arcpy.GetParameterAsText(7) if arcpy.GetArgumentCount() > 7 else "") or "ARCPY"
+    # Optional trace file: stage timings as JSON, plus a Chrome trace next to it
+    trace_file = arcpy.GetParameterAsText(8) if arcpy.GetArgumentCount() > 8 else ""
+    # Optional output format: "FILE_GDB", or "GEOPACKAGE", "SQLITE" or "PARQUET" written in bulk
+    output_format = (arcpy.GetParameterAsText(9) if arcpy.GetArgumentCount() > 9 else "") or "FILE_GDB"
+    # Optional route engine: "ARCPY" (CreateRoutes) or "CACHED" (see route_cache.py) calibrates the routes into
+    # the workspace before the events are located on them; empty uses the routes as they are
+    route_engine = arcpy.GetParameterAsText(10) if arcpy.GetArgumentCount() > 10 else ""
+    tracer = tracing.Tracer(workspace=workspace_gdb)
 
     arcpy.AddMessage("Starting LEC post-processing...")
     # print("Starting LEC post-processing...")
 
-    convert_lec_nodes_to_line_events(workspace_gdb,
-                                     lec_nodes_fc,
-                                     lec_fault_id_field,
-                                     routes_fc,
-                                     routes_id_field,
-                                     snapping_tolerance_meters,
-                                     clean_up_temp_files)
+    if route_engine:
+        lec_routes_fc = os.path.join(workspace_gdb, "LEC_Routes")
+        arcpy.AddMessage("Creating LENGTH-calibrated routes '{0}'...".format(lec_routes_fc))
+        with tracer.stage("create routes", inputs=[routes_fc], outputs=[lec_routes_fc]):
+            routes_fc = convert_routes_to_lr(routes_fc, routes_id_field, lec_routes_fc, route_engine)
+
+    if engine.upper() == "IN_MEMORY":
+        convert_lec_nodes_to_line_events_inmemory(workspace_gdb,
+                                                  lec_nodes_fc,
+                                                  lec_fault_id_field,
+                                                  routes_fc,
+                                                  routes_id_field,
+                                                  snapping_tolerance_meters,
+                                                  tracer,
+                                                  output_format)
+    else:
+        if is_feature_service(lec_nodes_fc):
+            # The geoprocessing tools read a local copy of the service, refreshed incrementally on every run
+            lec_nodes_fc = convert_fs_to_fc(lec_nodes_fc, os.path.join(workspace_gdb, "LEC_Nodes"))
+        convert_lec_nodes_to_line_events(workspace_gdb,
+                                         lec_nodes_fc,
+                                         lec_fault_id_field,
+                                         routes_fc,
+                                         routes_id_field,
+                                         snapping_tolerance_meters,
+                                         clean_up_temp_files,
+                                         tracer,
+                                         output_format)
+
+    if trace_file:
+        arcpy.AddMessage("Writing stage trace to '{0}'...".format(trace_file))
+        tracer.write(trace_file)
 
     arcpy.AddMessage("LEC post-processing completed.")
     # print("LEC post-processing completed.")
@@ -0,0 +1,690 @@
+# #############
+"""
+Source Name: lr_engine.py
+Version: ArcGIS Pro
+Author: ESRI
+
+In-memory linear referencing engine for the EFL post-processing tools.
+
+Routes are loaded once into flat NumPy arrays (vertex coordinates and measures, with an offset per route)
+and a uniform grid index over the route segments. Points are located on the routes in one vectorized
+pass: the grid gives the candidate segments around every point, each point is projected on its
+candidates and the nearest one within the search distance wins.
+
+This replaces the chain of geoprocessing tools (copy, select by location, split, spatial join, locate,
+make route event layer) that wrote an intermediate feature class to disk at every step.
+"""
+
+import numpy as np
+
+# Most cells searched around a point in each direction; larger search radii use a coarser grid
+MAX_RINGS = 3
+
+# Route ids per where clause when deleting the events of routes
+WHERE_BATCH_SIZE = 1000
+
+
+class RouteNetwork(object):
+    """
+    Polyline routes as vertex arrays with measures, plus a grid index over their segments.
+
+    :param route_ids: route identifier per route
+    :param offsets: index of the first vertex of every route, followed by the total vertex count
+    :param x: vertex x coordinates
+    :param y: vertex y coordinates
+    :param m: vertex measures; cumulative length from the first vertex (LENGTH calibration) when None
+    :param cell_size: grid cell size in coordinate units; derived from the segment lengths when None
+    """
+
+    def __init__(self, route_ids, offsets, x, y, m=None, cell_size=None):
+        self.route_ids = np.asarray(route_ids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.m = calibrate_length(self.offsets, self.x, self.y) if m is None else np.asarray(m, dtype=float)
+
+        ##### Segments join consecutive vertices of the same route #####
+        vertex_route = np.repeat(np.arange(len(self.route_ids)), np.diff(self.offsets))
+        start = np.arange(len(self.x) - 1)
+        start = start[vertex_route[start] == vertex_route[start + 1]]
+        self.segment_start = start
+        self.segment_route = vertex_route[start]
+
+        self._build_grid(cell_size)
+
+    @classmethod
+    def from_vertices(cls, vertex_route_ids, x, y, m=None, cell_size=None):
+        """Build a network from one row per vertex, grouped by route id in vertex order."""
+        vertex_route_ids = np.asarray(vertex_route_ids)
+        change = np.ones(len(vertex_route_ids), dtype=bool)
+        change[1:] = vertex_route_ids[1:] != vertex_route_ids[:-1]
+        starts = np.flatnonzero(change)
+        offsets = np.append(starts, len(vertex_route_ids))
+        return cls(vertex_route_ids[starts], offsets, x, y, m, cell_size)
+
+    def __len__(self):
+        return len(self.route_ids)
+
+    def route_index(self, route_ids):
+        """Map route ids to route indexes (-1 for unknown ids)."""
+        order = np.argsort(self.route_ids, kind="mergesort")
+        sorted_ids = self.route_ids[order]
+        position = np.clip(np.searchsorted(sorted_ids, route_ids), 0, max(len(sorted_ids) - 1, 0))
+        found = sorted_ids[position] == route_ids if len(sorted_ids) else np.zeros(len(route_ids), dtype=bool)
+        return np.where(found, order[position], -1)
+
+    def fingerprint(self):
+        """Hash of the route ids, vertices and measures; changes whenever the routes change."""
+        import hashlib
+
+        digest = hashlib.sha1()
+        digest.update(repr(self.route_ids.tolist()).encode("utf-8"))
+        for array in (self.offsets, self.x, self.y, self.m):
+            digest.update(np.ascontiguousarray(array).tobytes())
+        return digest.hexdigest()
+
+    def measure_range(self):
+        """Lowest and highest measure of every route."""
+        first = self.m[self.offsets[:-1]]
+        last = self.m[self.offsets[1:] - 1]
+        return np.minimum(first, last), np.maximum(first, last)
+
+    ##### Spatial index #####
+
+    def _build_grid(self, cell_size):
+        x0, y0 = self.x[self.segment_start], self.y[self.segment_start]
+        x1, y1 = self.x[self.segment_start + 1], self.y[self.segment_start + 1]
+        if cell_size is None:
+            extent = np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))
+            cell_size = float(np.percentile(extent, 90)) if len(extent) else 1.0
+        self.cell_size = cell_size if cell_size > 0 else 1.0
+        self.origin = (float(self.x.min()) if len(self.x) else 0.0, float(self.y.min()) if len(self.y) else 0.0)
+        self._grids = {}
+        self.rows, self.grid_keys, self.grid_starts, self.grid_segments = self._grid(self.cell_size)
+
+    def _grid(self, cell_size):
+        """
+        Grid of the given cell size, built on first use: (rows, cell keys, first entry of every cell followed by
+        the entry count, segment of every entry).
+        """
+        if cell_size in self._grids:
+            return self._grids[cell_size]
+        x0, y0 = self.x[self.segment_start], self.y[self.segment_start]
+        x1, y1 = self.x[self.segment_start + 1], self.y[self.segment_start + 1]
+
+        ##### Every segment is registered in each cell its bounding box overlaps #####
+        ix0, iy0 = self._cell(np.minimum(x0, x1), np.minimum(y0, y1), cell_size)
+        ix1, iy1 = self._cell(np.maximum(x0, x1), np.maximum(y0, y1), cell_size)
+        rows = int(iy1.max()) + 1 if len(iy1) else 1
+        span_x = ix1 - ix0 + 1
+        span_y = iy1 - iy0 + 1
+        count = span_x * span_y
+        segment = np.repeat(np.arange(len(self.segment_start)), count)
+        local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+        cell_x = ix0[segment] + local // span_y[segment]
+        cell_y = iy0[segment] + local % span_y[segment]
+        keys = cell_x * rows + cell_y
+
+        order = np.argsort(keys, kind="mergesort")
+        grid_keys, grid_starts = np.unique(keys[order], return_index=True)
+        grid = rows, grid_keys, np.append(grid_starts, len(order)), segment[order]
+        self._grids[cell_size] = grid
+        return grid
+
+    def _cell(self, x, y, cell_size=None):
+        cell_size = cell_size or self.cell_size
+        ix = np.floor((x - self.origin[0]) / cell_size).astype(np.int64)
+        iy = np.floor((y - self.origin[1]) / cell_size).astype(np.int64)
+        return ix, iy
+
+    def candidates(self, px, py, radius):
+        """
+        Candidate (point, segment) pairs for every point: segments registered in the cells within radius.
+        A radius of more than MAX_RINGS cells is searched on a coarser grid with cells of radius / MAX_RINGS,
+        so the number of cells visited per point stays bounded.
+        :return: (point_index, segment_index) arrays
+        """
+        px = np.asarray(px, dtype=float)
+        py = np.asarray(py, dtype=float)
+        if not len(self.grid_keys):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        cell_size = self.cell_size
+        ring = int(np.ceil(radius / cell_size))
+        if ring > MAX_RINGS:
+            cell_size = float(radius) / MAX_RINGS
+            ring = MAX_RINGS
+        rows, grid_keys, grid_starts, grid_segments = self._grid(cell_size)
+        ix, iy = self._cell(px, py, cell_size)
+        point_parts = []
+        segment_parts = []
+        for dx in range(-ring, ring + 1):
+            for dy in range(-ring, ring + 1):
+                cx, cy = ix + dx, iy + dy
+                valid = (cx >= 0) & (cy >= 0) & (cy < rows)
+                keys = cx * rows + cy
+                slot = np.searchsorted(grid_keys, keys)
+                slot = np.clip(slot, 0, len(grid_keys) - 1)
+                valid &= grid_keys[slot] == keys
+                points = np.flatnonzero(valid)
+                start = grid_starts[slot[points]]
+                count = grid_starts[slot[points] + 1] - start
+                point_parts.append(np.repeat(points, count))
+                local = np.arange(count.sum()) - np.repeat(np.cumsum(count) - count, count)
+                segment_parts.append(grid_segments[np.repeat(start, count) + local])
+        points = np.concatenate(point_parts) if point_parts else np.empty(0, dtype=np.int64)
+        segments = np.concatenate(segment_parts) if segment_parts else np.empty(0, dtype=np.int64)
+        # A long segment is registered in several cells; keep each pair once
+        if len(points):
+            pairs = np.unique(points * len(self.segment_start) + segments)
+            points, segments = pairs // len(self.segment_start), pairs % len(self.segment_start)
+        return points, segments
+
+    def project(self, px, py, points, segments):
+        """
+        Project points on segments.
+        :return: (distance, measure, fraction along the segment)
+        """
+        start = self.segment_start[segments]
+        x0, y0, m0 = self.x[start], self.y[start], self.m[start]
+        dx, dy, dm = self.x[start + 1] - x0, self.y[start + 1] - y0, self.m[start + 1] - m0
+        length2 = dx * dx + dy * dy
+        with np.errstate(invalid="ignore", divide="ignore"):
+            t = np.where(length2 > 0, ((px[points] - x0) * dx + (py[points] - y0) * dy) / length2, 0.0)
+        t = np.clip(t, 0.0, 1.0)
+        distance = np.hypot(px[points] - (x0 + t * dx), py[points] - (y0 + t * dy))
+        return distance, m0 + t * dm, t
+
+    def locate(self, px, py, radius):
+        """
+        Locate every point on its nearest route within radius.
+        :return: (route_index, measure, distance) arrays, route_index -1 for points farther than radius
+        """
+        px = np.asarray(px, dtype=float)
+        py = np.asarray(py, dtype=float)
+        route = np.full(len(px), -1, dtype=np.int64)
+        measure = np.full(len(px), np.nan)
+        distance = np.full(len(px), np.nan)
+
+        points, segments = self.candidates(px, py, radius)
+        if not len(points):
+            return route, measure, distance
+        dist, meas, _ = self.project(px, py, points, segments)
+        keep = dist <= radius
+        points, segments, dist, meas = points[keep], segments[keep], dist[keep], meas[keep]
+
+        ##### Nearest candidate per point; ties go to the lowest route index #####
+        order = np.lexsort((self.segment_route[segments], dist, points))
+        first = np.ones(len(order), dtype=bool)
+        first[1:] = points[order][1:] != points[order][:-1]
+        best = order[first]
+        route[points[best]] = self.segment_route[segments[best]]
+        measure[points[best]] = meas[best]
+        distance[points[best]] = dist[best]
+        return route, measure, distance
+
+    ##### Event geometry #####
+
+    def slice(self, route, from_measure, to_measure):
+        """Vertices (x, y, m) of a route between two measures, endpoints interpolated."""
+        start, stop = self.offsets[route], self.offsets[route + 1]
+        x, y, m = self.x[start:stop], self.y[start:stop], self.m[start:stop]
+        if m[-1] < m[0]:
+            x, y, m = x[::-1], y[::-1], m[::-1]
+        low, high = min(from_measure, to_measure), max(from_measure, to_measure)
+        inside = (m > low) & (m < high)
+        mm = np.concatenate(([low], m[inside], [high]))
+        return np.interp(mm, m, x), np.interp(mm, m, y), mm
+
+    def slices(self, route, from_measure, to_measure):
+        """
+        Vectorized slice: the vertices of many events at once, one binary search pass per route.
+        :param route: route index of every event; -1 gives an event without vertices
+        :return: (offsets, x, y, m); the vertices of event i are offsets[i]:offsets[i + 1]
+        """
+        route = np.asarray(route, dtype=np.int64)
+        low = np.minimum(from_measure, to_measure).astype(float)
+        high = np.maximum(from_measure, to_measure).astype(float)
+
+        ##### Vertices of every route in ascending measure order #####
+        start, stop = self.offsets[:-1], self.offsets[1:]
+        reverse = np.repeat(self.m[np.maximum(stop - 1, start)] < self.m[start], stop - start)
+        vertex_route = np.repeat(np.arange(len(start)), stop - start)
+        index = np.arange(len(self.m))
+        index = np.where(reverse, start[vertex_route] + stop[vertex_route] - 1 - index, index)
+        x, y, m = self.x[index], self.y[index], self.m[index]
+
+        ##### Inside vertices: from the first after the low end to the last before the high end #####
+        first = np.zeros(len(route), dtype=np.int64)
+        last = np.zeros(len(route), dtype=np.int64)
+        by_route = np.argsort(route, kind="mergesort")
+        bounds = np.searchsorted(route[by_route], np.arange(len(start) + 1))
+        for value in np.flatnonzero(np.diff(bounds)):
+            events = by_route[bounds[value]:bounds[value + 1]]
+            begin, end = start[value], stop[value]
+            first[events] = begin + np.searchsorted(m[begin:end], low[events], side="right")
+            last[events] = begin + np.searchsorted(m[begin:end], high[events], side="left")
+        known = route >= 0
+        begin, end = start[np.maximum(route, 0)], stop[np.maximum(route, 0)] - 1
+
+        def interpolate(measure, after):
+            right = np.clip(after, begin, end)
+            left = np.clip(after - 1, begin, end)
+            span = m[right] - m[left]
+            t = np.where(span > 0, (measure - m[left]) / np.where(span > 0, span, 1.0), 0.0)
+            return x[left] + t * (x[right] - x[left]), y[left] + t * (y[right] - y[left])
+
+        low_x, low_y = interpolate(low, first)
+        high_x, high_y = interpolate(high, last)
+
+        ##### Low end, inside vertices, high end of every event, one after the other #####
+        inside = np.where(known, last - first, 0)
+        count = np.where(known, inside + 2, 0)
+        offsets = np.append(0, np.cumsum(count))
+        event = np.repeat(np.arange(len(route)), count)
+        local = np.arange(offsets[-1]) - offsets[event]
+        source = np.clip(first[event] + local - 1, 0, max(len(m) - 1, 0))
+        out_x, out_y, out_m = x[source], y[source], m[source]
+        low_end, high_end = offsets[:-1][known], offsets[1:][known] - 1
+        out_x[low_end], out_y[low_end], out_m[low_end] = low_x[known], low_y[known], low[known]
+        out_x[high_end], out_y[high_end], out_m[high_end] = high_x[known], high_y[known], high[known]
+        return offsets, out_x, out_y, out_m
+
+
+def calibrate_length(offsets, x, y):
+    """Cumulative length from the first vertex of every route (CreateRoutes LENGTH measures)."""
+    step = np.zeros(len(x))
+    step[1:] = np.hypot(np.diff(x), np.diff(y))
+    step[offsets[:-1]] = 0.0
+    total = np.cumsum(step)
+    route_start = np.repeat(total[offsets[:-1]], np.diff(offsets))
+    return total - route_start
+
+
+def calibrate_routes(part_route, part_offsets, x, y):
+    """
+    CreateRoutes LENGTH measures with UPPER_LEFT coordinate priority and ignored gaps, for all routes at once.
+
+    Every route is made of one or more parts (the input features with the same route id). Measures start at
+    the part end closest to the upper left corner of the route extent; parts are taken by the distance of
+    their closest end to that corner, each oriented to start with that end, and the measures carry on from
+    one part to the next without counting the gap.
+
+    :param part_route: route index of every part, in ascending order
+    :param part_offsets: index of the first vertex of every part, followed by the total vertex count
+    :return: (part order, vertex order, m); the parts and vertices in measure order, and the measure of every
+             reordered vertex
+    """
+    part_route = np.asarray(part_route)
+    part_offsets = np.asarray(part_offsets, dtype=np.int64)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    part_start, part_length = part_offsets[:-1], np.diff(part_offsets)
+    if not len(part_start):
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+
+    ##### Upper left corner of every route extent, and the distance of both ends of every part to it #####
+    route_first = np.flatnonzero(np.append(True, part_route[1:] != part_route[:-1]))
+    parts_per_route = np.diff(np.append(route_first, len(part_route)))
+    corner_x = np.repeat(np.minimum.reduceat(x, part_start[route_first]), parts_per_route)
+    corner_y = np.repeat(np.maximum.reduceat(y, part_start[route_first]), parts_per_route)
+    part_end = part_offsets[1:] - 1
+    to_start = np.hypot(x[part_start] - corner_x, y[part_start] - corner_y)
+    to_end = np.hypot(x[part_end] - corner_x, y[part_end] - corner_y)
+    reverse = to_end < to_start
+
+    ##### Parts by route, then by distance to the corner; vertices of reversed parts taken backwards #####
+    part_order = np.lexsort((np.minimum(to_start, to_end), part_route))
+    length = part_length[part_order]
+    new_start = np.cumsum(length) - length
+    step = np.arange(length.sum()) - np.repeat(new_start, length)
+    vertex_order = np.where(np.repeat(reverse[part_order], length),
+                            np.repeat(part_end[part_order], length) - step,
+                            np.repeat(part_start[part_order], length) + step)
+
+    ##### Cumulative length within the route; a new part adds no length for the gap #####
+    ordered_x, ordered_y = x[vertex_order], y[vertex_order]
+    segment = np.zeros(len(vertex_order))
+    segment[1:] = np.hypot(np.diff(ordered_x), np.diff(ordered_y))
+    segment[new_start] = 0.0
+    total = np.cumsum(segment)
+    route_base = total[new_start[route_first]]
+    m = total - np.repeat(np.repeat(route_base, parts_per_route), length)
+    return part_order, vertex_order, m
+
+
+def condition_events(network, node_x, node_y, node_values, search_distance, default_value="Excellent",
+                     sequence=None):
+    """
+    Build condition events from nodes that mark where the condition of a route changes.
+
+    Every node within search_distance of a route starts a new event carrying its value, which lasts until
+    the next node on the route in the survey direction, or the end of the route. The stretch before the
+    first node of a route gets default_value. Nodes farther than search_distance from every route are
+    ignored.
+
+    The survey direction of a route comes from the order the nodes were collected in (sequence, e.g. the
+    ObjectIDs): when the nodes of a route were collected with decreasing measures, the route is digitized
+    against the survey direction, its events run towards the lower measures and the default stretch is at
+    its high-measure end. Without a sequence, and on routes with a single node, events run with the measures.
+    :param sequence: optional collection order of the nodes
+    :return: dict of columns RID, FMEAS, TMEAS, VALUE, DISTANCE (DISTANCE of the default events is 0)
+    """
+    route, measure, distance = network.locate(node_x, node_y, search_distance)
+    return located_condition_events(network, route, measure, distance, node_values, default_value, sequence)
+
+
+def surveyed_against_measures(route, measure, sequence, routes):
+    """
+    Whether each route was surveyed against its measure direction: taken in sequence order, the measures of
+    its nodes go down more often than up.
+    :param route: route index per node, -1 when not located
+    :param routes: number of routes
+    :return: boolean array, one value per route
+    """
+    located = np.flatnonzero(route >= 0)
+    order = located[np.lexsort((np.asarray(sequence)[located], route[located]))]
+    route, measure = route[order], measure[order]
+    same = route[1:] == route[:-1]
+    steps = np.sign(measure[1:] - measure[:-1])[same]
+    return np.bincount(route[1:][same], weights=steps, minlength=routes) < 0
+
+
+def located_condition_events(network, route, measure, distance, node_values, default_value="Excellent",
+                             sequence=None):
+    """
+    condition_events for nodes that are already located: route index (-1 when not located), measure and
+    distance per node.
+    """
+    node_values = np.asarray(node_values)
+    against = surveyed_against_measures(route, measure, sequence, len(network)) if sequence is not None \
+        else np.zeros(len(network), dtype=bool)
+    located = np.flatnonzero(route >= 0)
+    order = located[np.lexsort((measure[located], route[located]))]
+    route, measure, distance, values = route[order], measure[order], distance[order], node_values[order]
+
+    low, high = network.measure_range()
+    first = np.ones(len(route), dtype=bool)
+    first[1:] = route[1:] != route[:-1]
+    last = np.ones(len(route), dtype=bool)
+    last[:-1] = route[1:] != route[:-1]
+
+    ##### Node events run to the next node, or to the end of the route, in the survey direction #####
+    next_measure = np.empty(len(route))
+    next_measure[:-1] = measure[1:]
+    next_measure[last] = high[route[last]]
+    previous_measure = np.empty(len(route))
+    previous_measure[1:] = measure[:-1]
+    previous_measure[first] = low[route[first]]
+    reverse = against[route]
+
+    ##### Default events run from the start of the survey to the first node surveyed #####
+    default_routes = route[first]
+    default_reverse = against[default_routes]
+    columns = {
+        "RID": np.concatenate((network.route_ids[default_routes], network.route_ids[route])),
+        "FMEAS": np.concatenate((np.where(default_reverse, measure[last], low[default_routes]),
+                                 np.where(reverse, previous_measure, measure))),
+        "TMEAS": np.concatenate((np.where(default_reverse, high[default_routes], measure[first]),
+                                 np.where(reverse, measure, next_measure))),
+        "VALUE": np.concatenate((np.full(len(default_routes), default_value, dtype=object),
+                                 values.astype(object))),
+        "DISTANCE": np.concatenate((np.zeros(len(default_routes)), distance)),
+    }
+
+    ##### Drop zero-length events (nodes at the start of a route, or at the same measure) #####
+    keep = columns["TMEAS"] > columns["FMEAS"]
+    order = np.lexsort((columns["FMEAS"][keep], np.concatenate((default_routes, route))[keep]))
+    return {name: column[keep][order] for name, column in columns.items()}
+
+
+def line_events(network, group_values, route, measure, distance):
+    """
+    Collapse located nodes into one linear event per group, e.g. the start and end nodes of a LEC fault.
+
+    Each group goes on the route that most of its located nodes are on (ties to the smaller mean
+    distance), and its event spans from the lowest to the highest node measure on that route. Groups and
+    runs are found with one sort, so the node order within a group does not matter. Groups without any
+    located node are left out.
+    :param group_values: group value per node
+    :param route: route index per node, -1 when not located
+    :param measure: measure per node
+    :param distance: distance per node
+    :return: dict of columns GROUP, RID, FMEAS, TMEAS, DISTANCE (largest node distance), NODES, by group
+    """
+    located = np.flatnonzero(np.asarray(route) >= 0)
+    groups, group = np.unique(np.asarray(group_values)[located], return_inverse=True)
+    order = np.lexsort((route[located], group))
+    group = group[order]
+    route, measure, distance = route[located][order], measure[located][order], distance[located][order]
+
+    ##### Runs of nodes of the same group on the same route #####
+    start = np.ones(len(group), dtype=bool)
+    start[1:] = (group[1:] != group[:-1]) | (route[1:] != route[:-1])
+    starts = np.flatnonzero(start)
+    if not len(starts):
+        return {"GROUP": groups, "RID": network.route_ids[:0], "FMEAS": np.empty(0), "TMEAS": np.empty(0),
+                "DISTANCE": np.empty(0), "NODES": np.empty(0, dtype=np.int64)}
+    nodes = np.diff(np.append(starts, len(group)))
+    mean_distance = np.add.reduceat(distance, starts) / nodes
+
+    ##### The run with the most nodes (then the nearest) is the group's route #####
+    best = np.lexsort((mean_distance, -nodes, group[starts]))
+    first = np.ones(len(best), dtype=bool)
+    first[1:] = group[starts][best][1:] != group[starts][best][:-1]
+    best = best[first]
+    return {
+        "GROUP": groups[group[starts][best]],
+        "RID": network.route_ids[route[starts][best]],
+        "FMEAS": np.minimum.reduceat(measure, starts)[best],
+        "TMEAS": np.maximum.reduceat(measure, starts)[best],
+        "DISTANCE": np.maximum.reduceat(distance, starts)[best],
+        "NODES": nodes[best],
+    }
+
+
+def load_routes(routes_fc, routes_id_field, cell_size=None):
+    """
+    Read a route feature class into a RouteNetwork, using its M values when it has them.
+    :return: (RouteNetwork, spatial reference)
+    """
+    import arcpy
+
+    description = arcpy.Describe(routes_fc)
+    fields = [routes_id_field, "SHAPE@X", "SHAPE@Y"] + (["SHAPE@M"] if description.hasM else [])
+    vertices = arcpy.da.FeatureClassToNumPyArray(routes_fc, ["OID@"] + fields, explode_to_points=True,
+                                                 null_value={"SHAPE@M": np.nan})
+    # Vertices come back feature by feature in vertex order; keep features together
+    order = np.argsort(vertices["OID@"], kind="mergesort")
+    vertices = vertices[order]
+    m = vertices["SHAPE@M"] if description.hasM else None
+    if m is not None and np.isnan(m).all():
+        m = None
+
+    change = np.ones(len(vertices), dtype=bool)
+    change[1:] = vertices["OID@"][1:] != vertices["OID@"][:-1]
+    starts = np.flatnonzero(change)
+    network = RouteNetwork(vertices[routes_id_field][starts], np.append(starts, len(vertices)),
+                           vertices["SHAPE@X"], vertices["SHAPE@Y"], m, cell_size)
+    return network, description.spatialReference
+
+
+def load_points(points_fc, fields, spatial_reference=None):
+    """
+    Read point coordinates and attributes into arrays, projected to spatial_reference.
+    :return: (x, y, structured array of the attribute fields)
+    """
+    import arcpy
+
+    array = arcpy.da.FeatureClassToNumPyArray(points_fc, ["SHAPE@X", "SHAPE@Y"] + list(fields),
+                                              spatial_reference=spatial_reference, skip_nulls=False,
+                                              null_value=_null_values(points_fc, fields))
+    return array["SHAPE@X"], array["SHAPE@Y"], array[list(fields)] if fields else None
+
+
+def _null_values(table, fields):
+    """Null replacements that FeatureClassToNumPyArray accepts for each field type."""
+    import arcpy
+
+    types = {field.name.upper(): field.type for field in arcpy.ListFields(table)}
+    nulls = {"SHAPE@X": np.nan, "SHAPE@Y": np.nan}
+    for name in fields:
+        if name.endswith("@"):
+            # Geometry and ObjectID tokens are never null
+            continue
+        field_type = types.get(name.upper(), "String")
+        if field_type in ("Double", "Single"):
+            nulls[name] = np.nan
+        elif field_type in ("Integer", "SmallInteger", "OID"):
+            nulls[name] = -1
+        else:
+            nulls[name] = ""
+    return nulls
+
+
+def meters_to_units(spatial_reference, meters):
+    """Convert a distance in meters to the linear unit of a projected spatial reference."""
+    if spatial_reference.type != "Projected":
+        raise ValueError("The in-memory engine needs routes in a projected coordinate system.")
+    return float(meters) / spatial_reference.metersPerUnit
+
+
+def write_event_table(columns, out_table, field_names=None):
+    """
+    Write event columns to a table in one call. Tables in a GeoPackage or SQLite database and .parquet files
+    are written by bulk_output.
+    :param columns: dict of equal-length arrays
+    :param field_names: optional mapping of column name -> output field name
+    """
+    import arcpy
+    import bulk_output
+
+    if bulk_output.output_format(out_table):
+        return bulk_output.write_events(columns, out_table, field_names)
+
+    arcpy.da.NumPyArrayToTable(_event_array(columns, field_names), out_table)
+    return out_table
+
+
+def _event_array(columns, field_names=None):
+    """Event columns as a structured array with the output field names."""
+    field_names = field_names or {}
+    dtype = []
+    for name, column in columns.items():
+        column = np.asarray(column)
+        if column.dtype.kind in "OU":
+            width = max([1] + [len(str(value)) for value in column])
+            dtype.append((str(field_names.get(name, name)), "U{0}".format(max(width, 50))))
+        else:
+            dtype.append((str(field_names.get(name, name)), column.dtype.str))
+    array = np.empty(len(next(iter(columns.values()))) if columns else 0, dtype=dtype)
+    for (name, column), (out_name, _) in zip(columns.items(), dtype):
+        array[out_name] = column
+    return array
+
+
+def _add_event_fields(table, columns, field_names):
+    """Add one field per event column; returns the output field names."""
+    import arcpy
+
+    names = []
+    for column_name, column in columns.items():
+        out_name = field_names.get(column_name, column_name)
+        column = np.asarray(column)
+        if column.dtype.kind in "OU":
+            width = max([1] + [len(str(value)) for value in column])
+            arcpy.AddField_management(table, out_name, "TEXT", field_length=max(width, 50))
+        elif column.dtype.kind in "iu":
+            arcpy.AddField_management(table, out_name, "LONG")
+        else:
+            arcpy.AddField_management(table, out_name, "DOUBLE")
+        names.append(out_name)
+    return names
+
+
+def write_event_features(network, columns, out_fc, spatial_reference, field_names=None):
+    """
+    Write events as polyline features, cutting the event geometry out of the route vertex arrays. Feature
+    classes in a GeoPackage or SQLite database and .parquet files are written by bulk_output.
+    :param columns: dict of columns with at least RID, FMEAS and TMEAS
+    :param field_names: optional mapping of column name -> output field name
+    """
+    import os
+    import arcpy
+    import bulk_output
+
+    if bulk_output.output_format(out_fc):
+        return bulk_output.write_events(columns, out_fc, field_names, network, spatial_reference)
+
+    field_names = field_names or {}
+    workspace, name = os.path.split(out_fc)
+    arcpy.CreateFeatureclass_management(workspace, name, "POLYLINE", has_m="ENABLED",
+                                        spatial_reference=spatial_reference)
+    _add_event_fields(out_fc, columns, field_names)
+    return append_events(network, columns, out_fc, field_names)
+
+
+def append_events(network, columns, out_table, field_names=None):
+    """
+    Insert events into an existing event table or polyline feature class.
+
+    Tables get the events in one NumPyArrayToTable and Append. For feature classes the geometry of all the
+    events is cut in one RouteNetwork.slices pass and encoded as WKB, so the cursor only streams prepared rows.
+    :param network: RouteNetwork used to cut the event geometry; None for a table without geometry
+    """
+    import uuid
+    import arcpy
+    import esri_common  # puts Projects/esri/common on the import path
+    import bulk_tables
+
+    field_names = field_names or {}
+    names = [field_names.get(name, name) for name in columns]
+    if network is None:
+        scratch_table = "memory\\events_" + uuid.uuid4().hex[:8]
+        arcpy.da.NumPyArrayToTable(_event_array(columns, field_names), scratch_table)
+        try:
+            arcpy.management.Append(scratch_table, out_table, "NO_TEST")
+        finally:
+            arcpy.management.Delete(scratch_table)
+        return out_table
+
+    route_index = network.route_index(np.asarray(columns["RID"]))
+    offsets, x, y, m = network.slices(route_index, np.asarray(columns["FMEAS"], dtype=float),
+                                      np.asarray(columns["TMEAS"], dtype=float))
+    buffer, byte_offsets = bulk_tables.linestring_wkb(offsets, x, y, m)
+    data = buffer.tobytes()
+    shapes = [data[start:stop] for start, stop in zip(byte_offsets[:-1].tolist(), byte_offsets[1:].tolist())]
+    rows = zip(shapes, *[np.asarray(column).tolist() for column in columns.values()])
+    with arcpy.da.InsertCursor(out_table, ["SHAPE@WKB"] + names) as cursor:
+        for row in rows:
+            cursor.insertRow(row)
+    return out_table
+
+
+def _sql_literal(value):
+    """A route id as an SQL literal."""
+    if isinstance(value, str):
+        return "'{0}'".format(value.replace("'", "''"))
+    return repr(value)
+
+
+def delete_route_events(out_table, rid_field, route_ids):
+    """
+    Delete the events of the given routes from an event table or feature class: one DeleteRows on a view
+    selecting the routes with a where clause, per WHERE_BATCH_SIZE route ids.
+    :return: number of events deleted
+    """
+    import uuid
+    import arcpy
+
+    route_ids = np.unique(np.asarray(route_ids)).tolist()
+    field = arcpy.AddFieldDelimiters(out_table, rid_field)
+    deleted = 0
+    for start in range(0, len(route_ids), WHERE_BATCH_SIZE):
+        batch = route_ids[start:start + WHERE_BATCH_SIZE]
+        where = "{0} IN ({1})".format(field, ", ".join(_sql_literal(value) for value in batch))
+        view = arcpy.management.MakeTableView(out_table, "route_events_" + uuid.uuid4().hex[:8], where).getOutput(0)
+        try:
+            deleted += int(arcpy.management.GetCount(view).getOutput(0))
+            arcpy.management.DeleteRows(view)
+        finally:
+            arcpy.management.Delete(view)
+    return deleted
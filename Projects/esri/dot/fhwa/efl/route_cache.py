@@ -0,0 +1,304 @@
+# #############
+"""
+Source Name: route_cache.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Calibrated routes (CreateRoutes LENGTH measures, see lr_engine.calibrate_routes) cached between runs.
+
+The cache is an .npz file next to the routes geodatabase with the vertex coordinates and measures of every
+route part in flat arrays, a hash of the geometry of every route, and a fingerprint of all route hashes and
+the route id field.
+- When the routes geodatabase has not changed since the cache was written (same change stamp), the cached
+  routes are used as they are, without reading the routes feature class.
+- Otherwise the route vertices are read and hashed per route. Routes with the hash of the cache keep their
+  cached measures; only new routes and routes whose geometry changed are calibrated again.
+"""
+
+import hashlib
+import json
+import os
+
+import numpy as np
+
+import esri_common  # puts Projects/esri/common on the import path
+import change_stamp
+import lr_engine
+
+
+class CalibratedRoutes(object):
+    """
+    Route parts in measure order, as flat vertex arrays.
+
+    :param route_ids: sorted unique route ids
+    :param route_hash: geometry hash of every route
+    :param part_route: route index of every part, in ascending order
+    :param part_offsets: index of the first vertex of every part, followed by the total vertex count
+    :param x: vertex x coordinates
+    :param y: vertex y coordinates
+    :param m: vertex measures
+    :param routes_id_field: route id field the routes were dissolved on
+    :param stamp: change stamp of the routes geodatabase when the routes were read
+    """
+
+    def __init__(self, route_ids, route_hash, part_route, part_offsets, x, y, m, routes_id_field, stamp=None):
+        self.route_ids = np.asarray(route_ids)
+        self.route_hash = np.asarray(route_hash).astype(str)
+        self.part_route = np.asarray(part_route, dtype=np.int64)
+        self.part_offsets = np.asarray(part_offsets, dtype=np.int64)
+        self.x = np.asarray(x, dtype=float)
+        self.y = np.asarray(y, dtype=float)
+        self.m = np.asarray(m, dtype=float)
+        self.routes_id_field = routes_id_field
+        self.stamp = stamp
+        self.fingerprint = fingerprint(self.route_ids, self.route_hash, routes_id_field)
+
+    def network(self, cell_size=None):
+        """RouteNetwork with one entry per part, like lr_engine.load_routes with one entry per feature."""
+        return lr_engine.RouteNetwork(self.route_ids[self.part_route], self.part_offsets, self.x, self.y, self.m,
+                                      cell_size)
+
+    def save(self, path):
+        np.savez(path, route_ids=self.route_ids, route_hash=self.route_hash, part_route=self.part_route,
+                 part_offsets=self.part_offsets, x=self.x, y=self.y, m=self.m,
+                 routes_id_field=np.array(self.routes_id_field), stamp=np.array(self.stamp or ""))
+
+    @classmethod
+    def load(cls, path):
+        """Return the cached routes, or None when there are none."""
+        if not os.path.isfile(path):
+            return None
+        with np.load(path) as saved:
+            return cls(saved["route_ids"], saved["route_hash"], saved["part_route"], saved["part_offsets"],
+                       saved["x"], saved["y"], saved["m"], str(saved["routes_id_field"]),
+                       str(saved["stamp"]) or None)
+
+
+def fingerprint(route_ids, route_hash, routes_id_field):
+    """Hash of the route id field and of the id and geometry hash of every route."""
+    digest = hashlib.sha1(routes_id_field.encode("utf-8"))
+    digest.update(repr(np.asarray(route_ids).tolist()).encode("utf-8"))
+    digest.update("".join(route_hash).encode("ascii"))
+    return digest.hexdigest()
+
+
+def route_hashes(part_route, part_offsets, x, y, routes):
+    """Hash of the part sizes and vertex coordinates of every route, parts in feature order."""
+    route_part = np.searchsorted(part_route, np.arange(routes + 1))
+    hashes = []
+    for first, last in zip(route_part[:-1], route_part[1:]):
+        start, stop = part_offsets[first], part_offsets[last]
+        digest = hashlib.sha1(np.diff(part_offsets[first:last + 1]).tobytes())
+        digest.update(x[start:stop].tobytes())
+        digest.update(y[start:stop].tobytes())
+        hashes.append(digest.hexdigest())
+    return np.array(hashes, dtype="U40")
+
+
+def _take_parts(part_offsets, parts):
+    """Vertex indexes of the given parts, one after the other, and the part offsets of the result."""
+    start, length = part_offsets[parts], np.diff(part_offsets)[parts]
+    new_start = np.cumsum(length) - length
+    vertices = np.repeat(start - new_start, length) + np.arange(length.sum(), dtype=np.int64)
+    return vertices, np.append(new_start, length.sum()).astype(np.int64)
+
+
+def update(previous, route_ids, part_route, part_offsets, x, y, routes_id_field, stamp=None):
+    """
+    Calibrate routes, reusing the measures of the routes whose geometry did not change since previous.
+
+    :param previous: CalibratedRoutes of an earlier run, or None
+    :param route_ids: sorted unique route ids
+    :param part_route: route index of every part (input feature), in ascending order; the parts of a route in
+                       feature order
+    :param part_offsets: index of the first vertex of every part, followed by the total vertex count
+    :return: (CalibratedRoutes, ids of the calibrated routes, ids of the routes no longer present)
+    """
+    route_ids = np.asarray(route_ids)
+    part_route = np.asarray(part_route, dtype=np.int64)
+    part_offsets = np.asarray(part_offsets, dtype=np.int64)
+    x, y = np.asarray(x, dtype=float), np.asarray(y, dtype=float)
+    hashes = route_hashes(part_route, part_offsets, x, y, len(route_ids))
+
+    ##### Routes found in the previous calibration with the same geometry #####
+    reused = np.zeros(len(route_ids), dtype=bool)
+    previous_route = np.zeros(len(route_ids), dtype=np.int64)
+    removed = np.empty(0, dtype=route_ids.dtype)
+    if previous is not None and previous.routes_id_field == routes_id_field and len(previous.route_ids):
+        previous_route = np.clip(np.searchsorted(previous.route_ids, route_ids), 0, len(previous.route_ids) - 1)
+        reused = (previous.route_ids[previous_route] == route_ids) & \
+                 (previous.route_hash[previous_route] == hashes)
+        removed = np.setdiff1d(previous.route_ids, route_ids)
+
+    ##### Calibrate the other routes in one pass #####
+    changed_parts = np.flatnonzero(~reused[part_route])
+    vertices, changed_offsets = _take_parts(part_offsets, changed_parts)
+    part_order, vertex_order, changed_m = lr_engine.calibrate_routes(part_route[changed_parts], changed_offsets,
+                                                                     x[vertices], y[vertices])
+    changed_x, changed_y = x[vertices][vertex_order], y[vertices][vertex_order]
+    changed_part_route = part_route[changed_parts][part_order]
+    _, changed_offsets = _take_parts(changed_offsets, part_order)
+
+    ##### Merge the cached parts of the reused routes with the calibrated ones, by route #####
+    if reused.any():
+        new_route = np.full(len(previous.route_ids), -1, dtype=np.int64)
+        new_route[previous_route[reused]] = np.flatnonzero(reused)
+        kept_parts = np.flatnonzero(new_route[previous.part_route] >= 0)
+        kept_vertices, kept_offsets = _take_parts(previous.part_offsets, kept_parts)
+        all_route = np.concatenate((new_route[previous.part_route[kept_parts]], changed_part_route))
+        all_offsets = np.concatenate((kept_offsets[:-1], changed_offsets + kept_offsets[-1]))
+        all_x = np.concatenate((previous.x[kept_vertices], changed_x))
+        all_y = np.concatenate((previous.y[kept_vertices], changed_y))
+        all_m = np.concatenate((previous.m[kept_vertices], changed_m))
+        order = np.argsort(all_route, kind="mergesort")
+        vertices, new_offsets = _take_parts(all_offsets, order)
+        calibrated = CalibratedRoutes(route_ids, hashes, all_route[order], new_offsets, all_x[vertices],
+                                      all_y[vertices], all_m[vertices], routes_id_field, stamp)
+    else:
+        calibrated = CalibratedRoutes(route_ids, hashes, changed_part_route, changed_offsets, changed_x, changed_y,
+                                      changed_m, routes_id_field, stamp)
+    return calibrated, route_ids[~reused], removed
+
+
+def cache_path(routes_fc, routes_id_field):
+    """<geodatabase folder>/<geodatabase name>_<routes>_<id field>.routes.npz"""
+    workspace, name = os.path.split(routes_fc)
+    name = os.path.splitext(name)[0]
+    if workspace.lower().endswith((".gdb", ".sde", ".gpkg")):
+        name = "{0}_{1}".format(os.path.splitext(os.path.basename(workspace))[0], name)
+        workspace = os.path.dirname(workspace)
+    return os.path.join(workspace, "{0}_{1}.routes.npz".format(name, routes_id_field))
+
+
+def read_parts(routes_fc, routes_id_field):
+    """
+    Read the route vertices, grouped by route id and then by feature.
+    :return: (route_ids, part_route, part_offsets, x, y)
+    """
+    import arcpy
+
+    vertices = arcpy.da.FeatureClassToNumPyArray(routes_fc, ["OID@", routes_id_field, "SHAPE@X", "SHAPE@Y"],
+                                                 explode_to_points=True)
+    # Stable sort: the vertices of a feature stay in vertex order
+    vertices = vertices[np.lexsort((vertices["OID@"], vertices[routes_id_field]))]
+    change = np.ones(len(vertices), dtype=bool)
+    change[1:] = vertices["OID@"][1:] != vertices["OID@"][:-1]
+    starts = np.flatnonzero(change)
+    route_ids, part_route = np.unique(vertices[routes_id_field][starts], return_inverse=True)
+    return route_ids, part_route.ravel(), np.append(starts, len(vertices)), vertices["SHAPE@X"], \
+        vertices["SHAPE@Y"]
+
+
+def calibrate(routes_fc, routes_id_field, path=None):
+    """
+    Calibrated routes of a feature class, from the cache when possible; the cache is updated.
+    :param path: cache file; cache_path(routes_fc, routes_id_field) when None
+    :return: (CalibratedRoutes, ids of the calibrated routes, ids of the routes no longer present); both id
+             arrays are empty when the cache was up to date
+    """
+    path = path or cache_path(routes_fc, routes_id_field)
+    previous = CalibratedRoutes.load(path)
+    stamp = change_stamp.dataset_stamp(routes_fc)
+    if previous is not None and previous.routes_id_field == routes_id_field and stamp is not None \
+            and previous.stamp == stamp:
+        return previous, previous.route_ids[:0], previous.route_ids[:0]
+
+    calibrated, changed, removed = update(previous, *read_parts(routes_fc, routes_id_field),
+                                          routes_id_field=routes_id_field, stamp=stamp)
+    if previous is None or calibrated.fingerprint != previous.fingerprint or stamp != previous.stamp:
+        calibrated.save(path)
+    return calibrated, changed, removed
+
+
+def load_routes(routes_fc, routes_id_field, cell_size=None):
+    """
+    Calibrated routes as a RouteNetwork, the cached counterpart of lr_engine.load_routes for routes without M
+    values.
+    :return: (RouteNetwork, spatial reference)
+    """
+    import arcpy
+
+    calibrated, _, _ = calibrate(routes_fc, routes_id_field)
+    return calibrated.network(cell_size), arcpy.Describe(routes_fc).spatialReference
+
+
+def write_routes(calibrated, out_fc, spatial_reference=None, route_ids=None):
+    """
+    Write calibrated routes as polylines with M values, one multipart feature per route id.
+    :param route_ids: only write these routes; all of them when None
+    """
+    import arcpy
+
+    if not arcpy.Exists(out_fc):
+        workspace, name = os.path.split(out_fc)
+        arcpy.CreateFeatureclass_management(workspace, name, "POLYLINE", has_m="ENABLED",
+                                            spatial_reference=spatial_reference)
+        field_type = "TEXT" if calibrated.route_ids.dtype.kind in "OUS" else \
+            ("LONG" if calibrated.route_ids.dtype.kind in "iu" else "DOUBLE")
+        arcpy.AddField_management(out_fc, calibrated.routes_id_field, field_type)
+
+    routes = np.arange(len(calibrated.route_ids))
+    if route_ids is not None:
+        routes = routes[np.isin(calibrated.route_ids, route_ids)]
+    route_part = np.searchsorted(calibrated.part_route, np.arange(len(calibrated.route_ids) + 1))
+    offsets = calibrated.part_offsets
+    with arcpy.da.InsertCursor(out_fc, ["SHAPE@", calibrated.routes_id_field]) as cursor:
+        for route in routes:
+            parts = arcpy.Array()
+            for part in range(route_part[route], route_part[route + 1]):
+                start, stop = offsets[part], offsets[part + 1]
+                parts.add(arcpy.Array([arcpy.Point(x, y, None, m) for x, y, m in
+                                       zip(calibrated.x[start:stop], calibrated.y[start:stop],
+                                           calibrated.m[start:stop])]))
+            shape = arcpy.Polyline(parts, spatial_reference, False, True)
+            cursor.insertRow([shape, calibrated.route_ids[route].item()])
+    return out_fc
+
+
+def _outputs_path(path):
+    return os.path.splitext(path)[0] + ".outputs.json"
+
+
+def create_routes(routes_fc, routes_id_field, out_fc, path=None):
+    """
+    Cached counterpart of CreateRoutes with LENGTH measures, UPPER_LEFT priority and ignored gaps. An out_fc
+    written by an earlier call is kept when the routes did not change, and only the changed routes are replaced
+    in it otherwise.
+    :return: out_fc
+    """
+    import arcpy
+
+    path = path or cache_path(routes_fc, routes_id_field)
+    previous = CalibratedRoutes.load(path)
+    calibrated, changed, removed = calibrate(routes_fc, routes_id_field, path)
+
+    ##### Fingerprint of the routes every output was written from #####
+    outputs = {}
+    if os.path.isfile(_outputs_path(path)):
+        with open(_outputs_path(path)) as outputs_file:
+            outputs = json.load(outputs_file)
+    written = outputs.get(out_fc) if arcpy.Exists(out_fc) else None
+
+    if written == calibrated.fingerprint:
+        arcpy.AddMessage("Calibrated routes are up to date.")
+        return out_fc
+    spatial_reference = arcpy.Describe(routes_fc).spatialReference
+    if previous is not None and written == previous.fingerprint:
+        arcpy.AddMessage("Updating {0} changed and {1} removed routes...".format(len(changed), len(removed)))
+        lr_engine.delete_route_events(out_fc, routes_id_field, np.concatenate((changed, removed)))
+        write_routes(calibrated, out_fc, spatial_reference, changed)
+    else:
+        arcpy.AddMessage("Writing {0} calibrated routes...".format(len(calibrated.route_ids)))
+        if arcpy.Exists(out_fc):
+            arcpy.Delete_management(out_fc)
+        write_routes(calibrated, out_fc, spatial_reference)
+
+    outputs[out_fc] = calibrated.fingerprint
+    with open(_outputs_path(path), "w") as outputs_file:
+        json.dump(outputs, outputs_file)
+    # Writing into the routes geodatabase changes its stamp; keep the cache valid for the next call
+    stamp = change_stamp.dataset_stamp(routes_fc)
+    if stamp != calibrated.stamp:
+        calibrated.stamp = stamp
+        calibrated.save(path)
+    return out_fc
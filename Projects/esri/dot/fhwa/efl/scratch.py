@@ -0,0 +1,118 @@
+# #############
+"""
+Source Name: scratch.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Scratch storage for the intermediate datasets of the EFL post-processing tools.
+
+Intermediates (copied nodes and routes, split segments, converted lines, located-event tables, layers) are
+created in the memory workspace and handed from one geoprocessing step to the next without touching the
+output geodatabase. They are deleted when the tool leaves the ScratchWorkspace block, whether it succeeded
+or failed. For debugging, keep_in keeps them in a geodatabase instead, as the tools did before.
+
+output_geodatabase creates the output file geodatabase of a run and deletes it again when the run fails,
+together with the GeoPackage, SQLite and Parquet outputs the run wrote next to it, so failed runs do not
+leave orphaned outputs behind.
+"""
+
+import contextlib
+import os
+import shutil
+
+import bulk_output
+
+
+def memory_workspace(gp=None):
+    """Name of the in-memory workspace: "memory" in ArcGIS Pro, "in_memory" in ArcMap."""
+    if gp is None:
+        import arcpy as gp
+
+    return "memory" if gp.GetInstallInfo().get("ProductName") == "ArcGISPro" else "in_memory"
+
+
+class ScratchWorkspace(object):
+    """
+    Context manager handing out names for intermediate datasets and layers, deleted on exit.
+
+    :param keep_in: geodatabase to write the intermediates to and keep them in; None keeps them in memory
+                    and deletes them on exit
+    :param gp: geoprocessing module the intermediates are deleted with (see tracing.py); arcpy when None
+    """
+
+    def __init__(self, keep_in=None, gp=None):
+        self.keep_in = keep_in
+        self.gp = gp
+        self.location = keep_in or memory_workspace(gp)
+        self.items = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.cleanup(raise_errors=exc_type is None)
+        return False
+
+    def path(self, name):
+        """Catalog path for an intermediate dataset."""
+        path = os.path.join(self.location, name)
+        self.items.append(path)
+        return path
+
+    def layer(self, name):
+        """Name for an intermediate layer; layers are deleted on exit even when the datasets are kept."""
+        self.items.append(("layer", name))
+        return name
+
+    def cleanup(self, raise_errors=True):
+        """Delete the intermediates, newest first. Errors are only raised when the tool itself succeeded."""
+        gp = self.gp
+        if gp is None:
+            import arcpy as gp
+
+        for item in reversed(self.items):
+            if isinstance(item, tuple):
+                item = item[1]
+            elif self.keep_in:
+                continue
+            try:
+                if gp.Exists(item):
+                    gp.Delete_management(item)
+            except Exception:
+                if raise_errors:
+                    raise
+        self.items = []
+
+
+@contextlib.contextmanager
+def output_geodatabase(workspace, name, gp=None):
+    """
+    Create a file geodatabase for the outputs of a run. If the run fails, the geodatabase is deleted again, and
+    so are the bulk outputs next to it (see bulk_output.output_path) that did not exist before the run.
+    :param gp: geoprocessing module (see tracing.py); arcpy when None
+    """
+    if gp is None:
+        import arcpy as gp
+
+    bulk_outputs = [path for path in bulk_output.output_locations(os.path.join(workspace, name))
+                    if not os.path.exists(path)]
+    gp.AddMessage("Creating workspace file geodatabase '{0}'...".format(name))
+    gdb = gp.CreateFileGDB_management(workspace, name).getOutput(0)
+    try:
+        yield gdb
+    except BaseException:
+        gp.AddMessage("Removing workspace file geodatabase '{0}' of the failed run...".format(name))
+        try:
+            gp.ClearWorkspaceCache_management(gdb)
+            gp.Delete_management(gdb)
+        except Exception:
+            pass
+        for path in bulk_outputs:
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                elif os.path.isfile(path):
+                    os.remove(path)
+            except OSError:
+                pass
+        raise
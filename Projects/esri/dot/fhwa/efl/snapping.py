@@ -0,0 +1,240 @@
+# #############
+"""
+Source Name: snapping.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Batch snapping of points onto the routes of a RouteNetwork.
+
+The route segments are cut into pieces no longer than a fixed length and the piece midpoints go into a
+k-d tree, built once per network and reused by every call (get_index). Every point of a segment lies within
+half a piece length of one of its piece midpoints, so the nearest segments of a point are found among its
+nearest midpoints with a logarithmic tree query instead of a scan of every segment within a search radius.
+
+snap returns the k nearest routes of every point with their measures, distances and the direction of the
+route at the snapped location. snap_sequences then picks one candidate per point for ordered sequences of
+points (the nodes of one LEC fault, a collection trail): consecutive points prefer to stay on the same
+route with a measure difference that matches the distance between them, and a route ID recorded with a
+point wins over nearer routes.
+"""
+
+import collections
+
+import numpy as np
+
+
+CHUNK_SIZE = 100000
+
+
+class SnapCandidates(object):
+    """
+    The k nearest routes of every point, nearest first; arrays of shape (points, k).
+
+    route: route index, -1 where there are fewer than k routes within the search distance
+    measure, distance: measure of the snapped location and distance to it
+    direction: +1 when measures increase along the digitized direction of the route there, -1 when they
+               decrease, 0 on a segment without measure change
+    heading: direction of increasing measure at the snapped location, in degrees clockwise from north
+    """
+
+    def __init__(self, points, k):
+        self.route = np.full((points, k), -1, dtype=np.int64)
+        self.measure = np.full((points, k), np.nan)
+        self.distance = np.full((points, k), np.inf)
+        self.direction = np.zeros((points, k), dtype=np.int8)
+        self.heading = np.full((points, k), np.nan)
+
+    def __len__(self):
+        return len(self.route)
+
+    def nearest(self):
+        """(route, measure, distance) of the nearest candidate, as returned by RouteNetwork.locate."""
+        return self.route[:, 0], self.measure[:, 0], np.where(self.route[:, 0] >= 0, self.distance[:, 0], np.nan)
+
+
+class SnapIndex(object):
+    """
+    k-d tree over the route segments of a network.
+
+    :param network: RouteNetwork
+    :param piece_length: longest piece a segment is cut into; the median segment length when None
+    """
+
+    def __init__(self, network, piece_length=None):
+        from scipy import spatial
+
+        self.network = network
+        start = network.segment_start
+        x0, y0 = network.x[start], network.y[start]
+        dx, dy = network.x[start + 1] - x0, network.y[start + 1] - y0
+        length = np.hypot(dx, dy)
+        if piece_length is None:
+            piece_length = float(np.median(length)) if len(length) else 1.0
+        piece_length = piece_length if piece_length > 0 else 1.0
+
+        ##### Midpoint of every piece, with the segment it belongs to #####
+        pieces = np.maximum(np.ceil(length / piece_length), 1).astype(np.int64)
+        self.piece_segment = np.repeat(np.arange(len(start)), pieces)
+        local = np.arange(pieces.sum()) - np.repeat(np.cumsum(pieces) - pieces, pieces)
+        t = (local + 0.5) / pieces[self.piece_segment]
+        self.half_piece = float((length / pieces).max()) / 2.0 if len(length) else 0.0
+        self.tree = spatial.cKDTree(np.column_stack((x0[self.piece_segment] + t * dx[self.piece_segment],
+                                                     y0[self.piece_segment] + t * dy[self.piece_segment])))
+
+    def snap(self, px, py, k=1, max_distance=np.inf, chunk_size=CHUNK_SIZE):
+        """
+        Find the k nearest routes of every point within max_distance.
+        :return: SnapCandidates
+        """
+        px = np.asarray(px, dtype=float)
+        py = np.asarray(py, dtype=float)
+        candidates = SnapCandidates(len(px), k)
+        if not self.tree.n:
+            return candidates
+        for start in range(0, len(px), chunk_size):
+            self._snap_chunk(px, py, np.arange(start, min(start + chunk_size, len(px))), k, max_distance,
+                             candidates)
+        return candidates
+
+    def _snap_chunk(self, px, py, pending, k, max_distance, candidates):
+        network = self.network
+        count = min(4 * k, self.tree.n)
+        while len(pending):
+            midpoint_distance, piece = self.tree.query(np.column_stack((px[pending], py[pending])), count,
+                                                       distance_upper_bound=max_distance + self.half_piece)
+            midpoint_distance = midpoint_distance.reshape(len(pending), count)
+            piece = piece.reshape(len(pending), count)
+
+            ##### Project every point on the segments of its nearest pieces #####
+            row, column = np.nonzero(piece < self.tree.n)
+            pairs = np.unique(row * len(network.segment_start) + self.piece_segment[piece[row, column]])
+            row, segments = pairs // len(network.segment_start), pairs % len(network.segment_start)
+            points = pending[row]
+            distance, measure, _ = network.project(px, py, points, segments)
+            keep = distance <= max_distance
+            row, points, segments, distance, measure = (row[keep], points[keep], segments[keep], distance[keep],
+                                                        measure[keep])
+            routes = network.segment_route[segments]
+
+            ##### Nearest segment per (point, route), then the k nearest routes per point #####
+            order = np.lexsort((distance, routes, row))
+            first = np.ones(len(order), dtype=bool)
+            first[1:] = (row[order][1:] != row[order][:-1]) | (routes[order][1:] != routes[order][:-1])
+            best = order[first]
+            best = best[np.lexsort((routes[best], distance[best], row[best]))]
+            rank = np.arange(len(best)) - np.searchsorted(row[best], row[best])
+            best, rank = best[rank < k], rank[rank < k]
+            self._fill(candidates, points[best], rank, routes[best], segments[best], measure[best], distance[best])
+
+            ##### A point is done when no piece beyond the queried ones can be nearer than its kth route #####
+            kth = candidates.distance[pending, k - 1]
+            bound = np.where(np.isfinite(kth), kth, max_distance)
+            done = (piece[:, -1] == self.tree.n) | (midpoint_distance[:, -1] - self.half_piece >= bound)
+            if count == self.tree.n:
+                break
+            pending = pending[~done]
+            count = min(2 * count, self.tree.n)
+
+    def _fill(self, candidates, points, rank, routes, segments, measure, distance):
+        network = self.network
+        start = network.segment_start[segments]
+        dx, dy = network.x[start + 1] - network.x[start], network.y[start + 1] - network.y[start]
+        direction = np.sign(network.m[start + 1] - network.m[start]).astype(np.int8)
+        forward = np.where(direction < 0, -1.0, 1.0)
+        candidates.route[points, rank] = routes
+        candidates.measure[points, rank] = measure
+        candidates.distance[points, rank] = distance
+        candidates.direction[points, rank] = direction
+        candidates.heading[points, rank] = np.degrees(np.arctan2(forward * dx, forward * dy)) % 360.0
+
+
+_indexes = collections.OrderedDict()
+MAX_INDEXES = 4
+
+
+def get_index(network, piece_length=None):
+    """Return the SnapIndex of a network, building it only the first time the network is seen."""
+    key = (network.fingerprint(), piece_length)
+    if key in _indexes:
+        _indexes.move_to_end(key)
+        return _indexes[key]
+    index = SnapIndex(network, piece_length)
+    _indexes[key] = index
+    while len(_indexes) > MAX_INDEXES:
+        _indexes.popitem(last=False)
+    return index
+
+
+def snap_sequences(network, candidates, px, py, sequence, order=None, route_hint=None, switch_penalty=0.0):
+    """
+    Pick one candidate per point, resolving ambiguous points with their neighbours in the same sequence.
+
+    The points of every sequence are visited in order and the cheapest chain of candidates is kept
+    (Viterbi). A candidate costs its distance from the point. Moving to the next point on the same route
+    costs the difference between the measure change and the straight distance between the points; moving to
+    another route costs the straight distance plus switch_penalty. Where a point records a route ID found
+    among its candidates (route_hint), only that route is kept.
+
+    :param network: RouteNetwork the candidates refer to
+    :param candidates: SnapCandidates of the points
+    :param sequence: sequence value per point, e.g. a LEC fault ID
+    :param order: order of the points within a sequence, e.g. ObjectIDs; the input order when None
+    :param route_hint: optional route ID per point; empty or unknown IDs are ignored
+    :param switch_penalty: extra cost of changing route between consecutive points, in coordinate units
+    :return: (route, measure, distance) per point, route -1 for points without candidates
+    """
+    px = np.asarray(px, dtype=float)
+    py = np.asarray(py, dtype=float)
+    points = len(candidates)
+    order = np.arange(points) if order is None else np.asarray(order)
+    cost = np.where(candidates.route >= 0, candidates.distance, np.inf)
+    if route_hint is not None:
+        hinted = candidates.route == network.route_index(np.asarray(route_hint))[:, None]
+        hinted &= candidates.route >= 0
+        cost = np.where(hinted.any(axis=1)[:, None] & ~hinted, np.inf, cost)
+
+    ##### Sort the points by sequence, then by order; position counts the points within a sequence #####
+    perm = np.lexsort((order, np.asarray(sequence)))
+    sorted_sequence = np.asarray(sequence)[perm]
+    new_sequence = np.ones(points, dtype=bool)
+    new_sequence[1:] = sorted_sequence[1:] != sorted_sequence[:-1]
+    position = np.arange(points) - np.maximum.accumulate(np.where(new_sequence, np.arange(points), 0))
+
+    route, measure = candidates.route[perm], candidates.measure[perm]
+    total = cost[perm]
+    back = np.zeros(total.shape, dtype=np.int64)
+    straight = np.zeros(points)
+    straight[1:] = np.hypot(np.diff(px[perm]), np.diff(py[perm]))
+
+    ##### Forward pass, one point position at a time across all sequences #####
+    for step in range(1, int(position.max()) + 1 if points else 0):
+        current = np.flatnonzero(position == step)
+        previous = current - 1
+        along = np.abs(measure[current][:, None, :] - measure[previous][:, :, None])
+        same = route[current][:, None, :] == route[previous][:, :, None]
+        gap = straight[current][:, None, None]
+        transition = np.where(same, np.abs(along - gap), gap + switch_penalty)
+        transition = np.nan_to_num(transition, nan=0.0)
+        # A point without candidates breaks the chain: the next point starts afresh
+        reachable = np.isfinite(total[previous]).any(axis=1)
+        chain = np.where(reachable[:, None, None], total[previous][:, :, None] + transition, 0.0)
+        back[current] = np.argmin(chain, axis=1)
+        total[current] += np.min(chain, axis=1)
+
+    ##### Backward pass from the cheapest candidate of every last point #####
+    choice = np.zeros(points, dtype=np.int64)
+    last = np.ones(points, dtype=bool)
+    last[:-1] = new_sequence[1:]
+    choice[last] = np.argmin(total[last], axis=1)
+    for step in range(int(position.max()) if points else 0, 0, -1):
+        current = np.flatnonzero(position == step)
+        choice[current - 1] = back[current, choice[current]]
+
+    chosen_route = np.full(points, -1, dtype=np.int64)
+    chosen_measure = np.full(points, np.nan)
+    chosen_distance = np.full(points, np.nan)
+    valid = np.isfinite(cost[perm, choice])
+    chosen_route[perm[valid]] = route[valid, choice[valid]]
+    chosen_measure[perm[valid]] = measure[valid, choice[valid]]
+    chosen_distance[perm[valid]] = candidates.distance[perm[valid], choice[valid]]
+    return chosen_route, chosen_measure, chosen_distance
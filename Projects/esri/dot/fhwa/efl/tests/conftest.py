@@ -0,0 +1,9 @@
+"""
+Shared set-up of the EFL post-processing tests: the tool modules are imported from the folder above, as the
+toolboxes do.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
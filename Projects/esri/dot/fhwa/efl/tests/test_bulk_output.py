@@ -0,0 +1,118 @@
+# #############
+"""
+Source Name: test_bulk_output.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the bulk event writers: GeoPackage and SQLite tables read back with sqlite3, table and field names
+that need quoting, and the CRS written to the GeoParquet metadata.
+"""
+
+import json
+import os
+import sqlite3
+import struct
+
+import numpy as np
+import pytest
+
+import bulk_output
+import esri_common  # puts Projects/esri/common on the import path
+import bulk_tables
+
+
+class FakeSpatialReference(object):
+    def __init__(self, factory_code, name, crs_type="Projected"):
+        self.factoryCode, self.name, self.type = factory_code, name, crs_type
+
+    def exportToString(self):
+        return 'PROJCS["{0}"]'.format(self.name)
+
+
+UTM13 = FakeSpatialReference(26913, "NAD_1983_UTM_Zone_13N")
+
+
+def event_columns():
+    return {"RID": np.array(["R1", "R2", "R1"]), "FMEAS": np.array([0.0, 5.0, 10.0]),
+            "TMEAS": np.array([10.0, 5.0, np.nan]), "FAULT": np.array([3, 1, 2])}
+
+
+def event_geometry():
+    """Two lines and an event without geometry."""
+    offsets = np.array([0, 2, 5, 5])
+    x = np.array([0.0, 10.0, 20.0, 21.0, 25.0])
+    y = np.array([0.0, 0.0, 5.0, 6.0, 9.0])
+    return offsets, x, y, np.array([0.0, 10.0, 5.0, 6.0, 10.0])
+
+
+@pytest.mark.parametrize("name", ["main.LEC_LinearEvents", 'LEC "events"', 'x"; DROP TABLE gpkg_contents; --'])
+def test_geopackage_event_table(tmp_path, name):
+    database = str(tmp_path / "efl.gpkg")
+    columns = event_columns()
+    columns['FAULT "A"'] = columns.pop("FAULT")
+    out_path = bulk_output.write_events(columns, os.path.join(database, name))
+    table = name[5:] if name.startswith("main.") else name
+    assert out_path == os.path.join(database, table)
+
+    connection = sqlite3.connect(database)
+    try:
+        rows = connection.execute("SELECT RID, FMEAS, TMEAS, {0} FROM {1} ORDER BY fid".format(
+            bulk_tables.quote_identifier('FAULT "A"'), bulk_tables.quote_identifier(table))).fetchall()
+        contents = connection.execute("SELECT table_name, data_type, srs_id FROM gpkg_contents").fetchall()
+    finally:
+        connection.close()
+    assert rows == [("R1", 0.0, 10.0, 3), ("R2", 5.0, 5.0, 1), ("R1", 10.0, None, 2)]
+    assert contents == [(table, "attributes", None)]
+
+
+@pytest.mark.parametrize("database_name", ["efl.gpkg", "efl.sqlite"])
+def test_event_features(tmp_path, database_name):
+    database = str(tmp_path / database_name)
+    bulk_tables.write_sqlite(event_columns(), database, "LEC events", event_geometry(), UTM13, batch_size=2)
+
+    connection = sqlite3.connect(database)
+    try:
+        blobs = [row[0] for row in connection.execute('SELECT geom FROM "LEC events" ORDER BY fid')]
+        if database_name.endswith(".gpkg"):
+            assert connection.execute("SELECT srs_id, organization FROM gpkg_spatial_ref_sys WHERE srs_id = 26913") \
+                .fetchall() == [(26913, "EPSG")]
+            assert connection.execute("SELECT * FROM gpkg_geometry_columns").fetchall() == \
+                [("LEC events", "geom", "LINESTRING", 26913, 0, 1)]
+            assert connection.execute("SELECT min_x, min_y, max_x, max_y, srs_id FROM gpkg_contents").fetchall() == \
+                [(0.0, 0.0, 25.0, 9.0, 26913)]
+    finally:
+        connection.close()
+
+    assert blobs[2] is None
+    header = 0
+    if database_name.endswith(".gpkg"):
+        magic, _, flags, srs_id = struct.unpack("<2sBBi", blobs[1][:8])
+        assert (magic, flags, srs_id) == (b"GP", 0b011, 26913)
+        assert struct.unpack("<4d", blobs[1][8:40]) == (20.0, 25.0, 5.0, 9.0)
+        header = 40
+    byte_order, geometry_type, count = struct.unpack("<BII", blobs[1][header:header + 9])
+    assert (byte_order, geometry_type, count) == (1, 2002, 3)
+    assert struct.unpack("<9d", blobs[1][header + 9:]) == (20.0, 5.0, 5.0, 21.0, 6.0, 6.0, 25.0, 9.0, 10.0)
+
+
+def test_identifiers_are_quoted():
+    assert bulk_tables.quote_identifier("RID") == '"RID"'
+    assert bulk_tables.quote_identifier('a"b') == '"a""b"'
+
+
+def test_geoparquet_crs():
+    crs = bulk_tables.geoparquet_metadata(UTM13)["columns"]["geometry"]["crs"]
+    assert crs["id"] == {"authority": "EPSG", "code": 26913}
+    # An unknown CRS is null; a missing crs would mean longitude/latitude
+    metadata = bulk_tables.geoparquet_metadata(None)
+    assert "crs" in metadata["columns"]["geometry"] and metadata["columns"]["geometry"]["crs"] is None
+
+
+def test_parquet_events(tmp_path):
+    pq = pytest.importorskip("pyarrow.parquet")
+    path = bulk_tables.write_parquet(event_columns(), str(tmp_path / "events.parquet"), event_geometry(), UTM13)
+    table = pq.read_table(path)
+    assert table.column_names == ["RID", "FMEAS", "TMEAS", "FAULT", "geometry"]
+    geo = json.loads(table.schema.metadata[b"geo"])
+    assert geo["columns"]["geometry"]["crs"]["id"] == {"authority": "EPSG", "code": 26913}
+    assert table.schema.metadata[b"esri_spatial_reference"] == UTM13.exportToString().encode("utf-8")
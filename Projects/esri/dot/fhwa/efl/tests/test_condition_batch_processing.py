@@ -0,0 +1,116 @@
+# #############
+"""
+Source Name: test_condition_batch_processing.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the batch condition tool against a fake arcpy: every condition is written with its own condition
+field and events, in one process or in worker processes, also when two conditions share a name.
+"""
+
+import contextlib
+import multiprocessing
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import lr_engine
+import scratch
+
+
+class FakeSpatialReference(object):
+    type = "Projected"
+    metersPerUnit = 1.0
+
+    def exportToString(self):
+        return "PROJCS"
+
+    def loadFromString(self, text):
+        pass
+
+
+# Condition nodes by feature class: x along route R1 and the condition value of every node
+NODES = {"pavement_nodes": ([100.0, 600.0], ["Good", "Poor"]),
+         "shoulder_nodes": ([300.0], ["Fair"]),
+         "ditch_nodes": ([200.0, 700.0, 900.0], ["Poor", "Good", "Fair"])}
+
+
+@pytest.fixture
+def batch(monkeypatch, tmp_path):
+    """condition_batch_processing under a fake arcpy; yields (module, list of (output path, field names, events))."""
+    arcpy = types.ModuleType("arcpy")
+    arcpy.SpatialReference = FakeSpatialReference
+    arcpy.AddMessage = lambda message: None
+    written = []
+
+    def create_unique_name(name, workspace):
+        path, number = os.path.join(workspace, name), 0
+        while path in [out for out, _, _ in written]:
+            number += 1
+            path = os.path.join(workspace, "{0}{1}".format(name, number))
+        return path
+
+    arcpy.CreateUniqueName = create_unique_name
+    monkeypatch.setitem(sys.modules, "arcpy", arcpy)
+    import condition_batch_processing
+    monkeypatch.setattr(condition_batch_processing, "arcpy", arcpy)
+
+    network = lr_engine.RouteNetwork(np.array(["R1"]), [0, 2], [0.0, 1000.0], [0.0, 0.0])
+    monkeypatch.setattr(lr_engine, "load_routes", lambda routes_fc, routes_id_field: (network, FakeSpatialReference()))
+
+    def load_points(points_fc, fields, spatial_reference=None):
+        x, values = NODES[points_fc]
+        return (np.array(x), np.zeros(len(x)), {"OID@": np.arange(1, len(x) + 1), fields[1]: np.array(values)})
+
+    monkeypatch.setattr(lr_engine, "load_points", load_points)
+    monkeypatch.setattr(lr_engine, "write_event_table",
+                        lambda events, out_table, field_names: written.append((out_table, field_names, events)))
+    monkeypatch.setattr(lr_engine, "write_event_features", lambda *args: None)
+    monkeypatch.setattr(scratch, "output_geodatabase",
+                        lambda workspace, name: contextlib.nullcontext(os.path.join(workspace, name + ".gdb")))
+    # Only the tool's entry point may change the interpreter of the worker processes
+    monkeypatch.setattr(multiprocessing, "set_executable", pytest.fail)
+    yield condition_batch_processing, written
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_every_condition_keeps_its_field(batch, tmp_path, workers):
+    condition_batch_processing, written = batch
+    if workers > 1 and multiprocessing.get_start_method() != "fork":
+        pytest.skip("the fake arcpy only reaches forked worker processes")
+    conditions = [("pavement", "pavement_nodes", "PAVEMENT_RATING"), ("shoulder", "shoulder_nodes", "SHOULDER"),
+                  ("pavement", "ditch_nodes", "DITCH_RATING")]
+    workspace_gdb, summary = condition_batch_processing.create_cond_events_batch(str(tmp_path), conditions, "routes",
+                                                                                 "ROUTE_ID", 10, workers=workers)
+
+    assert [(os.path.basename(out), field_names) for out, field_names, _ in written] == [
+        ("out_pavement_event_table", {"VALUE": "PAVEMENT_RATING"}),
+        ("out_shoulder_event_table", {"VALUE": "SHOULDER"}),
+        ("out_pavement_event_table1", {"VALUE": "DITCH_RATING"})]
+    assert all(os.path.dirname(out) == workspace_gdb for out, _, _ in written)
+    # Every output holds the events of its own nodes, with the default value before the first node
+    assert [events["VALUE"].tolist() for _, _, events in written] == [["Excellent", "Good", "Poor"],
+                                                                      ["Excellent", "Fair"],
+                                                                      ["Excellent", "Poor", "Good", "Fair"]]
+    assert [timings["nodes"] for timings in summary] == [2, 1, 3]
+    assert [timings["events"] for timings in summary] == [3, 2, 4]
+
+
+def test_entry_point_sets_the_worker_interpreter(batch, monkeypatch):
+    condition_batch_processing, _ = batch
+    arcpy = condition_batch_processing.arcpy
+    table = types.SimpleNamespace(rowCount=1, getValue=lambda row, column: ["pavement", "pavement_nodes",
+                                                                            "PAVEMENT_RATING"][column])
+    arcpy.GetParameterAsText = lambda index: ["C:\\work", None, "routes", "ROUTE_ID", "10"][index]
+    arcpy.GetParameter = lambda index: table
+    calls = []
+    monkeypatch.setattr(condition_batch_processing, "create_cond_events_batch", lambda *args: calls.append(args))
+    monkeypatch.setattr(multiprocessing, "set_executable", lambda executable: calls.append(executable))
+    monkeypatch.setattr(sys, "platform", "win32")
+
+    condition_batch_processing.main()
+    assert calls == [os.path.join(sys.exec_prefix, "python.exe"),
+                     ("C:\\work", [("pavement", "pavement_nodes", "PAVEMENT_RATING")], "routes", "ROUTE_ID", "10")]
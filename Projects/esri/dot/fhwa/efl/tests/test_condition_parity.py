@@ -0,0 +1,67 @@
+# #############
+"""
+Source Name: test_condition_parity.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Fixture comparison of the in-memory condition events with the geoprocessing chain of create_cond_events.
+Needs ArcGIS Pro; skipped elsewhere.
+"""
+
+import numpy as np
+import pytest
+
+arcpy = pytest.importorskip("arcpy")
+
+import condition_node_processing
+
+
+CONDITIONS = ["Good", "Fair", "Poor", "Good", "Fair"]
+
+
+@pytest.fixture
+def fixture_gdb(tmp_path):
+    """One M-enabled route along x in UTM 13N, with condition nodes collected along it."""
+    gdb = arcpy.management.CreateFileGDB(str(tmp_path), "fixture.gdb").getOutput(0)
+    spatial_reference = arcpy.SpatialReference(26913)
+
+    routes = arcpy.management.CreateFeatureclass(gdb, "routes", "POLYLINE", has_m="ENABLED",
+                                                 spatial_reference=spatial_reference).getOutput(0)
+    arcpy.management.AddField(routes, "ROUTE_ID", "TEXT", field_length=20)
+    with arcpy.da.InsertCursor(routes, ["SHAPE@", "ROUTE_ID"]) as cursor:
+        points = arcpy.Array([arcpy.Point(500000.0 + x, 4000000.0, None, x) for x in np.linspace(0, 3000, 31)])
+        cursor.insertRow([arcpy.Polyline(points, spatial_reference, False, True), "R1"])
+
+    nodes = arcpy.management.CreateFeatureclass(gdb, "nodes", "POINT",
+                                                spatial_reference=spatial_reference).getOutput(0)
+    arcpy.management.AddField(nodes, "CONDITION", "TEXT", field_length=20)
+    with arcpy.da.InsertCursor(nodes, ["SHAPE@XY", "CONDITION"]) as cursor:
+        for x, offset, condition in zip([400.0, 950.0, 1500.0, 2210.0, 2700.0], [0.5, -1.0, 2.0, 0.0, -0.5],
+                                        CONDITIONS):
+            cursor.insertRow([(500000.0 + x, 4000000.0 + offset), condition])
+    return routes, nodes
+
+
+def read_events(out_fc):
+    array = arcpy.da.FeatureClassToNumPyArray(out_fc, ["RID", "FMEAS", "TMEAS", "CONDITION"])
+    array = array[np.lexsort((array["FMEAS"], array["RID"]))]
+    return array
+
+
+def test_inmemory_events_match_geoprocessing_chain(fixture_gdb, tmp_path):
+    routes, nodes = fixture_gdb
+    runs = []
+    for name, create in (("chain", condition_node_processing.create_cond_events),
+                         ("inmemory", condition_node_processing.create_cond_events_inmemory)):
+        workspace = tmp_path / name
+        workspace.mkdir()
+        arguments = [str(workspace), "pavement", nodes, "CONDITION", routes, "ROUTE_ID", 10]
+        if name == "chain":
+            arguments.append(True)
+        runs.append(read_events(create(*arguments)))
+
+    chain, inmemory = runs
+    assert chain["RID"].tolist() == inmemory["RID"].tolist()
+    np.testing.assert_allclose(chain["FMEAS"], inmemory["FMEAS"], atol=1e-3)
+    np.testing.assert_allclose(chain["TMEAS"], inmemory["TMEAS"], atol=1e-3)
+    assert chain["CONDITION"].tolist() == inmemory["CONDITION"].tolist() == ["Excellent"] + CONDITIONS
@@ -0,0 +1,100 @@
+# #############
+"""
+Source Name: test_event_index.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the route-measure event index: point, range and batch queries against a brute-force scan of the
+events, and rebuilding the index when the event table changes.
+"""
+
+import numpy as np
+import pytest
+
+import event_index
+
+
+def random_events(rng, count=400):
+    """Overlapping, nested, zero-length and reversed (FMEAS > TMEAS) events on a few routes."""
+    low = rng.uniform(0, 1000, count).round(1)
+    length = np.where(rng.random(count) < 0.1, 0.0, rng.exponential(80, count)).round(1)
+    reverse = rng.random(count) < 0.2
+    return {"RID": rng.choice(["R1", "R2", "R3", "R10"], count),
+            "FMEAS": np.where(reverse, low + length, low),
+            "TMEAS": np.where(reverse, low, low + length),
+            "EVENT": np.arange(count)}
+
+
+def brute_force(events, rid, from_measure, to_measure):
+    low, high = min(from_measure, to_measure), max(from_measure, to_measure)
+    event_low = np.minimum(events["FMEAS"], events["TMEAS"])
+    event_high = np.maximum(events["FMEAS"], events["TMEAS"])
+    return set(np.flatnonzero((events["RID"] == rid) & (event_low <= high) & (event_high >= low)).tolist())
+
+
+@pytest.fixture
+def indexed(tmp_path):
+    events = random_events(np.random.default_rng(4))
+    return events, event_index.build(events, str(tmp_path / "index"))
+
+
+def queries(rng, count=300):
+    rids = rng.choice(["R1", "R2", "R3", "R10", "R99"], count)
+    from_measures = rng.uniform(-50, 1100, count).round(1)
+    to_measures = from_measures + rng.choice([0.0, 5.0, -30.0, 200.0], count)
+    return rids, from_measures, to_measures
+
+
+def test_range_and_point_queries_match_brute_force(indexed):
+    events, index = indexed
+    for rid, from_measure, to_measure in zip(*queries(np.random.default_rng(5))):
+        found = index.rows(index.range(rid, from_measure, to_measure), ["EVENT"])["EVENT"]
+        assert set(found.tolist()) == brute_force(events, rid, from_measure, to_measure)
+        assert len(found) == len(set(found.tolist()))
+        covering = index.rows(index.point(rid, from_measure), ["EVENT"])["EVENT"]
+        assert set(covering.tolist()) == brute_force(events, rid, from_measure, from_measure)
+
+
+def test_batch_queries_match_brute_force(indexed):
+    events, index = indexed
+    rids, from_measures, to_measures = queries(np.random.default_rng(6))
+    query, event = index.batch_range(rids, from_measures, to_measures)
+    assert np.all(np.diff(query) >= 0)
+    found = index.rows(event, ["EVENT"])["EVENT"]
+    for number, (rid, from_measure, to_measure) in enumerate(zip(rids, from_measures, to_measures)):
+        assert set(found[query == number].tolist()) == brute_force(events, rid, from_measure, to_measure)
+
+    query, event = index.batch_point(rids, from_measures)
+    found = index.rows(event, ["EVENT"])["EVENT"]
+    for number, (rid, measure) in enumerate(zip(rids, from_measures)):
+        assert set(found[query == number].tolist()) == brute_force(events, rid, measure, measure)
+
+
+def test_empty_index(tmp_path):
+    index = event_index.build({"RID": np.array([], dtype="U2"), "FMEAS": np.array([]), "TMEAS": np.array([])},
+                              str(tmp_path / "index"))
+    assert len(index) == 0
+    assert index.range("R1", 0.0, 10.0).tolist() == []
+    query, event = index.batch_range(["R1"], [0.0], [10.0])
+    assert query.tolist() == event.tolist() == []
+
+
+def test_index_is_rebuilt_when_the_table_changes(tmp_path, monkeypatch):
+    gdb = tmp_path / "Events.gdb"
+    gdb.mkdir()
+    (gdb / "a00000009.gdbtable").write_bytes(b"events")
+    event_table = str(gdb / "out_events")
+    reads = []
+
+    def read_event_table(table, rid_field, from_field, to_field):
+        reads.append(table)
+        return {"RID": np.array(["R1", "R1"]), "FMEAS": np.array([0.0, 10.0]), "TMEAS": np.array([10.0, 25.0])}
+
+    monkeypatch.setattr(event_index.event_overlay, "read_event_table", read_event_table)
+    directory = str(tmp_path / "index" / "out_events")
+    assert event_index.open_index(event_table, directory).point("R1", 10.0).tolist() == [0, 1]
+    event_index.open_index(event_table, directory)
+    assert len(reads) == 1
+    (gdb / "a00000009.gdbtable").write_bytes(b"edited events")
+    event_index.open_index(event_table, directory)
+    assert len(reads) == 2
@@ -0,0 +1,101 @@
+# #############
+"""
+Source Name: test_event_overlay.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the route event overlay against a brute-force overlay: segment boundaries, the number of covering
+events of every table and the attributes of every combination of covering events.
+"""
+
+import itertools
+
+import numpy as np
+
+import event_overlay
+
+
+def random_table(rng, count, routes=("R1", "R2", "R10")):
+    """Overlapping, nested, touching, zero-length and reversed events with a number and a text attribute."""
+    low = rng.integers(0, 40, count) * 2.5
+    length = rng.choice([0.0, 2.5, 5.0, 12.5, 30.0], count)
+    reverse = rng.random(count) < 0.2
+    return {"RID": rng.choice(list(routes), count), "FMEAS": np.where(reverse, low + length, low),
+            "TMEAS": np.where(reverse, low, low + length), "CODE": rng.integers(1, 9, count),
+            "RATING": rng.choice(["Good", "Fair", "Poor"], count)}
+
+
+def plain(value):
+    """Python value of a column value, with NaN as None so that rows compare equal."""
+    value = value.item() if isinstance(value, np.generic) else value
+    return None if value != value else value
+
+
+def brute_force(tables):
+    """Rows (RID, FMEAS, TMEAS, then per table its attributes and COUNT) by testing every event on every segment."""
+    rows = []
+    route_ids = sorted(set(rid for table in tables for rid in table["RID"].tolist()))
+    for rid in route_ids:
+        measures = set()
+        for table in tables:
+            on_route = table["RID"] == rid
+            measures.update(table["FMEAS"][on_route].tolist() + table["TMEAS"][on_route].tolist())
+        measures = sorted(measures)
+        for from_measure, to_measure in zip(measures[:-1], measures[1:]):
+            choices, counts = [], []
+            for table in tables:
+                low = np.minimum(table["FMEAS"], table["TMEAS"])
+                high = np.maximum(table["FMEAS"], table["TMEAS"])
+                covering = np.flatnonzero((table["RID"] == rid) & (low <= from_measure) & (high >= to_measure))
+                counts.append(len(covering))
+                choices.append([(float(table["CODE"][event]), table["RATING"][event]) for event in covering] or
+                               [(np.nan, "")])
+            if not any(counts):
+                continue
+            for combination in itertools.product(*choices):
+                row = [rid, from_measure, to_measure]
+                for (code, rating), count in zip(combination, counts):
+                    row += [code, rating, count]
+                rows.append(tuple(map(plain, row)))
+    return sorted(rows, key=repr)
+
+
+def as_rows(columns, prefixes):
+    names = ["RID", "FMEAS", "TMEAS"] + [prefix + name for prefix in prefixes for name in ("CODE", "RATING", "COUNT")]
+    return sorted((tuple(map(plain, row)) for row in zip(*[columns[name] for name in names])), key=repr)
+
+
+def test_overlay_matches_brute_force():
+    rng = np.random.default_rng(3)
+    for _ in range(5):
+        tables = [random_table(rng, count) for count in (30, 20, 8)]
+        prefixes = ["T1_", "T2_", "T3_"]
+        segments = event_overlay.overlay(tables, prefixes)
+        assert as_rows(segments, prefixes) == brute_force(tables)
+
+
+def test_overlapping_events_of_one_table():
+    events = {"RID": np.array(["R1", "R1", "R1"]), "FMEAS": np.array([0.0, 5.0, 20.0]),
+              "TMEAS": np.array([10.0, 15.0, 30.0]), "CODE": np.array([1, 2, 3]),
+              "RATING": np.array(["Good", "Poor", "Fair"])}
+    lec = {"RID": np.array(["R1", "R1"]), "FMEAS": np.array([8.0, 8.0]), "TMEAS": np.array([12.0, 12.0]),
+           "CODE": np.array([7, 8]), "RATING": np.array(["A", "B"])}
+    segments = event_overlay.overlay([events, lec], ["C_", "L_"])
+    rows = [tuple(map(plain, row)) for row in zip(segments["FMEAS"], segments["TMEAS"], segments["C_CODE"],
+                                                  segments["C_COUNT"], segments["L_CODE"], segments["L_COUNT"])]
+    assert rows[0] == (0.0, 5.0, 1.0, 1, None, 0)
+    assert rows[1] == (5.0, 8.0, 1.0, 2, None, 0) and rows[2] == (5.0, 8.0, 2.0, 2, None, 0)
+    # Two events of each table cover 8-10: four combinations
+    assert [row[2:] for row in rows[3:7]] == [(1.0, 2, 7.0, 2), (1.0, 2, 8.0, 2), (2.0, 2, 7.0, 2), (2.0, 2, 8.0, 2)]
+    assert [row[:4] for row in rows[7:]] == [(10.0, 12.0, 2.0, 1), (10.0, 12.0, 2.0, 1), (12.0, 15.0, 2.0, 1),
+                                             (20.0, 30.0, 3.0, 1)]
+    # The gap from 15 to 20 is covered by no event
+    assert 15.0 not in segments["FMEAS"].tolist()
+
+
+def test_empty_table():
+    events = random_table(np.random.default_rng(1), 10)
+    empty = {name: column[:0] for name, column in events.items()}
+    segments = event_overlay.overlay([events, empty], ["A_", "B_"])
+    assert as_rows(segments, ["A_", "B_"]) == brute_force([events, empty])
+    assert set(segments["B_COUNT"].tolist()) == {0}
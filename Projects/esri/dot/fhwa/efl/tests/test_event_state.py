@@ -0,0 +1,108 @@
+# #############
+"""
+Source Name: test_event_state.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the incremental condition events: applying the rebuilt routes to the events of the last run must
+give the events of a full recompute.
+"""
+
+import numpy as np
+
+import event_state
+import lr_engine
+
+
+def random_network(rng, routes=12):
+    offsets = np.arange(0, routes * 15 + 1, 15)
+    x = np.cumsum(rng.normal(0.0, 20.0, routes * 15)) + np.repeat(rng.uniform(0, 2000, routes), 15)
+    y = np.cumsum(rng.normal(0.0, 20.0, routes * 15)) + np.repeat(rng.uniform(0, 2000, routes), 15)
+    return lr_engine.RouteNetwork(np.array(["R{0:02d}".format(i) for i in range(routes)]), offsets, x, y)
+
+
+def random_nodes(rng, network, count):
+    """Nodes close to random route vertices, plus a few far from every route."""
+    vertex = rng.integers(0, len(network.x), count)
+    x = network.x[vertex] + rng.normal(0.0, 2.0, count)
+    y = network.y[vertex] + rng.normal(0.0, 2.0, count)
+    x[:3] += 10000.0
+    return x, y, rng.choice(["Good", "Fair", "Poor"], count)
+
+
+def as_rows(events):
+    return sorted(zip(events["RID"].tolist(), np.round(events["FMEAS"], 9).tolist(),
+                      np.round(events["TMEAS"], 9).tolist(), events["VALUE"].tolist()))
+
+
+def apply_edit(old_events, touched, new_events):
+    """What the incremental run does to the outputs: delete the events of the touched routes, append the new."""
+    keep = ~np.isin(old_events["RID"], touched)
+    return {name: np.concatenate((column[keep], new_events[name])) for name, column in old_events.items()}
+
+
+def test_incremental_events_equal_full_recompute():
+    rng = np.random.default_rng(11)
+    network = random_network(rng)
+    x, y, value = random_nodes(rng, network, 150)
+    oid = np.arange(1, 151)
+    state, touched, events = event_state.incremental_events(network, None, oid, x, y, value, 10.0)
+    assert touched is None
+
+    for _ in range(3):
+        ##### Move, re-rate, delete and add nodes #####
+        x, y, value = x.copy(), y.copy(), value.copy()
+        moved = rng.choice(len(x), 5, replace=False)
+        x[moved], y[moved] = random_nodes(rng, network, 5)[:2]
+        rerated = rng.choice(len(x), 5, replace=False)
+        value[rerated] = rng.choice(["Good", "Fair", "Poor"], 5)
+        kept = np.ones(len(x), dtype=bool)
+        kept[rng.choice(len(x), 4, replace=False)] = False
+        new_x, new_y, new_value = random_nodes(rng, network, 6)
+        new_oid = np.arange(oid.max() + 1, oid.max() + 7)
+        x, y = np.concatenate((x[kept], new_x)), np.concatenate((y[kept], new_y))
+        value, oid = np.concatenate((value[kept], new_value)), np.concatenate((oid[kept], new_oid))
+
+        state, touched, new_events = event_state.incremental_events(network, state, oid, x, y, value, 10.0)
+        assert touched is not None and 0 < len(touched) < len(network)
+        events = apply_edit(events, touched, new_events)
+
+        full = lr_engine.condition_events(network, x, y, value, 10.0, sequence=oid)
+        assert as_rows(events) == as_rows(full)
+
+
+def test_changed_routes_rebuild_everything():
+    rng = np.random.default_rng(2)
+    network = random_network(rng)
+    x, y, value = random_nodes(rng, network, 40)
+    oid = np.arange(1, 41)
+    state = event_state.incremental_events(network, None, oid, x, y, value, 10.0)[0]
+
+    moved = lr_engine.RouteNetwork(network.route_ids, network.offsets, network.x + 1.0, network.y, network.m)
+    _, touched, events = event_state.incremental_events(moved, state, oid, x, y, value, 10.0)
+    assert touched is None
+    assert as_rows(events) == as_rows(lr_engine.condition_events(moved, x, y, value, 10.0, sequence=oid))
+
+
+def test_changed_parameters_rebuild_everything(tmp_path):
+    network = lr_engine.RouteNetwork(np.array(["R1"]), np.array([0, 2]), np.array([0.0, 100.0]),
+                                     np.array([0.0, 0.0]))
+    # The node at 15 units from the route is only found with the larger search distance
+    oid = np.array([1, 2])
+    x, y, value = np.array([20.0, 60.0]), np.array([1.0, 15.0]), np.array(["Good", "Poor"])
+    state, _, _ = event_state.incremental_events(network, None, oid, x, y, value, 10.0, condition_field="COND")
+    state.save(str(tmp_path / "state.npz"))
+    state = event_state.NodeState.load(str(tmp_path / "state.npz"))
+    assert (state.search_distance, state.condition_field) == (10.0, "COND")
+    _, touched, _ = event_state.incremental_events(network, state, oid, x, y, value, 10.0, condition_field="COND")
+    assert touched.tolist() == []
+
+    state, touched, events = event_state.incremental_events(network, state, oid, x, y, value, 20.0,
+                                                            condition_field="COND")
+    full = lr_engine.condition_events(network, x, y, value, 20.0, sequence=oid)
+    assert touched is None and len(events["RID"]) == 3
+    assert as_rows(events) == as_rows(full)
+
+    _, touched, _ = event_state.incremental_events(network, state, oid, x, y, value, 20.0,
+                                                   condition_field="OTHER_COND")
+    assert touched is None
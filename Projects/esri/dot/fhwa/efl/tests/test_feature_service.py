@@ -0,0 +1,276 @@
+# #############
+"""
+Source Name: test_feature_service.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the feature service client against a small mock of the query protocol served by http.server: paging,
+resuming an interrupted download from its checkpoint and incremental pulls by edit date. The output feature
+class is a fake arcpy table kept in memory.
+"""
+
+import datetime
+import json
+import sys
+import threading
+import types
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+import pytest
+
+import feature_service
+
+
+EPOCH = datetime.datetime(1970, 1, 1)
+FIRST_EDIT = 1600000000000
+
+
+class MockLayer(object):
+    """
+    Point features of one layer, editable by the tests, and the ObjectIDs asked for by every query; on_query is
+    called with the ObjectIDs of every page query before it is answered.
+    """
+
+    def __init__(self, count, page_size):
+        self.features = {}
+        self.info = {"objectIdField": "OBJECTID", "geometryType": "esriGeometryPoint", "maxRecordCount": page_size,
+                     "extent": {"spatialReference": {"wkid": 26913}},
+                     "editFieldsInfo": {"editDateField": "EditDate"},
+                     "fields": [{"name": "OBJECTID", "type": "esriFieldTypeOID"},
+                                {"name": "FAULT", "type": "esriFieldTypeString", "length": 20},
+                                {"name": "EditDate", "type": "esriFieldTypeDate"},
+                                {"name": "V", "type": "esriFieldTypeDouble"}]}
+        self.queries = []
+        self.on_query = None
+        for oid in range(1, count + 1):
+            self.edit(oid, oid * 0.5, FIRST_EDIT + oid * 1000)
+
+    def edit(self, oid, value, edit_date):
+        self.features[oid] = {"attributes": {"OBJECTID": oid, "FAULT": "F{0}".format(oid // 10), "EditDate": edit_date,
+                                             "V": value},
+                              "geometry": {"x": float(oid), "y": float(-oid)}}
+
+    def respond(self, path, params):
+        if not path.endswith("/query"):
+            return self.info
+        if "outStatistics" in params:
+            statistic = json.loads(params["outStatistics"])[0]
+            latest = max(feature["attributes"][statistic["onStatisticField"]] for feature in self.features.values())
+            return {"features": [{"attributes": {statistic["outStatisticFieldName"]: latest}}]}
+        if params.get("returnIdsOnly") == "true":
+            ids = sorted(self.features)
+            if "timestamp '" in params["where"]:
+                since = datetime.datetime.strptime(params["where"].split("timestamp '")[1][:19], "%Y-%m-%d %H:%M:%S")
+                milliseconds = (since - EPOCH).total_seconds() * 1000
+                ids = [oid for oid in ids if self.features[oid]["attributes"]["EditDate"] > milliseconds]
+            return {"objectIds": ids}
+        ids = [int(oid) for oid in params["objectIds"].split(",") if oid]
+        self.queries.append(ids)
+        if self.on_query is not None:
+            self.on_query(ids)
+        return {"features": [self.features[oid] for oid in ids if oid in self.features]}
+
+
+@pytest.fixture
+def service():
+    """A mock layer served on a local port; yields (layer URL, MockLayer)."""
+    layer = MockLayer(count=95, page_size=10)
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def do_POST(self):
+            params = dict(urllib.parse.parse_qsl(self.rfile.read(int(self.headers["Content-Length"])).decode()))
+            body = json.dumps(layer.respond(self.path, params)).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}/arcgis/rest/services/LEC/FeatureServer/0".format(server.server_port), layer
+    server.shutdown()
+    server.server_close()
+
+
+class FakeCursor(object):
+    def __init__(self, tables, table, fields):
+        self.tables, self.table, self.fields = tables, table, fields
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.tables[self.table]["rows"] = [row for row in self.tables[self.table]["rows"] if not row.get("deleted")]
+        return False
+
+    def insertRow(self, row):
+        self.tables.inserted += 1
+        if self.tables.inserted == self.tables.fail_at:
+            raise RuntimeError("Connection to the output geodatabase lost")
+        self.tables[self.table]["rows"].append(dict(zip(self.fields, row)))
+
+    def __iter__(self):
+        for row in self.tables[self.table]["rows"]:
+            self.current = row
+            yield [row[field] for field in self.fields]
+
+    def deleteRow(self):
+        self.current["deleted"] = True
+
+
+class FakeTables(dict):
+    """Feature classes as lists of row dicts; insertRow fails once when the fail_at-th row is inserted."""
+    inserted = 0
+    fail_at = None
+
+
+@pytest.fixture
+def fake_arcpy(monkeypatch):
+    tables = FakeTables()
+    arcpy = types.ModuleType("arcpy")
+    arcpy.Exists = lambda path: path in tables
+    arcpy.Delete_management = lambda path: tables.pop(path)
+    arcpy.CreateFeatureclass_management = lambda workspace, name, geometry_type, spatial_reference=None: \
+        tables.__setitem__(workspace + "/" + name, {"rows": []})
+    arcpy.AddField_management = lambda *args, **kwargs: None
+    arcpy.SpatialReference = lambda wkid: wkid
+    arcpy.AddMessage = lambda text: None
+    arcpy.da = types.SimpleNamespace(InsertCursor=lambda table, fields: FakeCursor(tables, table, fields),
+                                     UpdateCursor=lambda table, fields: FakeCursor(tables, table, fields))
+    monkeypatch.setitem(sys.modules, "arcpy", arcpy)
+    return tables
+
+
+def rows_by_oid(table):
+    return {row[feature_service.SOURCE_OID_FIELD]: row for row in table["rows"]}
+
+
+def test_pages_are_yielded_in_order(service):
+    url, layer = service
+    client = feature_service.FeatureServiceLayer(url)
+    try:
+        object_ids = client.object_ids()
+        pages = list(feature_service.iter_pages(client, object_ids, workers=3, max_in_flight=2))
+    finally:
+        client.close()
+    assert [page for page, _ in pages] == list(range(10))
+    assert [len(features) for _, features in pages] == [10] * 9 + [5]
+    oids = [feature["attributes"]["OBJECTID"] for _, features in pages for feature in features]
+    assert oids == list(range(1, 96))
+    # Every page was asked for once, by its ObjectIDs
+    assert sorted(map(tuple, layer.queries)) == [tuple(range(start, min(start + 10, 96)))
+                                                 for start in range(1, 96, 10)]
+
+
+def test_load_points_fills_arrays_from_pages(service):
+    url, _ = service
+    x, y, attributes = feature_service.load_points(url, ["OID@", "V"], where="1=1", workers=2)
+    np.testing.assert_array_equal(attributes["OID@"], np.arange(1, 96))
+    np.testing.assert_array_equal(x, np.arange(1, 96))
+    np.testing.assert_array_equal(y, -np.arange(1, 96))
+    np.testing.assert_allclose(attributes["V"], np.arange(1, 96) * 0.5)
+
+
+def test_load_points_needs_a_wkid_to_project_to(service):
+    url, layer = service
+    utm = types.SimpleNamespace(factoryCode=26913, name="NAD_1983_UTM_Zone_13N")
+    x, _, _ = feature_service.load_points(url, ["OID@"], spatial_reference=utm)
+    assert len(x) == 95
+
+    # Routes in a custom spatial reference: the service cannot return the points in it
+    layer.queries = []
+    custom = types.SimpleNamespace(factoryCode=0, name="Custom_Transverse_Mercator")
+    with pytest.raises(ValueError, match="Custom_Transverse_Mercator"):
+        feature_service.load_points(url, ["OID@"], spatial_reference=custom)
+    assert layer.queries == []
+
+
+def test_interrupted_download_resumes_from_checkpoint(service, fake_arcpy, tmp_path):
+    url, layer = service
+    out_fc = str(tmp_path / "LEC.gdb") + "/LEC_nodes"
+    fake_arcpy.fail_at = 45
+
+    with pytest.raises(RuntimeError):
+        feature_service.download(url, out_fc, workers=2)
+    with open(feature_service.state_path(out_fc)) as state_file:
+        state = json.load(state_file)
+    assert state["pending"] and state["pages_done"] == 4
+
+    layer.queries = []
+    feature_service.download(url, out_fc, workers=2)
+    rows = rows_by_oid(fake_arcpy[out_fc])
+    assert len(fake_arcpy[out_fc]["rows"]) == 95
+    assert sorted(rows) == list(range(1, 96))
+    assert rows[42]["SHAPE@XY"] == (42.0, -42.0) and rows[42]["V"] == 21.0
+    # Only the page that failed and the pages after it were downloaded again
+    assert sorted(oid for ids in layer.queries for oid in ids) == list(range(41, 96))
+
+
+def test_incremental_download_pulls_only_edits(service, fake_arcpy, tmp_path):
+    url, layer = service
+    out_fc = str(tmp_path / "LEC.gdb") + "/LEC_nodes"
+    feature_service.download(url, out_fc, workers=2)
+
+    latest = max(feature["attributes"]["EditDate"] for feature in layer.features.values())
+    layer.edit(7, 100.0, latest + 5000)
+    layer.edit(60, 200.0, latest + 6000)
+    layer.edit(96, 300.0, latest + 7000)
+    del layer.features[12], layer.features[13]
+    layer.queries = []
+
+    feature_service.download(url, out_fc, workers=2)
+    assert sorted(oid for ids in layer.queries for oid in ids) == [7, 60, 96]
+    rows = rows_by_oid(fake_arcpy[out_fc])
+    assert len(fake_arcpy[out_fc]["rows"]) == len(layer.features)
+    assert sorted(rows) == sorted(layer.features)
+    assert (rows[7]["V"], rows[60]["V"], rows[96]["V"]) == (100.0, 200.0, 300.0)
+
+    # Nothing edited since: nothing is downloaded
+    layer.queries = []
+    feature_service.download(url, out_fc, workers=2)
+    assert layer.queries == []
+    assert len(fake_arcpy[out_fc]["rows"]) == len(layer.features)
+
+
+def test_edits_made_during_a_pull_are_pulled_next_time(service, fake_arcpy, tmp_path):
+    url, layer = service
+    out_fc = str(tmp_path / "LEC.gdb") + "/LEC_nodes"
+    latest = max(feature["attributes"]["EditDate"] for feature in layer.features.values())
+
+    def edit_during_pull(ids):
+        # Feature 5 was on the first page; it is edited before the last page, which holds a later edit
+        if 91 in ids:
+            layer.edit(5, 500.0, latest + 1000)
+            layer.edit(95, 950.0, latest + 2000)
+
+    layer.on_query = edit_during_pull
+    feature_service.download(url, out_fc, workers=1)
+    assert rows_by_oid(fake_arcpy[out_fc])[5]["V"] == 2.5
+
+    layer.on_query = None
+    layer.queries = []
+    feature_service.download(url, out_fc, workers=1)
+    assert sorted(oid for ids in layer.queries for oid in ids) == [5, 95]
+    rows = rows_by_oid(fake_arcpy[out_fc])
+    assert (rows[5]["V"], rows[95]["V"]) == (500.0, 950.0)
+    assert len(fake_arcpy[out_fc]["rows"]) == 95
+
+
+def test_service_errors_are_raised(service):
+    url, layer = service
+    layer.respond = lambda path, params: {"error": {"code": 400, "message": "Invalid query"}}
+    client = feature_service.FeatureServiceLayer(url)
+    try:
+        with pytest.raises(feature_service.FeatureServiceError):
+            client.object_ids()
+    finally:
+        client.close()
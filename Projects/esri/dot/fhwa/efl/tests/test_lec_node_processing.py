@@ -0,0 +1,66 @@
+# #############
+"""
+Source Name: test_lec_node_processing.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the LEC tool's entry point against a fake arcpy: the optional route engine calibrates the routes
+into the workspace before the events are located on them.
+"""
+
+import os
+import sys
+import types
+
+import pytest
+
+
+ARGUMENTS = ["C:\\work\\LEC.gdb", "C:\\data\\LEC_Nodes", "FAULT_ID", "C:\\data\\Roads", "ROUTE_ID", "15", False,
+             "", "", ""]
+
+
+@pytest.fixture
+def lec(monkeypatch):
+    """lec_node_processing under a fake arcpy; yields (module, list of calls to the engines)."""
+    arcpy = types.ModuleType("arcpy")
+    arcpy.AddMessage = lambda message: None
+    arcpy.GetCount_management = lambda dataset: types.SimpleNamespace(getOutput=lambda index: "3")
+    monkeypatch.setitem(sys.modules, "arcpy", arcpy)
+    import lec_node_processing
+    monkeypatch.setattr(lec_node_processing, "arcpy", arcpy)
+
+    calls = []
+    monkeypatch.setattr(lec_node_processing, "convert_routes_to_lr",
+                        lambda routes_fc, routes_id_field, out_fc, engine: calls.append(
+                            ("routes", routes_fc, out_fc, engine)) or out_fc)
+    monkeypatch.setattr(lec_node_processing, "convert_lec_nodes_to_line_events",
+                        lambda workspace_gdb, lec_nodes_fc, lec_fault_id_field, routes_fc, *args: calls.append(
+                            ("ARCPY", routes_fc)))
+    monkeypatch.setattr(lec_node_processing, "convert_lec_nodes_to_line_events_inmemory",
+                        lambda workspace_gdb, lec_nodes_fc, lec_fault_id_field, routes_fc, *args: calls.append(
+                            ("IN_MEMORY", routes_fc)))
+    yield lec_node_processing, calls
+
+
+def run(lec_node_processing, arguments):
+    arcpy = lec_node_processing.arcpy
+    arcpy.GetArgumentCount = lambda: len(arguments)
+    arcpy.GetParameterAsText = lambda index: str(arguments[index])
+    arcpy.GetParameter = lambda index: arguments[index]
+    lec_node_processing.main()
+
+
+@pytest.mark.parametrize("engine", ["ARCPY", "IN_MEMORY"])
+@pytest.mark.parametrize("route_engine", ["ARCPY", "CACHED"])
+def test_route_engine_calibrates_the_routes_of_the_events(lec, engine, route_engine):
+    lec_node_processing, calls = lec
+    run(lec_node_processing, ARGUMENTS[:7] + [engine, "", "", route_engine])
+    lec_routes_fc = os.path.join("C:\\work\\LEC.gdb", "LEC_Routes")
+    assert calls == [("routes", "C:\\data\\Roads", lec_routes_fc, route_engine), (engine, lec_routes_fc)]
+
+
+@pytest.mark.parametrize("arguments", [ARGUMENTS, ARGUMENTS + [""]])
+def test_routes_are_used_as_they_are_without_a_route_engine(lec, arguments):
+    lec_node_processing, calls = lec
+    run(lec_node_processing, arguments)
+    assert calls == [("ARCPY", "C:\\data\\Roads")]
@@ -0,0 +1,280 @@
+# #############
+"""
+Source Name: test_lr_engine.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the in-memory linear referencing engine: locating nodes, survey direction of the condition events,
+event geometry and the bulk event writer.
+"""
+
+import re
+import struct
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import lr_engine
+
+
+def straight_network(route_ids=("A",), length=1000.0, reverse=(False,)):
+    """Horizontal routes of the given length, one every 100 units up; reversed routes run from right to left."""
+    x, y, offsets = [], [], [0]
+    for index, backwards in enumerate(reverse):
+        route_x = np.linspace(0.0, length, 11)
+        x.append(route_x[::-1] if backwards else route_x)
+        y.append(np.full(11, 100.0 * index))
+        offsets.append(offsets[-1] + 11)
+    return lr_engine.RouteNetwork(np.array(route_ids), offsets, np.concatenate(x), np.concatenate(y))
+
+
+def brute_force_locate(network, px, py, radius):
+    points = np.repeat(np.arange(len(px)), len(network.segment_start))
+    segments = np.tile(np.arange(len(network.segment_start)), len(px))
+    distance, measure, _ = network.project(px, py, points, segments)
+    route = np.full(len(px), -1)
+    best_measure = np.full(len(px), np.nan)
+    for point in range(len(px)):
+        mine = (points == point) & (distance <= radius)
+        if mine.any():
+            best = np.flatnonzero(mine)[np.argmin(distance[mine])]
+            route[point] = network.segment_route[segments[best]]
+            best_measure[point] = measure[best]
+    return route, best_measure
+
+
+def test_candidates_with_a_large_radius_are_capped_and_complete():
+    rng = np.random.default_rng(3)
+    offsets = np.arange(0, 401, 20)
+    x = np.cumsum(rng.normal(0.0, 5.0, 400)) + np.repeat(rng.uniform(0, 500, 20), 20)
+    y = np.cumsum(rng.normal(0.0, 5.0, 400)) + np.repeat(rng.uniform(0, 500, 20), 20)
+    network = lr_engine.RouteNetwork(np.arange(20), offsets, x, y, cell_size=2.0)
+    px, py = rng.uniform(0, 500, 200), rng.uniform(0, 500, 200)
+
+    radius = 150.0
+    route, measure, _ = network.locate(px, py, radius)
+    expected_route, expected_measure = brute_force_locate(network, px, py, radius)
+    np.testing.assert_array_equal(route, expected_route)
+    np.testing.assert_allclose(measure, expected_measure)
+    # The search ran on a coarser grid of radius / MAX_RINGS cells, not over 75 rings of 2-unit cells
+    assert radius / lr_engine.MAX_RINGS in network._grids
+
+
+def test_forward_route_default_stretch_is_at_the_start():
+    network = straight_network()
+    events = lr_engine.condition_events(network, [200.0, 500.0, 800.0], [1.0, 1.0, 1.0], ["Good", "Fair", "Poor"],
+                                        5.0, sequence=[1, 2, 3])
+    assert events["FMEAS"].tolist() == [0.0, 200.0, 500.0, 800.0]
+    assert events["TMEAS"].tolist() == [200.0, 500.0, 800.0, 1000.0]
+    assert events["VALUE"].tolist() == ["Excellent", "Good", "Fair", "Poor"]
+
+
+def test_route_surveyed_against_its_measures():
+    network = straight_network()
+    # Collected from the high-measure end: each node rates the stretch towards the lower measures
+    events = lr_engine.condition_events(network, [800.0, 500.0, 200.0], [1.0, 1.0, 1.0], ["Good", "Fair", "Poor"],
+                                        5.0, sequence=[1, 2, 3])
+    assert events["FMEAS"].tolist() == [0.0, 200.0, 500.0, 800.0]
+    assert events["TMEAS"].tolist() == [200.0, 500.0, 800.0, 1000.0]
+    assert events["VALUE"].tolist() == ["Poor", "Fair", "Good", "Excellent"]
+
+
+def test_survey_direction_does_not_depend_on_the_digitized_direction():
+    forward = straight_network()
+    backward = straight_network(reverse=(True,))
+    node_x = np.array([200.0, 500.0, 800.0])
+    values = ["Good", "Fair", "Poor"]
+    # The same walk from x=0 to x=1000 gives the same stretches, whichever way the route was digitized
+    ahead = lr_engine.condition_events(forward, node_x, np.ones(3), values, 5.0, sequence=[1, 2, 3])
+    behind = lr_engine.condition_events(backward, node_x, np.ones(3), values, 5.0, sequence=[1, 2, 3])
+    for events, route_measure in ((ahead, lambda m: m), (behind, lambda m: 1000.0 - m)):
+        stretches = sorted(zip(np.minimum(route_measure(events["FMEAS"]), route_measure(events["TMEAS"])).tolist(),
+                               events["VALUE"].tolist()))
+        assert stretches == [(0.0, "Excellent"), (200.0, "Good"), (500.0, "Fair"), (800.0, "Poor")]
+
+
+def test_direction_is_taken_per_route():
+    network = straight_network(("A", "B"), reverse=(False, False))
+    node_x = [200.0, 800.0, 700.0, 300.0]
+    node_y = [0.0, 0.0, 100.0, 100.0]
+    events = lr_engine.condition_events(network, node_x, node_y, ["Good", "Fair", "Poor", "Good"], 5.0,
+                                        sequence=[1, 2, 3, 4])
+    route_b = events["RID"] == "B"
+    assert events["FMEAS"][~route_b].tolist() == [0.0, 200.0, 800.0]
+    assert events["VALUE"][~route_b].tolist() == ["Excellent", "Good", "Fair"]
+    assert events["FMEAS"][route_b].tolist() == [0.0, 300.0, 700.0]
+    assert events["TMEAS"][route_b].tolist() == [300.0, 700.0, 1000.0]
+    assert events["VALUE"][route_b].tolist() == ["Good", "Poor", "Excellent"]
+
+
+def test_without_sequence_events_follow_the_measures():
+    network = straight_network()
+    events = lr_engine.condition_events(network, [800.0, 200.0], [0.0, 0.0], ["Poor", "Good"], 5.0)
+    assert events["VALUE"].tolist() == ["Excellent", "Good", "Poor"]
+
+
+def test_slices_match_slice():
+    rng = np.random.default_rng(5)
+    network = lr_engine.RouteNetwork(np.array(["A", "B"]), [0, 30, 50], rng.uniform(0, 100, 50),
+                                     rng.uniform(0, 100, 50), np.concatenate((np.linspace(0, 300, 30),
+                                                                              np.linspace(200, 0, 20))))
+    route = np.array([0, 0, 1, 1, 0])
+    from_measure = np.array([10.0, 250.0, 0.0, 150.0, 42.0])
+    to_measure = np.array([120.0, 35.0, 200.0, 155.0, 42.5])
+    offsets, x, y, m = network.slices(route, from_measure, to_measure)
+    for event in range(len(route)):
+        expected = network.slice(route[event], from_measure[event], to_measure[event])
+        part = slice(offsets[event], offsets[event + 1])
+        for actual, wanted in zip((x[part], y[part], m[part]), expected):
+            np.testing.assert_allclose(actual, wanted)
+
+
+def test_line_event_of_a_fault_with_an_unmatched_node():
+    network = straight_network(("A", "B"), reverse=(False, False))
+    group = np.array(["F1", "F1", "F2", "F2", "F3", "F3"])
+    # The end node of F1, both nodes of F2 and the start node of F3 are not within the search radius of a route
+    route = np.array([0, -1, -1, -1, -1, 1])
+    measure = np.array([250.0, np.nan, np.nan, np.nan, np.nan, 600.0])
+    distance = np.array([3.0, np.nan, np.nan, np.nan, np.nan, 1.5])
+    events = lr_engine.line_events(network, group, route, measure, distance)
+    # A fault with one located node is a zero-length event at it; a fault with none is left out
+    assert events["GROUP"].tolist() == ["F1", "F3"]
+    assert events["RID"].tolist() == ["A", "B"]
+    assert events["FMEAS"].tolist() == events["TMEAS"].tolist() == [250.0, 600.0]
+    assert events["NODES"].tolist() == [1, 1]
+    assert events["DISTANCE"].tolist() == [3.0, 1.5]
+
+
+def test_line_event_of_a_repeated_fault_id():
+    network = straight_network(("A", "B"), reverse=(False, False))
+    group = np.array(["F1", "F2", "F1", "F2", "F1", "F2", "F3", "F3"])
+    route = np.array([0, 1, 0, 0, 0, 1, 0, 1])
+    measure = np.array([100.0, 40.0, 500.0, 900.0, 300.0, 80.0, 10.0, 20.0])
+    distance = np.array([1.0, 2.0, 4.0, 0.5, 2.0, 3.0, 6.0, 2.0])
+    events = lr_engine.line_events(network, group, route, measure, distance)
+
+    assert events["GROUP"].tolist() == ["F1", "F2", "F3"]
+    # Every node of a fault counts: F1 spans all three of its nodes, F2 is on the route most of its nodes are on
+    # and F3, with one node on either route, is on the route of the nearer node
+    assert events["RID"].tolist() == ["A", "B", "B"]
+    assert events["FMEAS"].tolist() == [100.0, 40.0, 20.0]
+    assert events["TMEAS"].tolist() == [500.0, 80.0, 20.0]
+    assert events["NODES"].tolist() == [3, 2, 1]
+    assert events["DISTANCE"].tolist() == [4.0, 3.0, 2.0]
+
+
+def test_line_event_of_nodes_in_reverse_measure_order():
+    network = straight_network(("A",), reverse=(True,))
+    # The start node of the fault snaps at a higher measure than its end node
+    events = lr_engine.line_events(network, np.array(["F1", "F1"]), np.array([0, 0]), np.array([700.0, 200.0]),
+                                   np.array([1.0, 1.0]))
+    assert events["FMEAS"].tolist() == [200.0] and events["TMEAS"].tolist() == [700.0]
+
+
+def test_line_events_without_located_nodes():
+    events = lr_engine.line_events(straight_network(), np.array(["F1"]), np.array([-1]), np.array([np.nan]),
+                                   np.array([np.nan]))
+    assert all(len(column) == 0 for column in events.values())
+
+
+class FakeInsertCursor(object):
+    def __init__(self, store, table, fields):
+        self.store, self.table, self.fields = store, table, fields
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def insertRow(self, row):
+        self.store.setdefault(self.table, []).append(dict(zip(self.fields, row)))
+
+
+class FakeResult(object):
+    def __init__(self, value):
+        self.value = value
+
+    def getOutput(self, index):
+        return self.value
+
+
+@pytest.fixture
+def fake_arcpy(monkeypatch):
+    """
+    An arcpy stand-in keeping tables as lists of row dicts: rows written through InsertCursor,
+    NumPyArrayToTable and Append, and deleted through a table view with an "RID IN (...)" where clause.
+    """
+    store = {}
+    views = {}
+
+    def make_table_view(table, name, where):
+        literals = re.findall(r"'((?:[^']|'')*)'", where.split(" IN ", 1)[1])
+        views[name] = table, {literal.replace("''", "'") for literal in literals}
+        store.setdefault("where clauses", []).append(where)
+        return FakeResult(name)
+
+    def view_rows(name):
+        table, route_ids = views[name]
+        return [row for row in store[table] if row["RID"] in route_ids]
+
+    def delete_rows(name):
+        table = views[name][0]
+        store[table] = [row for row in store[table] if row not in view_rows(name)]
+
+    def delete(name):
+        return views.pop(name) if name in views else store.pop(name)
+
+    arcpy = types.ModuleType("arcpy")
+    arcpy.AddFieldDelimiters = lambda table, field: '"{0}"'.format(field)
+    arcpy.da = types.SimpleNamespace(
+        InsertCursor=lambda table, fields: FakeInsertCursor(store, table, fields),
+        NumPyArrayToTable=lambda array, table: store.__setitem__(table, [dict(zip(array.dtype.names, row))
+                                                                         for row in array.tolist()]))
+    arcpy.management = types.SimpleNamespace(
+        Append=lambda source, target, schema_type: store.setdefault(target, []).extend(store[source]),
+        MakeTableView=make_table_view,
+        GetCount=lambda name: FakeResult(str(len(view_rows(name)))),
+        DeleteRows=delete_rows,
+        Delete=delete)
+    monkeypatch.setitem(sys.modules, "arcpy", arcpy)
+    return store
+
+
+def decode_linestring_m(wkb):
+    byte_order, geometry_type, count = struct.unpack_from("<BII", wkb)
+    assert (byte_order, geometry_type) == (1, 2002)
+    return np.frombuffer(wkb, "<f8", count * 3, 9).reshape(count, 3)
+
+
+def test_append_events_writes_sliced_geometry(fake_arcpy):
+    network = straight_network(("A", "B"), reverse=(False, True))
+    columns = {"RID": np.array(["A", "B"]), "FMEAS": np.array([50.0, 0.0]), "TMEAS": np.array([250.0, 1000.0]),
+               "VALUE": np.array(["Good", "Poor"], dtype=object)}
+    lr_engine.append_events(network, columns, "events", {"VALUE": "CONDITION"})
+
+    rows = fake_arcpy["events"]
+    assert [row["CONDITION"] for row in rows] == ["Good", "Poor"]
+    assert [row["RID"] for row in rows] == ["A", "B"]
+    for row, route, low, high in zip(rows, (0, 1), (50.0, 0.0), (250.0, 1000.0)):
+        vertices = decode_linestring_m(row["SHAPE@WKB"])
+        for actual, expected in zip(vertices.T, network.slice(route, low, high)):
+            np.testing.assert_allclose(actual, expected)
+
+
+def test_append_events_without_geometry_appends_in_one_call(fake_arcpy):
+    columns = {"RID": np.array(["A", "B"]), "FMEAS": np.array([0.0, 10.0]), "TMEAS": np.array([5.0, 20.0])}
+    lr_engine.append_events(None, columns, "event_table", {"RID": "ROUTE"})
+    assert fake_arcpy == {"event_table": [{"ROUTE": "A", "FMEAS": 0.0, "TMEAS": 5.0},
+                                          {"ROUTE": "B", "FMEAS": 10.0, "TMEAS": 20.0}]}
+
+
+def test_delete_route_events_uses_one_where_clause_per_batch(fake_arcpy, monkeypatch):
+    monkeypatch.setattr(lr_engine, "WHERE_BATCH_SIZE", 2)
+    fake_arcpy["event_table"] = [{"RID": rid, "FMEAS": 0.0} for rid in ["A", "B", "B", "C", "O'Neil", "D"]]
+    deleted = lr_engine.delete_route_events("event_table", "RID", np.array(["B", "O'Neil", "C", "B"]))
+    assert deleted == 4
+    assert [row["RID"] for row in fake_arcpy["event_table"]] == ["A", "D"]
+    assert fake_arcpy["where clauses"] == ["\"RID\" IN ('B', 'C')", "\"RID\" IN ('O''Neil')"]
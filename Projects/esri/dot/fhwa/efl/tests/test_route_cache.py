@@ -0,0 +1,118 @@
+# #############
+"""
+Source Name: test_route_cache.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the calibrated route cache: reuse of unchanged routes, routes in a new or empty geodatabase, and,
+with ArcGIS Pro, a fixture comparison of the cached calibration with CreateRoutes.
+"""
+
+import os
+
+import numpy as np
+import pytest
+
+import esri_common  # puts Projects/esri/common on the import path
+import change_stamp
+import route_cache
+
+
+def route_parts():
+    """Route A of two parts with a gap, the second digitized backwards; route B of one part."""
+    x = np.array([0.0, 10.0, 20.0, 50.0, 40.0, 30.0, 0.0, 0.0])
+    y = np.array([0.0, 0.0, 0.0, 0.0, 0.0, 0.0, 100.0, 80.0])
+    return np.array(["A", "B"]), np.array([0, 0, 1]), np.array([0, 3, 6, 8]), x, y
+
+
+def test_measures_follow_create_routes_rules():
+    calibrated, changed, removed = route_cache.update(None, *route_parts(), routes_id_field="RID")
+    assert changed.tolist() == ["A", "B"] and removed.tolist() == []
+    network = calibrated.network()
+    np.testing.assert_allclose(network.m, [0.0, 10.0, 20.0, 20.0, 30.0, 40.0, 0.0, 20.0])
+    np.testing.assert_allclose(network.x, [0.0, 10.0, 20.0, 30.0, 40.0, 50.0, 0.0, 0.0])
+
+
+def test_unchanged_routes_keep_their_measures():
+    route_ids, part_route, part_offsets, x, y = route_parts()
+    previous, _, _ = route_cache.update(None, route_ids, part_route, part_offsets, x, y, "RID")
+    moved_y = y.copy()
+    moved_y[7] = 60.0
+    calibrated, changed, removed = route_cache.update(previous, route_ids, part_route, part_offsets, x, moved_y,
+                                                      "RID")
+    assert changed.tolist() == ["B"] and removed.tolist() == []
+    np.testing.assert_array_equal(calibrated.m[:6], previous.m[:6])
+    np.testing.assert_allclose(calibrated.m[6:], [0.0, 40.0])
+
+
+def test_routes_in_an_empty_geodatabase(tmp_path, monkeypatch):
+    gdb = tmp_path / "Routes.gdb"
+    gdb.mkdir()
+    routes_fc = str(gdb / "Routes")
+    assert change_stamp.dataset_stamp(routes_fc) is None
+    assert change_stamp.dataset_stamp(str(tmp_path / "Missing.gdb" / "Routes")) is None
+
+    reads = []
+    monkeypatch.setattr(route_cache, "read_parts", lambda *args: reads.append(args) or route_parts())
+    for _ in range(2):
+        calibrated, _, _ = route_cache.calibrate(routes_fc, "RID")
+        assert calibrated.route_ids.tolist() == ["A", "B"]
+    # Without a stamp the routes are read on every call
+    assert len(reads) == 2
+    assert os.path.isfile(route_cache.cache_path(routes_fc, "RID"))
+
+
+def test_cached_routes_are_used_while_the_geodatabase_is_unchanged(tmp_path, monkeypatch):
+    gdb = tmp_path / "Routes.gdb"
+    gdb.mkdir()
+    (gdb / "a00000001.gdbtable").write_bytes(b"routes")
+    (gdb / "a00000001.lock").write_bytes(b"")
+    routes_fc = str(gdb / "Routes")
+
+    reads = []
+    monkeypatch.setattr(route_cache, "read_parts", lambda *args: reads.append(args) or route_parts())
+    route_cache.calibrate(routes_fc, "RID")
+    # A reader's lock file does not change the stamp
+    (gdb / "a00000002.sr.lock").write_bytes(b"")
+    route_cache.calibrate(routes_fc, "RID")
+    assert len(reads) == 1
+    (gdb / "a00000001.gdbtable").write_bytes(b"edited routes")
+    route_cache.calibrate(routes_fc, "RID")
+    assert len(reads) == 2
+
+
+def test_cached_calibration_matches_create_routes(tmp_path):
+    arcpy = pytest.importorskip("arcpy")
+    import lec_node_processing
+
+    gdb = arcpy.management.CreateFileGDB(str(tmp_path), "routes.gdb").getOutput(0)
+    spatial_reference = arcpy.SpatialReference(26913)
+    routes_fc = arcpy.management.CreateFeatureclass(gdb, "lines", "POLYLINE",
+                                                    spatial_reference=spatial_reference).getOutput(0)
+    arcpy.management.AddField(routes_fc, "RID", "TEXT", field_length=10)
+    route_ids, part_route, part_offsets, x, y = route_parts()
+    rng = np.random.default_rng(7)
+    with arcpy.da.InsertCursor(routes_fc, ["SHAPE@", "RID"]) as cursor:
+        for part, route in enumerate(part_route):
+            start, stop = part_offsets[part], part_offsets[part + 1]
+            points = arcpy.Array([arcpy.Point(500000.0 + px * 10, 4000000.0 + py * 10)
+                                  for px, py in zip(x[start:stop], y[start:stop])])
+            cursor.insertRow([arcpy.Polyline(points, spatial_reference), str(route_ids[route])])
+        # Wiggly routes of several features each
+        for route in range(5):
+            for feature in range(3):
+                px = np.cumsum(rng.uniform(5, 50, 12)) + feature * 700.0
+                py = np.cumsum(rng.normal(0, 20, 12)) + route * 1000.0
+                if rng.random() < 0.5:
+                    px, py = px[::-1], py[::-1]
+                points = arcpy.Array([arcpy.Point(501000.0 + vx, 4001000.0 + vy) for vx, vy in zip(px, py)])
+                cursor.insertRow([arcpy.Polyline(points, spatial_reference), "W{0}".format(route)])
+
+    outputs = {}
+    for engine in ("ARCPY", "CACHED"):
+        out_fc = lec_node_processing.convert_routes_to_lr(routes_fc, "RID", os.path.join(gdb, engine), engine)
+        vertices = arcpy.da.FeatureClassToNumPyArray(out_fc, ["RID", "SHAPE@X", "SHAPE@Y", "SHAPE@M"],
+                                                     explode_to_points=True)
+        outputs[engine] = sorted((rid, round(vx, 3), round(vy, 3), round(vm, 3)) for rid, vx, vy, vm in
+                                 vertices.tolist())
+    assert outputs["CACHED"] == outputs["ARCPY"]
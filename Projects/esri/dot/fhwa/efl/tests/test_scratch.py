@@ -0,0 +1,138 @@
+# #############
+"""
+Source Name: test_scratch.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the scratch workspace and the output geodatabase of a run with a fake geoprocessing module: the
+intermediates are deleted on success and on error, and a failed run removes its geodatabase and the bulk
+outputs it wrote next to it.
+"""
+
+import os
+
+import pytest
+
+import bulk_output
+import scratch
+
+
+class FakeGeoprocessing(object):
+    """Datasets as a set of paths; file geodatabases are created as folders. Deletes are recorded in order."""
+
+    def __init__(self, product="ArcGISPro", failing=()):
+        self.product = product
+        self.failing = failing
+        self.datasets = set()
+        self.deleted = []
+        self.messages = []
+
+    def GetInstallInfo(self):
+        return {"ProductName": self.product}
+
+    def Exists(self, dataset):
+        return dataset in self.datasets
+
+    def Delete_management(self, dataset):
+        if dataset in self.failing:
+            raise RuntimeError("{0} is locked".format(dataset))
+        self.datasets.discard(dataset)
+        self.deleted.append(dataset)
+
+    def AddMessage(self, text):
+        self.messages.append(text)
+
+    def CreateFileGDB_management(self, workspace, name):
+        gdb = os.path.join(workspace, name + ".gdb")
+        os.mkdir(gdb)
+        self.datasets.add(gdb)
+        return FakeResult(gdb)
+
+    def ClearWorkspaceCache_management(self, gdb):
+        pass
+
+
+class FakeResult(object):
+    def __init__(self, output):
+        self.output = output
+
+    def getOutput(self, index):
+        return self.output
+
+
+def test_intermediates_are_deleted_newest_first():
+    gp = FakeGeoprocessing()
+    with scratch.ScratchWorkspace(gp=gp) as work:
+        nodes = work.path("work_nodes")
+        layer = work.layer("work_routes_lyr")
+        segments = work.path("work_segments")
+        gp.datasets.update([nodes, layer, segments])
+        assert nodes == os.path.join("memory", "work_nodes")
+    assert gp.deleted == [segments, layer, nodes]
+    assert not gp.datasets
+
+
+def test_in_memory_workspace_of_arcmap():
+    work = scratch.ScratchWorkspace(gp=FakeGeoprocessing(product="Desktop"))
+    assert work.path("work_nodes") == os.path.join("in_memory", "work_nodes")
+
+
+def test_kept_intermediates_lose_only_their_layers(tmp_path):
+    gp = FakeGeoprocessing()
+    keep_in = str(tmp_path / "Work.gdb")
+    with scratch.ScratchWorkspace(keep_in, gp) as work:
+        nodes = work.path("work_nodes")
+        layer = work.layer("work_routes_lyr")
+        gp.datasets.update([nodes, layer])
+    assert nodes == os.path.join(keep_in, "work_nodes")
+    assert gp.deleted == [layer] and gp.datasets == {nodes}
+
+
+def test_intermediates_are_deleted_when_the_tool_fails():
+    gp = FakeGeoprocessing(failing={"memory\\locked"})
+    with pytest.raises(ValueError, match="split failed"):
+        with scratch.ScratchWorkspace(gp=gp) as work:
+            nodes = work.path("work_nodes")
+            gp.datasets.update([nodes, "memory\\locked"])
+            work.items.append("memory\\locked")
+            raise ValueError("split failed")
+    # The tool's own error is raised, not the error of a delete
+    assert gp.deleted == [nodes]
+
+
+def test_delete_errors_are_raised_when_the_tool_succeeded():
+    gp = FakeGeoprocessing(failing={"memory\\locked"})
+    with pytest.raises(RuntimeError, match="locked"):
+        with scratch.ScratchWorkspace(gp=gp) as work:
+            gp.datasets.add("memory\\locked")
+            work.items.append("memory\\locked")
+
+
+def test_output_geodatabase_is_kept_on_success(tmp_path):
+    gp = FakeGeoprocessing()
+    with scratch.output_geodatabase(str(tmp_path), "Run_1", gp) as gdb:
+        gpkg, _, parquet = bulk_output.output_locations(gdb)
+        open(gpkg, "wb").close()
+        os.mkdir(parquet)
+    assert gdb == str(tmp_path / "Run_1.gdb")
+    assert gp.deleted == [] and os.path.isfile(gpkg) and os.path.isdir(parquet)
+
+
+def test_failed_run_removes_its_outputs(tmp_path):
+    gp = FakeGeoprocessing()
+    # A SQLite database of an earlier run with the same name is not touched
+    sqlite = str(tmp_path / "Run_1.sqlite")
+    open(sqlite, "wb").close()
+
+    with pytest.raises(RuntimeError, match="write failed"):
+        with scratch.output_geodatabase(str(tmp_path), "Run_1", gp) as gdb:
+            gpkg = bulk_output.output_path(gdb, "out_events", "GEOPACKAGE")
+            open(os.path.dirname(gpkg), "wb").close()
+            parquet = bulk_output.output_path(gdb, "out_events", "PARQUET")
+            os.mkdir(os.path.dirname(parquet))
+            open(parquet, "wb").close()
+            raise RuntimeError("write failed")
+
+    assert gp.deleted == [gdb]
+    assert not os.path.exists(os.path.dirname(gpkg)) and not os.path.exists(os.path.dirname(parquet))
+    assert os.path.isfile(sqlite)
@@ -0,0 +1,160 @@
+# #############
+"""
+Source Name: test_snapping.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the k-d tree snapping: the k nearest routes of every point against a brute-force search over every
+segment, and the choice of one candidate per point along sequences (route hints, chain breaks and the cost of
+moving along or between routes).
+"""
+
+import numpy as np
+
+import lr_engine
+import snapping
+
+
+def random_network(rng, routes=30, vertices=15):
+    """Random walks scattered over a 1000 x 1000 square, with segments of very different lengths."""
+    offsets = np.arange(0, routes * vertices + 1, vertices)
+    step = rng.choice([1.0, 10.0, 60.0], routes * vertices)
+    x = np.cumsum(rng.normal(0.0, 1.0, routes * vertices) * step) + np.repeat(rng.uniform(0, 1000, routes), vertices)
+    y = np.cumsum(rng.normal(0.0, 1.0, routes * vertices) * step) + np.repeat(rng.uniform(0, 1000, routes), vertices)
+    return lr_engine.RouteNetwork(np.array(["R{0}".format(route) for route in range(routes)]), offsets, x, y)
+
+
+def brute_force_snap(network, px, py, k, max_distance):
+    """(route, distance, measure) of the k nearest routes of every point, by projecting it on every segment."""
+    segments = np.arange(len(network.segment_start))
+    expected = []
+    for point in range(len(px)):
+        distance, measure, _ = network.project(px, py, np.full(len(segments), point), segments)
+        nearest = {}
+        for route, segment_distance, segment_measure in zip(network.segment_route[segments], distance, measure):
+            if segment_distance <= max_distance and (route not in nearest or segment_distance < nearest[route][0]):
+                nearest[route] = (segment_distance, segment_measure)
+        ranked = sorted((value[0], route, value[1]) for route, value in nearest.items())[:k]
+        expected.append([(route, distance, measure) for distance, route, measure in ranked])
+    return expected
+
+
+def parallel_network():
+    """Route A along y = 0 and route B along y = 10, both from x = 0 to x = 1000."""
+    return lr_engine.RouteNetwork(np.array(["A", "B"]), [0, 2, 4], [0.0, 1000.0, 0.0, 1000.0], [0.0, 0.0, 10.0, 10.0])
+
+
+def test_k_nearest_routes_match_brute_force():
+    rng = np.random.default_rng(5)
+    network = random_network(rng)
+    px, py = rng.uniform(-100, 1100, 300), rng.uniform(-100, 1100, 300)
+    for piece_length in (None, 5.0, 500.0):
+        index = snapping.SnapIndex(network, piece_length)
+        for k, max_distance in ((1, np.inf), (3, 80.0), (5, 250.0)):
+            candidates = index.snap(px, py, k=k, max_distance=max_distance, chunk_size=70)
+            expected = brute_force_snap(network, px, py, k, max_distance)
+            for point, nearest in enumerate(expected):
+                found = candidates.route[point] >= 0
+                assert candidates.route[point][found].tolist() == [route for route, _, _ in nearest]
+                np.testing.assert_allclose(candidates.distance[point][found], [value for _, value, _ in nearest])
+                np.testing.assert_allclose(candidates.measure[point][found], [value for _, _, value in nearest])
+                # Missing candidates come last
+                assert found.tolist() == sorted(found.tolist(), reverse=True)
+
+
+def test_nearest_candidate_matches_locate():
+    rng = np.random.default_rng(8)
+    network = random_network(rng)
+    px, py = rng.uniform(0, 1000, 200), rng.uniform(0, 1000, 200)
+    route, measure, distance = snapping.SnapIndex(network).snap(px, py, k=2, max_distance=40.0).nearest()
+    expected_route, expected_measure, expected_distance = network.locate(px, py, 40.0)
+    np.testing.assert_array_equal(route, expected_route)
+    np.testing.assert_allclose(measure, expected_measure)
+    np.testing.assert_allclose(distance, expected_distance)
+
+
+def test_direction_and_heading():
+    # Route C runs from right to left with increasing measures; route D decreases in measure to the north
+    network = lr_engine.RouteNetwork(np.array(["C", "D"]), [0, 2, 4], [100.0, 0.0, 500.0, 500.0],
+                                     [0.0, 0.0, 0.0, 100.0], m=[0.0, 100.0, 100.0, 0.0])
+    candidates = snapping.SnapIndex(network).snap([50.0, 505.0], [1.0, 50.0], k=1)
+    assert candidates.route[:, 0].tolist() == [0, 1]
+    assert candidates.direction[:, 0].tolist() == [1, -1]
+    np.testing.assert_allclose(candidates.heading[:, 0], [270.0, 180.0])
+
+
+def test_route_hint_wins_over_nearer_routes():
+    network = parallel_network()
+    px, py = np.array([100.0, 200.0, 300.0]), np.array([4.0, 4.0, 4.0])
+    candidates = snapping.SnapIndex(network).snap(px, py, k=2, max_distance=20.0)
+    # The second point records route B; an empty and an unknown route ID are ignored
+    route, measure, distance = snapping.snap_sequences(network, candidates, px, py, np.array([1, 2, 3]),
+                                                       route_hint=np.array(["", "B", "Z"]))
+    assert route.tolist() == [0, 1, 0]
+    np.testing.assert_allclose(measure, [100.0, 200.0, 300.0])
+    np.testing.assert_allclose(distance, [4.0, 6.0, 4.0])
+
+
+def test_sequence_stays_on_its_route():
+    network = parallel_network()
+    # The middle point is nearer route B, but its neighbours along the sequence are on route A
+    px, py = np.array([0.0, 100.0, 200.0]), np.array([4.0, 5.5, 4.0])
+    candidates = snapping.SnapIndex(network).snap(px, py, k=2, max_distance=20.0)
+    assert candidates.nearest()[0].tolist() == [0, 1, 0]
+    route, _, _ = snapping.snap_sequences(network, candidates, px, py, np.array(["F1"] * 3))
+    assert route.tolist() == [0, 0, 0]
+
+    # Alone in its own sequence, the middle point goes to its nearest route
+    route, _, _ = snapping.snap_sequences(network, candidates, px, py, np.array(["F1", "F2", "F1"]))
+    assert route.tolist() == [0, 1, 0]
+
+
+def test_points_are_visited_in_sequence_order():
+    network = parallel_network()
+    # Input order 0, 2, 1 along x: sorted by order, the point nearer B is between two points on A
+    px, py = np.array([0.0, 200.0, 100.0]), np.array([4.0, 4.0, 5.5])
+    candidates = snapping.SnapIndex(network).snap(px, py, k=2, max_distance=20.0)
+    route, measure, _ = snapping.snap_sequences(network, candidates, px, py, np.zeros(3), order=np.array([1, 3, 2]))
+    assert route.tolist() == [0, 0, 0]
+    # The results are in input order
+    np.testing.assert_allclose(measure, [0.0, 200.0, 100.0])
+
+
+def test_point_without_candidates_breaks_the_chain():
+    network = parallel_network()
+    # The middle point is out of reach; the points on either side of it are chosen independently
+    px, py = np.array([0.0, 500.0, 20.0]), np.array([4.0, 900.0, 5.5])
+    candidates = snapping.SnapIndex(network).snap(px, py, k=2, max_distance=20.0)
+    route, measure, distance = snapping.snap_sequences(network, candidates, px, py, np.zeros(3))
+    assert route.tolist() == [0, -1, 1]
+    assert np.isnan(measure[1]) and np.isnan(distance[1])
+    # Without the break, the last point would stay on route A with its first neighbour
+    keep = np.array([0, 2])
+    both = snapping.SnapIndex(network).snap(px[keep], py[keep], k=2, max_distance=20.0)
+    route, _, _ = snapping.snap_sequences(network, both, px[keep], py[keep], np.zeros(2))
+    assert route.tolist() == [0, 0]
+
+
+def test_transition_cost_follows_the_measures():
+    # Route B is nearer both points, but between them it makes a 500 unit detour to the north
+    b_x = [0.0, 50.0, 50.0, 100.0, 100.0, 150.0]
+    b_y = [5.0, 5.0, 500.0, 500.0, 5.0, 5.0]
+    network = lr_engine.RouteNetwork(np.array(["A", "B"]), [0, 2, 8], [0.0, 1000.0] + b_x, [0.0, 0.0] + b_y)
+    px, py = np.array([0.0, 100.0]), np.array([4.0, 4.0])
+    candidates = snapping.SnapIndex(network).snap(px, py, k=2, max_distance=20.0)
+    assert candidates.nearest()[0].tolist() == [1, 1]
+    # On B the measure changes by 1090 over a straight distance of 100; on A by 100
+    route, measure, _ = snapping.snap_sequences(network, candidates, px, py, np.zeros(2))
+    assert route.tolist() == [0, 0]
+    np.testing.assert_allclose(measure, [0.0, 100.0])
+
+
+def test_switch_penalty():
+    network = parallel_network()
+    px, py = np.array([0.0, 1.0]), np.array([3.0, 6.5])
+    candidates = snapping.SnapIndex(network).snap(px, py, k=2, max_distance=20.0)
+    # Switching route costs the straight distance of 1: cheaper than staying on either route
+    route, _, _ = snapping.snap_sequences(network, candidates, px, py, np.zeros(2))
+    assert route.tolist() == [0, 1]
+    route, _, _ = snapping.snap_sequences(network, candidates, px, py, np.zeros(2), switch_penalty=5.0)
+    assert route.tolist() == [0, 0]
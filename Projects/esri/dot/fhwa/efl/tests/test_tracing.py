@@ -0,0 +1,306 @@
+# #############
+"""
+Source Name: test_tracing.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Tests of the pipeline tracer with a fake backend: row counts, bytes written to the workspace and to bulk
+outputs next to it, the JSON and Chrome trace outputs, and the condition pipelines run through a fake
+geoprocessing module.
+"""
+
+import importlib.util
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+import pytest
+
+import lr_engine
+import tracing
+
+
+class FakeBackend(object):
+    """Row counts from a dict; messages are collected."""
+
+    def __init__(self, rows=None):
+        self.rows = rows or {}
+        self.messages = []
+
+    def count(self, dataset):
+        return self.rows[dataset]
+
+    def message(self, text):
+        self.messages.append(text)
+
+
+def write_bytes(path, size):
+    with open(str(path), "ab") as target:
+        target.write(b"x" * size)
+
+
+@pytest.fixture
+def workspace(tmp_path):
+    gdb = tmp_path / "Work.gdb"
+    gdb.mkdir()
+    write_bytes(gdb / "a0000001.gdbtable", 100)
+    return gdb
+
+
+def test_stage_counts_inputs_and_outputs(workspace):
+    backend = FakeBackend({"nodes": 10, "routes": 3, "events": 7})
+    tracer = tracing.Tracer(backend, str(workspace))
+    with tracer.stage("locate", inputs=["nodes", "routes"], outputs=["events"]) as stage:
+        assert stage.rows_in == 13
+        backend.rows["events"] = 8
+    assert (stage.rows_in, stage.rows_out) == (13, 8)
+    assert stage.wall_seconds >= 0 and stage.cpu_seconds >= 0
+    assert tracer.stages == [stage]
+
+
+def test_rows_set_by_the_step_are_kept(workspace):
+    tracer = tracing.Tracer(FakeBackend({"events": 99}), str(workspace))
+    with tracer.stage("write", outputs=["events"]) as stage:
+        stage.rows_out = 5
+    assert stage.rows_out == 5
+
+
+def test_failed_stage_is_recorded_without_output_counts(workspace):
+    tracer = tracing.Tracer(FakeBackend(), str(workspace))
+    with pytest.raises(RuntimeError):
+        with tracer.stage("split", outputs=["missing"]):
+            raise RuntimeError("tool failed")
+    assert [stage.name for stage in tracer.stages] == ["split"]
+    assert tracer.stages[0].rows_out is None
+
+
+def test_bytes_written_to_the_workspace(workspace):
+    tracer = tracing.Tracer(FakeBackend(), str(workspace))
+    with tracer.stage("copy") as stage:
+        write_bytes(workspace / "a0000002.gdbtable", 250)
+        write_bytes(workspace / "a0000001.gdbtable", 50)
+    assert stage.bytes_written == 300
+
+
+@pytest.mark.parametrize("output", [os.path.join("Work.gpkg", "out_events"), os.path.join("Work.sqlite", "events"),
+                                    os.path.join("Work_parquet", "out_events.parquet")])
+def test_bytes_written_to_bulk_outputs_next_to_the_workspace(workspace, tmp_path, output):
+    output = str(tmp_path / output)
+    # A Parquet output is its own file; a GeoPackage or SQLite table is stored in its database file
+    storage = output if output.endswith(".parquet") else os.path.dirname(output)
+    os.makedirs(os.path.dirname(storage), exist_ok=True)
+    tracer = tracing.Tracer(FakeBackend(), str(workspace))
+    with tracer.stage("write events", written=[output]) as stage:
+        write_bytes(storage, 4096)
+        write_bytes(workspace / "a0000003.gdbtable", 4)
+    assert stage.bytes_written == 4100
+
+    # Growth of an existing database only
+    with tracer.stage("write events", written=[output]) as stage:
+        write_bytes(storage, 1000)
+    assert stage.bytes_written == 1000
+
+
+def test_outputs_inside_the_workspace_are_measured_once(workspace):
+    tracer = tracing.Tracer(FakeBackend({str(workspace / "events"): 1}), str(workspace))
+    with tracer.stage("write", outputs=[str(workspace / "events")]) as stage:
+        write_bytes(workspace / "a0000004.gdbtable", 10)
+    assert stage.bytes_written == 10
+
+
+def test_memory_outputs_write_no_bytes(workspace):
+    tracer = tracing.Tracer(FakeBackend({"memory\\work": 4}), str(workspace))
+    with tracer.stage("copy", outputs=["memory\\work"]) as stage:
+        pass
+    assert stage.bytes_written == 0
+
+
+def test_python_memory_peak():
+    tracer = tracing.Tracer(FakeBackend(), python_memory=True)
+    with tracer.stage("arrays") as stage:
+        block = np.ones(1 << 20)
+        del block
+    assert stage.peak_python_bytes >= 8 << 20
+
+
+def test_summary_report_and_trace_files(workspace, tmp_path):
+    backend = FakeBackend()
+    tracer = tracing.Tracer(backend, str(workspace))
+    for name in ("load", "locate"):
+        with tracer.stage(name):
+            pass
+    tracer.stages[0].wall_seconds, tracer.stages[1].wall_seconds = 1.0, 3.0
+
+    assert tracer.summary() == "Total 4.00s: locate 3.00s (75%), load 1.00s (25%)"
+    tracer.report()
+    assert backend.messages == [tracer.summary()]
+
+    json_path, chrome_path = tracer.write(str(tmp_path / "run.json"))
+    with open(json_path) as trace_file:
+        stages = json.load(trace_file)
+    assert stages["total_seconds"] == 4.0
+    assert [stage["name"] for stage in stages["stages"]] == ["load", "locate"]
+    assert chrome_path == str(tmp_path / "run.trace.json")
+    with open(chrome_path) as trace_file:
+        events = json.load(trace_file)["traceEvents"]
+    assert [(event["name"], event["ph"], event["dur"]) for event in events] == [("load", "X", 1e6),
+                                                                               ("locate", "X", 3e6)]
+
+
+class FakeGeoprocessing(object):
+    """
+    Stand-in for arcpy. Every tool records its name and gives its output the rows of its first input, or of
+    rows_by_tool; the tools named in slow take that many seconds.
+    """
+
+    OUTPUT_ARGUMENTS = ("out_feature_class", "out_table", "out_layer", "Output_Feature_Class")
+    # Tools taking their output as the second positional argument
+    POSITIONAL_OUTPUT = ("CopyFeatures_management", "MakeFeatureLayer_management")
+    INPUT_ARGUMENTS = ("in_features", "target_features", "in_table", "Input_Features")
+
+    def __init__(self, rows, rows_by_tool=None, slow=None):
+        self.rows = dict(rows)
+        self.rows_by_tool = rows_by_tool or {}
+        self.slow = slow or {}
+        self.tools = []
+        self.messages = []
+        self.da = types.SimpleNamespace(UpdateCursor=self._update_cursor)
+
+    def __getattr__(self, name):
+        if not name.endswith(("_management", "_lr", "_analysis")):
+            raise AttributeError(name)
+
+        def tool(*args, **kwargs):
+            self.tools.append(name)
+            time.sleep(self.slow.get(name, 0.0))
+            if name == "CreateFileGDB_management":
+                output = os.path.join(args[0], args[1] + ".gdb")
+            else:
+                output = next((kwargs[key] for key in self.OUTPUT_ARGUMENTS if key in kwargs),
+                              args[1] if name in self.POSITIONAL_OUTPUT and len(args) > 1 else None)
+            source = next((kwargs[key] for key in self.INPUT_ARGUMENTS if key in kwargs), args[0] if args else None)
+            if output is not None:
+                self.rows[output] = self.rows_by_tool.get(name, self.rows.get(source, 0))
+            return types.SimpleNamespace(getOutput=lambda index: output)
+        return tool
+
+    def GetCount_management(self, dataset):
+        return types.SimpleNamespace(getOutput=lambda index: str(self.rows[dataset]))
+
+    def Exists(self, dataset):
+        return dataset in self.rows
+
+    def Delete_management(self, dataset):
+        self.tools.append("Delete_management")
+        del self.rows[dataset]
+
+    def AddMessage(self, text):
+        self.messages.append(text)
+
+    def GetInstallInfo(self):
+        return {"ProductName": "ArcGISPro"}
+
+    def _update_cursor(self, dataset, fields):
+        self.tools.append("UpdateCursor")
+        return FakeUpdateCursor([["Good"], ["Poor"]])
+
+
+class FakeUpdateCursor(object):
+    def __init__(self, rows):
+        self.rows = rows
+        self.updated = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def __iter__(self):
+        return iter(self.rows)
+
+    def updateRow(self, row):
+        self.updated.append(row)
+
+
+class GeoprocessingBackend(FakeBackend):
+    """Row counts from the datasets of a FakeGeoprocessing module, which the pipelines run their tools through."""
+
+    def __init__(self, gp):
+        FakeBackend.__init__(self, gp.rows)
+        self.gp = gp
+
+
+@pytest.fixture
+def condition_node_processing(monkeypatch):
+    """The condition tool module; a placeholder arcpy without any function stands in for a missing ArcGIS."""
+    if importlib.util.find_spec("arcpy") is None:
+        monkeypatch.setitem(sys.modules, "arcpy", types.ModuleType("arcpy"))
+    import condition_node_processing
+    return condition_node_processing
+
+
+def test_geoprocessing_pipeline_runs_through_the_backend(condition_node_processing, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    gp = FakeGeoprocessing({"nodes": 5, "routes": 2}, rows_by_tool={"SplitLineAtPoint_management": 7},
+                           slow={"SplitLineAtPoint_management": 0.2})
+    backend = GeoprocessingBackend(gp)
+    tracer = tracing.Tracer(backend)
+
+    out_fc = condition_node_processing.create_cond_events(str(tmp_path), "pavement", "nodes", "CONDITION", "routes",
+                                                          "ROUTE_ID", 10, True, tracer)
+
+    assert out_fc == os.path.join(tracer.workspace, "out_pavement_events")
+    assert [stage.name for stage in tracer.stages] == ["copy nodes", "select routes", "split", "spatial join",
+                                                       "default condition", "locate", "write events"]
+    rows = {stage.name: (stage.rows_in, stage.rows_out) for stage in tracer.stages}
+    assert rows["copy nodes"] == (5, 5) and rows["split"] == (7, 7) and rows["write events"] == (7, 7)
+    # The slow tool is the bottleneck of the summary, which is reported through the backend
+    assert tracer.summary().split(": ")[1].startswith("split")
+    assert backend.messages == [tracer.summary()]
+    # The intermediates were deleted through the backend as well; only the inputs and the output are left
+    assert sorted(gp.rows) == sorted(["nodes", "routes", tracer.workspace, out_fc])
+
+
+def test_incremental_pipeline_is_traced(condition_node_processing, tmp_path, monkeypatch):
+    network = lr_engine.RouteNetwork(np.array(["R1"]), [0, 2], [0.0, 1000.0], [0.0, 0.0])
+    nodes = {"x": np.array([100.0, 600.0]), "values": np.array(["Good", "Poor"])}
+    spatial_reference = types.SimpleNamespace(type="Projected", metersPerUnit=1.0)
+    monkeypatch.setattr(lr_engine, "load_routes", lambda routes_fc, routes_id_field: (network, spatial_reference))
+    monkeypatch.setattr(lr_engine, "load_points", lambda points_fc, fields, spatial_reference: (
+        nodes["x"], np.zeros(len(nodes["x"])), {"OID@": np.arange(1, len(nodes["x"]) + 1),
+                                                fields[1]: nodes["values"]}))
+    gp = FakeGeoprocessing({"nodes": 2, "routes": 1})
+    written = []
+
+    def write(events, out_table, *args):
+        gp.rows[out_table] = len(events["RID"])
+        written.append(("write", os.path.basename(out_table)))
+
+    monkeypatch.setattr(lr_engine, "write_event_table", write)
+    monkeypatch.setattr(lr_engine, "write_event_features", lambda network, events, out_fc, *args: write(events, out_fc))
+    monkeypatch.setattr(lr_engine, "delete_route_events",
+                        lambda output, rid_field, route_ids: written.append(("delete", os.path.basename(output))))
+    monkeypatch.setattr(lr_engine, "append_events", lambda network, events, output, field_names:
+                        written.append(("append", os.path.basename(output))))
+
+    runs = []
+    for values in (["Good", "Poor"], ["Good", "Fair"]):
+        nodes["values"] = np.array(values)
+        tracer = tracing.Tracer(GeoprocessingBackend(gp))
+        condition_node_processing.create_cond_events_incremental(str(tmp_path), "pavement", "nodes", "CONDITION",
+                                                                 "routes", "ROUTE_ID", 10, tracer)
+        runs.append(tracer)
+
+    for tracer in runs:
+        assert [stage.name for stage in tracer.stages] == ["load", "locate", "write events"]
+        assert tracer.stages[0].rows_in == 3 and tracer.stages[0].rows_out == 2
+        assert tracer.backend.messages == [tracer.summary()]
+    # The first run writes every route, the second one replaces the events of the re-rated route
+    assert runs[0].stages[2].rows_out == 6 and runs[1].stages[2].rows_out == 6
+    assert written == [("write", "out_pavement_event_table"), ("write", "out_pavement_events"),
+                       ("delete", "out_pavement_event_table"), ("append", "out_pavement_event_table"),
+                       ("delete", "out_pavement_events"), ("append", "out_pavement_events")]
@@ -0,0 +1,259 @@
+# #############
+"""
+Source Name: tracing.py
+Version: ArcGIS Pro
+Author: ESRI
+
+Stage-level instrumentation for the EFL post-processing pipelines.
+
+A Tracer records one entry per pipeline step (copy, split, spatial join, locate, ...):
+- wall and CPU time of the step
+- peak resident memory of the process, which includes the geoprocessing tools (when psutil is installed),
+  and optionally the peak Python memory (tracemalloc, which includes NumPy arrays)
+- row counts of the input and output datasets of the step
+- bytes written during the step: growth of the output workspace and of the files the step writes outside it
+  (GeoPackage and SQLite databases, Parquet files)
+
+The stages are written as JSON (write_json) or as a Chrome trace (write_chrome_trace, viewable in
+chrome://tracing or Perfetto), and summarized on one line (summary).
+
+Geoprocessing goes through a backend: ArcpyBackend by default, or any object with the same count(dataset) and
+message(text) methods and a gp attribute. gp is the geoprocessing module the pipelines call their tools
+through (Tracer.gp): arcpy, or a stand-in with the same functions. The tracer counts rows and reports through
+the same backend, so a fake backend runs a whole pipeline without ArcGIS, as the tests do.
+"""
+
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+
+class ArcpyBackend(object):
+    """Geoprocessing, row counts and messages through arcpy."""
+
+    @property
+    def gp(self):
+        import arcpy
+
+        return arcpy
+
+    def count(self, dataset):
+        return int(self.gp.GetCount_management(dataset).getOutput(0))
+
+    def message(self, text):
+        self.gp.AddMessage(text)
+
+
+class Stage(object):
+    """Measurements of one pipeline step; rows_out and bytes_written may also be set by the step itself."""
+
+    def __init__(self, name):
+        self.name = name
+        self.start = None
+        self.wall_seconds = None
+        self.cpu_seconds = None
+        self.peak_python_bytes = None
+        self.peak_rss_bytes = None
+        self.rows_in = None
+        self.rows_out = None
+        self.bytes_written = None
+        self.thread = threading.get_ident()
+
+    def as_dict(self):
+        return {"name": self.name, "wall_seconds": self.wall_seconds, "cpu_seconds": self.cpu_seconds,
+                "peak_python_bytes": self.peak_python_bytes, "peak_rss_bytes": self.peak_rss_bytes,
+                "rows_in": self.rows_in, "rows_out": self.rows_out, "bytes_written": self.bytes_written}
+
+
+class _RSSSampler(object):
+    """Samples the resident memory of the process in a background thread while a stage runs."""
+
+    INTERVAL = 0.05
+
+    def __init__(self):
+        try:
+            import psutil
+        except ImportError:
+            self._process = None
+            return
+        self._process = psutil.Process()
+        self.peak = self._process.memory_info().rss
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.INTERVAL):
+            self.peak = max(self.peak, self._process.memory_info().rss)
+
+    def stop(self):
+        if self._process is None:
+            return None
+        self._stop.set()
+        self._thread.join()
+        return max(self.peak, self._process.memory_info().rss)
+
+
+def _folder_bytes(path):
+    """
+    Total size of the files under a folder (a file geodatabase is a folder), or of a file; 0 for paths that
+    do not exist, such as memory workspaces.
+    """
+    if not path:
+        return 0
+    if os.path.isfile(path):
+        return os.path.getsize(path)
+    if not os.path.isdir(path):
+        return 0
+    total = 0
+    for root, _, names in os.walk(path):
+        for name in names:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                continue
+    return total
+
+
+def _storage_path(dataset):
+    """
+    The file or folder holding a dataset: the database file of a GeoPackage or SQLite table, the file
+    geodatabase of a feature class or table, and the dataset itself otherwise (Parquet files, folders).
+    """
+    dataset = os.path.normpath(str(dataset))
+    workspace = os.path.dirname(dataset)
+    if workspace.lower().endswith((".gpkg", ".sqlite", ".db", ".gdb")):
+        return workspace
+    return dataset
+
+
+def _inside(path, folder):
+    path, folder = os.path.normcase(os.path.abspath(path)), os.path.normcase(os.path.abspath(folder))
+    return path == folder or path.startswith(folder.rstrip(os.sep) + os.sep)
+
+
+class Tracer(object):
+    """
+    Records the stages of a pipeline run. Stages are expected to run one after the other.
+
+    :param backend: geoprocessing, row counting and messaging backend; ArcpyBackend when None
+    :param workspace: output workspace whose growth is reported as bytes written by each stage
+    :param python_memory: also record peak Python memory with tracemalloc, which slows down Python-heavy steps
+    """
+
+    def __init__(self, backend=None, workspace=None, python_memory=False):
+        self.backend = backend or ArcpyBackend()
+        self.workspace = workspace
+        self.python_memory = python_memory
+        self.stages = []
+        self._origin = time.perf_counter()
+
+    @property
+    def gp(self):
+        """Geoprocessing module of the backend, which the pipeline steps run their tools through."""
+        return getattr(self.backend, "gp", None) or ArcpyBackend().gp
+
+    def stage(self, name, inputs=(), outputs=(), written=()):
+        """
+        Context manager measuring one step.
+        :param inputs: datasets read by the step, counted before it runs
+        :param outputs: datasets written by the step, counted after it runs
+        :param written: other datasets written by the step, measured for bytes written but not counted, e.g.
+                        the GeoPackage, SQLite and Parquet outputs of bulk_output
+        :return: the Stage, for steps that report their own row counts
+        """
+        return _StageContext(self, Stage(name), inputs, outputs, written)
+
+    def _measured_paths(self, datasets):
+        """The workspace and the files or folders of the datasets outside it."""
+        paths = [self.workspace] if self.workspace else []
+        for dataset in datasets:
+            path = _storage_path(dataset)
+            if path not in paths and not (self.workspace and _inside(path, self.workspace)):
+                paths.append(path)
+        return paths
+
+    def _count(self, datasets):
+        return sum(self.backend.count(dataset) for dataset in datasets)
+
+    def total_seconds(self):
+        return sum(stage.wall_seconds or 0.0 for stage in self.stages)
+
+    def summary(self):
+        """One line: total time and each stage's wall time and share, slowest stage first."""
+        total = self.total_seconds()
+        parts = ["{0} {1:.2f}s ({2:.0%})".format(stage.name, stage.wall_seconds,
+                                                 stage.wall_seconds / total if total else 0.0)
+                 for stage in sorted(self.stages, key=lambda stage: -stage.wall_seconds)]
+        return "Total {0:.2f}s: {1}".format(total, ", ".join(parts))
+
+    def report(self):
+        """Send the one-line summary through the backend."""
+        self.backend.message(self.summary())
+
+    def write_json(self, path):
+        with open(path, "w") as trace_file:
+            json.dump({"total_seconds": self.total_seconds(),
+                       "stages": [stage.as_dict() for stage in self.stages]}, trace_file, indent=2)
+        return path
+
+    def write_chrome_trace(self, path):
+        """Write the stages as complete ("X") events of the Chrome trace event format."""
+        events = [{"name": stage.name, "cat": "stage", "ph": "X", "pid": os.getpid(), "tid": stage.thread,
+                   "ts": (stage.start - self._origin) * 1e6, "dur": stage.wall_seconds * 1e6,
+                   "args": {key: value for key, value in stage.as_dict().items() if key != "name"}}
+                  for stage in self.stages]
+        with open(path, "w") as trace_file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, trace_file)
+        return path
+
+    def write(self, path):
+        """Write the JSON stages to path and the Chrome trace next to it, as <name>.trace.json."""
+        return self.write_json(path), self.write_chrome_trace(os.path.splitext(path)[0] + ".trace.json")
+
+
+class _StageContext(object):
+
+    def __init__(self, tracer, stage, inputs, outputs, written):
+        self.tracer = tracer
+        self.stage = stage
+        self.inputs = inputs
+        self.outputs = outputs
+        self.written = written
+
+    def __enter__(self):
+        stage = self.stage
+        if self.inputs:
+            stage.rows_in = self.tracer._count(self.inputs)
+        self._memory_base = 0
+        self._started_tracemalloc = self.tracer.python_memory and not tracemalloc.is_tracing()
+        if self._started_tracemalloc:
+            tracemalloc.start()
+        if tracemalloc.is_tracing():
+            self._memory_base = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+        self._measured = self.tracer._measured_paths(list(self.outputs) + list(self.written))
+        self._bytes_base = sum(_folder_bytes(path) for path in self._measured)
+        self._sampler = _RSSSampler()
+        stage.start = time.perf_counter()
+        self._cpu_start = time.process_time()
+        return stage
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        stage = self.stage
+        stage.wall_seconds = time.perf_counter() - stage.start
+        stage.cpu_seconds = time.process_time() - self._cpu_start
+        stage.peak_rss_bytes = self._sampler.stop()
+        if tracemalloc.is_tracing():
+            stage.peak_python_bytes = max(tracemalloc.get_traced_memory()[1] - self._memory_base, 0)
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+        if stage.bytes_written is None:
+            stage.bytes_written = sum(_folder_bytes(path) for path in self._measured) - self._bytes_base
+        if exc_type is None and self.outputs and stage.rows_out is None:
+            stage.rows_out = self.tracer._count(self.outputs)
+        self.tracer.stages.append(stage)
+        return False
@@ -1,7 +1,6 @@
 import arcpy
-import saspy
-from saspy import autocfg
-import time
+
+import corr_batch
 
 class Toolbox(object):
     def __init__(self):
@@ -19,7 +18,7 @@ class SASCorr(object):
         """Define the tool (tool name is the name of the class)."""
         self.label = "Spearman Rank-Order Correlation"
         self.description = "Compute the non-parametric Spearman rank-order measues of association."
-        self.canRunInBackground = False
+        self.canRunInBackground = True
 
     def getParameterInfo(self):
         """Define parameter definitions"""
@@ -45,8 +44,18 @@ class SASCorr(object):
                             datatype = "DETable",
                             parameterType = "Required",
                             direction = "Output")
+
+        param3 = arcpy.Parameter(displayName="Correlation Engine",
+                            name = "Correlation_Engine",
+                            datatype = "GPString",
+                            parameterType = "Optional",
+                            direction = "Input")
+
+        param3.filter.type = "ValueList"
+        param3.filter.list = ["SAS", "NUMPY", "NUMPY_CHUNKED"]
+        param3.value = "SAS"
         
-        params = [param0, param1, param2]
+        params = [param0, param1, param2, param3]
         return params
 
     def isLicensed(self):
@@ -70,43 +79,16 @@ class SASCorr(object):
         varNames = parameters[1].valueAsText.upper()
         varNames = varNames.replace(';', ' ')
         outputTable = parameters[2].valueAsText
-        
-        ##### Create a unique SAS file name #####
-        uniqueFilename = 'temp_' + time.strftime("%Y%m%d_%H%M%S")
-        sasFileName = 'sasuser.' + uniqueFilename
-        sasOutFileName = 'sasuser.' + 'out_' + uniqueFilename
-
-        ##### Convert input feature layer to SAS table ####                
-        arcpy.conversion.TableToSAS(inputFC, 
-                                    sasFileName, 
-                                    replace_sas_dataset="OVERWRITE", 
-                                    use_domain_and_subtype_description="USE_DOMAIN")       
-
-        ##### Create the SAS CORR procedure #####
-        sasSyntax = f"""options linesize=80; 
-                        proc corr data={sasFileName} OUTS={sasOutFileName} pearson spearman kendall hoeffding; 
-                        var {varNames}; 
-                        run;"""     
-
-        ##### Create automatic SAS config file #####
-        scratchCFG = f"{arcpy.CreateUniqueName('sasConfig', arcpy.env.scratchFolder)}.txt"
-        autocfg.main(cfgfile = scratchCFG)
-
-        ##### Create a SAS session and submit the SAS CORR procedure #####
-        sas = saspy.SASsession(results='TEXT', cfgfile = scratchCFG)
-        sas_result = sas.submit(sasSyntax) 
-        sas.endsas()
-
-        ##### Convert output SAS CORR table to output table ####  
-        arcpy.conversion.SASToTable(sasOutFileName, outputTable)
-        
-        ##### Retrieve the SAS log files to add as geoprocessing messages ####  
-        log_lines = sas_result.get('LOG').split('\n')
-        for line in log_lines:
-            arcpy.AddMessage(line)
-            
-        lst_lines = sas_result.get('LST').split('\n')
-        for line in lst_lines:
-            arcpy.AddMessage(line)
-        
+        engine = parameters[3].valueAsText or "SAS"
+
+        ##### Run the request on the correlation job queue #####
+        ##### Unchanged inputs return the cached result without reading their rows #####
+        result = corr_batch.run_request(inputFC, varNames.split(), engine, outputTable)
+        if result is None:
+            messages.addWarningMessage("A later request for {0} superseded this one.".format(outputTable))
+            return
+
+        ##### Write the output table and add the log or listing as geoprocessing messages ####
+        corr_batch.write_output(result, varNames.split(), outputTable)
+
         return
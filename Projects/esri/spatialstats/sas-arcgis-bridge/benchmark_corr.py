@@ -0,0 +1,70 @@
+"""
+Source Name: benchmark_corr.py
+Author: ESRI
+
+Measure how the corr_engine runtime scales with the number of rows, fields and worker processes.
+The data are synthetic correlated normal values rounded to one decimal, so there are ties to
+exercise the tie corrections. Results are printed as a table and can be saved as JSON.
+
+Example:
+    python benchmark_corr.py --rows 10000 100000 --fields 10 50 --workers 1 4 --out corr_benchmark.json
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+import corr_engine
+
+
+def synthetic_data(rows, fields, seed=0):
+    """Correlated normal columns with a shared factor and a few missing values."""
+    rng = np.random.default_rng(seed)
+    factor = rng.normal(size=(rows, 1))
+    data = np.round(factor * rng.uniform(0.2, 1.0, fields) + rng.normal(size=(rows, fields)), 1)
+    data[rng.random((rows, fields)) < 0.001] = np.nan
+    return data
+
+
+def run(rows_list, fields_list, workers_list, statistics, tile_size, repeat):
+    results = []
+    for rows in rows_list:
+        for fields in fields_list:
+            data = synthetic_data(rows, fields)
+            names = ["F{0}".format(i) for i in range(fields)]
+            for workers in workers_list:
+                timings = []
+                for _ in range(repeat):
+                    start = time.perf_counter()
+                    corr_engine.correlate(data, names, statistics, workers=workers, tile_size=tile_size)
+                    timings.append(time.perf_counter() - start)
+                result = {"rows": rows, "fields": fields, "workers": workers, "tile_size": tile_size,
+                          "statistics": list(statistics), "seconds": min(timings)}
+                print("{rows:>10} rows {fields:>4} fields {workers:>3} workers  {seconds:10.3f} s".format(**result))
+                results.append(result)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NumPy correlation engine.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--fields", type=int, nargs="+", default=[10, 50])
+    parser.add_argument("--workers", type=int, nargs="+", default=sorted({1, os.cpu_count() or 1}))
+    parser.add_argument("--statistics", nargs="+", default=list(corr_engine.STATISTICS))
+    parser.add_argument("--tile-size", type=int, default=corr_engine.TILE_SIZE)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--out", help="optional JSON file for the results")
+    args = parser.parse_args()
+
+    results = run(args.rows, args.fields, args.workers, args.statistics, args.tile_size, args.repeat)
+
+    if args.out:
+        with open(args.out, "w") as out_file:
+            json.dump(results, out_file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+"""
+Source Name: bulk_output.py
+Author: ESRI
+
+Bulk output of the SAS geoprocessing tools: result tables written from columnar arrays, and log lines
+sent as a few long geoprocessing messages instead of one message per line.
+
+A result table goes to the format of its path:
+- a table in a GeoPackage (.gpkg) or SQLite (.sqlite) database, or a .parquet file, is written by the
+  writers shared with the EFL tools (see common/bulk_tables.py)
+- any other table (file geodatabase, dBASE) is written with one NumPyArrayToTable call
+
+The output data sets of a SAS procedure are read straight from the SAS session into columns (saspy
+sd2df), which replaces the conversion of the data set to an intermediate table with SASToTable.
+"""
+
+import os
+
+import numpy as np
+from numpy.lib import recfunctions
+
+import esri_common  # puts Projects/esri/common on the import path
+from bulk_tables import output_format, split_table_path, write_parquet, write_sqlite
+
+# Log lines per geoprocessing message
+LINES_PER_MESSAGE = 500
+
+
+def add_messages(lines, add_message=None, lines_per_message=LINES_PER_MESSAGE):
+    """
+    Send lines as geoprocessing messages, lines_per_message lines at a time.
+    :param add_message: callable taking one message; arcpy.AddMessage when None
+    """
+    if add_message is None:
+        import arcpy
+
+        add_message = arcpy.AddMessage
+    lines = list(lines)
+    for start in range(0, len(lines), lines_per_message):
+        add_message("\n".join(lines[start:start + lines_per_message]))
+
+
+def write_table(array, out_table):
+    """
+    Write a structured array to out_table in bulk, in the format of its path (see output_format).
+    :return: out_table
+    """
+    output = output_format(out_table)
+    if output is not None:
+        columns = {name: array[name] for name in array.dtype.names}
+        if output == "PARQUET":
+            return write_parquet(columns, out_table)
+        return write_sqlite(columns, *split_table_path(out_table))
+
+    import arcpy
+
+    # SAS names such as _TYPE_ are not valid in every workspace
+    workspace = os.path.dirname(out_table)
+    array = recfunctions.rename_fields(array, {name: str(arcpy.ValidateFieldName(name, workspace))
+                                               for name in array.dtype.names})
+    arcpy.da.NumPyArrayToTable(array, out_table)
+    return out_table
+
+
+def frame_to_array(frame):
+    """Structured array of a pandas DataFrame; text columns become fixed-width strings."""
+    dtype = []
+    for name in frame.columns:
+        column = frame[name].to_numpy()
+        if column.dtype.kind in "OUS":
+            width = max([1] + [len(str(value)) for value in column])
+            dtype.append((str(name), "U{0}".format(width)))
+        else:
+            dtype.append((str(name), column.dtype.str))
+    array = np.empty(len(frame), dtype=dtype)
+    for name, _ in dtype:
+        column = frame[name].to_numpy()
+        array[name] = ["" if value is None or value != value else str(value) for value in column] \
+            if column.dtype.kind in "OUS" else column
+    return array
+
+
+def read_sas_dataset(session, dataset):
+    """
+    Read a SAS data set (libref.table) of a session into a structured array.
+    :return: structured array, or None when the session cannot transfer data sets (sessions without sd2df)
+    """
+    if not hasattr(session, "sd2df"):
+        return None
+    libref, table = dataset.split(".", 1) if "." in dataset else ("work", dataset)
+    frame = session.sd2df(table, libref)
+    if frame is None:
+        return None
+    return frame_to_array(frame)
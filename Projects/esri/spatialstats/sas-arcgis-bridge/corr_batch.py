@@ -0,0 +1,261 @@
+"""
+Source Name: corr_batch.py
+Author: ESRI
+
+Correlation requests of the SASCorr tool and of batches of requests, such as the correlations behind the
+widgets of a dashboard.
+
+A request is an input table, a field list, an output table and an engine (SAS, NUMPY or NUMPY_CHUNKED).
+Requests run on the process-wide corr_cache.CorrelationJobQueue:
+- several requests run at once
+- a request with a cached result completes right away, and identical requests share one run
+- a new request for an output table supersedes a pending request for the same table
+- arcpy is not thread-safe: the input is read (or converted to a SAS data set) on the calling thread and
+  only the SAS session or NumPy work runs on the queue
+
+Results are cached under a key built from the change stamp of the input (field_cache.source_info) and the
+field list, so a cache hit reads no rows. Inputs without a change stamp (layers with a selection or
+definition query, sources without a file stamp or editor tracking) are keyed by a fingerprint of their rows.
+
+Batch usage: python corr_batch.py requests.json
+where requests.json holds a list of {"in_table", "fields", "out_table", "engine"} objects.
+"""
+
+import concurrent.futures
+import json
+import os
+import sys
+import time
+import uuid
+
+import bulk_output
+import corr_cache
+import corr_engine
+import corr_streaming
+import field_cache
+
+
+ENGINES = ("SAS", "NUMPY", "NUMPY_CHUNKED")
+
+
+def request_key(in_table, var_names, engine="SAS"):
+    """
+    Cache key of a request.
+    :param in_table: table, feature class or layer
+    :param var_names: list of field names
+    :param engine: SAS, NUMPY or NUMPY_CHUNKED
+    :return: hex digest
+    """
+    # The SAS output keeps the field order; the NumPy results are computed in sorted order and reordered
+    parts = (engine, corr_engine.STATISTICS) + ((" ".join(var_names),) if engine == "SAS" else ())
+    catalog_path, stamp = field_cache.source_info(in_table)
+    if stamp is not None:
+        return corr_cache.fingerprint([], var_names, os.path.normcase(catalog_path), stamp, *parts)
+    return corr_cache.fingerprint(field_cache.get_cache().iter_chunks(in_table, var_names), var_names, *parts)
+
+
+def read_numpy_input(in_table, var_names, chunked=False):
+    """
+    Read the input of an in-process request through arcpy, on the calling thread (see submit).
+    :return: 1-tuple of the input columns in sorted field order, or of the finished result for NUMPY_CHUNKED
+    """
+    sorted_names = sorted(var_names)
+    if chunked:
+        ##### Stream the input rows over worker processes; the cursor reads stay on this thread #####
+        return (corr_streaming.correlate_table(in_table, sorted_names, corr_engine.STATISTICS,
+                                               workers=os.cpu_count() or 1),)
+
+    ##### Read the input fields from the columnar cache, nulls become missing values #####
+    ##### Cached fields stay memory-mapped; the engine reads them in place #####
+    return (field_cache.get_cache().read(in_table, sorted_names),)
+
+
+def compute_numpy(var_names, data):
+    """
+    Compute the PROC CORR statistics in-process, without a SAS session.
+    :param data: columns read by read_numpy_input, or the result of a NUMPY_CHUNKED request
+    :return: corr_engine.CorrelationResult in sorted field order
+    """
+    if isinstance(data, corr_engine.CorrelationResult):
+        return data
+    return corr_engine.correlate(data, sorted(var_names), corr_engine.STATISTICS, workers=os.cpu_count() or 1)
+
+
+def export_sas_input(in_table):
+    """
+    Convert the input table to a uniquely named SAS data set, on the calling thread (see submit).
+    :return: (input data set, OUTS= data set)
+    """
+    import arcpy
+
+    ##### Create a unique SAS file name #####
+    uniqueFilename = 'temp_' + time.strftime("%Y%m%d_%H%M%S") + '_' + uuid.uuid4().hex[:6]
+    sasFileName = 'sasuser.' + uniqueFilename
+    sasOutFileName = 'sasuser.' + 'out_' + uniqueFilename
+
+    ##### Convert input feature layer to SAS table ####
+    arcpy.conversion.TableToSAS(in_table,
+                                sasFileName,
+                                replace_sas_dataset="OVERWRITE",
+                                use_domain_and_subtype_description="USE_DOMAIN")
+    return sasFileName, sasOutFileName
+
+
+def compute_sas(var_names, sasFileName, sasOutFileName):
+    """
+    Run PROC CORR in a pooled SAS session. Runs on the job queue, so it does not call arcpy.
+    :return: dict with the OUTS= data set as a structured array ("table") and the pool activity, log and
+             listing lines ("messages"). A session that cannot transfer data sets leaves the OUTS= data set
+             in place for read_sas_output, with "table" None and its name in "dataset"; that result is not
+             cached.
+    """
+    import sas_sessions
+
+    ##### Create the SAS CORR procedure #####
+    sasSyntax = f"""options linesize=80;
+                    proc corr data={sasFileName} OUTS={sasOutFileName} pearson spearman kendall hoeffding;
+                    var {" ".join(var_names)};
+                    run;"""
+
+    ##### Borrow a warm SAS session and submit the SAS CORR procedure #####
+    ##### The temporary SAS datasets are deleted when the session is returned #####
+    poolMessages = []
+    cleanup = [sasFileName, sasOutFileName]
+    with sas_sessions.get_pool().session(cleanup=cleanup, messages=poolMessages.append) as sas:
+        sas_result = sas.submit(sasSyntax)
+
+        ##### Read the output SAS CORR data set into columns ####
+        outsArray = bulk_output.read_sas_dataset(sas, sasOutFileName)
+        if outsArray is None:
+            cleanup.remove(sasOutFileName)
+
+    ##### Keep the SAS log and listing to add as geoprocessing messages ####
+    value = {"table": outsArray,
+             "messages": poolMessages + sas_result.get('LOG').split('\n') + sas_result.get('LST').split('\n')}
+    if outsArray is None:
+        value["dataset"] = sasOutFileName
+        return corr_cache.Uncached(value)
+    return value
+
+
+def read_sas_output(value):
+    """
+    Read the OUTS= data set a session could not transfer through an in-memory table, on the calling thread,
+    and delete it.
+    """
+    import arcpy
+
+    sasOutFileName = value.pop("dataset")
+    memoryTable = "memory\\" + sasOutFileName.split(".")[-1]
+    arcpy.conversion.SASToTable(sasOutFileName, memoryTable)
+    tableFields = [field.name for field in arcpy.ListFields(memoryTable) if field.type != "OID"]
+    value["table"] = arcpy.da.TableToNumPyArray(memoryTable, tableFields)
+    arcpy.management.Delete(memoryTable)
+    delete_sas_datasets([sasOutFileName])
+
+
+def delete_sas_datasets(datasets):
+    """Delete SAS data sets in a pooled session."""
+    import sas_sessions
+
+    with sas_sessions.get_pool().session(cleanup=datasets):
+        pass
+
+
+def submit(in_table, var_names, engine="SAS", out_table=None, queue=None):
+    """
+    Submit a correlation request to the job queue. The input is read through arcpy on the calling thread,
+    only when the result is neither cached nor running; the SAS session or NumPy work runs on the queue.
+    :param out_table: output table of the request; a later request for the same table supersedes this one
+    :param queue: corr_cache.CorrelationJobQueue; the process-wide queue when None
+    :return: concurrent.futures.Future of the result (see compute_sas and compute_numpy)
+    """
+    engine = engine.upper()
+    if engine not in ENGINES:
+        raise ValueError("Unknown correlation engine: {0}".format(engine))
+    queue = queue or corr_cache.get_queue()
+    key = request_key(in_table, var_names, engine)
+    if engine == "SAS":
+        exported = []
+
+        def prepare():
+            exported.extend(export_sas_input(in_table))
+            return exported
+
+        future = queue.submit(key, compute_sas, var_names, slot=out_table, prepare=prepare)
+        # A superseded request never runs, so its exported input is deleted here
+        future.add_done_callback(lambda done: done.cancelled() and exported and delete_sas_datasets(exported))
+        return future
+    return queue.submit(key, compute_numpy, var_names, slot=out_table,
+                        prepare=lambda: read_numpy_input(in_table, var_names, engine == "NUMPY_CHUNKED"))
+
+
+def run_request(in_table, var_names, engine="SAS", out_table=None):
+    """
+    Submit a request and wait for its result, as the SASCorr tool does.
+    :return: the result, or None when a later request for out_table superseded this one before it started
+    """
+    try:
+        return submit(in_table, var_names, engine, out_table).result()
+    except concurrent.futures.CancelledError:
+        return None
+
+
+def write_output(value, var_names, out_table):
+    """
+    Write the result of a request to its output table and add the listing as geoprocessing messages.
+    :return: out_table
+    """
+    if not isinstance(value, corr_engine.CorrelationResult):
+        if value.get("dataset"):
+            read_sas_output(value)
+        bulk_output.write_table(value["table"], out_table)
+        bulk_output.add_messages(value["messages"])
+        return out_table
+
+    result = value.select(var_names)
+    if result.binned:
+        import arcpy
+
+        arcpy.AddWarning("{0} have more than {1} distinct values. Their Spearman, Kendall and Hoeffding "
+                         "statistics were approximated from {1} quantile bins; use the NUMPY engine for "
+                         "exact values.".format(", ".join(result.binned), corr_streaming.MAX_BINS))
+
+    ##### Write the Spearman OUTS= table ####
+    corr_engine.write_outs_table(corr_engine.outs_rows(result, "SPEARMAN"), var_names, out_table)
+
+    ##### Add the listing as geoprocessing messages ####
+    bulk_output.add_messages(corr_engine.format_listing(result))
+    return out_table
+
+
+def run_requests(requests, max_workers=corr_cache.MAX_WORKERS):
+    """
+    Run a batch of requests at once and write their output tables.
+    :param requests: iterable of (in_table, var_names, out_table, engine) tuples
+    :param max_workers: number of requests run at the same time
+    :return: list of the output tables written
+    """
+    queue = corr_cache.CorrelationJobQueue(corr_cache.get_cache(), max_workers)
+    try:
+        # Only the last request for an output table is written
+        latest = {}
+        for in_table, var_names, out_table, engine in requests:
+            var_names = [name.upper() for name in var_names]
+            latest[out_table] = (submit(in_table, var_names, engine, out_table, queue), var_names)
+        return [write_output(future.result(), var_names, out_table)
+                for out_table, (future, var_names) in latest.items()]
+    finally:
+        queue.shutdown()
+
+
+def main(request_file):
+    with open(request_file) as requests_json:
+        requests = [(request["in_table"], request["fields"], request["out_table"], request.get("engine", "SAS"))
+                    for request in json.load(requests_json)]
+    for out_table in run_requests(requests):
+        print(out_table)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,222 @@
+"""
+Source Name: corr_cache.py
+Author: ESRI
+
+On-disk memoization of correlation results and a small job queue for running several correlation
+requests at once.
+
+Results are keyed by a fingerprint of the request: the change stamp of the input, or a hash of the
+input rows taken column by column in sorted field-name order when the input has no stamp, plus the
+sorted field list and any other parameters that change the result (engine, statistics). Re-running an
+unchanged layer with the same fields therefore hits the cache whatever order the fields were picked in.
+Entries are pickled into one file each; reads refresh the file's access time and the least recently used
+files are evicted once the cache grows past its size budget.
+
+The SASCorr tool and batches of requests submit through the process-wide queue (see corr_batch.py).
+"""
+
+import concurrent.futures
+import hashlib
+import os
+import pickle
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "SASCorrCache")
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+MAX_WORKERS = 4
+
+
+def fingerprint(chunks, var_names, *parts):
+    """
+    Hash the content of the input rows and the parameters of a correlation request.
+    :param chunks: iterable of 2-d float arrays with one column per variable (a single array is allowed)
+    :param var_names: variable names, one per column
+    :param parts: other values that change the result, e.g. engine and statistics
+    :return: hex digest
+    """
+    if isinstance(chunks, np.ndarray):
+        chunks = [chunks]
+    order = np.argsort([name.upper() for name in var_names], kind="stable")
+    digest = hashlib.sha1()
+    digest.update(repr(sorted(name.upper() for name in var_names)).encode("utf-8"))
+    digest.update(repr(parts).encode("utf-8"))
+    rows = 0
+    for chunk in chunks:
+        chunk = np.asarray(chunk, dtype=float)
+        rows += len(chunk)
+        digest.update(np.ascontiguousarray(chunk[:, order]).tobytes())
+    digest.update(str(rows).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class ResultCache(object):
+    """Pickled results in a directory, evicted least recently used first above max_bytes."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, "{0}.pkl".format(key))
+
+    def get(self, key):
+        """Return the cached value for key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as cache_file:
+                value = pickle.load(cache_file)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        # The access time orders the entries for eviction
+        now = time.time()
+        try:
+            os.utime(path, (now, now))
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        """Store a value and evict old entries until the cache fits its budget."""
+        path = self._path(key)
+        temp_path = "{0}.{1}.tmp".format(path, threading.get_ident())
+        with open(temp_path, "wb") as cache_file:
+            pickle.dump(value, cache_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Remove least recently used entries while the cache is larger than max_bytes."""
+        with self._lock:
+            entries = []
+            for name in os.listdir(self.directory):
+                if name.endswith(".pkl"):
+                    try:
+                        stat = os.stat(os.path.join(self.directory, name))
+                    except OSError:
+                        continue
+                    entries.append((stat.st_atime, stat.st_size, name))
+            total = sum(size for _, size, _ in entries)
+            for _, size, name in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    continue
+                total -= size
+
+    def clear(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(".pkl"):
+                os.remove(os.path.join(self.directory, name))
+
+
+class Uncached(object):
+    """Wraps a result that a compute callable of the job queue hands back without it being cached."""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class CorrelationJobQueue(object):
+    """
+    Run correlation requests on a thread pool, backed by a ResultCache.
+
+    arcpy is not thread-safe, so the work queued on the pool must not call it. The reads and writes through
+    arcpy go in the prepare callable of a request, which runs on the calling thread.
+
+    - Requests whose key is cached complete immediately.
+    - Requests with the same key as one still running share its future.
+    - A request submitted for a slot (e.g. a dashboard widget or an output table) supersedes the previous
+      request for that slot; the previous one is cancelled if it has not started yet.
+    """
+
+    def __init__(self, cache=None, max_workers=MAX_WORKERS):
+        self.cache = cache
+        self._executor = concurrent.futures.ThreadPoolExecutor(max_workers)
+        # Re-entrant because a future that is already done runs its callback inside submit()
+        self._lock = threading.RLock()
+        self._running = {}
+        self._slots = {}
+
+    def submit(self, key, compute, *args, slot=None, prepare=None):
+        """
+        Submit compute(*args) under a fingerprint key.
+        :param key: fingerprint of the request
+        :param compute: callable returning a picklable result, or an Uncached result
+        :param slot: optional name of the consumer; a new request for the slot supersedes the previous one
+        :param prepare: optional callable run on the calling thread, only when compute has to run; the items
+                        of the tuple it returns are passed to compute after args
+        :return: concurrent.futures.Future
+        """
+        with self._lock:
+            future = self._running.get(key)
+            if future is None:
+                value = self.cache.get(key) if self.cache is not None else None
+                if value is not None:
+                    future = concurrent.futures.Future()
+                    future.set_result(value)
+                else:
+                    if prepare is not None:
+                        args = args + tuple(prepare())
+                    future = self._executor.submit(self._run, key, compute, args)
+                    self._running[key] = future
+                    future.add_done_callback(lambda done: self._finished(key, done))
+            if slot is not None:
+                previous = self._slots.get(slot)
+                if previous is not None and previous[0] != key and not self._shared(previous[0], slot):
+                    previous[1].cancel()
+                self._slots[slot] = (key, future)
+        return future
+
+    def _shared(self, key, slot):
+        """True when another slot still waits for the request with this key."""
+        return any(other_key == key for other_slot, (other_key, _) in self._slots.items() if other_slot != slot)
+
+    def _run(self, key, compute, args):
+        value = compute(*args)
+        if isinstance(value, Uncached):
+            return value.value
+        if self.cache is not None:
+            self.cache.put(key, value)
+        return value
+
+    def _finished(self, key, future):
+        """Forget a finished or cancelled request so the next submit reads the cache or runs again."""
+        with self._lock:
+            if self._running.get(key) is future:
+                del self._running[key]
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+
+_cache = None
+_queue = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Return the process-wide result cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache(directory, max_bytes)
+        return _cache
+
+
+def get_queue(max_workers=MAX_WORKERS):
+    """Return the process-wide job queue over the process-wide result cache, creating it on first use."""
+    global _queue
+    cache = get_cache()
+    with _cache_lock:
+        if _queue is None:
+            _queue = CorrelationJobQueue(cache, max_workers)
+        return _queue
@@ -0,0 +1,530 @@
+"""
+Source Name: corr_engine.py
+Author: ESRI
+
+In-process NumPy implementation of the PROC CORR statistics requested by the SASCorr tool
+(PEARSON SPEARMAN KENDALL HOEFFDING). The results follow PROC CORR conventions:
+
+- Missing values are handled by pairwise deletion (the PROC CORR default), so every pair of
+  variables is computed from the observations where both values are present.
+- Ranks are mid-ranks, and Spearman, Kendall tau-b and Hoeffding D use the PROC CORR tie corrections.
+- Pearson and Spearman p-values come from the t distribution with n-2 degrees of freedom, Kendall
+  p-values from the normal approximation with the tie-corrected variance of S. PROC CORR does not
+  write Hoeffding p-values to its output data sets and they are not computed here.
+
+Kendall's S uses Knight's merge-sort algorithm and the Hoeffding bivariate ranks use the same
+merge-sort counting, so neither needs the O(n^2) comparison of every pair of observations. Ranks are
+computed once per field and shared by every pair that has the same observations. For wide field lists
+the matrix is split into tiles of fields that can be scheduled over a process pool.
+
+The engine does not need arcpy for the computation itself; arcpy is only imported by the helpers
+that read the input fields and write the output table.
+"""
+
+import concurrent.futures
+import math
+import multiprocessing
+import os
+import sys
+
+import numpy as np
+from scipy import special
+
+import bulk_output
+
+
+STATISTICS = ("PEARSON", "SPEARMAN", "KENDALL", "HOEFFDING")
+
+# Number of fields along each side of a tile of the correlation matrix
+TILE_SIZE = 8
+
+# Rows per block when counting the observations of every pair of variables
+CHUNK_SIZE = 100000
+
+
+class CorrelationResult(object):
+    """
+    Simple statistics and correlation matrices for a list of variables.
+    binned names the variables whose rank statistics were approximated from quantile bins (corr_streaming).
+    """
+
+    def __init__(self, var_names, n, mean, std, pair_n, coefficients, probabilities, binned=()):
+        self.var_names = list(var_names)
+        self.n = n
+        self.mean = mean
+        self.std = std
+        self.pair_n = pair_n
+        self.coefficients = coefficients
+        self.probabilities = probabilities
+        self.binned = list(binned)
+
+    def select(self, var_names):
+        """Return the result for a subset or reordering of the variables."""
+        index = [[name.upper() for name in self.var_names].index(name.upper()) for name in var_names]
+        grid = np.ix_(index, index)
+        # Results cached before binned was recorded do not have it
+        binned = {name.upper() for name in getattr(self, "binned", ())}
+        return CorrelationResult(var_names, self.n[index], self.mean[index], self.std[index], self.pair_n[grid],
+                                 {stat: matrix[grid] for stat, matrix in self.coefficients.items()},
+                                 {stat: matrix[grid] for stat, matrix in self.probabilities.items()},
+                                 [name for name in var_names if name.upper() in binned])
+
+
+def midranks(values):
+    """
+    Rank a 1-d array without missing values, giving tied values the mean of their ranks.
+    :param values: 1-d float array
+    :return: (ranks, tie_counts) where tie_counts holds the size of every group of equal values
+    """
+    order = np.argsort(values, kind="mergesort")
+    sorted_values = values[order]
+    starts = np.flatnonzero(np.concatenate(([True], sorted_values[1:] != sorted_values[:-1])))
+    counts = np.diff(np.append(starts, len(values)))
+    ranks = np.empty(len(values))
+    ranks[order] = np.repeat(starts + (counts + 1) / 2.0, counts)
+    return ranks, counts
+
+
+def pearson(x, y):
+    """Pearson product-moment correlation of two complete arrays."""
+    dx = x - x.mean()
+    dy = y - y.mean()
+    denominator = math.sqrt(np.dot(dx, dx) * np.dot(dy, dy))
+    if denominator == 0:
+        return np.nan
+    return float(np.dot(dx, dy) / denominator)
+
+
+def t_probability(r, n):
+    """Two-sided p-value for a Pearson/Spearman coefficient under H0: Rho=0."""
+    if n < 3 or np.isnan(r):
+        return np.nan
+    if abs(r) >= 1.0:
+        return 0.0
+    # With t = r*sqrt((n-2)/(1-r^2)), P(|T| > |t|) is the regularized incomplete beta at 1-r^2
+    return float(special.betainc((n - 2) / 2.0, 0.5, 1.0 - r * r))
+
+
+def count_smaller_before(values):
+    """
+    For every element, count the earlier elements with a strictly smaller value.
+
+    Bottom-up merge sort: at each of the log2(n) levels, the two sorted halves of every block are merged
+    with one stable sort, and each element of a right half picks up the number of smaller elements in
+    the left half of its block.
+    :param values: 1-d array
+    :return: 1-d int64 array of counts
+    """
+    n = len(values)
+    counts = np.zeros(n, dtype=np.int64)
+    if n < 2:
+        return counts
+    distinct, sequence = np.unique(values, return_inverse=True)
+    sequence = sequence.astype(np.int64)
+    identity = np.arange(n)
+    position = np.arange(n)
+    width = 1
+    while width < n:
+        block = position // (2 * width)
+        right = (position // width) % 2 == 1
+        # Right-half elements sort ahead of equal left-half elements so that ties are not counted
+        key = (block * len(distinct) + sequence) * 2 + (~right)
+        order = np.argsort(key, kind="stable")
+        is_left = (~right[order]).astype(np.int64)
+        cumulative = np.cumsum(is_left)
+        block_sorted = block[order]
+        block_start = np.searchsorted(block_sorted, block_sorted)
+        left_before = cumulative - is_left - np.concatenate(([0], cumulative))[block_start]
+        moved_right = right[order]
+        counts[identity[order][moved_right]] += left_before[moved_right]
+        sequence = sequence[order]
+        identity = identity[order]
+        width *= 2
+    return counts
+
+
+def _group_starts(*keys):
+    """For arrays sorted by keys, the index of the first element of each element's run of equal keys."""
+    n = len(keys[0])
+    change = np.zeros(n, dtype=bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.maximum.accumulate(np.where(change, np.arange(n), 0))
+
+
+def _tied_pairs(*keys):
+    """Number of pairs of observations tied on every key."""
+    order = np.lexsort(keys[::-1])
+    starts = _group_starts(*[key[order] for key in keys])
+    sizes = np.bincount(starts).astype(float)
+    return (sizes * (sizes - 1)).sum() / 2.0
+
+
+def kendall_s(x, y):
+    """
+    Kendall score S = sum(sign(xi-xj) * sign(yi-yj)) over all pairs i<j (Knight's algorithm).
+
+    Sorting by (x, y) leaves every discordant pair as an inversion of y, counted by merge sort in
+    O(n log n) levels; S follows from the inversions and the numbers of tied pairs.
+    """
+    n = len(x)
+    if n < 2:
+        return 0
+    order = np.lexsort((y, x))
+    # Earlier elements with a larger y are the inversions (discordant pairs)
+    swaps = int(count_smaller_before(-y[order]).sum())
+    n0 = n * (n - 1) // 2
+    n1 = _tied_pairs(x)
+    n2 = _tied_pairs(y)
+    n3 = _tied_pairs(x, y)
+    return int(round(n0 - n1 - n2 + n3 - 2 * swaps))
+
+
+def kendall_tau_b(x, y, s=None):
+    """
+    Kendall tau-b and its normal-approximation p-value.
+    :param x: 1-d complete array
+    :param y: 1-d complete array
+    :param s: optional pre-computed Kendall score for (x, y)
+    :return: (tau_b, p_value)
+    """
+    n = len(x)
+    if n < 2:
+        return np.nan, np.nan
+    if s is None:
+        s = kendall_s(x, y)
+    return kendall_from_score(s, n, midranks(x)[1], midranks(y)[1])
+
+
+def kendall_from_score(s, n, x_ties, y_ties):
+    """
+    Kendall tau-b and its p-value from the score S and the sizes of the groups of tied values.
+    :param s: Kendall score
+    :param n: number of observations
+    :param x_ties: sizes of the groups of equal x values (groups of one may be included)
+    :param y_ties: sizes of the groups of equal y values
+    :return: (tau_b, p_value)
+    """
+    if n < 2:
+        return np.nan, np.nan
+    t = np.asarray(x_ties, dtype=float)
+    u = np.asarray(y_ties, dtype=float)
+
+    n0 = n * (n - 1) / 2.0
+    n1 = (t * (t - 1)).sum() / 2.0
+    n2 = (u * (u - 1)).sum() / 2.0
+    denominator = math.sqrt((n0 - n1) * (n0 - n2))
+    if denominator == 0:
+        return np.nan, np.nan
+    tau = s / denominator
+
+    if n < 3:
+        return tau, np.nan
+    v0 = n * (n - 1) * (2 * n + 5)
+    vt = (t * (t - 1) * (2 * t + 5)).sum()
+    vu = (u * (u - 1) * (2 * u + 5)).sum()
+    v1 = (t * (t - 1)).sum() * (u * (u - 1)).sum()
+    v2 = (t * (t - 1) * (t - 2)).sum() * (u * (u - 1) * (u - 2)).sum()
+    variance = (v0 - vt - vu) / 18.0 + v1 / (2.0 * n * (n - 1)) + v2 / (9.0 * n * (n - 1) * (n - 2))
+    if variance <= 0:
+        return tau, np.nan
+    z = s / math.sqrt(variance)
+    return tau, math.erfc(abs(z) / math.sqrt(2.0))
+
+
+def _smaller_within_groups(group, values):
+    """For every element, the number of elements with the same group value and a smaller value."""
+    order = np.lexsort((values, group))
+    group_sorted = group[order]
+    values_sorted = values[order]
+    smaller = np.empty(len(group))
+    smaller[order] = _group_starts(group_sorted, values_sorted) - _group_starts(group_sorted)
+    return smaller
+
+
+def bivariate_ranks(x, y):
+    """
+    Hoeffding bivariate ranks Q: 1 plus the number of points with both values less than the ith point.
+    Points tied on one value count 1/2, points tied on both count 1/4.
+    """
+    n = len(x)
+    # Sorting by x, then by descending y, leaves the points below and to the left as earlier, smaller y
+    order = np.lexsort((-y, x))
+    both_smaller = np.empty(n)
+    both_smaller[order] = count_smaller_before(y[order])
+
+    order = np.lexsort((y, x))
+    starts = _group_starts(x[order], y[order])
+    both_tied = np.empty(n)
+    both_tied[order] = np.bincount(starts, minlength=n)[starts] - 1
+
+    return 1.0 + both_smaller + 0.5 * (_smaller_within_groups(x, y) + _smaller_within_groups(y, x)) + \
+        0.25 * both_tied
+
+
+def hoeffding_d(x, y, q=None):
+    """
+    Hoeffding dependence coefficient D, scaled by 30 as in PROC CORR.
+    :param x: 1-d complete array
+    :param y: 1-d complete array
+    :param q: optional pre-computed bivariate ranks for (x, y)
+    :return: D, or NaN when fewer than five observations are available
+    """
+    n = len(x)
+    if n < 5:
+        return np.nan
+    if q is None:
+        q = bivariate_ranks(x, y)
+    return hoeffding_from_ranks(n, midranks(x)[0], midranks(y)[0], q)
+
+
+def hoeffding_from_ranks(n, r, s, q, weights=None):
+    """
+    Hoeffding D from the mid-ranks R and S and the bivariate ranks Q of the observations.
+    :param n: number of observations
+    :param r: x mid-ranks
+    :param s: y mid-ranks
+    :param q: bivariate ranks
+    :param weights: optional number of observations sharing each (r, s, q) triple
+    :return: D, or NaN when fewer than five observations are available
+    """
+    if n < 5:
+        return np.nan
+    w = 1.0 if weights is None else weights
+    d1 = (w * (q - 1) * (q - 2)).sum()
+    d2 = (w * (r - 1) * (r - 2) * (s - 1) * (s - 2)).sum()
+    d3 = (w * (r - 2) * (s - 2) * (q - 1)).sum()
+    numerator = (n - 2) * (n - 3) * d1 + d2 - 2 * (n - 2) * d3
+    return float(30.0 * numerator / (n * (n - 1) * (n - 2) * (n - 3) * (n - 4)))
+
+
+def _pair_statistics(x, y, statistics, x_ranks=None, y_ranks=None):
+    """
+    Compute the requested coefficients and p-values for one pair of complete arrays.
+    :param x_ranks: optional pre-computed midranks(x), shared with the other pairs of the field
+    :param y_ranks: optional pre-computed midranks(y)
+    """
+    n = len(x)
+    values = {}
+    if "PEARSON" in statistics:
+        r = pearson(x, y) if n > 1 else np.nan
+        values["PEARSON"] = (r, t_probability(r, n))
+    if set(statistics) - {"PEARSON"}:
+        rx, tx = x_ranks if x_ranks is not None else midranks(x)
+        ry, ty = y_ranks if y_ranks is not None else midranks(y)
+    if "SPEARMAN" in statistics:
+        r = pearson(rx, ry) if n > 1 else np.nan
+        values["SPEARMAN"] = (r, t_probability(r, n))
+    if "KENDALL" in statistics:
+        values["KENDALL"] = kendall_from_score(kendall_s(rx, ry), n, tx, ty) if n > 1 else (np.nan, np.nan)
+    if "HOEFFDING" in statistics:
+        values["HOEFFDING"] = (hoeffding_from_ranks(n, rx, ry, bivariate_ranks(rx, ry)) if n > 4 else np.nan,
+                               np.nan)
+    return values
+
+
+def field_tiles(k, tile_size=TILE_SIZE):
+    """Split the upper triangle of a k x k matrix into (rows, columns) tiles of field indexes."""
+    starts = range(0, k, tile_size)
+    return [(range(i, min(i + tile_size, k)), range(j, min(j + tile_size, k)))
+            for i in starts for j in starts if j >= i]
+
+
+_tile_state = None
+
+
+def _init_tile_worker(columns, present, ranks, statistics):
+    global _tile_state
+    _tile_state = (columns, present, ranks, statistics)
+
+
+def _compute_tile(tile, state=None):
+    """Compute every pair (i <= j) of a tile; returns a list of (i, j, values)."""
+    columns, present, ranks, statistics = state or _tile_state
+    rows, tile_columns = tile
+    results = []
+    for i in rows:
+        for j in tile_columns:
+            # The diagonal only depends on the field's own ranks and is filled by correlate()
+            if j <= i:
+                continue
+            mask = present[i] & present[j]
+            # Ranks computed over a field's present values can be shared when the pair drops no rows
+            x_ranks = ranks[i] if mask.sum() == present[i].sum() else None
+            y_ranks = ranks[j] if mask.sum() == present[j].sum() else None
+            results.append((i, j, _pair_statistics(columns[i][mask], columns[j][mask], statistics, x_ranks, y_ranks)))
+    return results
+
+
+def _pair_counts(present, chunk_size=CHUNK_SIZE):
+    """Number of observations where both variables are present, for every pair; one chunk of rows at a time."""
+    k = len(present)
+    rows = len(present[0]) if k else 0
+    pair_n = np.zeros((k, k), dtype=np.int64)
+    for start in range(0, rows, chunk_size):
+        block = np.array([mask[start:start + chunk_size] for mask in present], dtype=np.int64)
+        pair_n += block @ block.T
+    return pair_n
+
+
+def process_pool(workers, **kwargs):
+    """Return a ProcessPoolExecutor that also works from inside ArcGIS Pro."""
+    # ArcGIS Pro embeds Python, so worker processes must be started with the real interpreter
+    if sys.platform == "win32":
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix, "python.exe"))
+    return concurrent.futures.ProcessPoolExecutor(workers, **kwargs)
+
+
+def correlate(data, var_names, statistics=STATISTICS, workers=1, tile_size=TILE_SIZE):
+    """
+    Compute PROC CORR style statistics for the columns of a 2-d array.
+    :param data: 2-d float array (rows = observations, columns = variables), or a list of 1-d float columns
+                 such as the memory maps of the field cache, which are read in place; missing values as NaN
+    :param var_names: variable names, one per column
+    :param statistics: iterable of statistic names from STATISTICS
+    :param workers: number of worker processes the field tiles are scheduled over
+    :param tile_size: number of fields along each side of a tile
+    :return: CorrelationResult
+    """
+    if isinstance(data, np.ndarray):
+        columns = list(np.asarray(data, dtype=float).T)
+    else:
+        columns = [np.asarray(column, dtype=float) for column in data]
+    statistics = [stat.upper() for stat in statistics]
+    k = len(columns)
+    present = [~np.isnan(column) for column in columns]
+
+    ##### Univariate simple statistics #####
+    n = np.array([mask.sum() for mask in present], dtype=np.int64)
+    mean = np.array([columns[i][present[i]].mean() if n[i] else np.nan for i in range(k)])
+    std = np.array([columns[i][present[i]].std(ddof=1) if n[i] > 1 else np.nan for i in range(k)])
+    pair_n = _pair_counts(present, CHUNK_SIZE)
+
+    coefficients = {stat: np.full((k, k), np.nan) for stat in statistics}
+    probabilities = {stat: np.full((k, k), np.nan) for stat in statistics}
+
+    ##### Ranks computed once per field #####
+    ranks = [midranks(columns[i][present[i]]) for i in range(k)]
+
+    ##### Pairwise statistics (pairwise deletion of missing values), tile by tile #####
+    tiles = field_tiles(k, tile_size)
+    state = (columns, present, ranks, statistics)
+    if workers > 1 and len(tiles) > 1:
+        with process_pool(min(workers, len(tiles)), initializer=_init_tile_worker, initargs=state) as executor:
+            tile_results = list(executor.map(_compute_tile, tiles))
+    else:
+        tile_results = [_compute_tile(tile, state) for tile in tiles]
+
+    for results in tile_results:
+        for i, j, values in results:
+            for stat, (coefficient, probability) in values.items():
+                coefficients[stat][i, j] = coefficients[stat][j, i] = coefficient
+                probabilities[stat][i, j] = probabilities[stat][j, i] = probability
+
+    for i in range(k):
+        for stat in ("PEARSON", "SPEARMAN", "KENDALL"):
+            # A variable is perfectly correlated with itself; the p-value is reported as missing
+            if stat in coefficients and pair_n[i, i] > 1:
+                coefficients[stat][i, i] = 1.0
+                probabilities[stat][i, i] = np.nan
+        # Hoeffding D of a variable with itself is 1 without ties and less with them, as PROC CORR reports it
+        if "HOEFFDING" in coefficients and pair_n[i, i] > 4:
+            coefficients["HOEFFDING"][i, i] = hoeffding_from_ranks(pair_n[i, i], ranks[i][0], ranks[i][0],
+                                                                   bivariate_ranks(ranks[i][0], ranks[i][0]))
+
+    return CorrelationResult(var_names, n, mean, std, pair_n, coefficients, probabilities)
+
+
+def outs_rows(result, statistic="SPEARMAN"):
+    """
+    Build the rows of a PROC CORR output data set (OUTP=, OUTS=, OUTK= or OUTH=).
+    :param result: CorrelationResult
+    :param statistic: statistic written to the CORR rows
+    :return: list of (_TYPE_, _NAME_, [values...]) tuples
+    """
+    rows = [("MEAN", "", list(result.mean)),
+            ("STD", "", list(result.std))]
+
+    # PROC CORR writes a single N row unless pairwise deletion produced different counts
+    if np.all(result.pair_n == result.pair_n[0, 0]):
+        rows.append(("N", "", list(result.n.astype(float))))
+    else:
+        for name, counts in zip(result.var_names, result.pair_n):
+            rows.append(("N", name, list(counts.astype(float))))
+
+    for name, coefficients in zip(result.var_names, result.coefficients[statistic]):
+        rows.append(("CORR", name, list(coefficients)))
+    return rows
+
+
+def format_listing(result):
+    """
+    Format the correlation matrices as text lines, in the spirit of the PROC CORR listing.
+    :param result: CorrelationResult
+    :return: list of lines
+    """
+    titles = {"PEARSON": "Pearson Correlation Coefficients",
+              "SPEARMAN": "Spearman Correlation Coefficients",
+              "KENDALL": "Kendall Tau b Correlation Coefficients",
+              "HOEFFDING": "Hoeffding Dependence Coefficients"}
+    width = max([12] + [len(name) + 2 for name in result.var_names])
+
+    def cell(value):
+        return "{0:>{1}}".format("." if np.isnan(value) else "{0:.5f}".format(value), width)
+
+    lines = ["Simple Statistics",
+             "{0:<{1}}{2:>{1}}{3:>{1}}{4:>{1}}".format("Variable", width, "N", "Mean", "Std Dev")]
+    for i, name in enumerate(result.var_names):
+        lines.append("{0:<{1}}{2:>{1}}".format(name, width, int(result.n[i])) + cell(result.mean[i]) +
+                     cell(result.std[i]))
+
+    header = " " * width + "".join("{0:>{1}}".format(name, width) for name in result.var_names)
+    for stat in result.coefficients:
+        lines.extend(["", titles[stat]])
+        if stat == "KENDALL":
+            lines.append("Prob > |tau| under H0: Tau=0")
+        elif stat != "HOEFFDING":
+            lines.append("Prob > |r| under H0: Rho=0")
+        lines.append(header)
+        for i, name in enumerate(result.var_names):
+            lines.append("{0:<{1}}".format(name, width) + "".join(cell(v) for v in result.coefficients[stat][i]))
+            if stat != "HOEFFDING":
+                lines.append(" " * width + "".join(cell(v) for v in result.probabilities[stat][i]))
+    return lines
+
+
+def read_numeric_fields(in_table, field_names):
+    """
+    Read numeric fields from a table or feature layer into a 2-d float array, nulls as NaN.
+    :param in_table: table, feature class or layer
+    :param field_names: list of field names
+    :return: 2-d float array
+    """
+    import arcpy
+
+    with arcpy.da.SearchCursor(in_table, field_names) as cursor:
+        rows = list(cursor)
+    return np.array(rows, dtype=float).reshape(len(rows), len(field_names))
+
+
+def write_outs_table(rows, var_names, out_table):
+    """
+    Write PROC CORR output data set rows to a geodatabase or dBASE table, or in bulk to a GeoPackage, SQLite
+    or Parquet table (see bulk_output.py).
+    :param rows: rows returned by outs_rows
+    :param var_names: variable names, one per value column
+    :param out_table: output table path
+    :return: out_table
+    """
+    import arcpy
+
+    workspace = os.path.dirname(out_table)
+    type_field = arcpy.ValidateFieldName("_TYPE_", workspace)
+    name_field = arcpy.ValidateFieldName("_NAME_", workspace)
+    name_length = max([8] + [len(name) for name in var_names])
+    dtype = [(str(type_field), "U8"), (str(name_field), "U{0}".format(name_length))] + \
+            [(str(arcpy.ValidateFieldName(name, workspace)), "<f8") for name in var_names]
+
+    array = np.array([(row_type, row_name) + tuple(values) for row_type, row_name, values in rows], dtype=dtype)
+    return bulk_output.write_table(array, out_table)
@@ -0,0 +1,384 @@
+"""
+Source Name: corr_streaming.py
+Author: ESRI
+
+Chunked, bounded-memory version of the corr_engine statistics for tables that do not fit in memory.
+
+The input is read in fixed-size batches and folded into one-pass accumulators. Every accumulator has
+a merge() method, so partial results computed by worker processes over disjoint row ranges combine
+into the same answer a single pass would give.
+
+- MomentAccumulator keeps pairwise counts, means and co-moments (Welford/Chan updates) for Pearson
+  and the simple statistics, with pairwise deletion of missing values.
+- FieldSketch records the distinct values of a field, up to a limit, and a mergeable bottom-k
+  random sample used to pick quantile bin edges once a field has more distinct values than that.
+  The sample is seeded from the field name and the row range, so a run gives the same bin edges,
+  and the same rank statistics, every time.
+- RankAccumulator keeps a bins x bins contingency table per pair of fields. Spearman, Kendall tau-b
+  and Hoeffding D are computed from the tables. They are exact for fields with at most `max_bins`
+  distinct values; otherwise values within a quantile bin are treated as ties, and the field is listed
+  in the `binned` attribute of the result so the caller can warn that its rank statistics are
+  approximate.
+
+Rank statistics need two passes over the input: the first builds the sketches and the bin edges,
+the second fills the contingency tables.
+"""
+
+import zlib
+
+import numpy as np
+
+import corr_engine
+
+
+CHUNK_SIZE = 100000
+MAX_BINS = 64
+SAMPLE_SIZE = 4096
+
+
+class MomentAccumulator(object):
+    """Pairwise counts, means, sums of squares and co-moments of k variables."""
+
+    def __init__(self, k):
+        self.k = k
+        self.n = np.zeros((k, k))
+        # mean[i, j] and m2[i, j] describe variable i over the rows where i and j are both present
+        self.mean = np.zeros((k, k))
+        self.m2 = np.zeros((k, k))
+        self.comoment = np.zeros((k, k))
+
+    def update(self, chunk):
+        """Fold a 2-d float chunk (missing values as NaN) into the accumulator."""
+        chunk = np.asarray(chunk, dtype=float)
+        if not len(chunk):
+            return
+        present = (~np.isnan(chunk)).astype(float)
+        # Shift by the chunk column means to keep the chunk sums well conditioned
+        shift = np.nanmean(np.where(present > 0, chunk, np.nan), axis=0)
+        shift = np.where(np.isnan(shift), 0.0, shift)
+        x = np.where(present > 0, chunk - shift, 0.0)
+
+        n = present.T @ present
+        sums = x.T @ present
+        squares = (x * x).T @ present
+        cross = x.T @ x
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = np.where(n > 0, sums / n, 0.0)
+        other = MomentAccumulator(self.k)
+        other.n = n
+        other.mean = mean + shift[:, None]
+        other.m2 = squares - mean * sums
+        other.comoment = cross - mean * sums.T
+        self.merge(other)
+
+    def merge(self, other):
+        """Combine with an accumulator built over a disjoint set of rows (Chan et al.)."""
+        n = self.n + other.n
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(n > 0, self.n * other.n / n, 0.0)
+            delta = other.mean - self.mean
+            self.mean = np.where(n > 0, self.mean + delta * np.where(n > 0, other.n / n, 0.0), 0.0)
+        self.m2 = self.m2 + other.m2 + delta * delta * weight
+        self.comoment = self.comoment + other.comoment + delta * delta.T * weight
+        self.n = n
+        return self
+
+    def simple_statistics(self):
+        """Return (n, mean, std) per variable."""
+        n = np.diag(self.n).copy()
+        mean = np.where(n > 0, np.diag(self.mean), np.nan)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            std = np.where(n > 1, np.sqrt(np.diag(self.m2) / (n - 1)), np.nan)
+        return n, mean, std
+
+    def pearson(self):
+        """Return the Pearson correlation and p-value matrices."""
+        with np.errstate(invalid="ignore", divide="ignore"):
+            r = self.comoment / np.sqrt(self.m2 * self.m2.T)
+        r = np.clip(np.where(np.isfinite(r), r, np.nan), -1.0, 1.0)
+        p = np.vectorize(corr_engine.t_probability)(r, self.n)
+        np.fill_diagonal(p, np.nan)
+        return r, p
+
+
+def sketch_seed(field_name, where_clause=None):
+    """Seed of the sample of a field over one row range: stable across runs and processes, unlike hash()."""
+    return [zlib.crc32(field_name.encode("utf-8")), zlib.crc32((where_clause or "").encode("utf-8"))]
+
+
+class FieldSketch(object):
+    """Distinct values (up to max_bins) and a bottom-k random sample of one field."""
+
+    def __init__(self, max_bins=MAX_BINS, sample_size=SAMPLE_SIZE, seed=None):
+        self.max_bins = max_bins
+        self.sample_size = sample_size
+        self.distinct = np.empty(0)
+        self.sample_keys = np.empty(0)
+        self.sample_values = np.empty(0)
+        self._rng = np.random.default_rng(seed)
+
+    def update(self, values):
+        values = values[~np.isnan(values)]
+        if self.distinct is not None:
+            self.distinct = np.union1d(self.distinct, values)
+            if len(self.distinct) > self.max_bins:
+                self.distinct = None
+        self._keep_smallest(self._rng.random(len(values)), values)
+
+    def _keep_smallest(self, keys, values):
+        keys = np.concatenate((self.sample_keys, keys))
+        values = np.concatenate((self.sample_values, values))
+        if len(keys) > self.sample_size:
+            keep = np.argpartition(keys, self.sample_size)[:self.sample_size]
+            keys, values = keys[keep], values[keep]
+        self.sample_keys, self.sample_values = keys, values
+
+    def merge(self, other):
+        if self.distinct is not None and other.distinct is not None:
+            self.distinct = np.union1d(self.distinct, other.distinct)
+            if len(self.distinct) > self.max_bins:
+                self.distinct = None
+        else:
+            self.distinct = None
+        self._keep_smallest(other.sample_keys, other.sample_values)
+        return self
+
+    @property
+    def exact(self):
+        return self.distinct is not None
+
+    def cut_points(self):
+        """Interior bin boundaries; a value v falls in bin searchsorted(cut_points, v, 'right')."""
+        if self.exact:
+            return self.distinct[1:]
+        quantiles = np.quantile(self.sample_values, np.linspace(0, 1, self.max_bins + 1)[1:-1])
+        return np.unique(quantiles)
+
+
+class RankAccumulator(object):
+    """Bin-by-bin contingency tables for every pair of fields."""
+
+    def __init__(self, cut_points):
+        self.cut_points = [np.asarray(cuts, dtype=float) for cuts in cut_points]
+        self.bins = [len(cuts) + 1 for cuts in self.cut_points]
+        k = len(self.cut_points)
+        self.pairs = [(i, j) for i in range(k) for j in range(i, k)]
+        self.tables = {(i, j): np.zeros((self.bins[i], self.bins[j]), dtype=np.int64) for i, j in self.pairs}
+
+    def update(self, chunk):
+        chunk = np.asarray(chunk, dtype=float)
+        present = ~np.isnan(chunk)
+        index = [np.searchsorted(cuts, chunk[:, i], side="right") for i, cuts in enumerate(self.cut_points)]
+        for i, j in self.pairs:
+            mask = present[:, i] & present[:, j]
+            flat = index[i][mask] * self.bins[j] + index[j][mask]
+            self.tables[i, j] += np.bincount(flat, minlength=self.bins[i] * self.bins[j]).reshape(
+                self.bins[i], self.bins[j])
+
+    def merge(self, other):
+        for pair in self.pairs:
+            self.tables[pair] += other.tables[pair]
+        return self
+
+
+def _suffix_sum(table):
+    """S[a, b] = sum of table[a:, b:] with a zero row and column appended."""
+    padded = np.zeros((table.shape[0] + 1, table.shape[1] + 1))
+    padded[:-1, :-1] = table[::-1, ::-1].cumsum(axis=0).cumsum(axis=1)[::-1, ::-1]
+    return padded
+
+
+def _prefix_sum(table):
+    """P[a, b] = sum of table[:a, :b] with a zero row and column prepended."""
+    padded = np.zeros((table.shape[0] + 1, table.shape[1] + 1))
+    padded[1:, 1:] = table.cumsum(axis=0).cumsum(axis=1)
+    return padded
+
+
+def table_statistics(table):
+    """
+    Spearman, Kendall tau-b and Hoeffding D from a contingency table of binned values.
+    :param table: 2-d array of counts, rows = x bins, columns = y bins
+    :return: dict of statistic name -> (coefficient, p_value)
+    """
+    table = np.asarray(table, dtype=float)
+    n = int(table.sum())
+    rows = table.sum(axis=1)
+    cols = table.sum(axis=0)
+    rank_x = np.cumsum(rows) - rows + (rows + 1) / 2.0
+    rank_y = np.cumsum(cols) - cols + (cols + 1) / 2.0
+
+    ##### Spearman: Pearson correlation of the bin mid-ranks, weighted by the counts #####
+    dx = rank_x - (n + 1) / 2.0
+    dy = rank_y - (n + 1) / 2.0
+    denominator = np.sqrt((rows * dx * dx).sum() * (cols * dy * dy).sum())
+    spearman = float(dx @ table @ dy / denominator) if denominator > 0 else np.nan
+
+    ##### Kendall: concordant minus discordant pairs #####
+    # Pairs with a larger x bin and a larger y bin
+    concordant = _suffix_sum(table)[1:, 1:]
+    # Pairs with a larger x bin and a smaller y bin
+    larger_x = np.vstack((table[::-1].cumsum(axis=0)[::-1][1:], np.zeros((1, table.shape[1]))))
+    discordant = larger_x.cumsum(axis=1) - larger_x
+    s = (table * concordant).sum() - (table * discordant).sum()
+    kendall = corr_engine.kendall_from_score(s, n, rows[rows > 0], cols[cols > 0])
+
+    ##### Hoeffding: bivariate ranks per occupied cell #####
+    prefix = _prefix_sum(table)
+    below_both = prefix[:-1, :-1]
+    same_row_left = table.cumsum(axis=1) - table
+    same_col_below = table.cumsum(axis=0) - table
+    q = 1.0 + below_both + 0.5 * (same_row_left + same_col_below) + 0.25 * (table - 1)
+    occupied = table > 0
+    a, b = np.nonzero(occupied)
+    hoeffding = corr_engine.hoeffding_from_ranks(n, rank_x[a], rank_y[b], q[occupied], table[occupied])
+
+    return {"SPEARMAN": (spearman, corr_engine.t_probability(spearman, n)),
+            "KENDALL": kendall,
+            "HOEFFDING": (hoeffding, np.nan)}
+
+
+def iter_chunks(in_table, field_names, chunk_size=CHUNK_SIZE, where_clause=None):
+    """
+    Read fields from a table in batches of chunk_size rows, nulls as NaN.
+    :return: generator of 2-d float arrays
+    """
+    import arcpy
+
+    with arcpy.da.SearchCursor(in_table, field_names, where_clause) as cursor:
+        rows = []
+        for row in cursor:
+            rows.append(row)
+            if len(rows) == chunk_size:
+                yield np.array(rows, dtype=float).reshape(len(rows), len(field_names))
+                rows = []
+        if rows:
+            yield np.array(rows, dtype=float).reshape(len(rows), len(field_names))
+
+
+def oid_ranges(in_table, parts):
+    """Split a table into `parts` where clauses over contiguous ObjectID ranges."""
+    import arcpy
+
+    oid_field = arcpy.Describe(in_table).OIDFieldName
+    low, high = None, None
+    with arcpy.da.SearchCursor(in_table, ["OID@"]) as cursor:
+        for (oid,) in cursor:
+            low = oid if low is None else min(low, oid)
+            high = oid if high is None else max(high, oid)
+    if low is None:
+        return [None]
+    bounds = np.linspace(low, high + 1, parts + 1).astype(np.int64)
+    return ["{0} >= {1} AND {0} < {2}".format(oid_field, start, stop)
+            for start, stop in zip(bounds[:-1], bounds[1:]) if stop > start]
+
+
+def first_pass(in_table, field_names, where_clause=None, chunk_size=CHUNK_SIZE, max_bins=MAX_BINS):
+    """Build the moment accumulator and field sketches for one row range (worker entry point)."""
+    moments = MomentAccumulator(len(field_names))
+    sketches = [FieldSketch(max_bins, seed=sketch_seed(name, where_clause)) for name in field_names]
+    for chunk in iter_chunks(in_table, field_names, chunk_size, where_clause):
+        moments.update(chunk)
+        for i, sketch in enumerate(sketches):
+            sketch.update(chunk[:, i])
+    return moments, sketches
+
+
+def second_pass(in_table, field_names, cut_points, where_clause=None, chunk_size=CHUNK_SIZE):
+    """Build the contingency tables for one row range (worker entry point)."""
+    ranks = RankAccumulator(cut_points)
+    for chunk in iter_chunks(in_table, field_names, chunk_size, where_clause):
+        ranks.update(chunk)
+    return ranks
+
+
+def _worker_source(in_table, workers):
+    """
+    Worker processes cannot see layers of the calling process, so they read the layer's data source.
+    Layers with a selection are read in this process only.
+    """
+    import arcpy
+
+    description = arcpy.Describe(in_table)
+    if getattr(description, "dataType", "") in ("FeatureLayer", "TableView"):
+        if getattr(description, "FIDSet", ""):
+            return in_table, 1
+        return description.catalogPath, workers
+    return in_table, workers
+
+
+def _run(function, jobs, workers):
+    """Run function(*job) for every job, in worker processes when workers > 1."""
+    if workers <= 1 or len(jobs) <= 1:
+        return [function(*job) for job in jobs]
+    with corr_engine.process_pool(workers) as executor:
+        return list(executor.map(function, *zip(*jobs)))
+
+
+def correlate_table(in_table, field_names, statistics=corr_engine.STATISTICS, chunk_size=CHUNK_SIZE,
+                    workers=1, max_bins=MAX_BINS):
+    """
+    Compute PROC CORR style statistics for fields of a table with bounded memory.
+    :param in_table: table, feature class or layer
+    :param field_names: list of numeric field names
+    :param statistics: iterable of statistic names from corr_engine.STATISTICS
+    :param chunk_size: number of rows read per batch
+    :param workers: number of worker processes, each reading its own ObjectID range
+    :param max_bins: maximum bins per field for the rank statistics
+    :return: corr_engine.CorrelationResult
+    """
+    statistics = [stat.upper() for stat in statistics]
+    if workers > 1:
+        in_table, workers = _worker_source(in_table, workers)
+    where_clauses = oid_ranges(in_table, workers) if workers > 1 else [None]
+
+    ##### Pass 1: moments and sketches #####
+    partials = _run(first_pass, [(in_table, field_names, where, chunk_size, max_bins) for where in where_clauses],
+                    workers)
+    moments, sketches = partials[0]
+    for other_moments, other_sketches in partials[1:]:
+        moments.merge(other_moments)
+        for sketch, other in zip(sketches, other_sketches):
+            sketch.merge(other)
+
+    ##### Pass 2: contingency tables for the rank statistics #####
+    ranks = None
+    if set(statistics) - {"PEARSON"}:
+        cut_points = [sketch.cut_points() for sketch in sketches]
+        partials = _run(second_pass, [(in_table, field_names, cut_points, where, chunk_size)
+                                      for where in where_clauses], workers)
+        ranks = partials[0]
+        for other in partials[1:]:
+            ranks.merge(other)
+
+    ##### Fields with more distinct values than bins have approximate rank statistics #####
+    binned = [name for name, sketch in zip(field_names, sketches) if not sketch.exact] if ranks is not None else []
+    return accumulated_result(field_names, statistics, moments, ranks, binned)
+
+
+def accumulated_result(var_names, statistics, moments, ranks=None, binned=()):
+    """
+    Turn merged accumulators into a corr_engine.CorrelationResult.
+    :param binned: names of the variables whose rank statistics were computed from quantile bins
+    """
+    k = len(var_names)
+    n, mean, std = moments.simple_statistics()
+    coefficients = {stat: np.full((k, k), np.nan) for stat in statistics}
+    probabilities = {stat: np.full((k, k), np.nan) for stat in statistics}
+
+    if "PEARSON" in statistics:
+        coefficients["PEARSON"], probabilities["PEARSON"] = moments.pearson()
+
+    if ranks is not None:
+        for i, j in ranks.pairs:
+            values = table_statistics(ranks.tables[i, j])
+            for stat in statistics:
+                if stat in values:
+                    coefficients[stat][i, j] = coefficients[stat][j, i] = values[stat][0]
+                    probabilities[stat][i, j] = probabilities[stat][j, i] = values[stat][1]
+        for stat in ("SPEARMAN", "KENDALL"):
+            if stat in coefficients:
+                np.fill_diagonal(probabilities[stat], np.nan)
+
+    return corr_engine.CorrelationResult(var_names, n.astype(np.int64), mean, std,
+                                         moments.n.astype(np.int64), coefficients, probabilities, binned)
@@ -0,0 +1,14 @@
+"""
+Source Name: esri_common.py
+Author: ESRI
+
+Puts the modules shared by the ESRI tools (Projects/esri/common) on the import path. Import it before them.
+"""
+
+import os
+import sys
+
+COMMON_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, os.pardir,
+                                           "common"))
+if COMMON_DIR not in sys.path:
+    sys.path.append(COMMON_DIR)
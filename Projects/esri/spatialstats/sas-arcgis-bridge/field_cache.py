@@ -0,0 +1,253 @@
+"""
+Source Name: field_cache.py
+Author: ESRI
+
+Columnar cache of numeric attribute fields for the SAS geoprocessing tools.
+
+Each numeric field of a source table is extracted once into a float64 .npy file (nulls as NaN) next to
+an ObjectID column, in a directory per source table. Later runs open only the fields they need as
+read-only memory maps, so nothing is copied until the values are used.
+
+A source is identified by its catalog path and a change stamp:
+- shapefiles, dBASE tables, file geodatabases, GeoPackage and SQLite tables: latest modification time and
+  total size of their files (Projects/esri/common/change_stamp.py; any edit in a geodatabase invalidates
+  its tables)
+- other sources with editor tracking: row count and latest edit date
+Sources without a change stamp, and layers with a selection or definition query, are read directly.
+
+The cache directory is kept under a disk budget by deleting the least recently read fields first; the ObjectID
+column of a source is kept while any of its fields is cached.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+import esri_common  # puts Projects/esri/common on the import path
+import change_stamp
+
+
+DEFAULT_CACHE_DIR = os.path.join(tempfile.gettempdir(), "SASFieldCache")
+DEFAULT_MAX_BYTES = 2 * 1024 * 1024 * 1024
+CHUNK_SIZE = 100000
+OID_COLUMN = "__OID__"
+
+
+def source_info(in_table):
+    """
+    Resolve a table or layer to (catalog_path, change_stamp).
+    :return: (catalog_path, stamp), or (catalog_path, None) when the source cannot be cached
+    """
+    import arcpy
+
+    description = arcpy.Describe(in_table)
+    catalog_path = description.catalogPath
+    if getattr(description, "FIDSet", "") or getattr(description, "whereClause", ""):
+        return catalog_path, None
+
+    stamp = change_stamp.dataset_stamp(catalog_path)
+    if stamp is not None:
+        return catalog_path, stamp
+    if getattr(description, "editorTrackingEnabled", False) and description.editedAtFieldName:
+        edited_at = None
+        rows = 0
+        with arcpy.da.SearchCursor(catalog_path, [description.editedAtFieldName]) as cursor:
+            for (value,) in cursor:
+                rows += 1
+                if value is not None and (edited_at is None or value > edited_at):
+                    edited_at = value
+        return catalog_path, "{0}:{1}".format(rows, edited_at)
+    return catalog_path, None
+
+
+def _read_rows(in_table, field_names, chunk_size=CHUNK_SIZE):
+    """Read fields straight from the source in chunks of float rows, nulls as NaN."""
+    import arcpy
+
+    with arcpy.da.SearchCursor(in_table, field_names) as cursor:
+        rows = []
+        for row in cursor:
+            rows.append(row)
+            if len(rows) == chunk_size:
+                yield np.array(rows, dtype=float).reshape(len(rows), len(field_names))
+                rows = []
+        if rows:
+            yield np.array(rows, dtype=float).reshape(len(rows), len(field_names))
+
+
+class FieldCache(object):
+    """Memory-mapped .npy columns per source table and field."""
+
+    def __init__(self, directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _source_dir(self, catalog_path):
+        key = hashlib.sha1(os.path.normcase(catalog_path).encode("utf-8")).hexdigest()
+        return os.path.join(self.directory, key)
+
+    @staticmethod
+    def _column_path(source_dir, field_name):
+        return os.path.join(source_dir, "{0}.npy".format(field_name.upper()))
+
+    def _prepare(self, source_dir, catalog_path, stamp):
+        """Create the source directory, wiping columns written for an older change stamp."""
+        meta_path = os.path.join(source_dir, "meta.json")
+        if os.path.isfile(meta_path):
+            with open(meta_path) as meta_file:
+                if json.load(meta_file).get("stamp") == stamp:
+                    return
+            shutil.rmtree(source_dir, ignore_errors=True)
+        os.makedirs(source_dir, exist_ok=True)
+        with open(meta_path, "w") as meta_file:
+            json.dump({"source": catalog_path, "stamp": stamp}, meta_file)
+
+    def _extract(self, catalog_path, source_dir, field_names):
+        """Read the missing fields in one cursor pass and write them as .npy columns."""
+        import arcpy
+
+        rows = int(arcpy.management.GetCount(catalog_path).getOutput(0))
+        names = [OID_COLUMN] + list(field_names)
+        temp_paths = ["{0}.{1}.tmp".format(self._column_path(source_dir, name), threading.get_ident())
+                      for name in names]
+        columns = [np.lib.format.open_memmap(path, mode="w+", dtype="<f8", shape=(rows,)) for path in temp_paths]
+        start = 0
+        overflow = False
+        for chunk in _read_rows(catalog_path, ["OID@"] + list(field_names)):
+            stop = start + len(chunk)
+            if stop > rows:
+                overflow = True
+                break
+            for i, column in enumerate(columns):
+                column[start:stop] = chunk[:, i]
+            start = stop
+        for column in columns:
+            column.flush()
+        del columns
+        if overflow or start != rows:
+            # The table changed while it was being read
+            for path in temp_paths:
+                os.remove(path)
+            return False
+
+        oid_path = self._column_path(source_dir, OID_COLUMN)
+        if os.path.isfile(oid_path) and not np.array_equal(np.load(oid_path, mmap_mode="r"),
+                                                           np.load(temp_paths[0], mmap_mode="r")):
+            # Cached columns were read in a different row order; keep only the new extraction
+            for name in os.listdir(source_dir):
+                if name.endswith(".npy"):
+                    os.remove(os.path.join(source_dir, name))
+        for name, path in zip(names, temp_paths):
+            os.replace(path, self._column_path(source_dir, name))
+        return True
+
+    def columns(self, in_table, field_names):
+        """
+        Return the fields of a table as read-only float64 memory maps, extracting missing ones first.
+        :param in_table: table, feature class or layer
+        :param field_names: list of numeric field names
+        :return: list of 1-d arrays, or None when the source cannot be cached
+        """
+        catalog_path, stamp = source_info(in_table)
+        if stamp is None:
+            return None
+        source_dir = self._source_dir(catalog_path)
+        with self._lock:
+            self._prepare(source_dir, catalog_path, stamp)
+            # A second extraction is needed when the first one found the cached rows in a different order
+            for _ in range(2):
+                missing = [name for name in field_names if not os.path.isfile(self._column_path(source_dir, name))]
+                if not missing:
+                    break
+                if not self._extract(catalog_path, source_dir, missing):
+                    return None
+            now = time.time()
+            columns = []
+            for name in field_names:
+                path = self._column_path(source_dir, name)
+                # The access time orders the columns for eviction
+                os.utime(path, (now, now))
+                columns.append(np.load(path, mmap_mode="r"))
+        self.evict()
+        return columns
+
+    def read(self, in_table, field_names):
+        """
+        Return the fields as a list of 1-d float arrays, through the cache when possible. Cached fields are the
+        memory maps themselves, so no column is copied; the others are columns of the rows read from the source.
+        """
+        columns = self.columns(in_table, field_names)
+        if columns is None:
+            chunks = list(_read_rows(in_table, field_names))
+            return list(np.vstack(chunks).T) if chunks else [np.empty(0) for _ in field_names]
+        return columns
+
+    def iter_chunks(self, in_table, field_names, chunk_size=CHUNK_SIZE):
+        """Yield the fields in chunks of rows, sliced from the memory maps when possible."""
+        columns = self.columns(in_table, field_names)
+        if columns is None:
+            for chunk in _read_rows(in_table, field_names, chunk_size):
+                yield chunk
+            return
+        rows = len(columns[0]) if columns else 0
+        for start in range(0, rows, chunk_size):
+            yield np.column_stack([column[start:start + chunk_size] for column in columns])
+
+    def evict(self):
+        """
+        Delete the least recently read columns while the cache is larger than max_bytes. The ObjectID column of a
+        source goes with its last field column, as the row order check of later extractions needs it.
+        """
+        oid_name = "{0}.npy".format(OID_COLUMN)
+        with self._lock:
+            entries = []
+            fields = {}
+            for root, _, names in os.walk(self.directory):
+                for name in names:
+                    if name.endswith(".npy") and name != oid_name:
+                        stat = os.stat(os.path.join(root, name))
+                        entries.append((stat.st_atime, stat.st_size, os.path.join(root, name)))
+                        fields[root] = fields.get(root, 0) + 1
+            oid_sizes = {root: os.stat(os.path.join(root, oid_name)).st_size for root in fields
+                         if os.path.isfile(os.path.join(root, oid_name))}
+            total = sum(size for _, size, _ in entries) + sum(oid_sizes.values())
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    # Still memory-mapped by a running analysis (Windows)
+                    continue
+                total -= size
+                root = os.path.dirname(path)
+                fields[root] -= 1
+                if not fields[root] and root in oid_sizes:
+                    try:
+                        os.remove(os.path.join(root, oid_name))
+                    except OSError:
+                        continue
+                    total -= oid_sizes[root]
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_cache(directory=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_MAX_BYTES):
+    """Return the process-wide field cache, creating it on first use."""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = FieldCache(directory, max_bytes)
+        else:
+            _cache.max_bytes = max_bytes
+        return _cache
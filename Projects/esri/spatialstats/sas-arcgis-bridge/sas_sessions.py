@@ -0,0 +1,162 @@
+"""
+Source Name: sas_sessions.py
+Author: ESRI
+
+Pool of warm saspy sessions shared by the SAS geoprocessing tools.
+
+Starting a SASsession is the slowest part of a SASCorr run, so the pool keeps a few sessions alive
+for the lifetime of the Python process (the ArcGIS Pro application or a standalone script) and
+hands them out one run at a time. All sessions are started from a single generated config file.
+
+Each session is health-checked before it is handed out and replaced when it no longer answers.
+Datasets registered for clean-up are deleted with PROC DATASETS when the session is returned.
+
+The session factory can be replaced, which lets the pool run against a fake session object that
+implements submit() and endsas() like saspy.SASsession.
+"""
+
+import atexit
+import contextlib
+import os
+import tempfile
+import threading
+
+
+HEALTH_CHECK_TOKEN = "SAS_SESSION_POOL_OK"
+
+
+class SASSessionPool(object):
+    """Keep up to `size` idle SAS sessions alive and reuse them across tool runs."""
+
+    def __init__(self, size=2, cfgfile=None, results="TEXT", session_factory=None, messages=None):
+        """
+        :param size: maximum number of idle sessions kept alive
+        :param cfgfile: saspy config file; generated once with saspy.autocfg when not given
+        :param results: saspy results format
+        :param session_factory: callable returning a new session; defaults to saspy.SASsession
+        :param messages: optional callable used to report pool activity (e.g. arcpy.AddMessage)
+        """
+        self.size = size
+        self.cfgfile = cfgfile
+        self.results = results
+        self.session_factory = session_factory or self._new_saspy_session
+        self.messages = messages or (lambda message: None)
+        self._idle = []
+        self._lock = threading.Lock()
+
+    def _config_file(self):
+        """Return the saspy config file, generating it the first time or when it was removed."""
+        if self.cfgfile is None or not os.path.isfile(self.cfgfile):
+            from saspy import autocfg
+
+            self.cfgfile = os.path.join(tempfile.gettempdir(), "sasConfig_{0}.py".format(os.getpid()))
+            autocfg.main(cfgfile=self.cfgfile)
+        return self.cfgfile
+
+    def _new_saspy_session(self):
+        import saspy
+
+        return saspy.SASsession(results=self.results, cfgfile=self._config_file())
+
+    def _is_alive(self, session):
+        """Submit a trivial statement and check that the session echoes it in the log."""
+        try:
+            result = session.submit("%put {0};".format(HEALTH_CHECK_TOKEN))
+        except Exception:
+            return False
+        return HEALTH_CHECK_TOKEN in (result or {}).get("LOG", "")
+
+    @staticmethod
+    def _end(session):
+        try:
+            session.endsas()
+        except Exception:
+            pass
+
+    def acquire(self, messages=None):
+        """
+        Return a healthy session, reusing an idle one when possible.
+        :param messages: optional callable reporting the pool activity of this call instead of self.messages
+        """
+        messages = messages or self.messages
+        while True:
+            with self._lock:
+                session = self._idle.pop() if self._idle else None
+            if session is None:
+                messages("Starting a new SAS session...")
+                return self.session_factory()
+            if self._is_alive(session):
+                return session
+            messages("Recycling an unresponsive SAS session...")
+            self._end(session)
+
+    def release(self, session, discard=False):
+        """
+        Return a session to the pool.
+        :param session: session obtained from acquire()
+        :param discard: end the session instead of keeping it, e.g. after an error
+        """
+        with self._lock:
+            if not discard and len(self._idle) < self.size:
+                self._idle.append(session)
+                return
+        self._end(session)
+
+    @staticmethod
+    def delete_datasets(session, datasets):
+        """
+        Delete SAS datasets given as 'libref.member' names.
+        :param session: SAS session
+        :param datasets: iterable of dataset names
+        """
+        members = {}
+        for dataset in datasets:
+            libref, _, member = dataset.rpartition(".")
+            members.setdefault(libref or "work", []).append(member)
+        for libref, names in members.items():
+            session.submit("proc datasets library={0} nolist nowarn; delete {1}; quit;".format(libref,
+                                                                                            " ".join(names)))
+
+    @contextlib.contextmanager
+    def session(self, cleanup=(), messages=None):
+        """
+        Context manager handing out a session for one tool run.
+        :param cleanup: dataset names deleted when the block exits, also when it fails
+        :param messages: optional callable reporting the pool activity (see acquire)
+        """
+        session = self.acquire(messages)
+        failed = False
+        try:
+            yield session
+        except Exception:
+            failed = True
+            raise
+        finally:
+            try:
+                self.delete_datasets(session, cleanup)
+            except Exception:
+                failed = True
+            self.release(session, discard=failed)
+
+    def shutdown(self):
+        """End every idle session."""
+        with self._lock:
+            sessions, self._idle = self._idle, []
+        for session in sessions:
+            self._end(session)
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool(size=2, messages=None):
+    """Return the process-wide session pool, creating it on first use."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = SASSessionPool(size=size, messages=messages)
+            atexit.register(_pool.shutdown)
+        elif messages is not None:
+            _pool.messages = messages
+        return _pool
@@ -0,0 +1,212 @@
+"""
+Source Name: test_corr_batch.py
+Author: ESRI
+
+Tests of the correlation job queue and of the request keys used by the SASCorr tool.
+"""
+
+import concurrent.futures
+import sys
+import threading
+import types
+
+import numpy as np
+import pytest
+
+import corr_batch
+import corr_cache
+import field_cache
+import sas_sessions
+
+
+@pytest.fixture
+def cache(tmp_path):
+    return corr_cache.ResultCache(str(tmp_path / "cache"))
+
+
+def test_queue_runs_requests_at_once(cache):
+    queue = corr_cache.CorrelationJobQueue(cache, max_workers=3)
+    barrier = threading.Barrier(3, timeout=5)
+
+    def compute(value):
+        # Only passes when the three requests run at the same time
+        barrier.wait()
+        return value
+
+    futures = [queue.submit("key{0}".format(i), compute, i) for i in range(3)]
+    assert [future.result(timeout=5) for future in futures] == [0, 1, 2]
+    queue.shutdown()
+
+
+def test_cached_request_completes_right_away(cache):
+    cache.put("key", {"answer": 42})
+    queue = corr_cache.CorrelationJobQueue(cache, max_workers=1)
+
+    future = queue.submit("key", pytest.fail, "should not run")
+    assert future.done()
+    assert future.result() == {"answer": 42}
+    queue.shutdown()
+
+
+def test_superseded_request_is_cancelled(cache):
+    queue = corr_cache.CorrelationJobQueue(cache, max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocking():
+        started.set()
+        release.wait(5)
+        return "blocking"
+
+    queue.submit("running", blocking, slot="other")
+    started.wait(5)
+    first = queue.submit("first", lambda: "first", slot="out_table")
+    second = queue.submit("second", lambda: "second", slot="out_table")
+    release.set()
+
+    assert first.cancelled()
+    assert second.result(timeout=5) == "second"
+    assert cache.get("second") == "second"
+    queue.shutdown()
+
+
+def test_identical_requests_share_one_run(cache):
+    queue = corr_cache.CorrelationJobQueue(cache, max_workers=2)
+    release = threading.Event()
+    runs = []
+
+    def compute():
+        runs.append(1)
+        release.wait(5)
+        return "value"
+
+    first = queue.submit("key", compute, slot="a")
+    second = queue.submit("key", compute, slot="b")
+    release.set()
+    assert first is second
+    assert second.result(timeout=5) == "value"
+    assert len(runs) == 1
+    queue.shutdown()
+
+
+def test_request_key_uses_the_change_stamp(monkeypatch):
+    stamp = ["1700000000.000000:4096"]
+    monkeypatch.setattr(field_cache, "source_info", lambda in_table: ("C:\\data\\a.gdb\\parcels", stamp[0]))
+    # A source with a change stamp is not read to build the key
+    monkeypatch.setattr(field_cache, "get_cache", pytest.fail)
+
+    key = corr_batch.request_key("parcels", ["A", "B"], "NUMPY")
+    assert corr_batch.request_key("parcels", ["B", "A"], "NUMPY") == key
+    assert corr_batch.request_key("parcels", ["B", "A"], "SAS") != corr_batch.request_key("parcels", ["A", "B"],
+                                                                                           "SAS")
+    stamp[0] = "1700000001.000000:4096"
+    assert corr_batch.request_key("parcels", ["A", "B"], "NUMPY") != key
+
+
+def test_request_key_without_stamp_hashes_rows(monkeypatch):
+    data = {"rows": np.arange(6.0).reshape(3, 2)}
+
+    class Cache(object):
+        def iter_chunks(self, in_table, field_names):
+            return iter([data["rows"][:2], data["rows"][2:]])
+
+    monkeypatch.setattr(field_cache, "source_info", lambda in_table: ("parcels", None))
+    monkeypatch.setattr(field_cache, "get_cache", Cache)
+
+    key = corr_batch.request_key("parcels", ["A", "B"], "NUMPY")
+    data["rows"] = data["rows"] + 1
+    assert corr_batch.request_key("parcels", ["A", "B"], "NUMPY") != key
+
+
+def test_run_requests_writes_the_last_request_per_table(monkeypatch, cache):
+    monkeypatch.setattr(corr_cache, "get_cache", lambda: cache)
+    monkeypatch.setattr(corr_batch, "request_key", lambda in_table, var_names, engine: in_table)
+    monkeypatch.setattr(corr_batch, "read_numpy_input", lambda in_table, var_names, chunked: (in_table,))
+    monkeypatch.setattr(corr_batch, "compute_numpy", lambda var_names, data: data)
+    written = []
+    monkeypatch.setattr(corr_batch, "write_output",
+                        lambda value, var_names, out_table: written.append((value, out_table)) or out_table)
+
+    tables = corr_batch.run_requests([("a", ["X"], "out1", "NUMPY"), ("b", ["X"], "out2", "NUMPY"),
+                                      ("c", ["X"], "out1", "NUMPY")], max_workers=2)
+    assert tables == ["out1", "out2"]
+    assert sorted(written) == [("b", "out2"), ("c", "out1")]
+
+
+def test_arcpy_reads_stay_on_the_calling_thread(monkeypatch, cache):
+    threads = []
+    monkeypatch.setattr(corr_batch, "request_key", lambda in_table, var_names, engine: in_table)
+    monkeypatch.setattr(corr_batch, "read_numpy_input",
+                        lambda in_table, var_names, chunked: threads.append(("read", threading.current_thread()))
+                        or (np.ones((3, 2)),))
+    monkeypatch.setattr(corr_batch, "compute_numpy",
+                        lambda var_names, data: threads.append(("compute", threading.current_thread())) or
+                        data.sum())
+    queue = corr_cache.CorrelationJobQueue(cache, max_workers=2)
+    try:
+        assert corr_batch.submit("parcels", ["A", "B"], "NUMPY", queue=queue).result(timeout=5) == 6.0
+        # A cached result reads nothing
+        assert corr_batch.submit("parcels", ["A", "B"], "NUMPY", queue=queue).result(timeout=5) == 6.0
+    finally:
+        queue.shutdown()
+    assert [name for name, _ in threads] == ["read", "compute"]
+    assert threads[0][1] is threading.current_thread() and threads[1][1] is not threading.current_thread()
+
+
+class FakeSASSession(object):
+    """A session without sd2df: the OUTS= data set goes through SASToTable."""
+
+    def __init__(self, log):
+        self.log = log
+
+    def submit(self, code):
+        self.log.append(("submit", code.split()[0] if code.split() else "", threading.current_thread()))
+        return {"LOG": "%put SAS_SESSION_POOL_OK" if code.startswith("%put") else "NOTE: done", "LST": "listing"}
+
+    def endsas(self):
+        pass
+
+
+def test_sas_request_uses_arcpy_on_the_calling_thread(monkeypatch, tmp_path, cache):
+    log = []
+
+    def record(name):
+        return lambda *args, **kwargs: log.append((name, args[0] if args else None, threading.current_thread()))
+
+    arcpy = types.ModuleType("arcpy")
+    arcpy.conversion = types.SimpleNamespace(TableToSAS=record("TableToSAS"), SASToTable=record("SASToTable"))
+    arcpy.management = types.SimpleNamespace(Delete=record("Delete"))
+    arcpy.ListFields = lambda table: [types.SimpleNamespace(name="_NAME_", type="String"),
+                                      types.SimpleNamespace(name="A", type="Double")]
+    arcpy.da = types.SimpleNamespace(TableToNumPyArray=lambda table, fields: np.array(
+        [("A", 1.0)], dtype=[("_NAME_", "U8"), ("A", "f8")]))
+    arcpy.AddMessage = record("AddMessage")
+    monkeypatch.setitem(sys.modules, "arcpy", arcpy)
+    monkeypatch.setattr(sas_sessions, "_pool", sas_sessions.SASSessionPool(session_factory=lambda: FakeSASSession(
+        log)))
+    monkeypatch.setattr(corr_batch, "request_key", lambda in_table, var_names, engine: in_table)
+
+    queue = corr_cache.CorrelationJobQueue(cache, max_workers=2)
+    try:
+        value = corr_batch.submit("parcels", ["A"], "SAS", queue=queue).result(timeout=5)
+    finally:
+        queue.shutdown()
+    out_table = corr_batch.write_output(value, ["A"], str(tmp_path / "corr.sqlite" / "outs"))
+
+    arcpy_calls = [(name, thread) for name, _, thread in log if name != "submit"]
+    assert [name for name, _ in arcpy_calls] == ["TableToSAS", "SASToTable", "Delete", "AddMessage"]
+    assert all(thread is threading.current_thread() for _, thread in arcpy_calls)
+    # PROC CORR ran on the queue; the OUTS= data set was deleted after it was read
+    assert any(name == "submit" and code == "options" and thread is not threading.current_thread()
+               for name, code, thread in log)
+    assert [code for name, code, _ in log if name == "submit"][-1] == "proc"
+    # A result read through SASToTable is not cached
+    assert cache.get("parcels") is None
+    assert out_table.endswith("outs")
+
+
+def test_superseded_tool_request_returns_none(monkeypatch):
+    future = concurrent.futures.Future()
+    future.cancel()
+    monkeypatch.setattr(corr_batch, "submit", lambda *args: future)
+    assert corr_batch.run_request("parcels", ["A"], "NUMPY", "out") is None
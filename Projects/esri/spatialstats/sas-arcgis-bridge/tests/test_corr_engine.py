@@ -0,0 +1,119 @@
+"""
+Source Name: test_corr_engine.py
+Author: ESRI
+
+Parity tests of the NumPy PROC CORR engine: Pearson, Spearman and Kendall tau-b coefficients and p-values
+against scipy.stats, and Hoeffding D against a brute-force computation of the bivariate ranks.
+"""
+
+import numpy as np
+import pytest
+from scipy import stats
+
+import corr_engine
+
+
+def _hoeffding_brute_force(x, y):
+    """Hoeffding D (x30) with the bivariate ranks counted over every pair of observations."""
+    n = len(x)
+    r = stats.rankdata(x)
+    s = stats.rankdata(y)
+    dx = np.sign(x[:, None] - x[None, :])
+    dy = np.sign(y[:, None] - y[None, :])
+    weight = np.where(dx > 0, 1.0, np.where(dx == 0, 0.5, 0.0)) * np.where(dy > 0, 1.0, np.where(dy == 0, 0.5, 0.0))
+    np.fill_diagonal(weight, 0.0)
+    q = 1.0 + weight.sum(axis=1)
+    d1 = ((q - 1) * (q - 2)).sum()
+    d2 = ((r - 1) * (r - 2) * (s - 1) * (s - 2)).sum()
+    d3 = ((r - 2) * (s - 2) * (q - 1)).sum()
+    return 30.0 * ((n - 2) * (n - 3) * d1 + d2 - 2 * (n - 2) * d3) / (n * (n - 1) * (n - 2) * (n - 3) * (n - 4))
+
+
+@pytest.fixture(params=["continuous", "ties"])
+def pair(request):
+    rng = np.random.default_rng(7)
+    x = rng.normal(size=400)
+    y = 0.4 * x + rng.normal(size=400)
+    if request.param == "ties":
+        x, y = np.round(x * 2), np.round(y)
+    return x, y
+
+
+def test_pearson_and_spearman_match_scipy(pair):
+    x, y = pair
+    result = corr_engine.correlate(np.column_stack(pair), ["X", "Y"], ["PEARSON", "SPEARMAN"])
+
+    expected = stats.pearsonr(x, y)
+    assert result.coefficients["PEARSON"][0, 1] == pytest.approx(expected[0], rel=1e-10)
+    assert result.probabilities["PEARSON"][0, 1] == pytest.approx(expected[1], rel=1e-8)
+    expected = stats.spearmanr(x, y)
+    assert result.coefficients["SPEARMAN"][0, 1] == pytest.approx(expected[0], rel=1e-10)
+    assert result.probabilities["SPEARMAN"][0, 1] == pytest.approx(expected[1], rel=1e-8)
+
+
+def test_kendall_matches_scipy(pair):
+    x, y = pair
+    result = corr_engine.correlate(np.column_stack(pair), ["X", "Y"], ["KENDALL"])
+
+    expected = stats.kendalltau(x, y, variant="b", method="asymptotic")
+    assert result.coefficients["KENDALL"][0, 1] == pytest.approx(expected[0], rel=1e-10)
+    assert result.probabilities["KENDALL"][0, 1] == pytest.approx(expected[1], rel=1e-8)
+
+
+def test_kendall_score_matches_pair_count(pair):
+    x, y = pair
+    expected = int((np.sign(x[:, None] - x[None, :]) * np.sign(y[:, None] - y[None, :])).sum() // 2)
+    assert corr_engine.kendall_s(x, y) == expected
+
+
+def test_hoeffding_matches_brute_force(pair):
+    x, y = pair
+    result = corr_engine.correlate(np.column_stack(pair), ["X", "Y"], ["HOEFFDING"])
+
+    assert result.coefficients["HOEFFDING"][0, 1] == pytest.approx(_hoeffding_brute_force(x, y), rel=1e-9)
+    assert result.coefficients["HOEFFDING"][0, 0] == pytest.approx(_hoeffding_brute_force(x, x), rel=1e-9)
+    assert result.coefficients["HOEFFDING"][1, 1] == pytest.approx(_hoeffding_brute_force(y, y), rel=1e-9)
+
+
+def test_hoeffding_diagonal_without_ties_is_one():
+    data = np.random.default_rng(3).normal(size=(50, 3))
+    result = corr_engine.correlate(data, ["A", "B", "C"])
+
+    np.testing.assert_allclose(np.diag(result.coefficients["HOEFFDING"]), 1.0)
+    assert np.isnan(np.diag(result.probabilities["HOEFFDING"])).all()
+
+
+def test_pairwise_deletion_and_tiles():
+    rng = np.random.default_rng(11)
+    data = rng.normal(size=(300, 5))
+    data[rng.random((300, 5)) < 0.1] = np.nan
+    names = ["V{0}".format(i) for i in range(5)]
+    tiled = corr_engine.correlate(data, names, tile_size=2)
+
+    for i in range(5):
+        for j in range(i + 1, 5):
+            mask = ~np.isnan(data[:, i]) & ~np.isnan(data[:, j])
+            assert tiled.pair_n[i, j] == mask.sum()
+            assert tiled.coefficients["KENDALL"][i, j] == pytest.approx(
+                stats.kendalltau(data[mask, i], data[mask, j])[0], rel=1e-10)
+            assert tiled.coefficients["SPEARMAN"][j, i] == pytest.approx(
+                stats.spearmanr(data[mask, i], data[mask, j])[0], rel=1e-10)
+
+
+def test_memory_mapped_columns_are_read_in_place(tmp_path, monkeypatch):
+    rng = np.random.default_rng(5)
+    data = rng.normal(size=(250, 3))
+    data[rng.random((250, 3)) < 0.1] = np.nan
+    columns = []
+    for i in range(3):
+        np.save(str(tmp_path / "{0}.npy".format(i)), data[:, i])
+        columns.append(np.load(str(tmp_path / "{0}.npy".format(i)), mmap_mode="r"))
+    # Pairs are counted in blocks of rows
+    monkeypatch.setattr(corr_engine, "CHUNK_SIZE", 40)
+
+    from_columns = corr_engine.correlate(columns, ["A", "B", "C"])
+    from_array = corr_engine.correlate(data, ["A", "B", "C"])
+    np.testing.assert_array_equal(from_columns.pair_n, from_array.pair_n)
+    np.testing.assert_array_equal(from_columns.n, from_array.n)
+    for stat in corr_engine.STATISTICS:
+        np.testing.assert_allclose(from_columns.coefficients[stat], from_array.coefficients[stat])
@@ -0,0 +1,108 @@
+"""
+Source Name: test_corr_streaming.py
+Author: ESRI
+
+Tests of the chunked correlation accumulators: partial accumulators merged over disjoint row ranges give
+the single-pass result, and the rank statistics match the exact engine for fields with few distinct values.
+"""
+
+import numpy as np
+
+import corr_engine
+import corr_streaming
+
+
+def _data(rows=3000, seed=1):
+    rng = np.random.default_rng(seed)
+    x = rng.integers(0, 20, rows).astype(float)
+    y = x + rng.integers(0, 10, rows)
+    z = rng.normal(size=rows)
+    data = np.column_stack((x, y, z))
+    data[rng.random(rows) < 0.05, 1] = np.nan
+    data[rng.random(rows) < 0.05, 2] = np.nan
+    return data
+
+
+def _accumulate(chunks, max_bins=corr_streaming.MAX_BINS):
+    """First and second pass over a list of chunks, one partial accumulator per chunk, merged."""
+    k = chunks[0].shape[1]
+    moments = [corr_streaming.MomentAccumulator(k) for _ in chunks]
+    sketches = [[corr_streaming.FieldSketch(max_bins, seed=i) for _ in range(k)] for i in range(len(chunks))]
+    for chunk, accumulator, chunk_sketches in zip(chunks, moments, sketches):
+        accumulator.update(chunk)
+        for column, sketch in enumerate(chunk_sketches):
+            sketch.update(chunk[:, column])
+    for other, other_sketches in zip(moments[1:], sketches[1:]):
+        moments[0].merge(other)
+        for sketch, other_sketch in zip(sketches[0], other_sketches):
+            sketch.merge(other_sketch)
+
+    cut_points = [sketch.cut_points() for sketch in sketches[0]]
+    ranks = [corr_streaming.RankAccumulator(cut_points) for _ in chunks]
+    for chunk, accumulator in zip(chunks, ranks):
+        accumulator.update(chunk)
+    for other in ranks[1:]:
+        ranks[0].merge(other)
+    return moments[0], sketches[0], ranks[0]
+
+
+def test_merged_moments_match_single_pass():
+    data = _data()
+    single, _, _ = _accumulate([data])
+    merged, _, _ = _accumulate(np.array_split(data, 7))
+
+    np.testing.assert_array_equal(merged.n, single.n)
+    np.testing.assert_allclose(merged.mean, single.mean, rtol=1e-12, atol=1e-12)
+    np.testing.assert_allclose(merged.m2, single.m2, rtol=1e-10)
+    np.testing.assert_allclose(merged.comoment, single.comoment, rtol=1e-10, atol=1e-8)
+
+
+def test_merged_rank_tables_match_single_pass():
+    data = _data()
+    _, _, single = _accumulate([data])
+    _, _, merged = _accumulate(np.array_split(data, 5))
+
+    # x and y have fewer distinct values than bins, so their cut points do not depend on the sample
+    for pair in [(0, 0), (0, 1), (1, 1)]:
+        np.testing.assert_array_equal(merged.tables[pair], single.tables[pair])
+        assert merged.tables[pair].sum() == single.tables[pair].sum()
+
+
+def test_exact_fields_match_engine():
+    data = _data()[:, :2]
+    moments, sketches, ranks = _accumulate(np.array_split(data, 4))
+    streamed = corr_streaming.accumulated_result(["X", "Y"], corr_engine.STATISTICS, moments, ranks)
+    exact = corr_engine.correlate(data, ["X", "Y"])
+
+    assert all(sketch.exact for sketch in sketches)
+    assert streamed.binned == []
+    for stat in corr_engine.STATISTICS:
+        np.testing.assert_allclose(streamed.coefficients[stat][0, 1], exact.coefficients[stat][0, 1], rtol=1e-9)
+    for stat in ("PEARSON", "SPEARMAN", "KENDALL"):
+        np.testing.assert_allclose(streamed.probabilities[stat][0, 1], exact.probabilities[stat][0, 1],
+                                   rtol=1e-6)
+
+
+def test_continuous_field_is_reported_as_binned():
+    data = _data()
+    moments, sketches, ranks = _accumulate(np.array_split(data, 3))
+    binned = [name for name, sketch in zip(["X", "Y", "Z"], sketches) if not sketch.exact]
+    result = corr_streaming.accumulated_result(["X", "Y", "Z"], corr_engine.STATISTICS, moments, ranks, binned)
+
+    assert result.binned == ["Z"]
+    assert result.select(["Z", "X"]).binned == ["Z"]
+    assert result.select(["X", "Y"]).binned == []
+
+
+def test_first_pass_samples_are_reproducible(monkeypatch):
+    data = _data(rows=20000)
+    monkeypatch.setattr(corr_streaming, "iter_chunks",
+                        lambda in_table, field_names, chunk_size, where_clause: iter(np.array_split(data, 4)))
+
+    _, sketches = corr_streaming.first_pass("table", ["X", "Y", "Z"], "OBJECTID < 20001", max_bins=8)
+    _, again = corr_streaming.first_pass("table", ["X", "Y", "Z"], "OBJECTID < 20001", max_bins=8)
+    np.testing.assert_array_equal(sketches[2].sample_values, again[2].sample_values)
+    np.testing.assert_array_equal(sketches[2].cut_points(), again[2].cut_points())
+    # Another row range draws other keys, so merged partial samples are not correlated
+    _, other = corr_streaming.first_pass("table", ["X", "Y", "Z"], "OBJECTID >= 20001", max_bins=8)
+    assert not np.array_equal(sketches[2].sample_keys, other[2].sample_keys)
@@ -0,0 +1,154 @@
+"""
+Source Name: test_field_cache.py
+Author: ESRI
+
+Tests of the columnar field cache against a fake arcpy whose tables are kept in memory: extraction of the
+missing fields, invalidation by the change stamp, a row order change between extractions and eviction.
+"""
+
+import os
+import sys
+import types
+
+import numpy as np
+import pytest
+
+import field_cache
+
+
+class FakeTables(dict):
+    """Tables by path: {"stamp", "oids", field: values}; cursors records the fields of every cursor opened."""
+
+    def __init__(self):
+        dict.__init__(self)
+        self.cursors = []
+
+    def search_cursor(self, path, fields):
+        self.cursors.append((path, list(fields)))
+        table = self[path]
+        columns = [table["oids"] if field == "OID@" else table[field] for field in fields]
+        return FakeCursor(list(zip(*columns)))
+
+
+class FakeCursor(object):
+    def __init__(self, rows):
+        self.rows = rows
+
+    def __enter__(self):
+        return iter(self.rows)
+
+    def __exit__(self, *args):
+        return False
+
+
+@pytest.fixture
+def tables(monkeypatch):
+    tables = FakeTables()
+    arcpy = types.ModuleType("arcpy")
+    arcpy.Describe = lambda path: types.SimpleNamespace(catalogPath=path, FIDSet="", whereClause="")
+    arcpy.da = types.SimpleNamespace(SearchCursor=tables.search_cursor)
+    arcpy.management = types.SimpleNamespace(
+        GetCount=lambda path: types.SimpleNamespace(getOutput=lambda index: str(len(tables[path]["oids"]))))
+    monkeypatch.setitem(sys.modules, "arcpy", arcpy)
+    monkeypatch.setattr(field_cache.change_stamp, "dataset_stamp", lambda path: tables[path]["stamp"])
+    return tables
+
+
+def parcels(rows=100, stamp="1700000000.000000:4096"):
+    oids = list(range(1, rows + 1))
+    return {"stamp": stamp, "oids": oids, "A": [None if oid % 10 == 0 else oid * 1.5 for oid in oids],
+            "B": [oid * -2.0 for oid in oids], "C": [oid % 7 for oid in oids]}
+
+
+def source_files(cache, path):
+    return sorted(name for name in os.listdir(cache._source_dir(path)) if name.endswith(".npy"))
+
+
+def test_fields_are_extracted_once(tables, tmp_path):
+    tables["parcels"] = parcels()
+    cache = field_cache.FieldCache(str(tmp_path / "fields"))
+
+    a, b = cache.read("parcels", ["A", "B"])
+    assert isinstance(a, np.memmap) and not a.flags.writeable
+    np.testing.assert_array_equal(np.isnan(a), [oid % 10 == 0 for oid in tables["parcels"]["oids"]])
+    np.testing.assert_array_equal(b, -2.0 * np.arange(1, 101))
+    assert tables.cursors == [("parcels", ["OID@", "A", "B"])]
+
+    # Cached fields are not read again; a new field is read on its own
+    cache.read("parcels", ["B", "A"])
+    c, a_again = cache.read("parcels", ["C", "A"])
+    assert tables.cursors == [("parcels", ["OID@", "A", "B"]), ("parcels", ["OID@", "C"])]
+    np.testing.assert_array_equal(c, np.arange(1, 101) % 7)
+    np.testing.assert_array_equal(a_again, a)
+    assert source_files(cache, "parcels") == ["A.npy", "B.npy", "C.npy", "__OID__.npy"]
+
+    chunks = list(cache.iter_chunks("parcels", ["A", "B"], chunk_size=30))
+    assert [len(chunk) for chunk in chunks] == [30, 30, 30, 10]
+    np.testing.assert_array_equal(np.vstack(chunks)[:, 1], b)
+
+
+def test_a_new_stamp_invalidates_the_fields(tables, tmp_path):
+    tables["parcels"] = parcels()
+    cache = field_cache.FieldCache(str(tmp_path / "fields"))
+    cache.read("parcels", ["A", "B"])
+
+    tables["parcels"] = parcels(rows=50, stamp="1700000100.000000:2048")
+    tables["parcels"]["B"] = [7.0] * 50
+    (b,) = cache.read("parcels", ["B"])
+    np.testing.assert_array_equal(b, [7.0] * 50)
+    # The fields written for the old stamp are gone
+    assert source_files(cache, "parcels") == ["B.npy", "__OID__.npy"]
+
+
+def test_row_order_change_extracts_every_field_again(tables, tmp_path):
+    tables["parcels"] = parcels()
+    cache = field_cache.FieldCache(str(tmp_path / "fields"))
+    cache.read("parcels", ["A"])
+
+    # Same stamp, but the cursor now returns the rows in reverse order
+    for name in ("oids", "A", "B", "C"):
+        tables["parcels"][name] = tables["parcels"][name][::-1]
+    a, b = cache.read("parcels", ["A", "B"])
+    # B is read in the new order and replaces the cached fields; A is then read again in that order
+    assert tables.cursors[1:] == [("parcels", ["OID@", "B"]), ("parcels", ["OID@", "A"])]
+    # The rows of both fields are in the new order
+    np.testing.assert_array_equal(b, -2.0 * np.arange(100, 0, -1))
+    assert np.isnan(a[0])
+    np.testing.assert_array_equal(a[1:10], 1.5 * np.arange(99, 90, -1))
+
+
+def test_a_table_that_changes_while_read_is_read_directly(tables, tmp_path, monkeypatch):
+    tables["parcels"] = parcels()
+    cache = field_cache.FieldCache(str(tmp_path / "fields"))
+    # The count is taken before a row is added
+    monkeypatch.setattr(sys.modules["arcpy"].management, "GetCount",
+                        lambda path: types.SimpleNamespace(getOutput=lambda index: "99"))
+    (a,) = cache.read("parcels", ["A"])
+    assert not isinstance(a, np.memmap) and len(a) == 100
+    assert source_files(cache, "parcels") == []
+
+
+def test_eviction_keeps_the_oid_column_of_cached_fields(tables, tmp_path):
+    tables["parcels"] = parcels()
+    tables["roads"] = parcels(stamp="1700000000.000000:8192")
+    cache = field_cache.FieldCache(str(tmp_path / "fields"))
+    cache.read("parcels", ["A", "B"])
+    cache.read("roads", ["A"])
+
+    # Least recently read first: parcels A, roads A, parcels B
+    for path, name, atime in (("parcels", "A", 1), ("roads", "A", 2), ("parcels", "B", 3)):
+        column_path = cache._column_path(cache._source_dir(path), name)
+        os.utime(column_path, (atime, atime))
+    size = os.path.getsize(cache._column_path(cache._source_dir("parcels"), "A"))
+    cache.max_bytes = 3 * size
+    cache.evict()
+
+    # Parcels A goes first but parcels B still needs its ObjectIDs; roads loses its only field and its ObjectIDs
+    assert source_files(cache, "parcels") == ["B.npy", "__OID__.npy"]
+    assert source_files(cache, "roads") == []
+
+    # The row order check still works for the source that kept a field
+    cursors = len(tables.cursors)
+    (b,) = cache.read("parcels", ["B"])
+    assert len(tables.cursors) == cursors
+    np.testing.assert_array_equal(b, -2.0 * np.arange(1, 101))
@@ -0,0 +1,106 @@
+"""
+Source Name: test_sas_sessions.py
+Author: ESRI
+
+Tests of the SAS session pool against a fake session that implements submit() and endsas().
+"""
+
+import sas_sessions
+
+
+class FakeSession(object):
+    """Answers the health check while alive and records the submitted code."""
+
+    def __init__(self):
+        self.alive = True
+        self.ended = False
+        self.submitted = []
+
+    def submit(self, code):
+        if not self.alive:
+            raise RuntimeError("SAS process is gone")
+        self.submitted.append(code)
+        log = code.split("%put ", 1)[1].rstrip(";") if code.startswith("%put ") else ""
+        return {"LOG": log, "LST": ""}
+
+    def endsas(self):
+        self.ended = True
+
+
+class FakeFactory(object):
+    def __init__(self):
+        self.sessions = []
+
+    def __call__(self):
+        self.sessions.append(FakeSession())
+        return self.sessions[-1]
+
+
+def test_session_is_reused():
+    factory = FakeFactory()
+    pool = sas_sessions.SASSessionPool(size=2, session_factory=factory)
+
+    with pool.session() as first:
+        pass
+    with pool.session() as second:
+        pass
+
+    assert second is first
+    assert len(factory.sessions) == 1
+    assert "%put {0};".format(sas_sessions.HEALTH_CHECK_TOKEN) in first.submitted
+    assert not first.ended
+
+
+def test_dead_session_is_replaced():
+    factory = FakeFactory()
+    pool = sas_sessions.SASSessionPool(size=2, session_factory=factory)
+    with pool.session() as first:
+        pass
+
+    first.alive = False
+    with pool.session() as second:
+        pass
+
+    assert second is not first
+    assert first.ended
+    assert len(factory.sessions) == 2
+
+
+def test_failed_run_discards_session():
+    factory = FakeFactory()
+    pool = sas_sessions.SASSessionPool(size=2, session_factory=factory)
+    try:
+        with pool.session() as session:
+            raise ValueError("PROC CORR failed")
+    except ValueError:
+        pass
+
+    assert session.ended
+    assert pool.acquire() is not session
+
+
+def test_temp_datasets_are_deleted_on_release():
+    factory = FakeFactory()
+    pool = sas_sessions.SASSessionPool(size=2, session_factory=factory)
+    cleanup = ["sasuser.temp_20260101_000000_abc123", "sasuser.out_temp_20260101_000000_abc123", "temp_work"]
+
+    with pool.session(cleanup=cleanup) as session:
+        session.submit("proc corr data=sasuser.temp_20260101_000000_abc123; run;")
+
+    assert session.submitted[-2:] == [
+        "proc datasets library=sasuser nolist nowarn; delete temp_20260101_000000_abc123 "
+        "out_temp_20260101_000000_abc123; quit;",
+        "proc datasets library=work nolist nowarn; delete temp_work; quit;"]
+    assert not session.ended
+
+
+def test_shutdown_ends_idle_sessions():
+    factory = FakeFactory()
+    pool = sas_sessions.SASSessionPool(size=1, session_factory=factory)
+    first, second = pool.acquire(), pool.acquire()
+    pool.release(first)
+    pool.release(second)
+
+    assert second.ended
+    pool.shutdown()
+    assert first.ended
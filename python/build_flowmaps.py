@@ -0,0 +1,231 @@
+"""
+Build step for the SteelImports flow maps: aggregates the Flowmap_Cities_*.csv trade records of the demo and of
+every country subset by city pair, and writes the great-circle arc of each pair with its volumes, so the map loads
+precomputed geometry instead of building it from the rows on each page view.
+
+For every data set (Projects/SteelImports and each CountrySubsets/<subset>) the CSV files of demos/csv-data are
+read, skipping the hand-kept copies (" - Copy", "_bak"). Files with identical content are aggregated and projected
+once. The output goes to demos/flowmap-data of the data set, one file per CSV file (cities, one_to_many,
+many_to_one, one_to_one):
+- geojson: a GeoJSON FeatureCollection of LineStrings, coordinates rounded to --precision decimals
+- binary: <name>.arcs.bin, the arc vertices as little-endian uint16 (lon, lat) pairs quantized to the extent of
+  the file, and <name>.json with the flow attributes as columns and the transform to decode the vertices
+  (lon = q[0] * scale[0] + translate[0], lat = q[1] * scale[1] + translate[1])
+
+Usage: python build_flowmaps.py [--root Projects/SteelImports] [--vertices 33] [--format geojson binary]
+"""
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+# Fields of a flow (origin, destination) and its volumes; the Vol2 fields are only in some of the files
+KEY_FIELDS = ("s_city_id", "e_city_id")
+ATTRIBUTE_FIELDS = ("s_city_id", "s_city", "s_lat", "s_lon", "s_pop", "s_country",
+                    "e_city_id", "e_City", "e_lat", "e_lon", "e_pop", "e_country")
+VOLUME_FIELDS = ("s_Volume", "e_vol", "s_Vol2", "e_Vol2")
+COORDINATE_FIELDS = ("s_lat", "s_lon", "e_lat", "e_lon", "s_pop", "e_pop")
+
+# Hand-kept near-duplicates of the source files
+SKIPPED_SUFFIXES = (" - Copy", "_bak")
+
+OUTPUT_FORMATS = ("geojson", "binary")
+
+
+def dataset_folders(root):
+    """The demo folder and the folders of its country subsets that have CSV data."""
+    folders = [root] + sorted(glob.glob(os.path.join(root, "CountrySubsets", "*")))
+    return [folder for folder in folders if os.path.isdir(os.path.join(folder, "demos", "csv-data"))]
+
+
+def source_files(folder):
+    """The Flowmap_Cities_*.csv files of a data set, without the hand-kept copies."""
+    paths = sorted(glob.glob(os.path.join(folder, "demos", "csv-data", "Flowmap_Cities*.csv")))
+    return [path for path in paths if not os.path.splitext(os.path.basename(path))[0].endswith(SKIPPED_SUFFIXES)]
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def aggregate_flows(path):
+    """
+    Stream the trade records of a CSV file and sum the volumes by (origin, destination) city pair.
+    :return: dict of the attribute and volume columns (numpy arrays), one row per pair in the order of first
+             appearance, and the number of records of each pair in "records"
+    """
+    pairs = {}
+    attributes = []
+    volumes = []
+    with open(path, newline="", encoding="utf-8-sig") as source:
+        reader = csv.DictReader(source)
+        volume_fields = [field for field in VOLUME_FIELDS if field in reader.fieldnames]
+        for row in reader:
+            key = tuple(row[field] for field in KEY_FIELDS)
+            index = pairs.get(key)
+            if index is None:
+                index = pairs[key] = len(attributes)
+                attributes.append([row.get(field, "") for field in ATTRIBUTE_FIELDS])
+                volumes.append([0.0] * (len(volume_fields) + 1))
+            pair_volumes = volumes[index]
+            for position, field in enumerate(volume_fields):
+                pair_volumes[position] += _number(row[field])
+            pair_volumes[-1] += 1
+
+    flows = {}
+    for position, field in enumerate(ATTRIBUTE_FIELDS):
+        column = [values[position] for values in attributes]
+        flows[field] = np.array([_number(value) for value in column]) if field in COORDINATE_FIELDS \
+            else np.array(column, dtype=object)
+    volume_array = np.array(volumes, dtype=float).reshape(len(volumes), len(volume_fields) + 1)
+    for position, field in enumerate(volume_fields):
+        flows[field] = np.round(volume_array[:, position], 6)
+    flows["records"] = volume_array[:, -1].astype(np.int64)
+    return flows
+
+
+def _unit_vectors(lon, lat):
+    lon, lat = np.radians(lon), np.radians(lat)
+    return np.stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)], axis=-1)
+
+
+def great_circle_arcs(s_lon, s_lat, e_lon, e_lat, vertices=33):
+    """
+    Vertices of the great-circle arcs from (s_lon, s_lat) to (e_lon, e_lat), computed for all the pairs at once.
+    The longitudes of an arc are continuous from its origin, so arcs across the antimeridian go past +-180.
+    :return: lon, lat arrays of shape (pairs, vertices)
+    """
+    a = _unit_vectors(s_lon, s_lat)
+    b = _unit_vectors(e_lon, e_lat)
+    cos_omega = np.clip(np.einsum("ij,ij->i", a, b), -1.0, 1.0)
+    omega = np.arccos(cos_omega)
+
+    # c: unit vector orthogonal to a in the plane of the arc, so that the arc is a cos(t) + c sin(t)
+    c = b - a * cos_omega[:, None]
+    norm = np.linalg.norm(c, axis=1)
+    degenerate = norm < 1e-12
+    if degenerate.any():
+        # Identical points have no arc (omega is 0); antipodal points have any: go through the pole of the origin
+        # meridian, or along the equator from a pole
+        pole = np.where(np.abs(a[degenerate, 2:3]) < 0.9, [[0.0, 0.0, 1.0]], [[1.0, 0.0, 0.0]])
+        c[degenerate] = pole - a[degenerate] * np.einsum("ij,ij->i", a[degenerate], pole)[:, None]
+        norm[degenerate] = np.linalg.norm(c[degenerate], axis=1)
+    c /= norm[:, None]
+
+    angles = omega[:, None] * np.linspace(0.0, 1.0, vertices)[None, :]
+    points = a[:, None, :] * np.cos(angles)[..., None] + c[:, None, :] * np.sin(angles)[..., None]
+    lon = np.degrees(np.arctan2(points[..., 1], points[..., 0]))
+    lat = np.degrees(np.arcsin(np.clip(points[..., 2], -1.0, 1.0)))
+
+    # Start at the origin longitude as given, then unwrap the jumps at the antimeridian
+    lon += np.round((np.asarray(s_lon, dtype=float)[:, None] - lon[:, :1]) / 360.0) * 360.0
+    lon = np.degrees(np.unwrap(np.radians(lon), axis=1))
+    return lon, lat
+
+
+def _properties(flows, index):
+    properties = {}
+    for field, column in flows.items():
+        value = column[index]
+        properties[field] = value.item() if isinstance(value, np.generic) else value
+    return properties
+
+
+def write_geojson(flows, lon, lat, path, precision=4):
+    """Write the flows as a GeoJSON FeatureCollection of LineStrings with rounded coordinates."""
+    coordinates = np.round(np.stack([lon, lat], axis=-1), precision).tolist()
+    features = [{"type": "Feature",
+                 "geometry": {"type": "LineString", "coordinates": coordinates[index]},
+                 "properties": _properties(flows, index)}
+                for index in range(len(coordinates))]
+    with open(path, "w", encoding="utf-8") as target:
+        json.dump({"type": "FeatureCollection", "features": features}, target, separators=(",", ":"))
+    return path
+
+
+def write_binary(flows, lon, lat, path):
+    """
+    Write the arc vertices quantized to uint16 to <path>.arcs.bin and the flow attributes with the decoding
+    transform to <path>.json.
+    """
+    coordinates = np.stack([lon, lat], axis=-1)
+    if coordinates.size:
+        low = coordinates.reshape(-1, 2).min(axis=0)
+        high = coordinates.reshape(-1, 2).max(axis=0)
+    else:
+        low = high = np.zeros(2)
+    scale = np.where(high > low, (high - low) / 65535.0, 1.0)
+    quantized = np.round((coordinates - low) / scale).astype("<u2")
+
+    bin_path = path + ".arcs.bin"
+    quantized.tofile(bin_path)
+    index = {"count": int(lon.shape[0]),
+             "vertices": int(lon.shape[1]) if lon.ndim == 2 else 0,
+             "arcs": os.path.basename(bin_path),
+             "dtype": "<u2",
+             "transform": {"scale": scale.tolist(), "translate": low.tolist()},
+             "columns": {field: column.tolist() for field, column in flows.items()}}
+    with open(path + ".json", "w", encoding="utf-8") as target:
+        json.dump(index, target, separators=(",", ":"))
+    return bin_path
+
+
+def build(root, vertices=33, formats=("geojson",), precision=4):
+    """
+    Build the flow map data of every data set under root.
+    :return: list of the files written
+    """
+    written = []
+    built = {}
+    for folder in dataset_folders(root):
+        out_folder = os.path.join(folder, "demos", "flowmap-data")
+        for path in source_files(folder):
+            # The subsets share most of their files; identical files are only aggregated and projected once
+            digest = file_hash(path)
+            if digest not in built:
+                flows = aggregate_flows(path)
+                lon, lat = great_circle_arcs(flows["s_lon"], flows["s_lat"], flows["e_lon"], flows["e_lat"],
+                                             vertices)
+                built[digest] = flows, lon, lat
+            flows, lon, lat = built[digest]
+
+            os.makedirs(out_folder, exist_ok=True)
+            name = os.path.splitext(os.path.basename(path))[0][len("Flowmap_Cities"):].lstrip("_") or "cities"
+            out_path = os.path.join(out_folder, name)
+            if "geojson" in formats:
+                written.append(write_geojson(flows, lon, lat, out_path + ".geojson", precision))
+            if "binary" in formats:
+                written.append(write_binary(flows, lon, lat, out_path))
+            print("{0}: {1} pairs".format(os.path.relpath(path, root), len(lon)))
+    return written
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the SteelImports flow map arcs.")
+    parser.add_argument("--root", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir,
+                                                       "Projects", "SteelImports"))
+    parser.add_argument("--vertices", type=int, default=33, help="vertices per great-circle arc")
+    parser.add_argument("--format", nargs="+", choices=OUTPUT_FORMATS, default=["geojson"], dest="formats")
+    parser.add_argument("--precision", type=int, default=4, help="decimals of the GeoJSON coordinates")
+    arguments = parser.parse_args()
+    build(os.path.normpath(arguments.root), arguments.vertices, arguments.formats, arguments.precision)
+
+
+if __name__ == "__main__":
+    main()